@@ -0,0 +1,307 @@
+import asyncio
+import json
+from typing import TYPE_CHECKING, Any, Optional
+
+from agent.email_classifier import LABELS, EmailClassifier
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from agent.core import AgentCore
+
+# Batched LLM triage of emails.
+#
+# Emails the local classifier (agent/email_classifier.py) can't decide are packed into one
+# structured-output completion per batch instead of one completion each. That saves the
+# per-request round-trip and the repeated system prompt. Each email is sent as a compact summary
+# under a short reference ("e1", "e2", ...), since Graph message ids are ~150 characters. The
+# response is a JSON object constrained by a strict schema, and its references are mapped back to
+# message ids.
+#
+# Batch size adapts at runtime:
+#   - A batch is closed when its estimated prompt tokens or expected output tokens would exceed
+#     the limits, or when it reaches the current batch size.
+#   - A truncated (finish_reason "length") or unparseable response halves the batch size, and the
+#     failed batch is split and retried.
+#   - Each fully successful batch grows the batch size again, up to max_batch_size.
+#   - Output tokens per email are re-estimated from the usage of each response.
+# Emails still missing after the retries are escalated.
+#
+# A completion that fails outright (rate limit, 5xx, timeout) is retried on the same batch after a
+# backoff; the batch size is kept, since the emails were not the problem. If it still fails, only
+# that batch's emails are marked failed (and escalated): the results of the other batches are kept.
+#
+# Escalation: the model flags emails that need the supervisor (legal or financial commitments,
+# complaints, security incidents, anything it cannot decide). Emails that could not be triaged
+# are escalated as well.
+
+ACTIONS = ("none", "reply", "schedule", "file", "junk", "review")
+LOCAL_ACTIONS = {"junk": "junk", "important": "review", "routine": "none"}
+
+TRIAGE_INSTRUCTIONS = (
+    "You triage emails for a Microsoft 365 assistant. For every email in the user message, identified by its ref, "
+    "return exactly one result with: the label (junk: spam, phishing or unsolicited marketing; important: needs the "
+    "user's attention or a decision; routine: informational or automated), the next action (none, reply, schedule, "
+    "file, junk or review), whether to escalate to the supervisor, and a reason of at most 12 words. Escalate legal "
+    "or financial commitments, complaints, security incidents, requests outside the user's authority, and anything "
+    "you cannot decide confidently. Never invent refs and never skip one."
+)
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "email_triage",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "ref": {"type": "string"},
+                            "label": {"type": "string", "enum": list(LABELS)},
+                            "action": {"type": "string", "enum": list(ACTIONS)},
+                            "escalate": {"type": "boolean"},
+                            "reason": {"type": "string"},
+                        },
+                        "required": ["ref", "label", "action", "escalate", "reason"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+PREVIEW_CHARS = 300 # bodyPreview characters sent per email
+CHARS_PER_TOKEN = 4
+ERROR_BACKOFF_SECONDS = 1.0 # Before the first retry of a failed completion; doubles per retry
+
+TRIAGE_EMAILS = REGISTRY.counter(
+    "triage_emails_total", "Emails triaged, by where the decision was made (rule, model, llm, failed).", ("source",))
+TRIAGE_BATCH_SIZE = REGISTRY.histogram(
+    "triage_batch_emails", "Emails per triage completion.", buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100))
+TRIAGE_BATCH_RETRIES = REGISTRY.counter(
+    "triage_batch_retries_total", "Triage batches split or retried, by reason.", ("reason",))
+TRIAGE_ESCALATIONS = REGISTRY.counter(
+    "triage_escalations_total", "Emails escalated to the supervisor by triage.")
+
+logger = get_logger(__name__)
+
+
+def _summary(ref: str, email: dict) -> dict:
+    return {
+        "ref": ref,
+        "from": email.get("from"),
+        "subject": email.get("subject"),
+        "importance": email.get("importance"),
+        "attachments": bool(email.get("has_attachments")),
+        "preview": (email.get("body_preview") or "")[:PREVIEW_CHARS],
+    }
+
+
+def _estimate_tokens(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":"))) // CHARS_PER_TOKEN + 1
+
+
+class BatchTriage:
+    """
+    Triages many emails with as few completions as possible.
+
+    Args:
+        agent: The AgentCore whose completion path (client, tracing, cost, completion cache) is used.
+        classifier: Local classifier run first; only its ambiguous emails go to the LLM. None sends all.
+        max_batch_size: Upper bound on emails per completion.
+        max_prompt_tokens: Estimated prompt tokens per completion (instructions included).
+        max_output_tokens: max_completion_tokens of each completion; bounds the batch by expected output.
+        max_concurrent_batches: Batches in flight at once.
+        max_error_retries: Retries of a batch whose completion raised (rate limit, server error, timeout).
+    """
+    def __init__(
+        self,
+        agent: "AgentCore",
+        classifier: Optional[EmailClassifier] = None,
+        max_batch_size: int = 40,
+        max_prompt_tokens: int = 8000,
+        max_output_tokens: int = 4000,
+        max_concurrent_batches: int = 2,
+        max_error_retries: int = 2
+    ):
+        self.agent = agent
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_error_retries = max_error_retries
+        self.batch_size = max_batch_size # Current (adaptive) limit
+        self.output_tokens_per_email = 40.0 # Re-estimated from each response's usage
+        self._slots = asyncio.Semaphore(max_concurrent_batches)
+        self._instruction_tokens = _estimate_tokens(TRIAGE_INSTRUCTIONS) + _estimate_tokens(RESPONSE_FORMAT)
+
+    def plan_batches(self, summaries: list[dict]) -> list[list[dict]]:
+        """
+        Greedily packs email summaries into batches within the current size and token limits.
+        """
+        prompt_budget = self.max_prompt_tokens - self._instruction_tokens
+        by_output = max(1, int(self.max_output_tokens * 0.8 / self.output_tokens_per_email)) # 20% headroom
+        size_limit = max(1, min(self.batch_size, by_output))
+
+        batches, current, current_tokens = [], [], 0
+        for summary in summaries:
+            tokens = _estimate_tokens(summary)
+            if current and (len(current) >= size_limit or current_tokens + tokens > prompt_budget):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def triage(self, emails: list[dict]) -> dict[str, Any]:
+        """
+        Triages emails as returned by list_outlook_emails.
+
+        Returns:
+            {"results": {message id: {"id", "label", "action", "escalate", "reason", "source"}},
+             "escalations": [results with escalate=True], "stats": {...}}, where source is
+            "rule" or "model" (local), "llm", or "failed" (not triaged; escalated).
+        """
+        with tracer.span("triage.run", emails=len(emails)) as span:
+            results: dict[str, dict] = {}
+            pending = emails
+            if self.classifier is not None:
+                local = self.classifier.triage(emails)
+                for decision in local["labeled"]:
+                    results[decision["id"]] = {
+                        "id": decision["id"], "label": decision["label"], "action": LOCAL_ACTIONS[decision["label"]],
+                        "escalate": False, "reason": decision["reason"], "source": decision["source"],
+                    }
+                pending = local["ambiguous"]
+
+            refs = {f"e{index + 1}": email for index, email in enumerate(pending)}
+            summaries = [_summary(ref, email) for ref, email in refs.items()]
+            completions = {"count": 0}
+            outcomes = await asyncio.gather(*(self._run_batch(batch, completions) for batch in self.plan_batches(summaries)),
+                                            return_exceptions=True)
+            llm_results = {}
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException): # Its emails are marked failed below
+                    logger.error("triage.batch_error", error=f"{type(outcome).__name__}: {outcome}")
+                    continue
+                llm_results.update(outcome)
+
+            for ref, email in refs.items():
+                message_id = email.get("id")
+                result = llm_results.get(ref)
+                if result is None:
+                    results[message_id] = {"id": message_id, "label": None, "action": "review", "escalate": True,
+                                           "reason": "could not be triaged automatically", "source": "failed"}
+                else:
+                    results[message_id] = {"id": message_id, "label": result["label"], "action": result["action"],
+                                           "escalate": result["escalate"], "reason": result["reason"], "source": "llm"}
+
+            stats = {"emails": len(emails), "rule": 0, "model": 0, "llm": 0, "failed": 0,
+                     "completions": completions["count"], "batch_size": self.batch_size}
+            for result in results.values():
+                stats[result["source"]] += 1
+                TRIAGE_EMAILS.inc(source=result["source"])
+            escalations = [result for result in results.values() if result["escalate"]]
+            TRIAGE_ESCALATIONS.inc(len(escalations))
+            stats["escalated"] = len(escalations)
+            span.set(**stats)
+        return {"results": results, "escalations": escalations, "stats": stats}
+
+    async def _run_batch(self, batch: list[dict], completions: dict, escalate: bool = False) -> dict[str, dict]:
+        """
+        Triages one batch; on truncation or invalid output the batch is split and retried, and
+        refs missing from an otherwise valid answer are retried once on the large model.
+        """
+        response = await self._complete_with_retries(batch, escalate)
+        if response is None:
+            return {} # The caller marks these emails failed
+        completions["count"] += 1
+
+        choice = response.choices[0] if response.choices else None
+        parsed = None
+        if choice is not None and choice.finish_reason != "length":
+            try:
+                parsed = json.loads(choice.message.content or "")["results"]
+            except (ValueError, KeyError, TypeError):
+                parsed = None
+
+        if parsed is None:
+            reason = "truncated" if choice is not None and choice.finish_reason == "length" else "invalid_output"
+            TRIAGE_BATCH_RETRIES.inc(reason=reason)
+            # Relative to the failed batch, so concurrent failures of equal batches don't compound
+            self.batch_size = max(1, min(self.batch_size, len(batch) // 2))
+            if reason == "truncated": # Each email needed more than its share of the output limit
+                self.output_tokens_per_email = max(self.output_tokens_per_email, 1.2 * self.max_output_tokens / len(batch))
+            logger.warning("triage.batch_failed", reason=reason, emails=len(batch), batch_size=self.batch_size)
+            if len(batch) == 1:
+                if escalate:
+                    return {}
+                return await self._run_batch(batch, completions, escalate=True)
+            middle = len(batch) // 2
+            halves = await asyncio.gather(self._run_batch(batch[:middle], completions, escalate),
+                                          self._run_batch(batch[middle:], completions, escalate))
+            return {**halves[0], **halves[1]}
+
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.completion_tokens:
+            observed = usage.completion_tokens / len(batch)
+            self.output_tokens_per_email = 0.7 * self.output_tokens_per_email + 0.3 * observed
+
+        wanted = {summary["ref"] for summary in batch}
+        results = {}
+        for item in parsed:
+            if isinstance(item, dict) and item.get("ref") in wanted and item.get("label") in LABELS:
+                results[item["ref"]] = {
+                    "label": item["label"],
+                    "action": item.get("action") if item.get("action") in ACTIONS else "review",
+                    "escalate": bool(item.get("escalate")),
+                    "reason": str(item.get("reason") or ""),
+                }
+
+        missing = [summary for summary in batch if summary["ref"] not in results]
+        if not missing:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+        elif not escalate:
+            TRIAGE_BATCH_RETRIES.inc(reason="missing_results")
+            results.update(await self._run_batch(missing, completions, escalate=True))
+        return results
+
+    async def _complete_with_retries(self, batch: list[dict], escalate: bool):
+        """
+        The batch's completion, retried with backoff while it raises; None once the retries are used up.
+        """
+        for attempt in range(self.max_error_retries + 1):
+            try:
+                async with self._slots:
+                    return await self._complete(batch, escalate)
+            except Exception as e:
+                logger.warning("triage.completion_failed", error=f"{type(e).__name__}: {e}", emails=len(batch), attempt=attempt + 1)
+                if attempt == self.max_error_retries:
+                    TRIAGE_BATCH_RETRIES.inc(reason="gave_up")
+                    return None
+                TRIAGE_BATCH_RETRIES.inc(reason="error")
+                await asyncio.sleep(ERROR_BACKOFF_SECONDS * (2 ** attempt))
+
+    async def _complete(self, batch: list[dict], escalate: bool):
+        TRIAGE_BATCH_SIZE.observe(len(batch))
+        lines = "\n".join(json.dumps(summary, ensure_ascii=False, separators=(",", ":")) for summary in batch)
+        return await self.agent._create_completion(
+            route=self.agent.model_router.for_triage(escalate),
+            cacheable=True, # Triage calls no tools, so identical batches may be answered from the cache
+            messages=[
+                {"role": "system", "content": TRIAGE_INSTRUCTIONS},
+                {"role": "user", "content": f"Triage these {len(batch)} emails (one JSON object per line):\n{lines}"},
+            ],
+            response_format=RESPONSE_FORMAT,
+            max_completion_tokens=self.max_output_tokens,
+        )
@@ -0,0 +1,278 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from utils.metrics import REGISTRY
+
+# Opt-in exact-match cache for chat completions.
+#
+# Automated triage sends the same prompt over and over (same system prompt, same email), and each
+# repeat costs a full LLM round-trip. The cache key is a SHA-256 over a normalized form of
+# everything that determines the answer: model, messages, tools and sampling parameters.
+# Normalization makes irrelevant differences disappear: JSON key order, line endings, trailing
+# whitespace, and the random tool-call ids, which are renumbered in order of appearance.
+# Per-session settings such as prompt_cache_key are left out, so sessions and workers share entries.
+#
+# Responses that call a state-changing (mutating) tool are never stored. AgentCore also stops
+# using the cache for the rest of a turn once a mutating tool has run, so a cached answer can
+# never stand in for, or repeat, a send/create/update/delete.
+#
+# Backends: in-process LRU with TTL (default), or SQLite for sharing between worker processes.
+# AgentCore uses get_async/put_async, which keep SQLite's lock waits and writes off the event loop.
+#
+# Configuration (environment):
+#     AGENT_COMPLETION_CACHE       "memory", or a path to an SQLite file; unset disables the cache
+#     AGENT_COMPLETION_CACHE_TTL   Entry lifetime in seconds (default 3600)
+#     AGENT_COMPLETION_CACHE_SIZE  Maximum entries (default 1024)
+
+# Request parameters that don't change the completion and are left out of the key.
+IGNORED_PARAMS = {"prompt_cache_key", "user", "stream", "stream_options", "metadata", "store", "timeout", "extra_headers"}
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "completion_cache_requests_total", "Completion cache lookups by result (hit, miss, bypass).", ("result",))
+CACHE_ENTRIES = REGISTRY.gauge(
+    "completion_cache_entries", "Entries currently held by the completion cache.", ("backend",))
+
+
+def _normalize_text(text: str) -> str:
+    return "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).strip()
+
+
+def _normalize_messages(messages: list) -> list:
+    ids: dict[str, str] = {}
+
+    def call_id(original: str) -> str:
+        return ids.setdefault(original, f"call_{len(ids)}")
+
+    normalized = []
+    for message in messages:
+        if hasattr(message, "model_dump"):
+            message = message.model_dump(exclude_none=True)
+        entry = {key: value for key, value in dict(message).items() if value is not None}
+        if isinstance(entry.get("content"), str):
+            entry["content"] = _normalize_text(entry["content"])
+        if entry.get("tool_calls"):
+            entry["tool_calls"] = [
+                {**call, "id": call_id(call.get("id", ""))} for call in
+                (c.model_dump(exclude_none=True) if hasattr(c, "model_dump") else dict(c) for c in entry["tool_calls"])
+            ]
+        if "tool_call_id" in entry:
+            entry["tool_call_id"] = call_id(entry["tool_call_id"])
+        normalized.append(entry)
+    return normalized
+
+
+def cache_key(request: dict) -> str:
+    """
+    SHA-256 of the normalized model, messages, tools and remaining parameters of a request.
+    """
+    canonical = {key: value for key, value in request.items() if key not in IGNORED_PARAMS}
+    canonical["messages"] = _normalize_messages(request.get("messages") or [])
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """
+    In-process LRU with per-entry expiry.
+    """
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: collections.OrderedDict[str, tuple[float, str]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    SQLite-backed LRU with per-entry expiry; several processes can share one file (WAL mode).
+    Calls may wait up to 5 s for another process's lock, so async code runs them in a thread.
+    """
+    name = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now))
+            self._writes += 1
+            if self._writes % 64 == 0: # Amortize eviction over many writes
+                self._conn.execute("DELETE FROM completions WHERE expires <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CompletionCache:
+    """
+    Exact-match cache of chat completion responses.
+
+    Args:
+        ttl: Seconds an entry stays valid.
+        max_entries: Entries kept before the least recently used ones are evicted.
+        path: SQLite file to use instead of process memory (shared between workers).
+    """
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1024, path: Optional[str] = None):
+        self.ttl = ttl
+        self.backend = SQLiteBackend(path, max_entries) if path else MemoryBackend(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["CompletionCache"]:
+        """
+        Returns a cache configured from AGENT_COMPLETION_CACHE*, or None when it is not enabled.
+        """
+        target = os.getenv("AGENT_COMPLETION_CACHE", "").strip()
+        if not target or target.lower() in ("0", "off", "false", "no"):
+            return None
+        return cls(
+            ttl=float(os.getenv("AGENT_COMPLETION_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("AGENT_COMPLETION_CACHE_SIZE", "1024")),
+            path=None if target.lower() == "memory" else target,
+        )
+
+    def get(self, request: dict) -> tuple[str, Optional[Any]]:
+        """
+        Looks up a request.
+
+        Returns:
+            (key, ChatCompletion or None). Tool-call ids of a hit are fresh, so a cached answer
+            never repeats ids already present in a conversation.
+        """
+        key = cache_key(request)
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(result="miss")
+            return key, None
+
+        from openai.types.chat import ChatCompletion
+        data = json.loads(value)
+        for choice in data.get("choices") or []:
+            for tool_call in (choice.get("message") or {}).get("tool_calls") or []:
+                tool_call["id"] = f"call_{uuid.uuid4().hex[:24]}"
+        self.hits += 1
+        CACHE_REQUESTS.inc(result="hit")
+        return key, ChatCompletion.model_validate(data)
+
+    def put(self, key: str, response: Any):
+        self.backend.set(key, response.model_dump_json(exclude_unset=True), self.ttl)
+        CACHE_ENTRIES.set(len(self.backend), backend=self.backend.name)
+
+    async def get_async(self, request: dict) -> tuple[str, Optional[Any]]:
+        """
+        get() for the event loop: a blocking backend is queried in a worker thread.
+        """
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.get, request)
+        return self.get(request)
+
+    async def put_async(self, key: str, response: Any):
+        """
+        put() for the event loop: a blocking backend is written in a worker thread.
+        """
+        if self.backend.blocking:
+            await asyncio.to_thread(self.put, key, response)
+        else:
+            self.put(key, response)
+
+    def bypass(self):
+        """
+        Counts a completion that was not eligible for caching.
+        """
+        self.bypassed += 1
+        CACHE_REQUESTS.inc(result="bypass")
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,561 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+from agent.completion_cache import CompletionCache
+from agent.core import AgentCore
+from agent.model_router import ModelRouter
+from agent.outbox import Outbox
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.drive_index import get_drive_index, indexed_users
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Conversation sessions for the multi-user server (main.py).
+#
+# Many conversations share one event loop and the expensive, thread-safe pieces:
+#   - one AsyncOpenAI client (one HTTP/2-capable connection pool to OpenAI)
+#   - one MicrosoftGraphAuth (one Azure AD token cache)
+#   - the per-loop pooled Graph client (microsoft_graph/http_client.py)
+#   - one model router, completion cache and outbox
+#   - the OneDrive search index, synced in the background for AGENT_DRIVE_INDEX_USERS
+# Each session owns only its AgentCore: history, tool routing state and token usage.
+#
+# Turns of one session run one at a time (a per-session lock); turns of different sessions run
+# concurrently. Sessions idle for longer than `idle_timeout` are evicted. When `max_sessions` is
+# reached, the least recently used idle session is evicted to make room.
+#
+# With a SessionStore, eviction only frees memory ("spills" the session). The new messages of
+# each turn are appended to the store when the turn ends. An evicted or pre-restart session is
+# loaded again on its next message, so memory is bounded by the active sessions and restarts
+# lose nothing.
+#
+# Configuration (environment):
+#     AGENT_SESSION_IDLE_SECONDS  Idle time before a session is evicted/spilled (default 1800)
+#     AGENT_MAX_SESSIONS          Sessions kept in memory at once (default 1000)
+#     AGENT_SESSION_STORE         Directory of the persistent session store (in-memory only if unset)
+#     AGENT_SESSION_SEGMENT_MB    Size at which the store starts a new segment file (default 64)
+
+SESSIONS_ACTIVE = REGISTRY.gauge(
+    "agent_sessions_active", "Conversation sessions held in memory.")
+SESSIONS_EVICTED = REGISTRY.counter(
+    "agent_sessions_evicted_total", "Conversation sessions evicted, by reason (idle, capacity, closed).", ("reason",))
+SESSIONS_LOADED = REGISTRY.counter(
+    "agent_sessions_loaded_total", "Conversation sessions loaded back from the session store.")
+STORE_BYTES = REGISTRY.counter(
+    "session_store_bytes_total", "Bytes moved by the session store, by direction (written, read).", ("direction",))
+STORE_SECONDS = REGISTRY.histogram(
+    "session_store_duration_seconds", "Latency of session store operations.", ("operation",))
+
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.jsonl$")
+
+logger = get_logger(__name__)
+
+
+class SessionStore:
+    """
+    Append-only, segmented on-disk store of conversation histories.
+
+    Messages are appended as JSON lines ({"s": session id, "m": message}) to the current segment
+    file; each append of a turn's messages is one contiguous byte range. An append-only index
+    (index.jsonl) records (session, segment, offset, length) per range, so loading a session reads
+    only its own ranges with seek + read instead of scanning the segments. The index is replayed
+    into memory on open (a few dozen bytes per range). Entries missing after a crash are recovered
+    by scanning the unindexed tail of the segments, and torn last lines are cut off.
+
+    Deleting a session appends a tombstone. compact() rewrites the live ranges into fresh segments
+    once enough of the data is garbage.
+
+    Args:
+        root: Directory holding the segments and the index (created if missing).
+        max_segment_bytes: Size at which a new segment is started.
+        fsync: fsync after every append (survives power loss, costs a disk flush per turn);
+               otherwise data is flushed to the OS, which survives process crashes.
+    """
+    def __init__(self, root: str, max_segment_bytes: int = 64 * 1024 * 1024, fsync: bool = False):
+        self.root = root
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        self.index: dict[str, list[tuple[int, int, int]]] = {} # session id -> [(segment, offset, length)]
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, "index.jsonl")
+        self._segment = 1
+        self._open_index()
+
+    @classmethod
+    def from_env(cls) -> Optional["SessionStore"]:
+        root = os.getenv("AGENT_SESSION_STORE")
+        if not root:
+            return None
+        return cls(root, max_segment_bytes=int(float(os.getenv("AGENT_SESSION_SEGMENT_MB", "64")) * 1024 * 1024))
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.root, f"segment-{segment:06d}.jsonl")
+
+    def _segments(self) -> list[int]:
+        return sorted(int(match.group(1)) for name in os.listdir(self.root) if (match := SEGMENT_NAME.match(name)))
+
+    def _open_index(self):
+        indexed_end: dict[int, int] = {} # segment -> end of the last indexed range
+        if os.path.exists(self._index_path):
+            complete = 0 # End of the last whole line
+            with open(self._index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # Torn last line
+                    complete += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("d"):
+                        self.index.pop(entry["s"], None)
+                        continue
+                    segment, offset, length = entry["g"], entry["o"], entry["n"]
+                    self.index.setdefault(entry["s"], []).append((segment, offset, length))
+                    indexed_end[segment] = max(indexed_end.get(segment, 0), offset + length)
+            if complete < os.path.getsize(self._index_path):
+                # Cut it off, or the next entry would be appended to it and lost with it
+                with open(self._index_path, "r+b") as f:
+                    f.truncate(complete)
+
+        segments = self._segments()
+        for segment in segments:
+            self._recover_tail(segment, indexed_end.get(segment, 0))
+        if segments:
+            self._segment = segments[-1]
+
+    def _recover_tail(self, segment: int, start: int):
+        """
+        Indexes records written after the last index entry of `segment` (a crash between the two
+        writes) and cuts off a torn last line.
+        """
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        if size <= start:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            tail = f.read()
+        complete = tail.rfind(b"\n") + 1
+        if complete < len(tail):
+            with open(path, "r+b") as f:
+                f.truncate(start + complete)
+        offset, ranges = start, []
+        for raw in tail[:complete].splitlines(keepends=True):
+            try:
+                session_id = json.loads(raw)["s"]
+            except (ValueError, KeyError):
+                offset += len(raw)
+                continue
+            if ranges and ranges[-1][0] == session_id and ranges[-1][1] + ranges[-1][2] == offset:
+                ranges[-1][2] += len(raw)
+            else:
+                ranges.append([session_id, offset, len(raw)])
+            offset += len(raw)
+        for session_id, range_offset, length in ranges:
+            self.index.setdefault(session_id, []).append((segment, range_offset, length))
+            self._write_index({"s": session_id, "g": segment, "o": range_offset, "n": length})
+
+    def _write_index(self, entry: dict):
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.index
+
+    def session_ids(self) -> list[str]:
+        return list(self.index)
+
+    def append(self, session_id: str, messages: Iterable[dict]):
+        """
+        Appends messages to a session as one contiguous range (blocking; call via a thread from async code).
+        """
+        data = "".join(json.dumps({"s": session_id, "m": message}, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+                       for message in messages).encode("utf-8")
+        if not data:
+            return
+        started = time.perf_counter()
+        with self._lock:
+            path = self._segment_path(self._segment)
+            if os.path.exists(path) and os.path.getsize(path) + len(data) > self.max_segment_bytes:
+                self._segment += 1
+                path = self._segment_path(self._segment)
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._write_index({"s": session_id, "g": self._segment, "o": offset, "n": len(data)})
+            self.index.setdefault(session_id, []).append((self._segment, offset, len(data)))
+        STORE_BYTES.inc(len(data), direction="written")
+        STORE_SECONDS.observe(time.perf_counter() - started, operation="append")
+
+    def load(self, session_id: str) -> list[dict]:
+        """
+        Reads a session's messages in order (empty if unknown).
+        """
+        started = time.perf_counter()
+        messages, read = [], 0
+        handles: dict[int, Any] = {}
+        with self._lock: # compact() may otherwise remove a segment mid-read
+            try:
+                for segment, offset, length in self.index.get(session_id, ()):
+                    handle = handles.get(segment)
+                    if handle is None:
+                        handle = handles[segment] = open(self._segment_path(segment), "rb")
+                    handle.seek(offset)
+                    chunk = handle.read(length)
+                    read += len(chunk)
+                    messages.extend(json.loads(line)["m"] for line in chunk.splitlines() if line)
+            finally:
+                for handle in handles.values():
+                    handle.close()
+        STORE_BYTES.inc(read, direction="read")
+        STORE_SECONDS.observe(time.perf_counter() - started, operation="load")
+        return messages
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if self.index.pop(session_id, None) is not None:
+                self._write_index({"s": session_id, "d": 1})
+
+    def garbage_ratio(self) -> float:
+        with self._lock: # append() changes the index from other threads
+            return self._garbage_ratio()
+
+    def _garbage_ratio(self) -> float:
+        live = sum(length for ranges in self.index.values() for _, _, length in ranges)
+        total = sum(os.path.getsize(self._segment_path(segment)) for segment in self._segments())
+        return 1.0 - live / total if total else 0.0
+
+    def compact(self, min_garbage: float = 0.5) -> bool:
+        """
+        Rewrites the live sessions into new segments (one contiguous range each) and a new index
+        when at least `min_garbage` of the stored bytes belong to deleted sessions. Blocking.
+
+        Returns:
+            Whether a compaction ran.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if self._garbage_ratio() < min_garbage:
+                return False
+            old_segments = self._segments()
+            segment = (old_segments[-1] if old_segments else 0) + 1
+            first_new = segment
+            new_index: dict[str, list[tuple[int, int, int]]] = {}
+            out = open(self._segment_path(segment), "wb")
+            try:
+                for session_id, ranges in self.index.items():
+                    data = b"".join(self._read_range(*entry) for entry in ranges)
+                    if out.tell() and out.tell() + len(data) > self.max_segment_bytes:
+                        out.close()
+                        segment += 1
+                        out = open(self._segment_path(segment), "wb")
+                    new_index[session_id] = [(segment, out.tell(), len(data))]
+                    out.write(data)
+                out.flush()
+                os.fsync(out.fileno())
+            finally:
+                out.close()
+
+            temporary = f"{self._index_path}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                for session_id, ranges in new_index.items():
+                    for entry_segment, offset, length in ranges:
+                        f.write(json.dumps({"s": session_id, "g": entry_segment, "o": offset, "n": length}, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self._index_path) # The switch-over point; old segments are garbage after it
+            for old in old_segments:
+                if old < first_new:
+                    os.remove(self._segment_path(old))
+            self.index = new_index
+            self._segment = segment
+        STORE_SECONDS.observe(time.perf_counter() - started, operation="compact")
+        return True
+
+    def _read_range(self, segment: int, offset: int, length: int) -> bytes:
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class SessionLimitError(RuntimeError):
+    """
+    Raised when a new session is needed but every session slot is busy with a running turn.
+    """
+
+
+class Session:
+    """
+    One conversation: its AgentCore plus the bookkeeping for serialization and eviction.
+    """
+    def __init__(self, session_id: str, agent: AgentCore):
+        self.id = session_id
+        self.agent = agent
+        self.lock = asyncio.Lock() # One turn at a time per conversation
+        self.created = time.monotonic()
+        self.last_active = self.created
+        self.turns = 0
+        self.persisted = 0 # Leading messages of agent.messages_history already in the session store
+        self.removed = False # Deleted by the client; a turn still running must not persist it again
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"session_id": self.id, "turns": self.turns, "busy": self.busy,
+                "idle_s": round(time.monotonic() - self.last_active, 3), "token_usage": self.agent.token_usage}
+
+
+class SessionManager:
+    """
+    Creates, serves and evicts conversation sessions that share clients.
+
+    Args:
+        supervisor_email: Escalation address for all sessions.
+        openai_client: Shared AsyncOpenAI client (created from OPENAI_API_KEY if omitted).
+        auth_handler: Shared Graph auth handler / token cache (MicrosoftGraphAuth if omitted).
+        idle_timeout: Seconds of inactivity after which a session is evicted.
+        max_sessions: Maximum sessions held at once.
+        store: Persistent SessionStore; evicted sessions are then spilled and reloaded on demand.
+        agent_factory: Builds an AgentCore for a new session from the shared pieces; defaults to
+                       AgentCore with the shared client, auth handler, router, cache and outbox.
+    """
+    def __init__(
+        self,
+        supervisor_email: str,
+        openai_client: Optional["AsyncOpenAI"] = None,
+        auth_handler: Optional[MicrosoftGraphAuth] = None,
+        idle_timeout: float = 1800.0,
+        max_sessions: int = 1000,
+        store: Optional[SessionStore] = None,
+        agent_factory: Optional[Callable[[str], AgentCore]] = None
+    ):
+        if openai_client is None:
+            from openai import AsyncOpenAI
+            openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.supervisor_email = supervisor_email
+        self.openai_client = openai_client
+        self.auth_handler = auth_handler or MicrosoftGraphAuth()
+        self.model_router = ModelRouter.from_env()
+        self.completion_cache = CompletionCache.from_env()
+        self.outbox = Outbox.from_env(self.auth_handler)
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.store = store
+        self.agent_factory = agent_factory or self._default_agent
+        self.sessions: dict[str, Session] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self._indexer: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, openai_client: Optional["AsyncOpenAI"] = None,
+                 auth_handler: Optional[MicrosoftGraphAuth] = None) -> "SessionManager":
+        return cls(
+            os.getenv("SUPERVISOR_EMAIL", "default_supervisor@example.com"),
+            openai_client=openai_client,
+            auth_handler=auth_handler,
+            idle_timeout=float(os.getenv("AGENT_SESSION_IDLE_SECONDS", "1800")),
+            max_sessions=int(os.getenv("AGENT_MAX_SESSIONS", "1000")),
+            store=SessionStore.from_env(),
+        )
+
+    def _default_agent(self, session_id: str) -> AgentCore:
+        return AgentCore(
+            self.supervisor_email,
+            openai_client=self.openai_client,
+            auth_handler=self.auth_handler,
+            prompt_cache_key=f"m365agent-{session_id}",
+            model_router=self.model_router,
+            completion_cache=self.completion_cache,
+            outbox=self.outbox,
+        )
+
+    # --- lifecycle ---
+    async def start(self) -> dict[str, Any]:
+        """
+        Starts idle eviction, the outbox workers and the OneDrive index sync, and warms up the shared token, connections
+        and tool modules once for all sessions. Returns the warm-up timings.
+        """
+        if self._reaper is None:
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+        if self.outbox is not None:
+            self.outbox.start()
+        drive_index, users = get_drive_index(), indexed_users()
+        if drive_index is not None and users and self._indexer is None:
+            interval = float(os.getenv("AGENT_DRIVE_INDEX_INTERVAL", "300"))
+            self._indexer = asyncio.get_running_loop().create_task(drive_index.keep_synced(self.auth_handler, users, interval))
+        probe = self.agent_factory("warm-up")
+        try:
+            return await probe.warm_up()
+        finally:
+            probe.close()
+
+    async def close(self):
+        for task in (self._reaper, self._indexer):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._reaper = self._indexer = None
+        for session_id in list(self.sessions):
+            self._evict(session_id, "closed")
+        if self.outbox is not None:
+            await self.outbox.stop()
+        await self.openai_client.close()
+
+    # --- sessions ---
+    async def create(self, session_id: Optional[str] = None) -> Session:
+        """
+        Creates a session (or returns the existing one with that id). A new session's system
+        message is written to the store right away (in a thread), so the session survives being
+        spilled before its first turn.
+
+        Raises:
+            SessionLimitError: If max_sessions is reached and no idle session can be evicted.
+        """
+        if session_id and session_id in self.sessions:
+            return self.sessions[session_id]
+        session = self._admit(session_id or uuid.uuid4().hex)
+        await self._persist(session)
+        logger.info("session.created", session_id=session.id, sessions=len(self.sessions))
+        return session
+
+    def _admit(self, session_id: str) -> Session:
+        if len(self.sessions) >= self.max_sessions:
+            idle = [session for session in self.sessions.values() if not session.busy]
+            if not idle:
+                raise SessionLimitError(f"All {self.max_sessions} sessions are busy.")
+            self._evict(min(idle, key=lambda session: session.last_active).id, "capacity")
+        session = Session(session_id, self.agent_factory(session_id))
+        self.sessions[session_id] = session
+        SESSIONS_ACTIVE.set(len(self.sessions))
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """
+        The in-memory session with that id; spilled sessions are not loaded (see exists/load).
+        """
+        return self.sessions.get(session_id)
+
+    def exists(self, session_id: str) -> bool:
+        """
+        Whether the session is in memory or can be loaded from the store.
+        """
+        return session_id in self.sessions or (self.store is not None and session_id in self.store)
+
+    async def load(self, session_id: str) -> Optional[Session]:
+        """
+        The session with that id, loaded from the store if it was spilled or the process restarted;
+        None if it is unknown.
+        """
+        session = self.sessions.get(session_id)
+        if session is not None or self.store is None or session_id not in self.store:
+            return session
+        history = await asyncio.to_thread(self.store.load, session_id)
+        session = self.sessions.get(session_id) # Loaded concurrently by another request
+        if session is not None:
+            return session
+        session = self._admit(session_id)
+        agent = session.agent
+        if history and history[0].get("role") == "system":
+            history[0] = agent.messages_history[0] # Current instructions; the rest is replayed as stored
+        agent.messages_history = history or agent.messages_history
+        session.persisted = len(history)
+        session.turns = sum(1 for message in history if message.get("role") == "user")
+        SESSIONS_LOADED.inc()
+        logger.info("session.loaded", session_id=session_id, messages=len(history), sessions=len(self.sessions))
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        if not self.exists(session_id):
+            return False
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.removed = True
+        self._evict(session_id, "closed")
+        if self.store is not None:
+            self.store.delete(session_id)
+        return True
+
+    async def open(self, session_id: str) -> Session:
+        """
+        The session with that id: in memory, loaded from the store, or created.
+
+        Raises:
+            SessionLimitError: If the session has to be admitted and every session slot is busy.
+        """
+        return await self.load(session_id) or await self.create(session_id)
+
+    async def process_message(self, session_id: str, user_message: str, **kwargs) -> dict[str, Any]:
+        """
+        Runs one turn in a session (loaded or created on first use); turns of one session are
+        serialized. The turn's new messages are appended to the store before returning.
+        Keyword arguments (e.g. on_delta, profile) are passed to AgentCore.process_message.
+
+        Raises:
+            SessionLimitError: See open().
+        """
+        session = await self.open(session_id)
+        async with session.lock:
+            session.last_active = time.monotonic()
+            try:
+                return await session.agent.process_message(user_message, **kwargs)
+            finally:
+                session.turns += 1
+                session.last_active = time.monotonic()
+                await self._persist(session)
+
+    async def _persist(self, session: Session):
+        if self.store is None or session.removed:
+            return
+        history = session.agent.messages_history
+        new_messages = history[session.persisted:]
+        if not new_messages:
+            return
+        try:
+            await asyncio.to_thread(self.store.append, session.id, new_messages)
+            session.persisted = len(history)
+        except OSError as e: # The turn still succeeded; the next turn retries these messages
+            logger.error("session.persist_failed", session_id=session.id, error=str(e))
+
+    def _evict(self, session_id: str, reason: str):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.agent.close()
+        SESSIONS_EVICTED.inc(reason=reason)
+        SESSIONS_ACTIVE.set(len(self.sessions))
+        logger.info("session.evicted", session_id=session_id, reason=reason, turns=session.turns,
+                    spilled=self.store is not None)
+
+    async def _reap(self):
+        interval = max(1.0, min(60.0, self.idle_timeout / 4))
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.idle_timeout
+            for session in list(self.sessions.values()):
+                if not session.busy and session.last_active < cutoff:
+                    self._evict(session.id, "idle")
+            if self.store is not None:
+                try:
+                    if await asyncio.to_thread(self.store.compact):
+                        logger.info("session_store.compacted", sessions=len(self.store.index))
+                except Exception as e: # Keep reaping; a dead reaper would stop eviction for good
+                    logger.error("session_store.compact_failed", error=f"{type(e).__name__}: {e}")
@@ -1,161 +1,625 @@
 import asyncio
+import base64
+import inspect
 import json
 import os
-from openai import OpenAI
-from typing import Optional, List, Dict, Any
+import time
+import uuid
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, List, Dict, Any, Union
 from datetime import datetime
 
-from openai.types.chat import (
-    ChatCompletionMessageToolCall,
-    ChatCompletionMessageParam,
-    ChatCompletionSystemMessageParam,
-    ChatCompletionUserMessageParam,
-    ChatCompletionAssistantMessageParam,
-    ChatCompletionToolMessageParam,
-)
+# openai, azure.identity and the Graph tool modules (httpx) are imported on first use, not here:
+# together they dominate start-up time, and AgentCore.start_warm_up() loads them in the background.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion, ChatCompletionMessageToolCall, ChatCompletionMessageParam
 
-# Microsoft Graph auth and tool functions
+# Microsoft Graph auth (azure.identity itself is loaded lazily by MicrosoftGraphAuth)
 from microsoft_graph.auth import MicrosoftGraphAuth
-from microsoft_graph.outlook_email import send_outlook_email, list_outlook_emails, get_outlook_email_content
-from microsoft_graph.outlook_calendar import create_calendar_event, update_calendar_event, delete_calendar_event
-from microsoft_graph.onedrive_files import upload_file_to_onedrive, list_files_in_folder, download_file_from_onedrive, delete_file_from_onedrive
 
-# Tool definitions
-from tools.outlook_tools import OUTLOOK_EMAIL_TOOLS
-from tools.calendar_tools import CALENDAR_TOOLS
-from tools.onedrive_tools import ONEDRIVE_FILE_TOOLS
+# Tool registry (schemas, validators and implementations of the @tool-decorated Graph helpers)
+from tools.registry import ToolArgumentError, registry
+
+# Per-turn tool and model selection
+from agent.completion_cache import CompletionCache
+from agent.model_router import ModelRouter
+from agent.outbox import Outbox
+from agent.tool_router import ROUTER_TOKENS_SAVED, ToolRouter
+
+# Tracing, metrics and per-turn profiling
+from agent.profiling import MemoryProbe, build_turn_profile
+from utils.logger import get_logger
+from utils.loop_watchdog import LoopWatchdog
+from utils.metrics import REGISTRY, start_metrics_server
+from utils.tracing import tracer
+
+LLM_SECONDS = REGISTRY.histogram(
+        "llm_request_duration_seconds", "Latency of chat completion calls.", ("model", "status"))
+LLM_TOKENS = REGISTRY.counter(
+        "llm_tokens_total", "Tokens reported by chat completion calls.", ("model", "type"))
+TOOL_SECONDS = REGISTRY.histogram(
+        "agent_tool_duration_seconds", "Wall time of agent tool calls.", ("tool", "status"))
+TURN_SECONDS = REGISTRY.histogram(
+        "agent_turn_duration_seconds", "Wall time of a full process_message turn.", ("status",))
+
+# Receives the text of a streamed answer as it arrives; may be a coroutine function.
+DeltaCallback = Callable[[str], Union[None, Awaitable[None]]]
+
+logger = get_logger(__name__)
+
+# Built once: the system message opens every prompt, so it must stay byte-identical across turns
+# and sessions for the provider's prompt-prefix cache to hit.
+SYSTEM_INSTRUCTIONS = (
+    "You are an intelligent Microsoft 365 agent designed to help users manage their email, calendar, and OneDrive files. "
+    "You have access to specific tools to perform these actions. "
+    "Always prioritize using the available tools to fulfill user requests related to these domains. "
+    "If a request is outside your capabilities (e.g., requires access to systems not covered by your tools, or is a highly complex multi-step process that you cannot break down), "
+    "or if a tool call fails repeatedly, you must escalate the request to the supervisor by stating 'This task requires supervisor attention.' "
+    "When performing file operations, assume the user's OneDrive is the target unless specified otherwise. "
+    "For email and calendar operations, assume the user's mailbox/calendar is 'ai_agent_dev2@intellistrata.com.au' unless another specific user ID is provided by the user. "
+    "When creating or updating calendar events, always ask for specific date and time details if not provided, and clarify the timezone. "
+    "When a tool produces results (e.g., a list of emails), summarize them concisely and offer further assistance based on the results. "
+    "Be polite, helpful, and clear in your responses. "
+    "When sending emails, ask for confirmation before sending the final email content if it's a critical action. "
+    "After performing an action, confirm success or report any failures clearly."
+)
+
+
+async def _emit(on_delta: DeltaCallback, text: str):
+    result = on_delta(text)
+    if inspect.isawaitable(result):
+        await result
 
 
 class AgentCore:
-    def __init__(self, supervisor_email: str):
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.auth_handler = MicrosoftGraphAuth()
+    def __init__(
+        self,
+        supervisor_email: str,
+        openai_client: Optional["AsyncOpenAI"] = None, # Pre-built (shared) client, e.g. pointed at a local stand-in
+        auth_handler: Optional[MicrosoftGraphAuth] = None, # Pre-built auth handler, shared or stubbed
+        max_concurrent_tools: int = 4, # Read-only tool calls of one round run concurrently up to this limit
+        tool_routing: bool = True, # Send only the tools relevant to each turn (all of them when unsure)
+        prompt_cache_key: Optional[str] = None, # Routes this session's requests to the same provider cache
+        model_router: Optional[ModelRouter] = None, # Fast vs large model per completion; from AGENT_* env by default
+        max_tool_rounds: int = 5, # Tool rounds per user turn before the model must answer
+        turn_time_budget: float = 60.0, # Seconds after which no new tool round is started
+        completion_cache: Optional[CompletionCache] = None, # Exact-match response cache; from AGENT_COMPLETION_CACHE by default
+        outbox: Optional[Outbox] = None # Durable background queue for mutating tools (once started); from AGENT_OUTBOX_PATH by default
+    ):
+        self._openai_client = openai_client # Created on first use when not provided
+        self.auth_handler = auth_handler or MicrosoftGraphAuth()
         self.supervisor_email = supervisor_email
-
-        # Combine tools
-        self.all_tools = OUTLOOK_EMAIL_TOOLS + CALENDAR_TOOLS + ONEDRIVE_FILE_TOOLS
-
-        self.tool_functions = {
-            "send_outlook_email": send_outlook_email,
-            "list_outlook_emails": list_outlook_emails,
-            "get_outlook_email_content": get_outlook_email_content,
-            "create_calendar_event": create_calendar_event,
-            "update_calendar_event": update_calendar_event,
-            "delete_calendar_event": delete_calendar_event,
-            "upload_file_to_onedrive": upload_file_to_onedrive,
-            "list_files_in_folder": list_files_in_folder,
-            "download_file_from_onedrive": download_file_from_onedrive,
-            "delete_file_from_onedrive": delete_file_from_onedrive,
-        }
-
-        self.system_instructions = (
-            "You are an intelligent Microsoft 365 agent designed to help users manage their email, calendar, and OneDrive files. "
-            "You have access to specific tools to perform these actions. "
-            "Always prioritize using the available tools to fulfill user requests related to these domains. "
-            "If a request is outside your capabilities (e.g., requires access to systems not covered by your tools, or is a highly complex multi-step process that you cannot break down), "
-            f"or if a tool call fails repeatedly, you must escalate the request to the supervisor by stating 'This task requires supervisor attention.' "
-            "When performing file operations, assume the user's OneDrive is the target unless specified otherwise. "
-            "For email and calendar operations, assume the user's mailbox/calendar is 'ai_agent_dev2@intellistrata.com.au' unless another specific user ID is provided by the user. "
-            "When creating or updating calendar events, always ask for specific date and time details if not provided, and clarify the timezone. "
-            "When a tool produces results (e.g., a list of emails), summarize them concisely and offer further assistance based on the results. "
-            "Be polite, helpful, and clear in your responses. "
-            "When sending emails, ask for confirmation before sending the final email content if it's a critical action. "
-            "After performing an action, confirm success or report any failures clearly."
-        )
-
-        # Typed history of messages
-        self.messages_history: List[ChatCompletionMessageParam] = [
-            ChatCompletionSystemMessageParam(role="system", content=self.system_instructions)
+        self.tool_slots = asyncio.Semaphore(max_concurrent_tools)
+        self._warm_up_task: Optional[asyncio.Task] = None
+
+        self.tools = registry # Tool modules are imported on first use (see all_tools)
+        self.tool_router = ToolRouter(self.tools) if tool_routing else None
+        self.prompt_cache_key = prompt_cache_key or f"m365agent-{uuid.uuid4().hex}"
+        self.model_router = model_router or ModelRouter.from_env()
+        self.max_tool_rounds = max_tool_rounds
+        self.turn_time_budget = turn_time_budget
+        self.completion_cache = completion_cache if completion_cache is not None else CompletionCache.from_env()
+        self.outbox = outbox if outbox is not None else Outbox.from_env(self.auth_handler)
+        self._outbox_jobs: set[str] = set() # Jobs submitted by this session
+        self._outbox_notices: List[str] = [] # Outcomes of those jobs, reported at the start of the next turn
+        if self.outbox is not None:
+            self.outbox.listeners.append(self._on_outbox_job_done)
+        self.token_usage = {"prompt": 0, "cached": 0, "completion": 0, "cost_usd": 0.0} # Session totals
+
+        self.system_instructions = SYSTEM_INSTRUCTIONS
+
+        # Typed history of messages (ChatCompletion*MessageParam are TypedDicts, i.e. plain dicts).
+        # Append-only: earlier messages are never edited or reordered, so each request's prompt
+        # starts with the previous request's prompt and the provider can serve it from cache.
+        self.messages_history: List["ChatCompletionMessageParam"] = [
+            {"role": "system", "content": self.system_instructions}
         ]
 
-    async def _dispatch_tool_call(self, tool_call: ChatCompletionMessageToolCall) -> Dict[str, Any]:
+    @property
+    def openai_client(self) -> "AsyncOpenAI":
+        if self._openai_client is None:
+            from openai import AsyncOpenAI
+            self._openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._openai_client
+
+    @property
+    def all_tools(self) -> List[Dict[str, Any]]:
+        return self.tools.schemas()
+
+    def _select_tools(self, user_message: str) -> Dict[str, Any]:
+        """
+        Returns the tool schemas for this turn and how they were chosen (see ToolRouter.select).
+        """
+        with tracer.span("agent.route_tools") as span:
+            if self.tool_router is None:
+                routing = {"tools": self.all_tools, "mode": "disabled", "groups": [], "confidence": None, "tokens_saved": 0}
+            else:
+                routing = self.tool_router.select(user_message)
+            span.set(**{key: value for key, value in routing.items() if key != "tools"})
+        return routing
+
+    def start_warm_up(self) -> asyncio.Task:
+        """
+        Starts warm_up() in the background (idempotent) and returns its task, and starts the outbox
+        workers. Call it right after construction, e.g. while the user is still typing.
+        """
+        if self._warm_up_task is None:
+            if self.outbox is not None:
+                self.outbox.start()
+            self._warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
+        return self._warm_up_task
+
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        Concurrently pre-loads the deferred modules, fetches the Graph access token and opens the
+        Graph and OpenAI connections, so the first turn doesn't pay for them. Failures are logged
+        and otherwise ignored; the first turn then simply does the work itself.
+
+        Returns:
+            A dictionary with the duration (ms) or error of each warm-up step.
+        """
+        async def timed(name: str, coro):
+            started = time.perf_counter()
+            try:
+                await coro
+                return name, {"ms": round((time.perf_counter() - started) * 1000, 3)}
+            except Exception as e:
+                logger.debug("warm_up.failed", step=name, error=f"{type(e).__name__}: {e}")
+                return name, {"ms": round((time.perf_counter() - started) * 1000, 3), "error": f"{type(e).__name__}: {e}"}
+
+        async def graph_connection():
+            # Importing the tool modules pulls in httpx; do it off the loop.
+            await asyncio.to_thread(self.tools.load)
+            from microsoft_graph.http_client import warm_up_connection
+            await warm_up_connection(self.auth_handler.get_base_graph_url())
+
+        async def openai_connection():
+            # Any response, even an error status, leaves a pooled keep-alive connection behind.
+            await self.openai_client.with_raw_response.models.list()
+
+        results = dict(await asyncio.gather(
+            timed("graph_token", self.auth_handler.get_access_token_async()),
+            timed("graph_connection", graph_connection()),
+            timed("openai_connection", openai_connection()),
+        ))
+        logger.info("warm_up.done", **results)
+        return results
+
+    async def _dispatch_tool_call(self, tool_call: "ChatCompletionMessageToolCall") -> Dict[str, Any]:
         tool_name = tool_call.function.name
         tool_args = tool_call.function.arguments
 
-        if tool_name not in self.tool_functions:
+        spec = self.tools.get(tool_name)
+        if spec is None:
             return {"error": f"Tool '{tool_name}' not found or implemented."}
 
-        try:
-            parsed_args = json.loads(tool_args)
-            func = self.tool_functions[tool_name]
-            result = await func(auth_handler=self.auth_handler, **parsed_args)
-            return result
-        except json.JSONDecodeError:
-            return {"error": f"Invalid JSON arguments for '{tool_name}': {tool_args}"}
-        except Exception as e:
-            return {"error": f"Error executing tool '{tool_name}': {type(e).__name__} - {e}"}
-
-    async def process_message(self, user_message: str) -> Dict[str, Any]:
-        self.messages_history.append(ChatCompletionUserMessageParam(role="user", content=user_message))
+        queued_at = time.perf_counter()
+        async with self.tool_slots:
+            started = time.perf_counter()
+            queued_ms = round((started - queued_at) * 1000, 3)
+            with tracer.span(f"tool.{tool_name}", kind="tool", tool=tool_name, args_bytes=len(tool_args or ""), queued_ms=queued_ms) as span:
+                try:
+                    parsed_args = spec.validate(json.loads(tool_args or "{}"))
+                    logger.info("tool.call", tool=tool_name, args=parsed_args, queued_ms=queued_ms)
+                    if spec.mutating and self.outbox is not None and self.outbox.running:
+                        result = await self._submit_to_outbox(tool_name, parsed_args)
+                        span.set(outbox_status=result.get("status"))
+                    else:
+                        result = await spec.func(auth_handler=self.auth_handler, **parsed_args)
+                except json.JSONDecodeError:
+                    result = {"error": f"Invalid JSON arguments for '{tool_name}': {tool_args}"}
+                except ToolArgumentError as e:
+                    # Rejected locally; the model gets the reason and can retry with fixed arguments
+                    logger.info("tool.rejected", tool=tool_name, reason=str(e))
+                    result = {"status": "error", "message": f"Invalid arguments for '{tool_name}': {e}"}
+                except Exception as e:
+                    result = {"error": f"Error executing tool '{tool_name}': {type(e).__name__} - {e}"}
+
+                failed = isinstance(result, dict) and ("error" in result or result.get("status") == "error")
+                if failed:
+                    span.status = "error"
+                duration = time.perf_counter() - started
+                TOOL_SECONDS.observe(duration, tool=tool_name, status="error" if failed else "ok")
+                logger.info("tool.result", tool=tool_name, status="error" if failed else "ok",
+                            duration_ms=round(duration * 1000, 3), result=result)
+                return result
+
+    async def _submit_to_outbox(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Runs a mutating tool through the outbox: waits up to outbox.confirm_wait for the result,
+        otherwise reports the job as queued. An identical operation already queued or done is not repeated.
+        """
+        job, created = await self.outbox.submit(tool_name, arguments)
+        if not created:
+            return {"status": "duplicate", "job_id": job.id, "state": job.state,
+                    "message": f"An identical '{tool_name}' request was already {job.state} "
+                               f"(job {job.id}); it was not repeated.", "result": job.result}
+        self._outbox_jobs.add(job.id)
+        job = await self.outbox.wait(job.id, timeout=self.outbox.confirm_wait)
+        if job.state == "succeeded":
+            self._outbox_jobs.discard(job.id) # Reported now, not again next turn
+            return job.result
+        if job.state == "failed":
+            self._outbox_jobs.discard(job.id)
+            return {"status": "error", "job_id": job.id, "message": job.error}
+        return {"status": "queued", "job_id": job.id,
+                "message": f"'{tool_name}' is queued (job {job.id}) and will complete in the background; "
+                           "the outcome will be reported on the next turn."}
+
+    def _on_outbox_job_done(self, job):
+        if job.id in self._outbox_jobs:
+            self._outbox_jobs.discard(job.id)
+            outcome = "succeeded" if job.state == "succeeded" else f"{job.state}: {job.error}"
+            self._outbox_notices.append(f"Background job {job.id} ({job.tool}) {outcome}")
+
+    def close(self):
+        """
+        Detaches the session from shared resources (the outbox keeps running its jobs).
+        Shared clients are owned, and closed, by whoever created them.
+        """
+        if self.outbox is not None and self._on_outbox_job_done in self.outbox.listeners:
+            self.outbox.listeners.remove(self._on_outbox_job_done)
+
+    @staticmethod
+    def _assistant_message(message) -> Dict[str, Any]:
+        """
+        Plain-dict copy of an assistant response with a fixed key order and no null fields, so
+        the message serializes to the same bytes in every later request.
+        """
+        entry: Dict[str, Any] = {"role": "assistant", "content": message.content}
+        if message.tool_calls:
+            entry["tool_calls"] = [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+                }
+                for tool_call in message.tool_calls
+            ]
+        return entry
+
+    def _calls_mutating_tool(self, tool_calls: Optional[list]) -> bool:
+        for tool_call in tool_calls or []:
+            spec = self.tools.get(tool_call.function.name)
+            if spec is None or spec.mutating: # Unknown tools are treated as state-changing
+                return True
+        return False
+
+    async def _create_completion(self, route: Optional[Dict[str, str]] = None, cacheable: bool = False,
+                                 on_delta: Optional[DeltaCallback] = None, **kwargs) -> "ChatCompletion":
+        """
+        Single entry point for chat completions, so every call is traced and its latency
+        and token usage (including prompt tokens served from the provider's cache) are recorded.
+
+        Args:
+            route: A ModelRouter decision; its model is used unless kwargs name one, and the
+                   call's latency and estimated cost are recorded under its route.
+            cacheable: Whether the completion cache (if enabled) may answer or store this request.
+                       Responses calling a mutating tool are never stored.
+            on_delta: If given, the completion is streamed and answer text is passed to it as it
+                      arrives; the return value is still the complete response.
+            **kwargs: Arguments for chat.completions.create.
+        """
+        if route is not None:
+            kwargs.setdefault("model", route["model"])
+        kwargs.setdefault("prompt_cache_key", self.prompt_cache_key)
+        model = kwargs.get("model", "")
+        route_name = route["route"] if route else "unrouted"
+        started = time.perf_counter()
+        with tracer.span("llm.chat_completion", kind="client", model=model, route=route_name,
+                         messages=len(kwargs.get("messages", []))) as span:
+            if route is not None:
+                span.set(route_reason=route.get("reason"))
+
+            cache_key = None
+            if self.completion_cache is not None:
+                if not cacheable:
+                    self.completion_cache.bypass()
+                    span.set(completion_cache="bypass")
+                else:
+                    cache_key, cached = await self.completion_cache.get_async(kwargs)
+                    span.set(completion_cache="hit" if cached is not None else "miss")
+                    if cached is not None:
+                        self.model_router.record(route_name, model, time.perf_counter() - started)
+                        span.set(finish_reason=cached.choices[0].finish_reason if cached.choices else None)
+                        if on_delta is not None and cached.choices and cached.choices[0].message.content:
+                            await _emit(on_delta, cached.choices[0].message.content)
+                        return cached # No tokens were billed, so usage is not recorded
+            try:
+                if on_delta is None:
+                    response = await self.openai_client.chat.completions.create(**kwargs)
+                else:
+                    response = await self._stream_completion(kwargs, on_delta, span, started)
+            except Exception:
+                LLM_SECONDS.observe(time.perf_counter() - started, model=model, status="error")
+                self.model_router.record(route_name, model, time.perf_counter() - started)
+                raise
+            duration = time.perf_counter() - started
+            LLM_SECONDS.observe(duration, model=model, status="ok")
+
+            usage = getattr(response, "usage", None)
+            if usage is None:
+                self.model_router.record(route_name, model, duration)
+            else:
+                details = getattr(usage, "prompt_tokens_details", None)
+                cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+                span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cached_tokens=cached_tokens)
+                LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, type="prompt")
+                LLM_TOKENS.inc(cached_tokens, model=model, type="cached")
+                LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, type="completion")
+                self.token_usage["prompt"] += usage.prompt_tokens or 0
+                self.token_usage["cached"] += cached_tokens
+                self.token_usage["completion"] += usage.completion_tokens or 0
+                cost = self.model_router.record(route_name, model, duration, usage.prompt_tokens or 0,
+                                                usage.completion_tokens or 0, cached_tokens)
+                if cost is not None:
+                    span.set(cost_usd=round(cost, 8))
+                    self.token_usage["cost_usd"] += cost
+            span.set(finish_reason=response.choices[0].finish_reason if response.choices else None)
+            if cache_key is not None and response.choices and not self._calls_mutating_tool(response.choices[0].message.tool_calls):
+                await self.completion_cache.put_async(cache_key, response)
+            return response
+
+    async def _stream_completion(self, kwargs: Dict[str, Any], on_delta: DeltaCallback, span, started: float) -> "ChatCompletion":
+        """
+        Streams a completion, passing content deltas to `on_delta`, and reassembles the chunks
+        (content, tool-call fragments, usage) into a regular ChatCompletion.
+        """
+        from openai.types.chat import ChatCompletion
+
+        stream = await self.openai_client.chat.completions.create(
+            **kwargs, stream=True, stream_options={"include_usage": True})
+        content: List[str] = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        meta: Dict[str, Any] = {"id": "", "created": int(time.time()), "model": kwargs.get("model", "")}
+        finish_reason, usage = None, None
+        async for chunk in stream:
+            meta.update(id=chunk.id or meta["id"], created=chunk.created or meta["created"], model=chunk.model or meta["model"])
+            if chunk.usage is not None:
+                usage = chunk.usage.model_dump()
+            for choice in chunk.choices:
+                delta = choice.delta
+                if delta.content:
+                    if not content:
+                        span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 3))
+                    content.append(delta.content)
+                    await _emit(on_delta, delta.content)
+                for fragment in delta.tool_calls or []:
+                    entry = tool_calls.setdefault(fragment.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                    if fragment.id:
+                        entry["id"] = fragment.id
+                    if fragment.function is not None:
+                        entry["function"]["name"] += fragment.function.name or ""
+                        entry["function"]["arguments"] += fragment.function.arguments or ""
+                finish_reason = choice.finish_reason or finish_reason
+
+        message: Dict[str, Any] = {"role": "assistant", "content": "".join(content) if content else None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        span.set(streamed=True)
+        return ChatCompletion.model_validate({
+            **meta, "object": "chat.completion", "usage": usage,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason or ("tool_calls" if tool_calls else "stop")}],
+        })
+
+    async def process_message(self, user_message: str, profile: bool = False, debug: bool = False,
+                              on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
+        """
+        Runs one user turn.
+
+        Args:
+            user_message: The user's message.
+            profile: If True, the result also contains a "profile" entry breaking the turn down into
+                     LLM time per completion, each tool's wall time, time queued behind the tool
+                     concurrency limit, serialization time and prompt/completion tokens.
+            debug: If True (implies profile), the profile also contains tracemalloc and history-size
+                   snapshots. This is slow and meant for investigating individual turns.
+            on_delta: If given, completions are streamed and the answer text is passed to it as
+                      it arrives (sync or async callable). "text_output" still holds the full answer.
+
+        Returns:
+            A dictionary with "text_output" and, when requested, "profile".
+        """
+        memory_probe = MemoryProbe() if debug else None
+        if memory_probe:
+            memory_probe.start()
+
+        started = time.perf_counter()
+        with tracer.turn("agent.turn", supervisor=self.supervisor_email) as trace:
+            trace.attributes["status"] = "ok"
+            result = await self._process_message(user_message, on_delta)
+        TURN_SECONDS.observe(time.perf_counter() - started, status=trace.attributes["status"])
+
+        if profile or debug:
+            result["profile"] = build_turn_profile(trace)
+            if memory_probe:
+                result["profile"]["debug"] = memory_probe.stop(self.messages_history)
+        return result
+
+    async def _process_message(self, user_message: str, on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
+        if self._outbox_notices:
+            # Appended, not inserted, so the cached history prefix stays valid
+            notices, self._outbox_notices = self._outbox_notices, []
+            self.messages_history.append({"role": "system", "content": "Since the last message: " + "; ".join(notices) + "."})
+        self.messages_history.append({"role": "user", "content": user_message})
+        trace = tracer.current_trace()
 
         try:
-            chat_completion_response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=self.messages_history,
-                tools=self.all_tools,
-                tool_choice="auto",
-            )
-
-            response_message = chat_completion_response.choices[0].message
-
-            # Append assistant message with either content or tool calls
-            self.messages_history.append(ChatCompletionAssistantMessageParam(
-                role="assistant",
-                content=response_message.content,
-                tool_calls=response_message.tool_calls
-            ))
-
-            # Handle tool calls if present
-            if response_message.tool_calls:
-                for tool_call in response_message.tool_calls:
-                    print(f"\nCalling tool: {tool_call.function.name} with args: {tool_call.function.arguments}")
-                    tool_result = await self._dispatch_tool_call(tool_call)
-                    print(f"Tool result: {tool_result}")
-
-                    self.messages_history.append(ChatCompletionToolMessageParam(
-                        role="tool",
-                        tool_call_id=tool_call.id,
-                        content=json.dumps(tool_result)
-                    ))
-
-                # Second call with tool responses
-                second_response = self.openai_client.chat.completions.create(
-                    model="gpt-4o",
+            routing = self._select_tools(user_message)
+            turn_tools = routing["tools"]
+            plan_route = self.model_router.for_plan(user_message, routing)
+            route = plan_route
+            deadline = time.monotonic() + self.turn_time_budget
+            seen_calls: Dict[str, str] = {} # Canonical "name(arguments)" -> id of the call that ran it
+            tools_used: List[str] = []
+            rounds = 0
+            stop_reason = None # Set once the loop must end; the next completion may not call tools
+            mutated = False # A state-changing tool ran; from then on nothing in this turn is cached
+
+            while True:
+                # The tools stay in the request even when calls are no longer allowed, so the
+                # cached prompt prefix still matches; tool_choice="none" forces a text answer.
+                response = await self._create_completion(
+                    route=route,
+                    cacheable=not mutated,
+                    on_delta=on_delta,
                     messages=self.messages_history,
-                    tools=self.all_tools,
-                    tool_choice="auto"
+                    tools=turn_tools,
+                    tool_choice="none" if stop_reason else "auto",
                 )
-
-                final_message = second_response.choices[0].message
-                final_text = final_message.content or ""
-
-                self.messages_history.append(ChatCompletionAssistantMessageParam(
-                    role="assistant",
-                    content=final_text
-                ))
-
+                ROUTER_TOKENS_SAVED.inc(routing["tokens_saved"])
+                response_message = response.choices[0].message
+
+                # Append assistant message with either content or tool calls
+                self.messages_history.append(self._assistant_message(response_message))
+
+                if not response_message.tool_calls or stop_reason:
+                    if response_message.tool_calls:
+                        # Ignored calls would leave the history without their required tool results
+                        self.messages_history[-1] = {"role": "assistant", "content": response_message.content or ""}
+                    stop_reason = stop_reason or "answered"
+                    break
+
+                rounds += 1
+                mutated = mutated or self._calls_mutating_tool(response_message.tool_calls)
+                tool_results = await self._run_tool_round(response_message.tool_calls, seen_calls)
+                tools_used.extend(tool_call.function.name for tool_call in response_message.tool_calls)
+
+                if all(isinstance(result, dict) and result.get("status") == "skipped" for result in tool_results):
+                    stop_reason = "repeated_calls" # The model is going round in circles
+                elif rounds >= self.max_tool_rounds:
+                    stop_reason = "max_rounds"
+                elif time.monotonic() >= deadline:
+                    stop_reason = "time_budget"
+                route = self.model_router.for_summary(tool_results, escalate=plan_route["route"] == "plan_large")
+
+            if self.tool_router is not None:
+                self.tool_router.record_usage(tools_used)
+            if trace is not None:
+                trace.attributes.update(tool_rounds=rounds, stop_reason=stop_reason)
+            if stop_reason != "answered":
+                logger.info("turn.cut_short", reason=stop_reason, rounds=rounds)
+
+            final_text = response_message.content or ""
+            if final_text:
                 return {"text_output": final_text}
-
-            elif response_message.content:
-                return {"text_output": response_message.content}
-            else:
-                return {"text_output": "I couldn't process that request fully. Could you please rephrase?"}
+            return {"text_output": "I couldn't process that request fully. Could you please rephrase?"}
 
         except Exception as e:
-            print(f"[Error in process_message] {type(e).__name__}: {e}")
+            logger.exception("turn.error", error=f"{type(e).__name__}: {e}")
+            self._answer_open_tool_calls(f"The turn failed: {type(e).__name__}")
+            if trace is not None:
+                trace.attributes["status"] = "error"
             return {"text_output": "An internal error occurred. Please try again later or contact support."}
 
+    @staticmethod
+    def _json_default(value: Any) -> Any:
+        # Tool results are meant to be JSON already; bytes and other stray objects must not fail the round
+        if isinstance(value, (bytes, bytearray)):
+            return base64.b64encode(value).decode("ascii")
+        return str(value)
+
+    def _answer_open_tool_calls(self, message: str):
+        """
+        Gives every tool call of the last assistant message a result if it has none yet.
+        The API rejects a history with unanswered tool calls, so without this one failed
+        round would break every later turn of the conversation.
+        """
+        for index in range(len(self.messages_history) - 1, -1, -1):
+            entry = self.messages_history[index]
+            if entry.get("role") == "assistant":
+                break
+        else:
+            return
+        answered = {later.get("tool_call_id") for later in self.messages_history[index + 1:] if later.get("role") == "tool"}
+        for tool_call in entry.get("tool_calls") or []:
+            if tool_call["id"] not in answered:
+                self.messages_history.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "content": json.dumps({"status": "error", "message": message}),
+                })
+
+    async def _run_tool_round(self, tool_calls: list, seen_calls: Dict[str, str]) -> List[Any]:
+        """
+        Runs one round of tool calls and appends their results to the history.
+        A call identical (same tool, same arguments) to one already made in this turn is not
+        run again; it gets a "skipped" result pointing at the earlier call instead.
+        """
+        calls_to_run = []
+        tool_results: List[Any] = [None] * len(tool_calls)
+        for index, tool_call in enumerate(tool_calls):
+            try:
+                arguments = json.dumps(json.loads(tool_call.function.arguments or "{}"), sort_keys=True)
+            except json.JSONDecodeError:
+                arguments = tool_call.function.arguments
+            key = f"{tool_call.function.name}({arguments})"
+            if key in seen_calls:
+                tool_results[index] = {
+                    "status": "skipped",
+                    "message": f"Identical call already made in this turn (tool_call_id {seen_calls[key]}); use its result.",
+                }
+                continue
+            seen_calls[key] = tool_call.id
+            calls_to_run.append(index)
+
+        # Consecutive read-only calls run concurrently, bounded by self.tool_slots. A mutating call
+        # runs alone and in order, so two changes to the same mailbox or drive never race and a
+        # read placed after a change sees it.
+        steps: List[List[int]] = []
+        previous_mutating = True
+        for index in calls_to_run:
+            mutating = self._calls_mutating_tool([tool_calls[index]])
+            if mutating or previous_mutating:
+                steps.append([index])
+            else:
+                steps[-1].append(index)
+            previous_mutating = mutating
+        for step in steps:
+            results = await asyncio.gather(*(self._dispatch_tool_call(tool_calls[index]) for index in step),
+                                           return_exceptions=True)
+            for index, result in zip(step, results):
+                if isinstance(result, BaseException):
+                    result = {"error": f"Error executing tool '{tool_calls[index].function.name}': {type(result).__name__} - {result}"}
+                tool_results[index] = result
+
+        for tool_call, tool_result in zip(tool_calls, tool_results):
+            with tracer.span("agent.serialize", tool=tool_call.function.name):
+                try:
+                    content = json.dumps(tool_result, default=self._json_default)
+                except (TypeError, ValueError) as e:
+                    content = json.dumps({"status": "error", "message": f"The result of '{tool_call.function.name}' could not be serialized: {e}"})
+
+            self.messages_history.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": content
+            })
+        return tool_results
+
 
 # Testing script (optional)
 async def main():
     supervisor_email = os.getenv("SUPERVISOR_EMAIL", "default_supervisor@example.com")
     agent = AgentCore(supervisor_email)
+    agent.start_warm_up() # Token, connections and imports load while the user types
+
+    metrics_port = os.getenv("AGENT_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+        logger.info("metrics.serving", url=f"http://127.0.0.1:{metrics_port}/metrics")
+
+    # Opt-in event-loop blocking detector (AGENT_LOOP_WATCHDOG=1)
+    watchdog = LoopWatchdog.from_env()
+    if watchdog:
+        watchdog.start()
 
     print("Agent ready. Type 'exit' to quit.")
     print(f"🕒 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     while True:
-        user_input = input("\nYou: ")
+        # input() runs in a thread so the warm-up (and anything else on the loop) keeps going
+        user_input = await asyncio.to_thread(input, "\nYou: ")
         if user_input.lower() == 'exit':
             break
 
@@ -165,6 +629,9 @@ async def main():
         if "supervisor attention" in response['text_output'].lower():
             print(f"(Automatic escalation to {agent.supervisor_email})")
 
+    if watchdog:
+        await watchdog.stop()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,147 @@
+import os
+import re
+from typing import Any, Iterable, Optional
+
+from utils.metrics import REGISTRY
+
+# Per-completion model routing.
+#
+# A turn starts with a "plan" call that decides on tool calls (or answers directly); after each
+# tool round a "summary" call either turns the results into a reply or plans the next round. Most
+# plan calls are simple read-only requests ("show me my unread emails") and nearly all summary
+# calls only paraphrase tool output; both go to the fast model. The large model is used where
+# mistakes are expensive: requests that change something (send, delete, schedule, ...), multi-step
+# or multi-domain requests, long messages, and summaries of failed tool calls.
+#
+# Configuration (environment):
+#     AGENT_FAST_MODEL      Model for simple turns and summaries (default gpt-4o-mini)
+#     AGENT_LARGE_MODEL     Model for planning-heavy or state-changing turns (default gpt-4o)
+#     AGENT_MODEL_ROUTING   "off" sends every completion to the large model
+
+# USD per million tokens: (input, cached input, output).
+MODEL_PRICES_PER_MTOK = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+# Words that announce a state change; such turns are planned by the large model.
+MUTATING_CUES = {
+    "send", "reply", "forward", "delete", "remove", "create", "schedule", "book", "move", "rename",
+    "update", "change", "reschedule", "cancel", "upload", "invite", "share", "write", "draft",
+    "add", "put", "arrange", "organize", "organise", "mark", "setup",
+}
+MUTATING_PHRASES = re.compile(r"\b(set up|sign up|clean up|get rid of)\b")
+# Phrases that indicate several dependent steps.
+MULTI_STEP_PATTERN = re.compile(r"\b(and then|after that|then|afterwards|as well as|for each|every|all of|unless|if)\b")
+LONG_MESSAGE_WORDS = 40
+
+ROUTE_REQUESTS = REGISTRY.counter(
+    "llm_route_requests_total", "Chat completions by route and model.", ("route", "model"))
+ROUTE_SECONDS = REGISTRY.histogram(
+    "llm_route_duration_seconds", "Latency of chat completions by route.", ("route", "model"))
+ROUTE_COST = REGISTRY.counter(
+    "llm_route_cost_usd_total", "Estimated cost of chat completions by route (USD).", ("route", "model"))
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """
+    Estimated cost in USD from MODEL_PRICES_PER_MTOK, or None for models without a known price.
+    Dated snapshots (e.g. "gpt-4o-2024-08-06") are priced like their base model.
+    """
+    prices = MODEL_PRICES_PER_MTOK.get(model)
+    if prices is None:
+        base = max((name for name in MODEL_PRICES_PER_MTOK if model.startswith(name + "-")), key=len, default=None)
+        prices = MODEL_PRICES_PER_MTOK.get(base) if base else None
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """
+    Chooses the model of each completion and records latency and cost per route.
+
+    Args:
+        fast_model: Model for simple plan calls and tool-result summaries.
+        large_model: Model for state-changing, multi-step or otherwise complex turns.
+        enabled: If False, every completion goes to the large model (routes are still tracked).
+    """
+    def __init__(self, fast_model: str = "gpt-4o-mini", large_model: str = "gpt-4o", enabled: bool = True):
+        self.fast_model = fast_model
+        self.large_model = large_model
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        return cls(
+            fast_model=os.getenv("AGENT_FAST_MODEL", "gpt-4o-mini"),
+            large_model=os.getenv("AGENT_LARGE_MODEL", "gpt-4o"),
+            enabled=os.getenv("AGENT_MODEL_ROUTING", "on").lower() not in ("0", "off", "false", "no"),
+        )
+
+    def _decision(self, route: str, fast: bool, reason: str) -> dict[str, str]:
+        model = self.fast_model if fast and self.enabled else self.large_model
+        return {"route": route, "model": model, "reason": reason if self.enabled else "routing disabled"}
+
+    def for_plan(self, user_message: str, tool_routing: Optional[dict] = None) -> dict[str, str]:
+        """
+        Model for the first completion of a turn.
+
+        Args:
+            user_message: The user's message.
+            tool_routing: The ToolRouter decision for the turn, if any; a message matching more
+                          than one tool group counts as complex.
+
+        Returns:
+            {"route": "plan_fast" or "plan_large", "model": ..., "reason": ...}
+        """
+        text = user_message.lower()
+        words = re.findall(r"[a-z']+", text)
+        if MUTATING_CUES.intersection(words) or MUTATING_PHRASES.search(text):
+            return self._decision("plan_large", False, "state-changing request")
+        if len(words) > LONG_MESSAGE_WORDS:
+            return self._decision("plan_large", False, "long request")
+        if MULTI_STEP_PATTERN.search(text):
+            return self._decision("plan_large", False, "multi-step request")
+        if tool_routing and len(tool_routing.get("matched") or []) > 1:
+            return self._decision("plan_large", False, "multi-domain request")
+        return self._decision("plan_fast", True, "simple request")
+
+    def for_summary(self, tool_results: Iterable[Any], escalate: bool = False) -> dict[str, str]:
+        """
+        Model for a completion that follows tool results: it either answers from them or plans
+        the next tool round. Failed tools need the large model to explain the failure or decide
+        on escalation; `escalate` (a turn planned by the large model) keeps later rounds on it too.
+        """
+        if escalate:
+            return self._decision("summary_large", False, "complex task")
+        for result in tool_results:
+            if isinstance(result, dict) and ("error" in result or result.get("status") == "error"):
+                return self._decision("summary_large", False, "tool error")
+        return self._decision("summary_fast", True, "tool results only")
+
+    def for_triage(self, escalate: bool = False) -> dict[str, str]:
+        """
+        Model for a batched email-triage completion (see agent/batch_triage.py). Labelling is a
+        classification task for the fast model; `escalate` retries a batch on the large model.
+        """
+        if escalate:
+            return self._decision("triage_large", False, "retry of a failed triage batch")
+        return self._decision("triage_fast", True, "batch triage")
+
+    def record(self, route: str, model: str, duration_s: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0) -> Optional[float]:
+        """
+        Records one completion of `route`; returns its estimated cost in USD (None if unknown).
+        """
+        ROUTE_REQUESTS.inc(route=route, model=model)
+        ROUTE_SECONDS.observe(duration_s, route=route, model=model)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        if cost is not None:
+            ROUTE_COST.inc(cost, route=route, model=model)
+        return cost
@@ -0,0 +1,386 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from tools.registry import ToolRegistry, registry as default_registry
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.tracing import tracer
+
+# Durable outbox for mutating Graph operations.
+#
+# Sending mail, creating/updating/deleting events and uploading/deleting files no longer have to
+# run inline in the user's turn. A mutating tool call becomes a job in an append-only JSONL
+# journal, and background workers run it with bounded concurrency and retries. The agent can
+# confirm within a short wait and report the outcome later.
+#
+# Idempotency: every job has an idempotency key, by default a hash of the tool name and its
+# canonical arguments. Submitting a key that is already queued, running or done within the dedupe
+# window returns the existing job instead of running the operation again. A retried turn, or a
+# model repeating itself, therefore never sends the same email twice.
+#
+# Durability: each state change (enqueued, started, succeeded, failed, unknown) is appended and
+# fsynced before the operation proceeds. On restart the journal is replayed:
+#   - queued jobs are run again;
+#   - jobs that were running when the process died are retried if the operation is safe to repeat
+#     (PUT/PATCH/DELETE semantics); otherwise (send mail, create event) they are marked "unknown"
+#     for a human to check, because repeating them could duplicate the action.
+#
+# Retries: Graph's transport already retries short throttling/unavailability bursts. The outbox
+# retries what is left, with exponential backoff and jitter:
+#   - throttling/unavailable statuses and connection failures (nothing reached Graph), for all jobs;
+#   - 500s and timeouts only for jobs that are safe to repeat.
+#
+# Configuration (environment):
+#     AGENT_OUTBOX_PATH          Journal file; enables the outbox (mutating tools run inline without it)
+#     AGENT_OUTBOX_WORKERS       Concurrent jobs (default 2)
+#     AGENT_OUTBOX_CONFIRM_WAIT  Seconds a turn waits for a job before answering "queued" (default 2)
+
+# Mutating tools whose repetition has the same effect as running them once.
+SAFE_TO_REPEAT = {"update_calendar_event", "delete_calendar_event", "upload_file_to_onedrive", "delete_file_from_onedrive"}
+
+# Failures that never reached Graph or were refused before processing: retryable for every job.
+RETRYABLE_ALWAYS = re.compile(r"HTTP Error (429|502|503|504)\b|\b(ConnectError|ConnectTimeout|PoolTimeout)\b")
+# Failures after which Graph may or may not have applied the change: retryable only if safe to repeat.
+RETRYABLE_IF_SAFE = re.compile(r"HTTP Error 500\b|\b(ReadTimeout|WriteTimeout|RemoteProtocolError|ReadError)\b")
+
+TERMINAL = {"succeeded", "failed", "unknown"}
+
+OUTBOX_JOBS = REGISTRY.counter(
+    "outbox_jobs_total", "Outbox job state changes by tool and state.", ("tool", "state"))
+OUTBOX_DEPTH = REGISTRY.gauge(
+    "outbox_queue_depth", "Outbox jobs queued or running.")
+OUTBOX_SECONDS = REGISTRY.histogram(
+    "outbox_job_duration_seconds", "Time from enqueue to a terminal state.", ("tool", "state"))
+OUTBOX_DUPLICATES = REGISTRY.counter(
+    "outbox_duplicates_total", "Submissions answered with an existing job (same idempotency key).", ("tool",))
+
+logger = get_logger(__name__)
+
+
+def idempotency_key(tool: str, arguments: dict) -> str:
+    """
+    Default idempotency key: SHA-256 of the tool name and its canonical JSON arguments.
+    """
+    canonical = json.dumps({"tool": tool, "arguments": arguments}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _failure_message(result: Any) -> Optional[str]:
+    if isinstance(result, dict) and ("error" in result or result.get("status") == "error"):
+        return str(result.get("message") or result.get("error"))
+    return None
+
+
+class Job:
+    """
+    One mutating operation and its state; rebuilt from the journal on start-up.
+    """
+    def __init__(self, job_id: str, tool: str, arguments: dict, key: str, created: float):
+        self.id = job_id
+        self.tool = tool
+        self.arguments = arguments
+        self.key = key
+        self.created = created
+        self.state = "queued" # queued, running, succeeded, failed, unknown
+        self.attempts = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.updated = created
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"job_id": self.id, "tool": self.tool, "state": self.state, "attempts": self.attempts,
+                "result": self.result, "error": self.error, "created": self.created, "updated": self.updated}
+
+
+class Outbox:
+    """
+    Append-only, durable job queue for mutating tools.
+
+    Args:
+        path: JSONL journal file (created if missing).
+        auth_handler: Auth handler passed to the tool functions.
+        registry: Tool registry used to look up the operations.
+        workers: Jobs run concurrently.
+        max_attempts: Attempts per job before it fails.
+        backoff: Base delay (seconds) of the exponential backoff between attempts.
+        dedupe_window: Seconds during which a finished job still absorbs resubmissions of its key.
+        confirm_wait: Seconds a caller (AgentCore) waits for a new job before reporting it as queued.
+    """
+    def __init__(
+        self,
+        path: str,
+        auth_handler,
+        registry: ToolRegistry = default_registry,
+        workers: int = 2,
+        max_attempts: int = 5,
+        backoff: float = 2.0,
+        dedupe_window: float = 24 * 3600.0,
+        confirm_wait: float = 2.0
+    ):
+        self.path = path
+        self.auth_handler = auth_handler
+        self.registry = registry
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.dedupe_window = dedupe_window
+        self.confirm_wait = confirm_wait
+        self.jobs: dict[str, Job] = {}
+        self.by_key: dict[str, str] = {} # idempotency key -> job id
+        self.listeners: list[Callable[[Job], None]] = [] # Called when a job reaches a terminal state
+        self._journal_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._done: dict[str, asyncio.Event] = {}
+        self._recovered = self._replay()
+
+    @classmethod
+    def from_env(cls, auth_handler) -> Optional["Outbox"]:
+        path = os.getenv("AGENT_OUTBOX_PATH")
+        if not path:
+            return None
+        return cls(path, auth_handler, workers=int(os.getenv("AGENT_OUTBOX_WORKERS", "2")),
+                   confirm_wait=float(os.getenv("AGENT_OUTBOX_CONFIRM_WAIT", "2")))
+
+    # --- journal ---
+    def _append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        with self._journal_lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _record(self, job: Job, event: str, **fields):
+        job.updated = time.time()
+        self._append({"event": event, "job_id": job.id, "ts": job.updated, **fields})
+
+    def _replay(self) -> list[Job]:
+        """
+        Rebuilds job states from the journal; returns the jobs to resume.
+        """
+        if not os.path.exists(self.path):
+            return []
+        lines, complete = 0, 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # A torn last line from a crash mid-write; cut off below
+                lines += 1
+                complete += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                event, job = record.get("event"), self.jobs.get(record.get("job_id"))
+                if event == "enqueued":
+                    job = Job(record["job_id"], record["tool"], record["arguments"], record["key"], record["ts"])
+                    self.jobs[job.id] = job
+                    self.by_key[job.key] = job.id
+                elif job is None:
+                    continue
+                elif event == "started":
+                    job.state, job.attempts = "running", record.get("attempt", job.attempts + 1)
+                elif event == "retry":
+                    job.state, job.error = "queued", record.get("error")
+                elif event in TERMINAL:
+                    job.state, job.result, job.error = event, record.get("result"), record.get("error")
+                job.updated = record.get("ts", job.updated)
+        if complete < os.path.getsize(self.path):
+            # Otherwise the next record would be appended to the torn line and lost with it
+            with open(self.path, "r+b") as f:
+                f.truncate(complete)
+            logger.warning("outbox.torn_record_removed", path=self.path)
+
+        resume = []
+        for job in self.jobs.values():
+            if job.state == "running":
+                if job.tool in SAFE_TO_REPEAT:
+                    job.state = "queued"
+                    self._record(job, "retry", error="interrupted by restart")
+                else:
+                    # It may or may not have happened; repeating it could duplicate the action.
+                    job.state, job.error = "unknown", "interrupted by a restart; check whether it was applied"
+                    self._record(job, "unknown", error=job.error)
+                    OUTBOX_JOBS.inc(tool=job.tool, state="unknown")
+                    logger.warning("outbox.unknown", job_id=job.id, tool=job.tool)
+            if job.state == "queued":
+                resume.append(job)
+
+        live = sum(1 for job in self.jobs.values() if job.state not in TERMINAL or time.time() - job.updated < self.dedupe_window)
+        if lines > 1000 and lines > 4 * max(live, 1):
+            self._compact()
+        return resume
+
+    def _compact(self):
+        """
+        Rewrites the journal with one snapshot per job still inside the dedupe window.
+        """
+        now = time.time()
+        keep = [job for job in self.jobs.values() if job.state not in TERMINAL or now - job.updated < self.dedupe_window]
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            for job in keep:
+                f.write(json.dumps({"event": "enqueued", "job_id": job.id, "ts": job.created, "tool": job.tool,
+                                    "arguments": job.arguments, "key": job.key}, default=str) + "\n")
+                if job.state in TERMINAL:
+                    f.write(json.dumps({"event": job.state, "job_id": job.id, "ts": job.updated,
+                                        "result": job.result, "error": job.error}, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.jobs = {job.id: job for job in keep}
+        self.by_key = {job.key: job.id for job in keep}
+
+    # --- lifecycle ---
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        Starts the workers on the running loop (idempotent) and resumes recovered jobs. Call it
+        outside any turn; the workers run in an empty context either way, so their spans never
+        join the trace of the turn that happened to start them.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        for job in self._recovered:
+            self._queue.put_nowait(job.id)
+        self._recovered = []
+        self._update_depth()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(), context=contextvars.Context()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _update_depth(self):
+        OUTBOX_DEPTH.set(sum(1 for job in self.jobs.values() if job.state in ("queued", "running")))
+
+    # --- API ---
+    async def submit(self, tool: str, arguments: dict, key: Optional[str] = None) -> tuple[Job, bool]:
+        """
+        Enqueues a mutating operation.
+
+        Returns:
+            (job, created): `created` is False when a job with the same idempotency key is already
+            queued, running or finished within the dedupe window; that job is returned instead.
+
+        Raises:
+            RuntimeError: If start() has not been called.
+        """
+        if not self._tasks:
+            raise RuntimeError("The outbox is not started; call Outbox.start() first")
+        key = key or idempotency_key(tool, arguments)
+        existing = self.jobs.get(self.by_key.get(key, ""))
+        if existing is not None and (existing.state != "failed" and
+                                     (existing.state not in TERMINAL or time.time() - existing.updated < self.dedupe_window)):
+            OUTBOX_DUPLICATES.inc(tool=tool)
+            logger.info("outbox.duplicate", job_id=existing.id, tool=tool, state=existing.state)
+            return existing, False
+
+        job = Job(uuid.uuid4().hex[:16], tool, arguments, key, time.time())
+        await asyncio.to_thread(self._append, {"event": "enqueued", "job_id": job.id, "ts": job.created,
+                                               "tool": tool, "arguments": arguments, "key": key})
+        self.jobs[job.id] = job
+        self.by_key[key] = job.id
+        OUTBOX_JOBS.inc(tool=tool, state="queued")
+        self._queue.put_nowait(job.id)
+        self._update_depth()
+        return job, True
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        """
+        Waits until the job reaches a terminal state or `timeout` passes; returns the job either way.
+        """
+        job = self.jobs[job_id]
+        if job.state not in TERMINAL:
+            event = self._done.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def status(self, job_id: str) -> Optional[dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    # --- execution ---
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            try:
+                if job is None or job.state != "queued":
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # Never lose a worker
+                logger.exception("outbox.worker_error", job_id=job_id, error=f"{type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        spec = self.registry.get(job.tool)
+        job.attempts += 1
+        job.state = "running"
+        await asyncio.to_thread(self._record, job, "started", attempt=job.attempts)
+
+        with tracer.span(f"outbox.{job.tool}", kind="tool", tool=job.tool, job_id=job.id, attempt=job.attempts) as span:
+            if spec is None:
+                result = {"status": "error", "message": f"Tool '{job.tool}' is not registered."}
+            else:
+                try:
+                    result = await spec.func(auth_handler=self.auth_handler, **job.arguments)
+                except Exception as e:
+                    result = {"status": "error", "message": f"{type(e).__name__} - {e}"}
+            failure = _failure_message(result)
+            if failure:
+                span.status = "error"
+
+        if failure is None:
+            await self._finish(job, "succeeded", result=result)
+            return
+
+        retryable = RETRYABLE_ALWAYS.search(failure) or (job.tool in SAFE_TO_REPEAT and RETRYABLE_IF_SAFE.search(failure))
+        if retryable and job.attempts < self.max_attempts:
+            delay = self.backoff * (2 ** (job.attempts - 1)) * random.uniform(0.8, 1.2)
+            job.state, job.error = "queued", failure
+            await asyncio.to_thread(self._record, job, "retry", error=failure, delay_s=round(delay, 3))
+            OUTBOX_JOBS.inc(tool=job.tool, state="retry")
+            logger.warning("outbox.retry", job_id=job.id, tool=job.tool, attempt=job.attempts, delay_s=round(delay, 3), error=failure)
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job.id) # Doesn't hold a worker
+            return
+        await self._finish(job, "failed", result=result, error=failure)
+
+    async def _finish(self, job: Job, state: str, result: Any = None, error: Optional[str] = None):
+        job.state, job.result, job.error = state, result, error
+        await asyncio.to_thread(self._record, job, state, result=result, error=error)
+        OUTBOX_JOBS.inc(tool=job.tool, state=state)
+        OUTBOX_SECONDS.observe(time.time() - job.created, tool=job.tool, state=state)
+        logger.info("outbox.done", job_id=job.id, tool=job.tool, state=state, attempts=job.attempts)
+        self._update_depth()
+        event = self._done.pop(job.id, None)
+        if event is not None:
+            event.set()
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning("outbox.listener_error", error=f"{type(e).__name__}: {e}")
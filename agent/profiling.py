@@ -0,0 +1,176 @@
+import json
+import tracemalloc
+from typing import Any, Optional
+
+from utils.tracing import Span, TurnTrace
+
+# Turns the spans recorded during one agent turn into a latency breakdown that can be
+# returned to the caller alongside the text output (see AgentCore.process_message).
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def _union_seconds(spans: list[Span]) -> float:
+    """
+    Wall time covered by a set of possibly overlapping spans.
+    """
+    total = 0.0
+    current_start = current_end = None
+    for span in sorted(spans, key=lambda s: s.start):
+        end = span.start + span.duration
+        if current_end is None or span.start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = span.start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def _descendants(span: Span, children: dict[int, list[Span]]) -> list[Span]:
+    found = []
+    stack = list(children.get(span.span_id, []))
+    while stack:
+        child = stack.pop()
+        found.append(child)
+        stack.extend(children.get(child.span_id, []))
+    return found
+
+
+def build_turn_profile(trace: TurnTrace) -> dict[str, Any]:
+    """
+    Breaks a finished turn down into LLM time per completion, wall time per tool call
+    (with the Graph and token time spent inside it), time queued behind the tool
+    concurrency limit, JSON serialization time, token usage and the tool routing decision.
+
+    Args:
+        trace: The TurnTrace of the turn, as yielded by `tracer.turn()`.
+
+    Returns:
+        A JSON-serializable dictionary; all durations are in milliseconds.
+    """
+    spans = list(trace.spans)
+    children: dict[int, list[Span]] = {}
+    for span in spans:
+        if span.parent_id is not None:
+            children.setdefault(span.parent_id, []).append(span)
+
+    completions = []
+    prompt_tokens = completion_tokens = cached_tokens = 0
+    cost_usd = 0.0
+    for span in spans:
+        if span.name != "llm.chat_completion":
+            continue
+        attrs = span.attributes
+        prompt_tokens += attrs.get("prompt_tokens") or 0
+        completion_tokens += attrs.get("completion_tokens") or 0
+        cached_tokens += attrs.get("cached_tokens") or 0
+        cost_usd += attrs.get("cost_usd") or 0.0
+        completions.append({
+            "model": attrs.get("model"),
+            "route": attrs.get("route"),
+            "duration_ms": _ms(span.duration),
+            "prompt_tokens": attrs.get("prompt_tokens"),
+            "completion_tokens": attrs.get("completion_tokens"),
+            "cached_tokens": attrs.get("cached_tokens"),
+            "cost_usd": attrs.get("cost_usd"),
+            "completion_cache": attrs.get("completion_cache"),
+            "finish_reason": attrs.get("finish_reason"),
+            "status": span.status,
+        })
+
+    tool_spans = [span for span in spans if span.kind == "tool"]
+    tools = []
+    for span in tool_spans:
+        inner = _descendants(span, children)
+        graph_spans = [s for s in inner if s.name == "graph.request"]
+        tools.append({
+            "tool": span.attributes.get("tool"),
+            "status": span.status,
+            "duration_ms": _ms(span.duration),
+            "queued_ms": span.attributes.get("queued_ms", 0.0),
+            "graph_ms": _ms(sum(s.duration for s in graph_spans)),
+            "graph_requests": len(graph_spans),
+            "token_ms": _ms(sum(s.duration for s in inner if s.name == "graph.token")),
+        })
+
+    routing = next((dict(span.attributes, duration_ms=_ms(span.duration)) for span in spans if span.name == "agent.route_tools"), None)
+
+    llm_seconds = sum(span.duration for span in spans if span.name == "llm.chat_completion")
+    tools_wall_seconds = _union_seconds(tool_spans)
+    total_seconds = trace.duration
+
+    return {
+        "total_ms": _ms(total_seconds),
+        "tool_rounds": trace.attributes.get("tool_rounds", 0),
+        "stop_reason": trace.attributes.get("stop_reason"),
+        "llm_ms": _ms(llm_seconds),
+        "tools_wall_ms": _ms(tools_wall_seconds),
+        "graph_ms": _ms(sum(s.duration for s in spans if s.name == "graph.request")),
+        "token_ms": _ms(sum(s.duration for s in spans if s.name == "graph.token")),
+        "serialization_ms": _ms(sum(s.duration for s in spans if s.name == "agent.serialize")),
+        "queued_ms": round(sum(t["queued_ms"] for t in tools), 3),
+        "other_ms": _ms(max(0.0, total_seconds - llm_seconds - tools_wall_seconds)),
+        "tokens": {
+            "prompt": prompt_tokens,
+            "completion": completion_tokens,
+            "cached": cached_tokens,
+            "cache_hit_rate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else None,
+        },
+        "cost_usd": round(cost_usd, 8),
+        "completions": completions,
+        "tools": tools,
+        "tool_routing": routing,
+    }
+
+
+class MemoryProbe:
+    """
+    Debug-only tracemalloc and history-size snapshots taken around one turn.
+    Starts tracemalloc if it isn't running and stops it again afterwards.
+    """
+    def __init__(self, top: int = 5):
+        self.top = top
+        self._started_here = False
+        self._before: Optional[tracemalloc.Snapshot] = None
+        self._before_current = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_here = True
+        tracemalloc.reset_peak()
+        self._before_current, _ = tracemalloc.get_traced_memory()
+        self._before = tracemalloc.take_snapshot()
+
+    def stop(self, history: list) -> dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        top_allocations = []
+        if self._before is not None:
+            for stat in after.compare_to(self._before, "lineno")[:self.top]:
+                frame = stat.traceback[0]
+                top_allocations.append({
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "size_diff_kib": round(stat.size_diff / 1024, 2),
+                    "count_diff": stat.count_diff,
+                })
+        if self._started_here:
+            tracemalloc.stop()
+
+        return {
+            "memory": {
+                "current_kib": round(current / 1024, 2),
+                "peak_kib": round(peak / 1024, 2),
+                "turn_delta_kib": round((current - self._before_current) / 1024, 2),
+                "top_allocations": top_allocations,
+            },
+            "history": {
+                "messages": len(history),
+                "bytes": len(json.dumps(history, default=str)),
+            },
+        }
@@ -0,0 +1,233 @@
+import collections
+import hashlib
+import json
+import math
+import re
+from typing import Iterable, Optional
+
+from tools.registry import ToolRegistry, registry as default_registry
+from utils.metrics import REGISTRY
+
+# Per-turn tool selection.
+#
+# Sending every tool schema with every completion costs prompt tokens on each call, and that cost
+# grows with each tool added. The router scores the tool groups (one group per Graph module:
+# email, calendar, OneDrive) against the user's message with two cheap local signals:
+#   - keyword hits against the group's vocabulary (tool names, parameter names, domain words)
+#   - cosine similarity of hashed character-trigram vectors (a tiny local "embedding")
+# plus a bonus for groups used in the last few turns, so follow-ups like "open the second one"
+# keep their tools. Every group scoring above the threshold is sent in full; when no group is
+# confident enough, the full tool set is sent, so routing never removes a tool the model needs.
+#
+# Tools precede the messages in the prompt, so a tool list that changes from turn to turn would
+# defeat the provider's prompt-prefix cache. With `sticky=True` (the default) the tools routed to
+# stay in the list for the rest of the session, groups are always listed in the same (registry)
+# order, and when a later turn needs a group that isn't in the list yet, the list grows straight to
+# the full set. A message that matches no group (chit-chat, "thanks") keeps the sticky list rather
+# than falling back to all tools, which would flip the list back and forth on every such turn.
+# Only before the first routed turn do those messages get the full set, without making it sticky,
+# so a vague opening message doesn't end routing for the session. A session's tool list therefore
+# changes at most twice after its first routed turn, and each change costs one cache miss.
+
+# Domain words per tool module, on top of what is derived from the tools themselves.
+DOMAIN_KEYWORDS = {
+    "microsoft_graph.outlook_email": {
+        "email", "emails", "mail", "inbox", "message", "messages", "reply", "send", "sent", "unread",
+        "sender", "junk", "draft", "drafts", "forward", "outlook", "read",
+    },
+    "microsoft_graph.outlook_calendar": {
+        "calendar", "meeting", "meetings", "event", "events", "schedule", "appointment", "invite",
+        "reschedule", "cancel", "attendee", "attendees", "agenda", "tomorrow", "today", "monday",
+        "tuesday", "wednesday", "thursday", "friday", "book", "call",
+        "ics", "ical", "icalendar", "import", "migrate",
+    },
+    "microsoft_graph.onedrive_files": {
+        "file", "files", "folder", "folders", "onedrive", "document", "documents", "upload", "download",
+        "drive", "pdf", "docx", "xlsx", "spreadsheet", "report", "save", "search", "workbook", "sheet",
+        "move", "copy", "archive", "reorganize", "cleanup",
+    },
+}
+
+# Words that carry no routing signal (they appear in every tool description).
+STOP_WORDS = {
+    "a", "an", "the", "to", "of", "for", "in", "on", "my", "me", "i", "and", "or", "is", "it", "be",
+    "id", "user", "with", "by", "from", "this", "that", "please", "can", "you", "all", "any",
+}
+
+ROUTER_DECISIONS = REGISTRY.counter(
+    "tool_router_decisions_total", "Tool routing decisions by outcome (routed, sticky or fallback to all tools).", ("mode",))
+ROUTER_TOKENS_SAVED = REGISTRY.counter(
+    "tool_router_prompt_tokens_saved_total", "Estimated tool-schema prompt tokens not sent thanks to routing (summed over completions).")
+
+VECTOR_DIM = 512
+
+
+def _words(text: str) -> list[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOP_WORDS]
+
+
+def _trigram_vector(text: str) -> dict[int, float]:
+    """
+    L2-normalized bag of hashed character trigrams of the words in `text`.
+    """
+    counts: collections.Counter = collections.Counter()
+    for word in _words(text):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=4).digest()
+            counts[int.from_bytes(digest, "little") % VECTOR_DIM] += 1
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {index: value / norm for index, value in counts.items()}
+
+
+def _cosine(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+def estimate_tokens(schemas: Iterable[dict]) -> int:
+    """
+    Rough prompt-token cost of tool schemas (about four characters per token).
+    """
+    return sum(len(json.dumps(schema, separators=(",", ":"))) for schema in schemas) // 4
+
+
+class ToolGroup:
+    """
+    The tools of one module plus the vocabulary and trigram vector used to score them.
+    """
+    def __init__(self, module: str, schemas: list[dict]):
+        self.module = module
+        self.schemas = schemas
+        self.tool_names = [schema["function"]["name"] for schema in schemas]
+        self.tokens = estimate_tokens(schemas)
+
+        self.keywords = set(DOMAIN_KEYWORDS.get(module, ()))
+        texts = []
+        for schema in schemas:
+            function = schema["function"]
+            self.keywords.update(_words(function["name"].replace("_", " ")))
+            texts.append(function["name"].replace("_", " "))
+            texts.append(function.get("description", ""))
+            texts.extend(function.get("parameters", {}).get("properties", {}))
+        self.vector = _trigram_vector(" ".join(texts))
+
+
+class ToolRouter:
+    """
+    Picks the tool subset sent with each completion.
+
+    Args:
+        registry: The tool registry to route over.
+        threshold: Minimum group score for a group to be selected.
+        fallback_below: If no group reaches this score, all tools are sent.
+        recent_turns: How many recent turns' tool usage boosts a group.
+        recent_bonus: Score added to a group used in the recent turns.
+        sticky: Keep sending a group in later turns once it has been routed to.
+    """
+    def __init__(
+        self,
+        registry: ToolRegistry = default_registry,
+        threshold: float = 0.35,
+        fallback_below: float = 0.5,
+        recent_turns: int = 3,
+        recent_bonus: float = 0.4,
+        sticky: bool = True
+    ):
+        self.registry = registry
+        self.threshold = threshold
+        self.fallback_below = fallback_below
+        self.recent_bonus = recent_bonus
+        self.recent: collections.deque[set[str]] = collections.deque(maxlen=recent_turns) # tool names per turn
+        self.sticky = sticky
+        self.sticky_groups: set[str] = set() # Modules routed to earlier in the session
+        self._groups: Optional[list[ToolGroup]] = None
+
+    @property
+    def groups(self) -> list[ToolGroup]:
+        if self._groups is None:
+            by_module: dict[str, list[dict]] = {}
+            for schema in self.registry.schemas():
+                spec = self.registry.get(schema["function"]["name"])
+                by_module.setdefault(spec.module, []).append(schema)
+            self._groups = [ToolGroup(module, schemas) for module, schemas in by_module.items()]
+            # Words from several groups' tool names (e.g. "delete", "list") don't discriminate.
+            seen = collections.Counter(word for group in self._groups for word in group.keywords)
+            for group in self._groups:
+                group.keywords = {word for word in group.keywords
+                                  if seen[word] == 1 or word in DOMAIN_KEYWORDS.get(group.module, ())}
+        return self._groups
+
+    def score(self, message: str, with_recent: bool = True) -> dict[str, float]:
+        """
+        Returns the score of each tool group (module) for `message`, optionally without the
+        recent-usage bonus (i.e. judged on the message alone).
+        """
+        words = set(_words(message))
+        vector = _trigram_vector(message)
+        recent = set().union(*self.recent) if self.recent and with_recent else set()
+        scores = {}
+        for group in self.groups:
+            hits = len(words & group.keywords)
+            keyword_score = min(1.0, 0.75 * hits) # One distinctive word is already strong evidence
+            score = 0.7 * keyword_score + 0.6 * _cosine(vector, group.vector)
+            if recent & set(group.tool_names):
+                score += self.recent_bonus
+            scores[group.module] = round(score, 4)
+        return scores
+
+    def select(self, message: str) -> dict:
+        """
+        Chooses the tools for a turn.
+
+        Returns:
+            {"tools": [schemas], "mode": "routed", "sticky" (no match; the session's sticky tools
+             are kept) or "fallback" (all tools), "groups": [selected modules],
+             "matched": [modules the message itself matches, ignoring recent usage and stickiness],
+             "confidence": best group score, "tokens_sent": int, "tokens_saved": int}, where the
+            token counts are estimates per completion sent with these tools.
+        """
+        scores = self.score(message)
+        groups = self.groups
+        all_tokens = sum(group.tokens for group in groups)
+        confidence = max(scores.values(), default=0.0)
+
+        chosen = {group.module for group in groups if scores[group.module] >= self.threshold}
+        if confidence < self.fallback_below or not chosen:
+            if self.sticky and self.sticky_groups:
+                # Keeps the tool list (and the cached prefix behind it) unchanged
+                mode = "sticky"
+                selected = [group for group in groups if group.module in self.sticky_groups]
+            else:
+                mode, selected = "fallback", groups
+        else:
+            mode = "routed"
+            if self.sticky:
+                if self.sticky_groups and not chosen <= self.sticky_groups:
+                    # Each change of the tool list invalidates the cached history behind it, so
+                    # the second change goes straight to the full set, which never changes again.
+                    chosen = {group.module for group in groups}
+                self.sticky_groups |= chosen
+                chosen = self.sticky_groups
+            selected = [group for group in groups if group.module in chosen] # Canonical order
+
+        schemas = [schema for group in selected for schema in group.schemas]
+        tokens_sent = sum(group.tokens for group in selected)
+        tokens_saved = all_tokens - tokens_sent
+        ROUTER_DECISIONS.inc(mode=mode)
+        return {
+            "tools": schemas,
+            "mode": mode,
+            "groups": [group.module for group in selected],
+            "matched": [module for module, value in self.score(message, with_recent=False).items() if value >= self.threshold],
+            "confidence": confidence,
+            "tokens_sent": tokens_sent,
+            "tokens_saved": tokens_saved,
+        }
+
+    def record_usage(self, tool_names: Iterable[str]):
+        """
+        Records the tools called in a turn (an empty turn still ages out older usage).
+        """
+        self.recent.append({name for name in tool_names if name})
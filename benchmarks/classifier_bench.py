@@ -0,0 +1,219 @@
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Optional
+
+from agent.email_classifier import LABELS, EmailClassifier, NaiveBayesModel
+from utils.logger import setup_logging
+
+# Offline evaluation and throughput benchmark for the local email classifier.
+#
+# Trains the naive Bayes model on part of a labelled corpus and evaluates the full classifier
+# (rules + model + confidence threshold) on the rest. Reports:
+#   - coverage: the share of emails labelled locally by rules or the model, i.e. LLM calls avoided
+#   - precision/recall per label on the locally labelled emails, and overall accuracy
+#   - throughput of classify() in emails per second and microseconds per email
+# For several thresholds it also shows the coverage/accuracy trade-off.
+#
+# The corpus is either a JSONL file of list_outlook_emails entries with a "label" field (e.g. past
+# LLM decisions), or a synthetic mailbox whose vocabularies overlap, with a share of deliberately
+# ambiguous messages and some label noise.
+#
+# Usage:
+#   python -m benchmarks.classifier_bench --emails 20000
+#   python -m benchmarks.classifier_bench --data labelled.jsonl --save-model classifier.json
+
+COLLEAGUES = [f"{name}@contoso.com" for name in ("alice", "bob", "carol", "dave", "erin", "frank", "grace", "heidi")]
+VENDORS = ["billing@fabrikam.com", "support@tailspin.io", "accounts@northwind.biz", "sales@adventure-works.com"]
+AUTOMATED = ["noreply@github.com", "notifications@slack.com", "newsletter@medium.com", "no-reply@linkedin.com",
+             "updates@zoom.us", "marketing@shopnow.com"]
+SPAMMERS = ["promo@deals-4-u.xyz", "winner@lucky-draw.top", "admin@secure-verify.info", "offers@cheap-meds.ru"]
+
+TEMPLATES = {
+    "important": [
+        ("Contract renewal needs your signature by {day}", "Hi, the {client} contract expires on {day}. Please review and sign the attached renewal so we can send it back."),
+        ("Board meeting moved to {day}", "The board meeting has been moved to {day} at 10am. Please confirm you can attend and bring the quarterly figures."),
+        ("Customer escalation: {client}", "{client} reported an outage affecting their production system. They need a response from us today."),
+        ("Approval needed: budget for {project}", "Can you approve the revised budget for {project}? Finance needs the decision before {day}."),
+        ("Invoice {number} overdue", "Invoice {number} for {client} is now 30 days overdue. Please advise how you want us to proceed."),
+    ],
+    "routine": [
+        ("Weekly team update", "Here is this week's update for {project}: progress is on track, no blockers. See the notes for details."),
+        ("Lunch on {day}?", "Anyone up for lunch on {day}? Thinking of the new place near the office."),
+        ("Your {service} digest", "Here are the top stories for you this week from {service}. Manage preferences or unsubscribe at any time."),
+        ("[{project}] build passed", "The latest build of {project} passed all checks. View the run for details."),
+        ("Meeting notes: {project} sync", "Notes from today's {project} sync are attached. Action items are listed at the bottom."),
+    ],
+    "junk": [
+        ("Congratulations, you have won a {prize}!", "Claim your prize now! You have been selected as the winner of a {prize}. Act now, offer ends soon."),
+        ("Verify your account immediately", "Your account will be suspended. Click the link to verify your password and billing details."),
+        ("Limited time offer: 90% off {product}", "Exclusive deal on {product}, 100% free shipping. Limited time offer, act now!"),
+        ("Earn $5000 a week from home", "Work from home and earn thousands. No experience needed, start today."),
+        ("Re: your invoice {number}", "Please see the attached invoice and pay via wire transfer to the new account details below."),
+    ],
+}
+# Messages whose wording sits between labels: the same text gets different labels (weights per
+# label, in LABELS order), so no local model can be sure; the LLM should handle most of them.
+AMBIGUOUS_TEMPLATES = [
+    ((0.0, 0.5, 0.5), "Quick question about {project}", "Do you have a minute to look at the {project} numbers? Not urgent but would be good before {day}."),
+    ((0.0, 0.4, 0.6), "Reminder: {project} deadline", "Friendly reminder that the {project} deadline is {day}. No action needed if you have already submitted."),
+    ((0.5, 0.5, 0.0), "Invoice {number} from {client}", "Please find invoice {number} attached. Payment details have changed, see the attachment."),
+    ((0.0, 0.6, 0.4), "FYI - {client} update", "{client} just let us know they may cancel. Can we talk about it this week?"),
+]
+FILLERS = {
+    "day": ["Monday", "Tuesday", "Friday", "next week", "the 15th", "end of month"],
+    "client": ["Contoso", "Fabrikam", "Northwind", "Litware", "Tailspin"],
+    "project": ["Apollo", "migration", "Q3 roadmap", "website redesign", "data platform"],
+    "number": [str(n) for n in range(1000, 1100)],
+    "service": ["Medium", "LinkedIn", "GitHub", "Slack"],
+    "prize": ["iPhone", "gift card", "cruise", "laptop"],
+    "product": ["watches", "sunglasses", "supplements", "software"],
+}
+
+
+def _fill(text: str, rng: random.Random) -> str:
+    return text.format(**{key: rng.choice(values) for key, values in FILLERS.items()})
+
+
+def synthetic_mailbox(count: int, seed: int = 7, ambiguous_share: float = 0.15, label_noise: float = 0.02) -> list[tuple[dict, str]]:
+    """
+    Labelled synthetic list_outlook_emails entries.
+    """
+    rng = random.Random(seed)
+    senders = {
+        "important": COLLEAGUES + VENDORS,
+        "routine": COLLEAGUES + AUTOMATED,
+        "junk": SPAMMERS + VENDORS[:1],
+    }
+    corpus = []
+    for index in range(count):
+        if rng.random() < ambiguous_share:
+            weights, subject, body = rng.choice(AMBIGUOUS_TEMPLATES)
+            label = rng.choices(LABELS, weights=weights)[0]
+            sender = rng.choice(COLLEAGUES + VENDORS)
+        else:
+            label = rng.choices(LABELS, weights=(0.2, 0.25, 0.55))[0]
+            subject, body = rng.choice(TEMPLATES[label])
+            sender = rng.choice(senders[label])
+        if rng.random() < label_noise:
+            label = rng.choice(LABELS)
+        importance = "high" if label == "important" and rng.random() < 0.2 else ("low" if rng.random() < 0.05 else "normal")
+        corpus.append(({
+            "id": f"msg-{index:06d}",
+            "subject": _fill(subject, rng),
+            "from": sender,
+            "received_date_time": "2025-07-25T09:00:00Z",
+            "is_read": rng.random() < 0.5,
+            "importance": importance,
+            "has_attachments": rng.random() < 0.3,
+            "body_preview": _fill(body, rng),
+        }, label))
+    return corpus
+
+
+def load_corpus(path: str) -> list[tuple[dict, str]]:
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                email = json.loads(line)
+                corpus.append((email, email.pop("label")))
+    return corpus
+
+
+def evaluate(classifier: EmailClassifier, test: list[tuple[dict, str]]) -> dict:
+    by_source = {"rule": 0, "model": 0, "llm": 0}
+    confusion = {label: {other: 0 for other in LABELS} for label in LABELS} # expected -> predicted
+    for email, expected in test:
+        result = classifier.classify(email)
+        by_source[result["source"]] += 1
+        if result["label"] is not None:
+            confusion[expected][result["label"]] += 1
+
+    labeled = by_source["rule"] + by_source["model"]
+    correct = sum(confusion[label][label] for label in LABELS)
+    per_label = {}
+    for label in LABELS:
+        predicted = sum(confusion[other][label] for other in LABELS)
+        actual = sum(confusion[label].values())
+        per_label[label] = {
+            "precision": round(confusion[label][label] / predicted, 4) if predicted else None,
+            "recall": round(confusion[label][label] / actual, 4) if actual else None,
+        }
+    return {
+        "coverage": round(labeled / len(test), 4) if test else 0.0,
+        "by_source": by_source,
+        "accuracy": round(correct / labeled, 4) if labeled else None,
+        "per_label": per_label,
+    }
+
+
+def throughput(classifier: EmailClassifier, emails: list[dict], repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for email in emails:
+            classifier.classify(email)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {"emails_per_s": round(len(emails) / best), "us_per_email": round(best / len(emails) * 1e6, 2),
+            "median_us_per_email": round(statistics.median(timings) / len(emails) * 1e6, 2)}
+
+
+def main(args: argparse.Namespace):
+    setup_logging(level="WARNING")
+    corpus = load_corpus(args.data) if args.data else synthetic_mailbox(args.emails, seed=args.seed)
+    random.Random(args.seed).shuffle(corpus)
+    split = int(len(corpus) * args.train_share)
+    train, test = corpus[:split], corpus[split:]
+
+    started = time.perf_counter()
+    model = NaiveBayesModel().fit(train)
+    train_ms = (time.perf_counter() - started) * 1000
+    if args.save_model:
+        model.save(args.save_model)
+
+    rules_only = evaluate(EmailClassifier(), test)
+    thresholds = {}
+    for threshold in args.thresholds:
+        thresholds[threshold] = evaluate(EmailClassifier(model=model, threshold=threshold), test)
+    speed = throughput(EmailClassifier(model=model, threshold=args.threshold), [email for email, _ in test], args.repeats)
+    chosen = thresholds.get(args.threshold) or evaluate(EmailClassifier(model=model, threshold=args.threshold), test)
+
+    report = {"train": len(train), "test": len(test), "train_ms": round(train_ms, 1), "rules_only": rules_only,
+              "thresholds": thresholds, "threshold": args.threshold, "result": chosen, "throughput": speed}
+
+    print(f"corpus: {len(train)} train / {len(test)} test, trained in {train_ms:.0f} ms, vocabulary {len(model.vocabulary)}")
+    print(f"rules only:   coverage {rules_only['coverage']:6.1%}  accuracy {rules_only['accuracy'] or 0:6.1%}")
+    print(f"{'threshold':>10} {'coverage':>9} {'accuracy':>9} {'rule':>6} {'model':>6} {'llm':>6}")
+    for threshold, row in thresholds.items():
+        print(f"{threshold:>10} {row['coverage']:>9.1%} {row['accuracy'] or 0:>9.1%} "
+              f"{row['by_source']['rule']:>6} {row['by_source']['model']:>6} {row['by_source']['llm']:>6}")
+    for label, values in chosen["per_label"].items():
+        print(f"  {label:<10} precision {values['precision'] or 0:6.1%}  recall {values['recall'] or 0:6.1%}  (threshold {args.threshold})")
+    print(f"throughput: {speed['emails_per_s']:,} emails/s ({speed['us_per_email']} us per email)")
+    print(f"LLM calls avoided: {chosen['coverage']:.1%} of emails")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline evaluation and throughput benchmark for the email classifier.")
+    parser.add_argument("--data", help="JSONL of list_outlook_emails entries with a 'label' field; synthetic if omitted.")
+    parser.add_argument("--emails", type=int, default=20000, help="Size of the synthetic corpus.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--train-share", type=float, default=0.8, help="Share of the corpus used for training.")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Confidence threshold reported in detail.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--repeats", type=int, default=3, help="Throughput passes over the test set (best is reported).")
+    parser.add_argument("--save-model", help="Optional path to write the trained model (AGENT_EMAIL_CLASSIFIER_MODEL).")
+    parser.add_argument("--json", help="Optional path to write the results as JSON.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
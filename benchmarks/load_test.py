@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from typing import Optional
+
+from openai import AsyncOpenAI
+
+from agent.core import AgentCore
+from benchmarks.standins import StandInServer, StubAuth
+from utils.logger import setup_logging
+from utils.loop_watchdog import LoopWatchdog
+
+# Concurrent-session load generator for AgentCore.
+#
+# Drives N AgentCore sessions at once through scripted multi-turn conversations against
+# the local Graph/OpenAI stand-ins and reports, per concurrency level:
+#   - p50/p95/p99 turn latency
+#   - event-loop lag and stalls, measured by utils.loop_watchdog while the sessions run
+#   - connections opened against the stand-in server (total and peak concurrent)
+#   - traced Python memory per session (from a separate untimed replay) and average history size
+#
+# Usage:
+#   python -m benchmarks.load_test --levels 1,5,10,25 --turns 4 --llm-latency-ms 300
+
+# Each conversation is a list of user turns; sessions pick conversations round-robin.
+CONVERSATIONS = [
+    ["Show me my unread emails", "Read the first one", "Reply that I received it", "Thanks, that's all"],
+    ["What's in my inbox?", "List my files in Reports", "Download the first report", "Thanks"],
+    ["Set up a meeting tomorrow at 9", "Show me my unread emails", "Hello!", "Read the first one"],
+]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of samples (0.0 for an empty list).
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+async def run_session(agent: AgentCore, conversation: list[str], turns: int, think_time: float, latencies: list[float], errors: list[str]):
+    for i in range(turns):
+        user_message = conversation[i % len(conversation)]
+        start = time.perf_counter()
+        response = await agent.process_message(user_message)
+        latencies.append(time.perf_counter() - start)
+        if "internal error" in response.get("text_output", "").lower():
+            errors.append(user_message)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+def _agents(server: StandInServer, concurrency: int) -> tuple[AsyncOpenAI, list[AgentCore]]:
+    # One OpenAI client and one auth handler shared by all sessions, as in the server (main.py)
+    openai_client = AsyncOpenAI(api_key="stand-in", base_url=server.openai_url, max_retries=0)
+    auth_handler = StubAuth(server.graph_url)
+    agents = [
+        AgentCore(f"supervisor{i}@example.com", openai_client=openai_client, auth_handler=auth_handler)
+        for i in range(concurrency)
+    ]
+    return openai_client, agents
+
+
+async def _run_sessions(agents: list[AgentCore], turns: int, think_time: float, latencies: list[float], errors: list[str]):
+    await asyncio.gather(*(
+        run_session(agent, CONVERSATIONS[i % len(CONVERSATIONS)], turns, think_time, latencies, errors)
+        for i, agent in enumerate(agents)
+    ))
+
+
+async def measure_memory(server: StandInServer, concurrency: int, turns: int) -> tuple[float, float]:
+    """
+    Replays a level with tracemalloc on and returns (retained bytes per session, peak bytes).
+
+    Kept apart from run_level's timed pass: tracing every allocation slows the loop enough
+    to distort turn latency and loop lag.
+    """
+    tracemalloc.start()
+    try:
+        baseline_memory, _ = tracemalloc.get_traced_memory()
+        openai_client, agents = _agents(server, concurrency)
+        await _run_sessions(agents, turns, 0.0, [], [])
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    await openai_client.close()
+    return (current_memory - baseline_memory) / concurrency, peak_memory
+
+
+async def run_level(server: StandInServer, concurrency: int, turns: int, think_time: float) -> dict:
+    """
+    Runs one concurrency level and returns its measurements.
+    """
+    server.stats.reset_peak()
+    before = server.stats.snapshot()
+    openai_client, agents = _agents(server, concurrency)
+
+    latencies: list[float] = []
+    errors: list[str] = []
+    # Stalls are counted, not printed; with the async OpenAI client there should be none.
+    watchdog = LoopWatchdog(interval=0.01, stall_threshold=0.1, on_stall=None)
+    watchdog.start()
+    started = time.perf_counter()
+    await _run_sessions(agents, turns, think_time, latencies, errors)
+    elapsed = time.perf_counter() - started
+    await watchdog.stop()
+    lag = watchdog.percentiles()
+    after = server.stats.snapshot()
+
+    history_bytes = [len(json.dumps(agent.messages_history, default=str)) for agent in agents]
+    prompt_tokens = sum(agent.token_usage["prompt"] for agent in agents)
+    cached_tokens = sum(agent.token_usage["cached"] for agent in agents)
+    cost_usd = sum(agent.token_usage["cost_usd"] for agent in agents)
+    await openai_client.close()
+
+    per_session_memory, peak_memory = await measure_memory(server, concurrency, turns)
+
+    return {
+        "concurrency": concurrency,
+        "turns": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "turn_latency_s": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+        },
+        "loop_lag_s": {
+            "p50": lag["p50"],
+            "p99": lag["p99"],
+            "max": lag["max"],
+            "stalls": len(watchdog.stalls),
+        },
+        "connections": {
+            "opened": after["connections_total"] - before["connections_total"],
+            "peak_concurrent": after["connections_peak"],
+            "graph_requests": after["graph_requests"] - before["graph_requests"],
+            "openai_requests": after["openai_requests"] - before["openai_requests"],
+        },
+        "tokens": {
+            "prompt": prompt_tokens,
+            "cached": cached_tokens,
+            "cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "cost_usd_per_turn": cost_usd / len(latencies) if latencies else 0.0,
+        },
+        "memory": {
+            "per_session_kib": per_session_memory / 1024,
+            "peak_kib": peak_memory / 1024,
+            "avg_history_bytes": statistics.fmean(history_bytes) if history_bytes else 0.0,
+        },
+    }
+
+
+def format_report(results: list[dict]) -> str:
+    header = (
+        f"{'conc':>5} {'turns':>6} {'err':>4} {'turn/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'lag p99':>8} {'lag max':>8} {'stalls':>6} {'conns':>6} {'peak':>5} {'KiB/sess':>9} {'cache%':>7} {'$/1k turns':>10}"
+    )
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['concurrency']:>5} {r['turns']:>6} {r['errors']:>4} {r['throughput_turns_per_s']:>8.1f} "
+            f"{r['turn_latency_s']['p50'] * 1000:>8.1f} {r['turn_latency_s']['p95'] * 1000:>8.1f} "
+            f"{r['turn_latency_s']['p99'] * 1000:>8.1f} {r['loop_lag_s']['p99'] * 1000:>8.1f} "
+            f"{r['loop_lag_s']['max'] * 1000:>8.1f} {r['loop_lag_s']['stalls']:>6} {r['connections']['opened']:>6} "
+            f"{r['connections']['peak_concurrent']:>5} {r['memory']['per_session_kib']:>9.1f} "
+            f"{r['tokens']['cache_hit_rate'] * 100:>7.1f} {r['tokens']['cost_usd_per_turn'] * 1000:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+async def main(args: argparse.Namespace):
+    # The agent logs every tool call; keep that noise out of the report unless asked for.
+    setup_logging(level="INFO" if args.verbose else "WARNING")
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    results = []
+    with StandInServer(
+        llm_latency_ms=args.llm_latency_ms,
+        graph_latency_ms=args.graph_latency_ms,
+        jitter=args.jitter
+    ) as server:
+        # One untimed turn first, so lazily imported modules don't count as per-session memory.
+        await run_level(server, 1, 1, 0.0)
+
+        for concurrency in levels:
+            result = await run_level(server, concurrency, args.turns, args.think_time)
+            results.append(result)
+            print(f"concurrency={concurrency}: p95={result['turn_latency_s']['p95'] * 1000:.1f} ms")
+
+    print()
+    print(format_report(results))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nRaw results written to {args.json}")
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for AgentCore against local stand-ins.")
+    parser.add_argument("--levels", default="1,5,10,25", help="Comma-separated concurrency levels to run.")
+    parser.add_argument("--turns", type=int, default=4, help="User turns per session.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds each session waits between turns.")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Simulated chat completion latency.")
+    parser.add_argument("--graph-latency-ms", type=float, default=50.0, help="Simulated Graph request latency.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative jitter applied to simulated latencies.")
+    parser.add_argument("--json", help="Optional path to write the raw results as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent's own log output.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,924 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+from zoneinfo import ZoneInfo
+
+from utils.quickxor import QuickXorHash
+
+# Local stand-ins for Microsoft Graph and the OpenAI Chat Completions API.
+# Both are served by one threaded HTTP server so that the agent under test can be
+# pointed at them without any Azure AD app registration or OpenAI API key.
+#
+# The server runs in its own threads (not on the asyncio loop of the agent), because
+# the agent still makes some blocking calls; a stand-in living on the same loop would
+# deadlock against them.
+
+GRAPH_PREFIX = "/graph/v1.0"
+OPENAI_PREFIX = "/openai/v1"
+
+# Prompt-prefix cache emulation, modelled on OpenAI's: prompts of at least ~1024 tokens are cached
+# in ~128-token steps, and a request is billed as cached for its longest previously seen prefix.
+CACHE_MIN_CHARS = 4096
+CACHE_STEP_CHARS = 512
+CACHE_MAX_ENTRIES = 200_000
+
+
+class StubAuth:
+    """
+    Drop-in replacement for MicrosoftGraphAuth that never talks to Azure AD.
+    It hands out a fixed token and points Graph calls at the stand-in server.
+
+    Args:
+        base_graph_url: The stand-in server's Graph URL.
+        token_latency_ms: Simulated (blocking) latency of the first token acquisition,
+                          like a real Azure AD round-trip; later calls hit the cache.
+    """
+    def __init__(self, base_graph_url: str, token_latency_ms: float = 0.0):
+        self.base_graph_url = base_graph_url
+        self.token_latency_ms = token_latency_ms
+        self._token = ""
+        self._lock = threading.Lock()
+
+    def get_access_token(self) -> str:
+        with self._lock:
+            if not self._token:
+                time.sleep(self.token_latency_ms / 1000.0)
+                self._token = "stand-in-token"
+            return self._token
+
+    async def get_access_token_async(self) -> str:
+        if self._token:
+            return self._token
+        return await asyncio.to_thread(self.get_access_token)
+
+    def get_base_graph_url(self) -> str:
+        return self.base_graph_url
+
+
+class StandInStats:
+    """
+    Thread-safe connection and request counters for the stand-in server.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_total = 0
+        self.connections_active = 0
+        self.connections_peak = 0
+        self.graph_requests = 0
+        self.openai_requests = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_total += 1
+            self.connections_active += 1
+            self.connections_peak = max(self.connections_peak, self.connections_active)
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_active -= 1
+
+    def count_request(self, kind: str):
+        with self._lock:
+            if kind == "openai":
+                self.openai_requests += 1
+            else:
+                self.graph_requests += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections_total": self.connections_total,
+                "connections_active": self.connections_active,
+                "connections_peak": self.connections_peak,
+                "graph_requests": self.graph_requests,
+                "openai_requests": self.openai_requests,
+            }
+
+    def reset_peak(self):
+        with self._lock:
+            self.connections_peak = self.connections_active
+
+
+def _fake_message(index: int) -> dict:
+    return {
+        "id": f"msg-{index:04d}",
+        "subject": f"Quarterly report follow-up #{index}",
+        "from": {"emailAddress": {"address": f"sender{index}@example.com"}},
+        "receivedDateTime": "2025-07-25T09:00:00Z",
+        "isRead": index % 3 == 0,
+        "importance": "high" if index % 5 == 0 else "normal",
+        "hasAttachments": index % 4 == 0,
+        "bodyPreview": "Hi team, please find the latest numbers attached. " * 3,
+    }
+
+
+def _fake_drive_item(index: int) -> dict:
+    item = {
+        "id": f"item-{index:04d}",
+        "name": f"report_{index}.xlsx" if index % 3 else f"Folder {index}",
+        "size": 1024 * (index + 1),
+        "lastModifiedDateTime": "2025-07-25T09:00:00Z",
+    }
+    if index % 3 == 0:
+        item["folder"] = {"childCount": index}
+    else:
+        item["file"] = {"mimeType": "application/octet-stream"}
+    return item
+
+
+# Keyword -> (tool name, arguments) used by the fake model to decide on a tool call.
+# Order matters: the first keyword found in the user message wins.
+SCRIPTED_TOOL_CALLS = [
+    ("read the first", ("get_outlook_email_content", {"user_id": "loadtest@example.com", "email_id": "msg-0001"})),
+    ("unread", ("list_outlook_emails", {"user_id": "loadtest@example.com", "filter_unread": True})),
+    ("inbox", ("list_outlook_emails", {"user_id": "loadtest@example.com"})),
+    ("reply", ("send_outlook_email", {"recipient_email": "sender1@example.com", "subject": "Re: report", "body_content": "Thanks, received."})),
+    ("meeting", ("create_calendar_event", {
+        "user_id": "loadtest@example.com", "subject": "Sync", "start_time_str": "2025-07-25T09:00:00",
+        "end_time_str": "2025-07-25T10:00:00", "timezone_str": "UTC"})),
+    ("files", ("list_files_in_folder", {"user_id": "loadtest@example.com", "folder_path": "Reports"})),
+    ("download", ("download_file_from_onedrive", {"user_id": "loadtest@example.com", "file_id": "item-0001"})),
+]
+
+
+# Keyword -> tool calls made one round after another within a single user turn (multi-step tasks).
+# Checked before SCRIPTED_TOOL_CALLS. "keep checking" never stops on its own, to exercise loop limits.
+SCRIPTED_CHAINS = [
+    ("latest and reply", [
+        ("list_outlook_emails", {"user_id": "loadtest@example.com", "filter_unread": True}),
+        ("get_outlook_email_content", {"user_id": "loadtest@example.com", "email_id": "msg-0001"}),
+        ("send_outlook_email", {"recipient_email": "sender1@example.com", "subject": "Re: report", "body_content": "Thanks, received."}),
+    ]),
+    ("keep checking", [("list_outlook_emails", {"user_id": "loadtest@example.com", "filter_unread": True})] * 20),
+]
+
+
+def _scripted_step(messages: list) -> Optional[tuple]:
+    """
+    Returns the (tool name, arguments) the fake model calls next, or None to answer in text.
+    """
+    user_index = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=None)
+    if user_index is None:
+        return None
+    user_text = str(messages[user_index].get("content") or "").lower()
+    step = sum(1 for m in messages[user_index + 1:] if m.get("role") == "assistant" and m.get("tool_calls"))
+    for keyword, chain in SCRIPTED_CHAINS:
+        if keyword in user_text:
+            return chain[step] if step < len(chain) else None
+    if step:
+        return None # Single-call scripts answer after their tool result
+    for keyword, call in SCRIPTED_TOOL_CALLS:
+        if keyword in user_text:
+            return call
+    return None
+
+
+def _triage_answer(messages: list) -> dict:
+    """
+    Structured answer to a batch triage request (agent/batch_triage.py): one result per email line.
+    """
+    results = []
+    for line in str(messages[-1].get("content") or "").splitlines()[1:]:
+        try:
+            email = json.loads(line)
+        except ValueError:
+            continue
+        text = f"{email.get('subject')} {email.get('preview')}".lower()
+        if any(word in text for word in ("won", "offer", "prize", "verify your")):
+            label, action = "junk", "junk"
+        elif email.get("importance") == "high" or any(word in text for word in ("contract", "approve", "overdue", "cancel")):
+            label, action = "important", "reply"
+        else:
+            label, action = "routine", "none"
+        escalate = any(word in text for word in ("contract", "complaint", "cancel"))
+        results.append({"ref": email.get("ref"), "label": label, "action": action, "escalate": escalate,
+                        "reason": "stand-in decision based on keywords"})
+    return {"results": results}
+
+
+DRIVE_FOLDERS = ("Finance", "Finance/Reports", "Projects", "Projects/Apollo", "HR", "Marketing")
+DRIVE_TOPICS = (
+    ("budget", "quarterly budget forecast revenue expenses margin numbers"),
+    ("minutes", "meeting minutes action items decisions attendees"),
+    ("contract", "service agreement contract terms renewal liability signature"),
+    ("roadmap", "product roadmap milestones launch release timeline"),
+    ("onboarding", "new hire onboarding checklist laptop accounts training"),
+    ("campaign", "marketing campaign audience channels leads conversion"),
+)
+
+
+def _in_zone(moment: datetime, from_zone: str, to_zone: str) -> datetime:
+    source, target = (timezone.utc if name == "UTC" else ZoneInfo(name) for name in (from_zone, to_zone))
+    return moment.replace(tzinfo=source).astimezone(target).replace(tzinfo=None)
+
+
+def _occurrences(event: dict, window_start: str, window_end: str, zone: Optional[str] = None) -> list[dict]:
+    """
+    Occurrences of a stand-in event between two dates, for daily and weekly recurrences (enough
+    for tests of occurrence cancellation). Times are in `zone` (an IANA name or "UTC", as asked
+    for with Prefer: outlook.timezone), by default in the event's own time zone.
+    """
+    start = datetime.fromisoformat(event["start"]["dateTime"])
+    recurrence = event.get("recurrence")
+    if not recurrence:
+        return []
+    pattern, limit = recurrence["pattern"], recurrence["range"]
+    first, last = datetime.fromisoformat(window_start[:19]), datetime.fromisoformat(window_end[:19])
+    until = datetime.fromisoformat(limit["endDate"]) + timedelta(days=1) if limit["type"] == "endDate" else None
+    days = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6}
+    found, current, count = [], start, 0
+    while current < last and (until is None or current < until):
+        offset = (current.date() - start.date()).days
+        if pattern["type"] == "daily":
+            matches = offset % pattern["interval"] == 0
+        else:
+            matches = (current.weekday() in {days[day] for day in pattern.get("daysOfWeek", [])}
+                       and (offset // 7) % pattern["interval"] == 0)
+        if matches:
+            count += 1
+            if limit["type"] == "numbered" and count > limit["numberOfOccurrences"]:
+                break
+            if current >= first:
+                shown = _in_zone(current, event["start"]["timeZone"], zone) if zone else current
+                found.append({"id": f"{event['id']}-occ-{current:%Y%m%d}",
+                              "start": {"dateTime": f"{shown:%Y-%m-%dT%H:%M:%S}.0000000", "timeZone": zone or event["start"]["timeZone"]}})
+        current += timedelta(days=1)
+    return found
+
+
+class StandInDrive:
+    """
+    A small OneDrive for the delta API: folders and text documents whose changes are versioned,
+    so /drive/root/delta can return only what changed since a token. Items are also addressable by
+    path, and can be uploaded (directly or through upload sessions), moved, copied and deleted.
+    Copies complete asynchronously, like Graph's: their monitor reports "inProgress" for
+    `copy_polls` polls before "completed".
+
+    Args:
+        files: Number of documents to create.
+        copy_polls: Monitor polls a copy stays in progress.
+    """
+    def __init__(self, files: int = 200, copy_polls: int = 2):
+        self.items: dict[str, dict] = {}
+        self.contents: dict[str, bytes] = {}
+        self.versions: dict[str, int] = {} # item id -> version of its last change
+        self.children: dict[str, dict[str, str]] = {} # folder id -> lower-cased name -> item id
+        self.sessions: dict[str, dict] = {} # upload session id -> {"path", "data"}
+        self.copies: dict[str, dict] = {} # copy monitor id -> {"polls", "resource_id"}
+        self.copy_polls = copy_polls
+        self.version = 0
+        self.lock = threading.Lock()
+        rng = random.Random(7)
+        self._put({"id": "root", "name": "root", "root": {}, "folder": {}})
+        folder_ids = {"": "root"}
+        for path in DRIVE_FOLDERS:
+            parent, _, name = path.rpartition("/")
+            folder_ids[path] = f"folder-{len(folder_ids):03d}"
+            self._put({"id": folder_ids[path], "name": name, "folder": {}, "parentReference": {"id": folder_ids[parent]}})
+        for index in range(files):
+            topic, words = DRIVE_TOPICS[index % len(DRIVE_TOPICS)]
+            quarter = f"Q{index % 4 + 1}"
+            text = f"{topic.title()} {quarter} {2020 + index % 6}\n" + " ".join(rng.choice(words.split()) for _ in range(400))
+            self.put_file(f"file-{index:05d}", f"{topic}_{quarter}_{index}.txt", folder_ids[rng.choice(DRIVE_FOLDERS)], text)
+
+    def _put(self, item: dict):
+        self.version += 1
+        item["eTag"] = f'"{{{item["id"]}}},{self.version}"'
+        previous = self.items.get(item["id"])
+        if previous is not None and "name" in previous:
+            self.children.get((previous.get("parentReference") or {}).get("id"), {}).pop(previous["name"].lower(), None)
+        if "deleted" not in item and "root" not in item:
+            self.children.setdefault(item["parentReference"]["id"], {})[item["name"].lower()] = item["id"]
+        self.items[item["id"]] = item
+        self.versions[item["id"]] = self.version
+
+    def put_file(self, item_id: str, name: str, parent_id: str, text):
+        """
+        Creates or overwrites a document (its cTag changes). `text` may be str or bytes.
+        """
+        with self.lock:
+            data = text.encode("utf-8") if isinstance(text, str) else bytes(text)
+            self.contents[item_id] = data
+            self._put({"id": item_id, "name": name, "size": len(data),
+                       "file": {"mimeType": "text/plain", "hashes": {"quickXorHash": QuickXorHash(data).b64digest()}},
+                       "cTag": f'"c:{{{item_id}}},{self.version + 1}"', "parentReference": {"id": parent_id},
+                       "lastModifiedDateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())})
+            return self.items[item_id]
+
+    def rename(self, item_id: str, name: str):
+        """
+        Renames an item; the eTag changes, the cTag does not.
+        """
+        self.move(item_id, name=name)
+
+    def move(self, item_id: str, name: Optional[str] = None, parent_id: Optional[str] = None) -> dict:
+        with self.lock:
+            item = self.items[item_id]
+            parent = {"id": parent_id} if parent_id else item.get("parentReference")
+            self._put({**item, "name": name or item["name"], "parentReference": parent})
+            return self.items[item_id]
+
+    def free_name(self, parent_id: str, name: str, conflict_behavior: str) -> Optional[str]:
+        """
+        The name an item may take in a folder under @microsoft.graph.conflictBehavior, or None
+        when it conflicts ("fail"). "replace" deletes the existing item.
+        """
+        existing = self.children.get(parent_id, {}).get(name.lower())
+        if existing is None:
+            return name
+        if conflict_behavior == "replace":
+            self.delete(existing)
+            return name
+        if conflict_behavior == "rename":
+            stem, dot, extension = name.rpartition(".") if "." in name else (name, "", "")
+            counter = 1
+            while f"{stem} {counter}{dot}{extension}".lower() in self.children.get(parent_id, {}):
+                counter += 1
+            return f"{stem} {counter}{dot}{extension}"
+        return None
+
+    def copy(self, item_id: str, parent_id: str, name: Optional[str] = None) -> dict:
+        """
+        Copies an item (and everything below it) into a folder; returns the new item.
+        """
+        source = self.items[item_id]
+        new_id = f"{'folder' if 'folder' in source else 'file'}-{uuid.uuid4().hex[:12]}"
+        if "folder" in source:
+            with self.lock:
+                self._put({"id": new_id, "name": name or source["name"], "folder": {}, "parentReference": {"id": parent_id}})
+            for child_id in list(self.children.get(item_id, {}).values()):
+                self.copy(child_id, new_id)
+            return self.items[new_id]
+        return self.put_file(new_id, name or source["name"], parent_id, self.contents.get(item_id, b""))
+
+    def children_page(self, folder_id: str, skip: int, page_size: int) -> tuple[list[dict], bool]:
+        with self.lock:
+            ids = sorted(self.children.get(folder_id, {}).values())
+            return [self.items[child_id] for child_id in ids[skip:skip + page_size]], skip + page_size < len(ids)
+
+    def delete(self, item_id: str):
+        """
+        Deletes an item and everything below it.
+        """
+        with self.lock:
+            pending = [item_id]
+            while pending:
+                current = pending.pop()
+                pending.extend(self.children.pop(current, {}).values())
+                self._put({"id": current, "deleted": {"state": "deleted"}, "parentReference": self.items[current].get("parentReference")})
+                self.contents.pop(current, None)
+
+    def find(self, path: str) -> Optional[dict]:
+        """
+        The live item at a root-relative path (case-insensitive, like OneDrive), or None.
+        """
+        item_id = "root"
+        for name in filter(None, path.strip("/").split("/")):
+            item_id = self.children.get(item_id, {}).get(name.lower())
+            if item_id is None:
+                return None
+        return self.items[item_id]
+
+    def make_folders(self, path: str) -> str:
+        """
+        Creates the folders of `path` that do not exist yet; returns the id of the last one.
+        """
+        with self.lock:
+            parent_id = "root"
+            for name in filter(None, path.strip("/").split("/")):
+                child_id = self.children.get(parent_id, {}).get(name.lower())
+                if child_id is None:
+                    child_id = f"folder-{uuid.uuid4().hex[:12]}"
+                    self._put({"id": child_id, "name": name, "folder": {}, "parentReference": {"id": parent_id}})
+                parent_id = child_id
+            return parent_id
+
+    def upload(self, path: str, data: bytes) -> dict:
+        """
+        Creates or replaces the file at `path`, creating missing parent folders.
+        """
+        folder, _, name = path.strip("/").rpartition("/")
+        parent_id = self.make_folders(folder)
+        existing = self.children.get(parent_id, {}).get(name.lower())
+        return self.put_file(existing or f"file-{uuid.uuid4().hex[:12]}", name, parent_id, data)
+
+    def delta(self, token: int, skip: int, page_size: int, base_url: str) -> dict:
+        with self.lock:
+            changed = sorted((version, item_id) for item_id, version in self.versions.items() if version > token)
+            items = [self.items[item_id] for _, item_id in changed]
+            if token == 0:
+                items = [item for item in items if "deleted" not in item]
+            page = items[skip:skip + page_size]
+            result = {"value": page}
+            if skip + page_size < len(items):
+                result["@odata.nextLink"] = f"{base_url}/drive/root/delta?token={token}&skip={skip + page_size}"
+            else:
+                result["@odata.deltaLink"] = f"{base_url}/drive/root/delta?token={self.version}"
+            return result
+
+
+class PromptCache:
+    """
+    Emulated provider prompt cache: remembers hashes of prompt prefixes (tools, then messages)
+    at fixed character steps and reports how many leading characters of a new prompt were seen before.
+    """
+    def __init__(self):
+        self._prefixes: set[bytes] = set()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, request: dict) -> int:
+        prompt = (json.dumps(request.get("tools") or []) + json.dumps(request.get("messages") or [])).encode("utf-8")
+        if len(prompt) < CACHE_MIN_CHARS:
+            return 0
+        digests = []
+        running = hashlib.sha1()
+        for start in range(0, len(prompt) - CACHE_STEP_CHARS + 1, CACHE_STEP_CHARS):
+            running.update(prompt[start:start + CACHE_STEP_CHARS])
+            digests.append(running.digest())
+        with self._lock:
+            matched = 0
+            for digest in digests:
+                if digest not in self._prefixes:
+                    break
+                matched += 1
+            if len(self._prefixes) + len(digests) > CACHE_MAX_ENTRIES:
+                self._prefixes.clear()
+            self._prefixes.update(digests)
+        cached_chars = matched * CACHE_STEP_CHARS
+        return cached_chars if cached_chars >= CACHE_MIN_CHARS else 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so connection reuse by clients is visible in the stats
+    server: "StandInServer"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without this, Nagle's algorithm holds the body
+        # back until the client's delayed ACK (~40 ms), which would dwarf the simulated latencies.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stats.connection_opened()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.stats.connection_closed()
+
+    def log_message(self, format, *args):
+        pass # Keep the load-test output readable
+
+    # --- helpers ---
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, payload=None, content_type: str = "application/json", headers: Optional[dict] = None):
+        if payload is None:
+            body = b""
+        elif isinstance(payload, bytes):
+            body = payload
+        else:
+            body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _delay(self, latency_ms: float):
+        if latency_ms > 0:
+            jitter = self.server.jitter
+            time.sleep(latency_ms * random.uniform(1 - jitter, 1 + jitter) / 1000.0)
+
+    # --- dispatch ---
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+    def _handle(self, method: str):
+        body = self._read_body()
+        path = self.path.split("?", 1)[0]
+        if path == f"{GRAPH_PREFIX}/$batch" and method == "POST":
+            self.server.stats.count_request("graph")
+            self._delay(self.server.graph_latency_ms)
+            self._send(200, {"responses": self._batch(json.loads(body or b"{}").get("requests", []))})
+            return
+        if self.server.drive is not None and path.startswith(GRAPH_PREFIX) and self._handle_drive(method, path[len(GRAPH_PREFIX):], body):
+            return
+        if path.startswith(OPENAI_PREFIX):
+            self.server.stats.count_request("openai")
+            self._delay(self.server.llm_latency_ms)
+            self._handle_openai(path[len(OPENAI_PREFIX):], body)
+        elif path.startswith(GRAPH_PREFIX):
+            self.server.stats.count_request("graph")
+            self._delay(self.server.graph_latency_ms)
+            self._handle_graph(method, path[len(GRAPH_PREFIX):], body)
+        else:
+            self._send(404, {"error": {"code": "NotFound", "message": path}})
+
+    def _handle_openai(self, path: str, body: bytes):
+        if path != "/chat/completions":
+            self._send(404, {"error": {"message": f"Unknown stand-in endpoint {path}"}})
+            return
+
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+        last = messages[-1] if messages else {}
+        prompt_chars = len(body)
+
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        response_format = request.get("response_format") or {}
+        step = _scripted_step(messages) if request.get("tool_choice") != "none" else None
+        if (response_format.get("json_schema") or {}).get("name") == "email_triage":
+            content = json.dumps(_triage_answer(messages))
+            limit = request.get("max_completion_tokens") or request.get("max_tokens")
+            if limit and len(content) // 4 > limit:
+                content, finish_reason = content[:limit * 4], "length" # Truncated like a real model
+            message["content"] = content
+        elif step is not None:
+            tool_name, tool_args = step
+            message["tool_calls"] = [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tool_name, "arguments": json.dumps(tool_args)},
+            }]
+            finish_reason = "tool_calls"
+        elif last.get("role") == "tool":
+            message["content"] = "Here is a short summary of the tool results. Anything else?"
+        else:
+            message["content"] = "Sure, I can help with your email, calendar and OneDrive files."
+
+        completion_tokens = max(1, len(json.dumps(message)) // 4)
+        prompt_tokens = max(1, prompt_chars // 4)
+        cached_tokens = min(prompt_tokens, self.server.prompt_cache.lookup_and_store(request) // 4)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        head = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()), "model": request.get("model", "gpt-4o")}
+        if request.get("stream"):
+            self._send(200, self._sse_body(head, message, finish_reason, usage, request), content_type="text/event-stream")
+            return
+        self._send(200, {
+            **head,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": usage,
+        })
+
+    @staticmethod
+    def _sse_body(head: dict, message: dict, finish_reason: str, usage: dict, request: dict) -> bytes:
+        """
+        The response as server-sent chat.completion.chunk events: content word by word, each tool
+        call as a name fragment followed by an arguments fragment, then usage if requested.
+        """
+        def chunk(delta: dict, finish: Optional[str] = None, chunk_usage: Optional[dict] = None, choices: bool = True) -> str:
+            body = {**head, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if choices else [],
+                    "usage": chunk_usage}
+            return f"data: {json.dumps(body)}\n\n"
+
+        events = [chunk({"role": "assistant", "content": ""})]
+        for word in re.findall(r"\S+\s*", message.get("content") or ""):
+            events.append(chunk({"content": word}))
+        for index, call in enumerate(message.get("tool_calls") or []):
+            events.append(chunk({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                                 "function": {"name": call["function"]["name"], "arguments": ""}}]}))
+            events.append(chunk({"tool_calls": [{"index": index, "function": {"arguments": call["function"]["arguments"]}}]}))
+        events.append(chunk({}, finish=finish_reason))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            events.append(chunk({}, chunk_usage=usage, choices=False))
+        events.append("data: [DONE]\n\n")
+        return "".join(events).encode("utf-8")
+
+    def _handle_drive(self, method: str, path: str, body: bytes) -> bool:
+        """
+        Serves the stand-in drive: the delta API, items by id or path (metadata, content, moves,
+        deletes, honouring If-None-Match/If-Match like Graph), uploads, upload sessions and folder
+        creation. False for anything else.
+        """
+        drive: StandInDrive = self.server.drive
+        if path.endswith("/drive/root/delta") and method == "GET":
+            self.server.stats.count_request("graph")
+            self._delay(self.server.graph_latency_ms)
+            query = parse_qs(urlsplit(self.path).query)
+            token, skip = int(query.get("token", ["0"])[0]), int(query.get("skip", ["0"])[0])
+            if token > drive.version:
+                self._send(410, {"error": {"code": "resyncRequired", "message": "The delta token is no longer valid."}})
+            else:
+                base_url = f"http://{self.headers.get('Host')}{GRAPH_PREFIX}{path.rsplit('/drive/', 1)[0]}"
+                self._send(200, drive.delta(token, skip, 100, base_url))
+            return True
+        if path.startswith("/upload/") and method == "PUT":
+            self.server.stats.count_request("graph")
+            return self._upload_fragment(path.rsplit("/", 1)[-1], body)
+        if path.startswith("/monitor/") and method == "GET":
+            self.server.stats.count_request("graph")
+            return self._copy_monitor(path.rsplit("/", 1)[-1])
+
+        match = re.search(r"/drive/(items/[^/]+|root:/[^:]*:?|root)(/content|/children|/createUploadSession|/copy)?$", path)
+        if match is None:
+            return False
+        address, operation = match.group(1), match.group(2)
+        if address.startswith("items/"):
+            item = drive.items.get(address[len("items/"):])
+            item = None if item is None or "deleted" in item else item
+            item_path = self._drive_path(item) if item else None
+        else:
+            item_path = unquote(address[len("root:/"):].rstrip(":")) if address.startswith("root:/") else ""
+            item = drive.find(item_path)
+        creating = (method == "PUT" and operation == "/content") or method == "POST"
+        if item is None and address.startswith("root:/") and operation is None:
+            self.server.stats.count_request("graph")
+            self._send(404, {"error": {"code": "itemNotFound", "message": "The resource could not be found."}})
+            return True
+        if item is None and not (creating and not address.startswith("items/")):
+            return False # Unknown items fall through to the generic stand-in responses
+        etag = item["eTag"] if item else None
+
+        self.server.stats.count_request("graph")
+        self._delay(self.server.graph_latency_ms)
+        if method == "GET" and etag and self.headers.get("If-None-Match") == etag:
+            self._send(304, headers={"ETag": etag})
+        elif method in ("PATCH", "PUT", "DELETE") and self.headers.get("If-Match") not in (None, etag):
+            self._send(412, {"error": {"code": "preconditionFailed", "message": "ETag does not match."}})
+        elif method == "GET" and operation == "/content" and item["id"] in drive.contents:
+            self._send(200, drive.contents[item["id"]], content_type="application/octet-stream", headers={"ETag": etag})
+        elif method == "GET" and operation is None:
+            self._send(200, item, headers={"ETag": etag})
+        elif method == "DELETE" and operation is None:
+            drive.delete(item["id"])
+            self._send(204)
+        elif method == "PATCH" and operation is None:
+            changes = json.loads(body or b"{}")
+            parent = changes.get("parentReference") or {}
+            parent_id = parent.get("id")
+            if parent.get("path"):
+                parent_id = drive.make_folders(unquote(parent["path"].split("root:", 1)[-1]))
+            name = changes.get("name") or item["name"]
+            target_id = parent_id or (item.get("parentReference") or {}).get("id")
+            if drive.children.get(target_id, {}).get(name.lower()) not in (None, item["id"]):
+                name = drive.free_name(target_id, name, self._conflict_behavior())
+            if name is None:
+                self._send(409, {"error": {"code": "nameAlreadyExists", "message": "The specified item name already exists."}})
+            else:
+                self._send(200, drive.move(item["id"], name=name, parent_id=parent_id))
+        elif method == "POST" and operation == "/copy":
+            parent_id = (json.loads(body or b"{}").get("parentReference") or {}).get("id")
+            if parent_id not in drive.items or "folder" not in drive.items[parent_id]:
+                self._send(400, {"error": {"code": "invalidRequest", "message": "Invalid destination."}})
+                return True
+            name = drive.free_name(parent_id, item["name"], self._conflict_behavior())
+            if name is None:
+                self._send(409, {"error": {"code": "nameAlreadyExists", "message": "The specified item name already exists."}})
+                return True
+            monitor_id = uuid.uuid4().hex
+            drive.copies[monitor_id] = {"polls": drive.copy_polls, "resource_id": drive.copy(item["id"], parent_id, name)["id"]}
+            self._send(202, headers={"Location": f"http://{self.headers.get('Host')}{GRAPH_PREFIX}/monitor/{monitor_id}"})
+        elif method == "GET" and operation == "/children" and "folder" in item:
+            skip = int(parse_qs(urlsplit(self.path).query).get("skip", ["0"])[0])
+            page, more = drive.children_page(item["id"], skip, 200)
+            result = {"value": page}
+            if more:
+                result["@odata.nextLink"] = f"http://{self.headers.get('Host')}{self.path.split('?', 1)[0]}?skip={skip + 200}"
+            self._send(200, result)
+        elif method == "PUT" and operation == "/content":
+            self._send(200 if item else 201, drive.upload(item_path, body))
+        elif method == "POST" and operation == "/createUploadSession":
+            session_id = uuid.uuid4().hex
+            drive.sessions[session_id] = {"path": item_path, "data": bytearray()}
+            self._send(200, {"uploadUrl": f"http://{self.headers.get('Host')}{GRAPH_PREFIX}/upload/{session_id}",
+                             "nextExpectedRanges": ["0-"]})
+        elif method == "POST" and operation == "/children":
+            name = json.loads(body or b"{}").get("name", "")
+            folder_id = drive.make_folders(f"{item_path}/{name}" if item_path else name)
+            self._send(201, drive.items[folder_id])
+        else:
+            return False
+        return True
+
+    def _conflict_behavior(self) -> str:
+        return parse_qs(urlsplit(self.path).query).get("@microsoft.graph.conflictBehavior", ["fail"])[0]
+
+    def _batch(self, requests: list[dict]) -> list[dict]:
+        """
+        Runs the sub-requests of a $batch against this server, concurrently like Graph.
+        """
+        host, port = self.server.server_address[:2]
+
+        def run(request: dict) -> dict:
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            try:
+                body = request.get("body")
+                headers = dict(request.get("headers") or {})
+                if body is not None:
+                    body = json.dumps(body).encode("utf-8")
+                    headers.setdefault("Content-Type", "application/json")
+                connection.request(request["method"], f"{GRAPH_PREFIX}{request['url']}", body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                is_json = data and response.getheader("Content-Type", "").startswith("application/json")
+                return {"id": request["id"], "status": response.status,
+                        "headers": {name: value for name, value in response.getheaders() if name in ("Location", "ETag", "Retry-After")},
+                        "body": json.loads(data) if is_json else None}
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(requests), 20))) as pool:
+            return list(pool.map(run, requests))
+
+    def _copy_monitor(self, monitor_id: str) -> bool:
+        copy = self.server.drive.copies.get(monitor_id)
+        if copy is None:
+            self._send(404, {"error": {"code": "itemNotFound", "message": "Unknown monitor."}})
+        elif copy["polls"] > 0:
+            copy["polls"] -= 1
+            self._send(202, {"status": "inProgress", "percentageComplete": 50.0})
+        else:
+            self._send(200, {"status": "completed", "percentageComplete": 100.0, "resourceId": copy["resource_id"]})
+        return True
+
+    def _drive_path(self, item: dict) -> str:
+        drive: StandInDrive = self.server.drive
+        names = []
+        while item is not None and "root" not in item:
+            names.append(item["name"])
+            item = drive.items.get((item.get("parentReference") or {}).get("id"))
+        return "/".join(reversed(names))
+
+    def _upload_fragment(self, session_id: str, body: bytes) -> bool:
+        """
+        One PUT to an upload session URL (Content-Range: bytes start-end/total).
+        """
+        drive: StandInDrive = self.server.drive
+        session = drive.sessions.get(session_id)
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)", self.headers.get("Content-Range", ""))
+        if session is None or match is None or int(match.group(1)) != len(session["data"]):
+            self._send(416 if session else 404, {"error": {"code": "invalidRange", "message": "Unexpected fragment."}})
+            return True
+        session["data"] += body
+        end, total = int(match.group(2)), int(match.group(3))
+        if end + 1 < total:
+            self._send(202, {"nextExpectedRanges": [f"{end + 1}-"]})
+        else:
+            del drive.sessions[session_id]
+            self._send(201, drive.upload(session["path"], bytes(session["data"])))
+        return True
+
+    def _handle_graph(self, method: str, path: str, body: bytes):
+        if path.endswith("/sendMail") and method == "POST":
+            self._send(202)
+        elif "/mailFolders/" in path and path.endswith("/messages"):
+            self._send(200, {"value": [_fake_message(i) for i in range(self.server.page_size)]})
+        elif "/messages/" in path and method == "GET":
+            message = _fake_message(1)
+            message["body"] = {"contentType": "text", "content": "Full email body. " * 200}
+            self._send(200, message)
+        elif path.endswith("/calendar/events") and method == "POST":
+            event = json.loads(body or b"{}")
+            event["id"] = f"event-{uuid.uuid4().hex[:12]}"
+            with self.server.lock:
+                self.server.events[event["id"]] = event
+            self._send(201, event)
+        elif path.endswith("/calendar/events") and method == "GET": # Lookup by extended property value
+            match = re.search(r"ep/value eq '((?:[^']|'')*)'", unquote(urlsplit(self.path).query))
+            wanted = match.group(1).replace("''", "'") if match else None
+            with self.server.lock:
+                found = [{"id": event["id"]} for event in self.server.events.values()
+                         if any(prop.get("value") == wanted for prop in event.get("singleValueExtendedProperties", []))]
+            self._send(200, {"value": found[:1]})
+        elif path.endswith("/instances") and method == "GET":
+            query = parse_qs(urlsplit(self.path).query)
+            event = self.server.events.get(path.rsplit("/", 2)[-2])
+            prefer = re.search(r'outlook\.timezone="([^"]+)"', self.headers.get("Prefer", ""))
+            occurrences = _occurrences(event, query["startDateTime"][0], query["endDateTime"][0],
+                                       prefer.group(1) if prefer else None) if event else []
+            self._send(200, {"value": [item for item in occurrences if item["id"] not in self.server.cancelled]})
+        elif "/events/" in path and "-occ-" in path and method == "DELETE":
+            self.server.cancelled.add(path.rsplit("/", 1)[-1])
+            self._send(204)
+        elif "/calendar/events/" in path:
+            self._send(204 if method == "DELETE" else 200, None if method == "DELETE" else {"id": path.rsplit("/", 1)[-1]})
+        elif path.endswith("/content") and method == "PUT":
+            self._send(201, {"id": f"item-{uuid.uuid4().hex[:12]}", "name": path.rsplit("/", 2)[-2].rstrip(":"), "size": len(body)})
+        elif path.endswith("/content") and method == "GET":
+            self._send(200, b"x" * self.server.download_bytes, content_type="application/octet-stream")
+        elif "/drive/items/" in path and method == "GET": # Item metadata (the content route is matched above)
+            item_id = path.rsplit("/", 1)[-1]
+            self._send(200, {"id": item_id, "name": f"{item_id}.txt", "size": self.server.download_bytes,
+                             "cTag": f'"c:{{{item_id}}},1"', "file": {"mimeType": "text/plain"}})
+        elif path.endswith("/children"):
+            self._send(200, {"value": [_fake_drive_item(i) for i in range(self.server.page_size)]})
+        elif method == "DELETE":
+            self._send(204)
+        elif method == "GET":
+            self._send(200, {"value": []})
+        else:
+            self._send(200, {})
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server emulating the subset of Microsoft Graph and OpenAI used by the agent.
+
+    Args:
+        host: Interface to bind to.
+        port: Port to bind to; 0 picks a free port.
+        llm_latency_ms: Simulated latency of every chat completion.
+        graph_latency_ms: Simulated latency of every Graph request.
+        jitter: Relative random jitter applied to both latencies (0.2 = +/-20%).
+        page_size: Number of items returned by list endpoints.
+        download_bytes: Size of the body returned by file downloads.
+        drive: A StandInDrive served through the delta API, if any.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        llm_latency_ms: float = 300.0,
+        graph_latency_ms: float = 50.0,
+        jitter: float = 0.2,
+        page_size: int = 10,
+        download_bytes: int = 64 * 1024,
+        drive: Optional[StandInDrive] = None
+    ):
+        super().__init__((host, port), StandInHandler)
+        self.stats = StandInStats()
+        self.llm_latency_ms = llm_latency_ms
+        self.graph_latency_ms = graph_latency_ms
+        self.jitter = jitter
+        self.page_size = page_size
+        self.download_bytes = download_bytes
+        self.drive = drive
+        self.prompt_cache = PromptCache()
+        self.events: dict[str, dict] = {} # Calendar events created through the stand-in
+        self.cancelled: set[str] = set() # Deleted occurrences of recurring events
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def graph_url(self) -> str:
+        return f"{self.base_url}{GRAPH_PREFIX}"
+
+    @property
+    def openai_url(self) -> str:
+        return f"{self.base_url}{OPENAI_PREFIX}"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stand-in-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
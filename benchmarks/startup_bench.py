@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+
+# Start-up benchmark for AgentCore.
+#
+# Tracks two numbers, each measured in fresh interpreter processes so that nothing is
+# already imported or connected:
+#   - import time of agent.core
+#   - first-turn latency, cold (construct and immediately send a message) versus warm
+#     (construct, start_warm_up(), then send the message once the warm-up has finished,
+#     as happens while the user is typing)
+#
+# The first turn runs against the local stand-ins, with a simulated Azure AD token latency.
+#
+# Usage:
+#   python -m benchmarks.startup_bench --runs 5
+
+
+def _import_child():
+    started = time.perf_counter()
+    import agent.core # noqa: F401
+    return {"import_ms": (time.perf_counter() - started) * 1000}
+
+
+async def _first_turn_child(warm: bool, token_latency_ms: float, llm_latency_ms: float, graph_latency_ms: float) -> dict:
+    from benchmarks.standins import StandInServer, StubAuth
+    from utils.logger import setup_logging
+    setup_logging(level="WARNING")
+
+    with StandInServer(llm_latency_ms=llm_latency_ms, graph_latency_ms=graph_latency_ms, jitter=0.0) as server:
+        # AgentCore creates its OpenAI client lazily, as in the REPL; point that client at the stand-in.
+        os.environ["OPENAI_BASE_URL"] = server.openai_url
+        os.environ["OPENAI_API_KEY"] = "stand-in"
+
+        started = time.perf_counter()
+        from agent.core import AgentCore
+        agent = AgentCore("supervisor@example.com", auth_handler=StubAuth(server.graph_url, token_latency_ms))
+        ready_ms = (time.perf_counter() - started) * 1000
+
+        warm_up = None
+        if warm:
+            warm_up = await agent.start_warm_up()
+
+        turn_started = time.perf_counter()
+        await agent.process_message("Show me my unread emails")
+        first_turn_ms = (time.perf_counter() - turn_started) * 1000
+
+        turn_started = time.perf_counter()
+        await agent.process_message("Show me my unread emails")
+        second_turn_ms = (time.perf_counter() - turn_started) * 1000
+
+    return {"ready_ms": ready_ms, "first_turn_ms": first_turn_ms, "second_turn_ms": second_turn_ms, "warm_up": warm_up}
+
+
+def _run_child(args: list[str]) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup_bench", *args],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args: argparse.Namespace):
+    latencies = ["--token-latency-ms", str(args.token_latency_ms), "--llm-latency-ms", str(args.llm_latency_ms),
+                 "--graph-latency-ms", str(args.graph_latency_ms)]
+
+    imports = [_run_child(["--child", "import"])["import_ms"] for _ in range(args.runs)]
+    cold = [_run_child(["--child", "cold", *latencies]) for _ in range(args.runs)]
+    warm = [_run_child(["--child", "warm", *latencies]) for _ in range(args.runs)]
+
+    def median(rows: list[dict], key: str) -> float:
+        return statistics.median(row[key] for row in rows)
+
+    report = {
+        "import_ms": statistics.median(imports),
+        "cold": {"ready_ms": median(cold, "ready_ms"), "first_turn_ms": median(cold, "first_turn_ms"),
+                 "second_turn_ms": median(cold, "second_turn_ms")},
+        "warm": {"ready_ms": median(warm, "ready_ms"), "first_turn_ms": median(warm, "first_turn_ms"),
+                 "second_turn_ms": median(warm, "second_turn_ms"), "warm_up": warm[-1]["warm_up"]},
+    }
+
+    print(f"import agent.core:            {report['import_ms']:8.1f} ms (median of {args.runs})")
+    print(f"ready (import + construct):   {report['cold']['ready_ms']:8.1f} ms")
+    print(f"first turn, cold:             {report['cold']['first_turn_ms']:8.1f} ms")
+    print(f"first turn, after warm-up:    {report['warm']['first_turn_ms']:8.1f} ms")
+    print(f"second turn (steady state):   {report['cold']['second_turn_ms']:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import-time and first-turn benchmark for AgentCore.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement.")
+    parser.add_argument("--token-latency-ms", type=float, default=300.0, help="Simulated Azure AD token latency.")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Simulated chat completion latency.")
+    parser.add_argument("--graph-latency-ms", type=float, default=50.0, help="Simulated Graph request latency.")
+    parser.add_argument("--json", help="Optional path to write the results as JSON.")
+    parser.add_argument("--child", choices=["import", "cold", "warm"], help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    parsed = parse_args()
+    if parsed.child == "import":
+        print(json.dumps(_import_child()))
+    elif parsed.child:
+        print(json.dumps(asyncio.run(_first_turn_child(
+            parsed.child == "warm", parsed.token_latency_ms, parsed.llm_latency_ms, parsed.graph_latency_ms))))
+    else:
+        main(parsed)
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import hmac
+import json
+import os
+from typing import Optional
+
+from aiohttp import WSMsgType, web
+
+from agent.conversation import SessionLimitError, SessionManager
+from microsoft_graph.http_client import close_shared_graph_client
+from utils.logger import get_logger, setup_logging
+from utils.loop_watchdog import LoopWatchdog
+from utils.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY
+from utils.text_extraction import close_extractor
+
+# Entry point.
+#
+#   python main.py serve [--host 127.0.0.1] [--port 8080]   multi-user HTTP/WebSocket server
+#   python main.py repl                                      single interactive conversation
+#   python main.py index --user a@b.com [--watch]            build/update the OneDrive search index
+#   python main.py sync --user a@b.com --local DIR --remote FOLDER [--direction both|upload|download]
+#                       [--no-delete] [--dry-run]              sync a local directory with a OneDrive folder
+#   python main.py export --user a@b.com --remote FOLDER (--out FILE.zip | --upload PATH.zip)
+#                                                              export a OneDrive folder as a zip archive
+#   python main.py import-ics --user a@b.com --file team.ics [--timezone Europe/London] [--dry-run]
+#                                                              import an iCalendar file into a calendar
+#
+# The server hosts many conversations in one event loop; see agent/conversation.py for what the
+# sessions share. Endpoints:
+#   POST   /sessions                         -> {"session_id"}
+#   POST   /sessions/{id}/messages           {"message": "..."} -> {"text_output"}
+#          (Accept: text/event-stream, or ?stream=1, streams "delta" events followed by "done")
+#   GET    /sessions/{id}/ws                 WebSocket: send {"message"}, receive {"type": "delta"/"done"/"error"}
+#   When every session slot is running a turn, requests needing a new or spilled session get 503 with
+#   Retry-After (WebSocket: an "error" frame with "retry_after").
+#   GET    /sessions/{id}                    session info
+#   DELETE /sessions/{id}                    ends the session
+#   GET    /healthz, GET /metrics
+#
+# Configuration (environment):
+#     AGENT_SERVER_HOST / AGENT_SERVER_PORT  Bind address (default 127.0.0.1:8080)
+#     AGENT_SERVER_TOKEN                     If set, requests need "Authorization: Bearer <token>"
+#                                            (WebSocket clients may pass ?token=<token> instead)
+#     AGENT_SESSION_STORE                    Directory persisting sessions across evictions and restarts
+
+logger = get_logger(__name__)
+
+MANAGER_KEY = web.AppKey("manager", SessionManager)
+TOKEN_KEY = web.AppKey("token", str)
+MAX_MESSAGE_CHARS = 32_000
+BUSY_RETRY_AFTER_SECONDS = 5 # Suggested to clients when every session slot is running a turn
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    token = request.app.get(TOKEN_KEY)
+    if token and request.path not in ("/healthz",):
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip() or request.query.get("token", "")
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            raise web.HTTPUnauthorized(text="Missing or invalid bearer token.")
+    return await handler(request)
+
+
+def _user_message(payload) -> str:
+    message = payload.get("message") if isinstance(payload, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("Expected a JSON object with a non-empty 'message' string.")
+    if len(message) > MAX_MESSAGE_CHARS:
+        raise ValueError(f"'message' is longer than {MAX_MESSAGE_CHARS} characters.")
+    return message
+
+
+def _sessions_busy(error: SessionLimitError) -> web.HTTPServiceUnavailable:
+    return web.HTTPServiceUnavailable(text=str(error), headers={"Retry-After": str(BUSY_RETRY_AFTER_SECONDS)})
+
+
+def _session_id(request: web.Request) -> str:
+    session_id = request.match_info["session_id"]
+    if not request.app[MANAGER_KEY].exists(session_id):
+        raise web.HTTPNotFound(text=f"Unknown session '{session_id}'.")
+    return session_id
+
+
+async def create_session(request: web.Request) -> web.Response:
+    try:
+        session = await request.app[MANAGER_KEY].create()
+    except SessionLimitError as e:
+        raise _sessions_busy(e)
+    return web.json_response({"session_id": session.id}, status=201)
+
+
+async def get_session(request: web.Request) -> web.Response:
+    try:
+        session = await request.app[MANAGER_KEY].load(_session_id(request))
+    except SessionLimitError as e: # Spilled, and no slot to load it into
+        raise _sessions_busy(e)
+    if session is None: # Deleted in the meantime
+        raise web.HTTPNotFound(text="Unknown session.")
+    return web.json_response(session.to_dict())
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    request.app[MANAGER_KEY].remove(_session_id(request))
+    return web.Response(status=204)
+
+
+async def post_message(request: web.Request) -> web.StreamResponse:
+    manager = request.app[MANAGER_KEY]
+    session_id = _session_id(request)
+    try:
+        message = _user_message(await request.json())
+    except ValueError as e: # Includes invalid JSON
+        raise web.HTTPBadRequest(text=str(e))
+
+    stream = request.query.get("stream") in ("1", "true") or "text/event-stream" in request.headers.get("Accept", "")
+    try:
+        if not stream:
+            result = await manager.process_message(session_id, message)
+            return web.json_response({"text_output": result["text_output"]})
+        await manager.open(session_id) # Admitted before the stream starts, so a full server can still answer 503
+    except SessionLimitError as e:
+        raise _sessions_busy(e)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    async def on_delta(text: str):
+        await response.write(f"event: delta\ndata: {json.dumps({'text': text})}\n\n".encode("utf-8"))
+
+    try:
+        result = await manager.process_message(session_id, message, on_delta=on_delta)
+    except SessionLimitError as e: # Evicted again before its turn started
+        await response.write(f"event: error\ndata: {json.dumps({'message': str(e), 'retry_after': BUSY_RETRY_AFTER_SECONDS})}\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+    await response.write(f"event: done\ndata: {json.dumps({'text_output': result['text_output']})}\n\n".encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def session_socket(request: web.Request) -> web.WebSocketResponse:
+    manager = request.app[MANAGER_KEY]
+    session_id = _session_id(request)
+    socket = web.WebSocketResponse(heartbeat=30.0)
+    await socket.prepare(request)
+
+    async def on_delta(text: str):
+        await socket.send_json({"type": "delta", "text": text})
+
+    async for frame in socket:
+        if frame.type != WSMsgType.TEXT:
+            continue
+        try:
+            payload = json.loads(frame.data)
+            message = _user_message(payload)
+        except ValueError as e:
+            await socket.send_json({"type": "error", "message": str(e)})
+            continue
+        if not manager.exists(session_id): # Evicted (without a store) or deleted while the socket was open
+            await socket.send_json({"type": "error", "message": "Session has ended."})
+            break
+        try:
+            result = await manager.process_message(session_id, message, on_delta=on_delta)
+        except SessionLimitError as e: # The client may send the message again later
+            await socket.send_json({"type": "error", "message": str(e), "retry_after": BUSY_RETRY_AFTER_SECONDS})
+            continue
+        await socket.send_json({"type": "done", "text_output": result["text_output"]})
+    return socket
+
+
+async def healthz(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "sessions": len(request.app[MANAGER_KEY].sessions)})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode("utf-8"), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+
+def build_app(manager: Optional[SessionManager] = None, token: Optional[str] = None) -> web.Application:
+    """
+    The aiohttp application; `manager` defaults to SessionManager.from_env() (created on startup).
+    """
+    app = web.Application(middlewares=[auth_middleware], client_max_size=1024 * 1024)
+    app[TOKEN_KEY] = token if token is not None else os.getenv("AGENT_SERVER_TOKEN")
+
+    async def lifecycle(app: web.Application):
+        app[MANAGER_KEY] = manager or SessionManager.from_env()
+        watchdog = LoopWatchdog.from_env()
+        if watchdog:
+            watchdog.start()
+        warm_up = await app[MANAGER_KEY].start()
+        logger.info("server.ready", warm_up=warm_up)
+        yield
+        await app[MANAGER_KEY].close()
+        await close_shared_graph_client()
+        close_extractor()
+        if watchdog:
+            await watchdog.stop()
+
+    app.cleanup_ctx.append(lifecycle)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_get("/sessions/{session_id}", get_session)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_post("/sessions/{session_id}/messages", post_message)
+    app.router.add_get("/sessions/{session_id}/ws", session_socket)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Intelligent Agent for Microsoft 365 Automation.")
+    parser.set_defaults(command="serve", host=os.getenv("AGENT_SERVER_HOST", "127.0.0.1"),
+                        port=int(os.getenv("AGENT_SERVER_PORT", "8080")))
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="Run the multi-user HTTP/WebSocket server (default).")
+    serve.add_argument("--host", default=os.getenv("AGENT_SERVER_HOST", "127.0.0.1"))
+    serve.add_argument("--port", type=int, default=int(os.getenv("AGENT_SERVER_PORT", "8080")))
+    commands.add_parser("repl", help="Chat with the agent in this terminal.")
+    index = commands.add_parser("index", help="Build or update the OneDrive search index (AGENT_DRIVE_INDEX).")
+    index.add_argument("--user", action="append", dest="users", help="OneDrive owner; repeatable (default: AGENT_DRIVE_INDEX_USERS).")
+    index.add_argument("--watch", action="store_true", help="Keep syncing every AGENT_DRIVE_INDEX_INTERVAL seconds.")
+    sync = commands.add_parser("sync", help="Sync a local directory with a OneDrive folder.")
+    sync.add_argument("--user", required=True, help="OneDrive owner.")
+    sync.add_argument("--local", required=True, help="Local directory.")
+    sync.add_argument("--remote", required=True, help="OneDrive folder, relative to the drive root.")
+    sync.add_argument("--direction", choices=("both", "upload", "download"), default="both")
+    sync.add_argument("--no-delete", action="store_true", help="Do not propagate deletions.")
+    sync.add_argument("--dry-run", action="store_true", help="Only report what would be done.")
+    sync.add_argument("--concurrency", type=int, default=8, help="Transfers running at once.")
+    export = commands.add_parser("export", help="Export a OneDrive folder as a zip archive.")
+    export.add_argument("--user", required=True, help="OneDrive owner.")
+    export.add_argument("--remote", required=True, help="OneDrive folder, relative to the drive root.")
+    target = export.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="Local zip file to write.")
+    target.add_argument("--upload", help="OneDrive path to upload the zip to.")
+    export.add_argument("--compression", choices=("deflated", "stored"), default="deflated")
+    export.add_argument("--prefetch", type=int, default=4, help="Files downloaded ahead of the zip writer.")
+    ics = commands.add_parser("import-ics", help="Import an iCalendar (.ics) file into an Outlook calendar.")
+    ics.add_argument("--user", required=True, help="Calendar owner.")
+    ics.add_argument("--file", required=True, help="Local .ics file.")
+    ics.add_argument("--calendar-id", help="Calendar to import into (default: the main calendar).")
+    ics.add_argument("--timezone", default="UTC", help="Time zone of floating times and all-day events.")
+    ics.add_argument("--attendees", action="store_true", help="Add attendees (Outlook sends them invitations).")
+    ics.add_argument("--dry-run", action="store_true", help="Only report what would be imported.")
+    ics.add_argument("--concurrency", type=int, default=2, help="$batch requests in flight at once.")
+    return parser.parse_args(argv)
+
+
+async def run_index(users: list[str], watch: bool = False):
+    from microsoft_graph.auth import MicrosoftGraphAuth
+    from microsoft_graph.drive_index import get_drive_index
+
+    drive_index = get_drive_index()
+    if drive_index is None:
+        raise SystemExit("Set AGENT_DRIVE_INDEX to the path of the index file.")
+    if not users:
+        raise SystemExit("Name at least one OneDrive owner with --user or AGENT_DRIVE_INDEX_USERS.")
+    auth_handler = MicrosoftGraphAuth()
+    try:
+        if watch:
+            await drive_index.keep_synced(auth_handler, users, float(os.getenv("AGENT_DRIVE_INDEX_INTERVAL", "300")))
+        for user_id in users:
+            print(json.dumps({"user_id": user_id, **await drive_index.sync(auth_handler, user_id)}))
+    finally:
+        await close_shared_graph_client()
+        close_extractor()
+        drive_index.close()
+
+
+async def run_sync(args: argparse.Namespace) -> int:
+    from microsoft_graph.auth import MicrosoftGraphAuth
+    from microsoft_graph.onedrive_sync import sync_onedrive_folder
+
+    try:
+        report = await sync_onedrive_folder(
+            MicrosoftGraphAuth(), args.user, args.local, args.remote, direction=args.direction,
+            delete=not args.no_delete, dry_run=args.dry_run, concurrency=args.concurrency)
+    finally:
+        await close_shared_graph_client()
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+async def run_export(args: argparse.Namespace) -> int:
+    from microsoft_graph.auth import MicrosoftGraphAuth
+    from microsoft_graph.onedrive_export import export_onedrive_folder
+
+    try:
+        report = await export_onedrive_folder(
+            MicrosoftGraphAuth(), args.user, args.remote, output_path=args.out, destination_path=args.upload,
+            compression=args.compression, prefetch=args.prefetch)
+    finally:
+        await close_shared_graph_client()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+async def run_import_ics(args: argparse.Namespace) -> int:
+    from microsoft_graph.auth import MicrosoftGraphAuth
+    from microsoft_graph.ics_import import import_ics
+
+    try:
+        report = await import_ics(
+            MicrosoftGraphAuth(), args.user, args.file, calendar_id=args.calendar_id, default_timezone=args.timezone,
+            include_attendees=args.attendees, dry_run=args.dry_run, concurrency=args.concurrency)
+    finally:
+        await close_shared_graph_client()
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    if args.command == "repl":
+        from agent.core import main as repl
+        asyncio.run(repl())
+        return
+    if args.command == "index":
+        from microsoft_graph.drive_index import indexed_users
+        setup_logging(level=os.getenv("AGENT_LOG_LEVEL", "INFO"))
+        asyncio.run(run_index(args.users or indexed_users(), args.watch))
+        return
+    if args.command == "sync":
+        setup_logging(level=os.getenv("AGENT_LOG_LEVEL", "INFO"))
+        raise SystemExit(asyncio.run(run_sync(args)))
+    if args.command == "export":
+        setup_logging(level=os.getenv("AGENT_LOG_LEVEL", "INFO"))
+        raise SystemExit(asyncio.run(run_export(args)))
+    if args.command == "import-ics":
+        setup_logging(level=os.getenv("AGENT_LOG_LEVEL", "INFO"))
+        raise SystemExit(asyncio.run(run_import_ics(args)))
+    setup_logging(level=os.getenv("AGENT_LOG_LEVEL", "INFO"))
+    web.run_app(build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -99,12 +99,22 @@
 
 import os
 from dotenv import load_dotenv
-from azure.identity import ClientSecretCredential
 import asyncio # Needed for running async test
+import threading
+import time
+
+from utils.metrics import REGISTRY
+from utils.tracing import tracer
 
 # Load environment variables from .env file
 load_dotenv()
 
+TOKEN_SECONDS = REGISTRY.histogram(
+    "graph_token_duration_seconds", "Time spent acquiring Azure AD access tokens.", ("status",))
+
+# Cached tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
 class MicrosoftGraphAuth:
     """
     Handles authentication with Azure AD for Microsoft Graph API using Client Credentials Flow.
@@ -124,22 +134,64 @@ class MicrosoftGraphAuth:
         assert self.client_secret is not None
         assert self.tenant_id is not None
 
-        self.credential = ClientSecretCredential(
-            tenant_id=self.tenant_id,
-            client_id=self.client_id,
-            client_secret=self.client_secret
-        )
+        self._credential = None # Created on first use; importing azure.identity is slow
+        self._token: str = ""
+        self._token_expires_on: float = 0.0
+        self._token_lock = threading.Lock()
+
+    @property
+    def credential(self):
+        if self._credential is None:
+            from azure.identity import ClientSecretCredential
+            self._credential = ClientSecretCredential(
+                tenant_id=self.tenant_id,
+                client_id=self.client_id,
+                client_secret=self.client_secret
+            )
+        return self._credential
+
+    def _cached_token(self) -> str:
+        if self._token and time.time() < self._token_expires_on - TOKEN_REFRESH_MARGIN_SECONDS:
+            return self._token
+        return ""
 
     def get_access_token(self) -> str:
         """
         Retrieves an access token string from Azure AD.
+        The token is cached until shortly before it expires; concurrent callers share one refresh.
         """
-        try:
-            token_object = self.credential.get_token(*self.scope)
-            return token_object.token
-        except Exception as e:
-            # Capture the original exception type and message for better debugging
-            raise Exception(f"Failed to get access token from Azure AD: {type(e).__name__} - {e}")
+        token = self._cached_token()
+        if token:
+            return token
+
+        with self._token_lock:
+            token = self._cached_token() # Another thread may have refreshed it while we waited
+            if token:
+                return token
+
+            started = time.perf_counter()
+            with tracer.span("graph.token", kind="client"):
+                try:
+                    token_object = self.credential.get_token(*self.scope)
+                    TOKEN_SECONDS.observe(time.perf_counter() - started, status="ok")
+                except Exception as e:
+                    TOKEN_SECONDS.observe(time.perf_counter() - started, status="error")
+                    # Capture the original exception type and message for better debugging
+                    raise Exception(f"Failed to get access token from Azure AD: {type(e).__name__} - {e}")
+
+            self._token = token_object.token
+            self._token_expires_on = float(token_object.expires_on)
+            return self._token
+
+    async def get_access_token_async(self) -> str:
+        """
+        Async variant of get_access_token for use on the event loop: returns the cached token
+        immediately, and otherwise refreshes it in a worker thread instead of blocking the loop.
+        """
+        token = self._cached_token()
+        if token:
+            return token
+        return await asyncio.to_thread(self.get_access_token)
 
     def get_base_graph_url(self) -> str:
         """
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from typing import Any, Optional
+
+import httpx
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+# JSON batching for Microsoft Graph (POST /$batch).
+#
+# Up to 20 independent requests travel in one POST, so a job of N small writes costs N/20
+# round-trips instead of N. Each sub-request is a dict with "method", a URL relative to the
+# Graph version root ("/users/{id}/drive/items/{id}") and optional "headers" and "body" (JSON).
+# Graph may run the sub-requests of a batch in any order, so only independent requests are
+# batched together (no dependsOn).
+#
+# Sub-responses are throttled one by one: a 429 (or 503) inside a 200 batch response is retried
+# in a later batch once its Retry-After has passed, up to `max_attempts`. Batches are sent
+# concurrently, bounded by AGENT_GRAPH_BATCH_CONCURRENCY (default 4). A batch that fails as a
+# whole (after the transport's own retries) fails each of its sub-requests with that status, so
+# callers always get one response per request, in request order.
+#
+# Config (environment variables):
+#   AGENT_GRAPH_BATCH_CONCURRENCY   Batches in flight at once (default 4)
+
+MAX_BATCH_REQUESTS = 20 # Graph's limit per $batch
+RETRYABLE_STATUS = {429, 503}
+MAX_RETRY_AFTER_SECONDS = 30.0
+
+GRAPH_BATCHES = REGISTRY.histogram(
+    "graph_batch_size", "Sub-requests per Microsoft Graph $batch request.", buckets=(1, 2, 5, 10, 15, 20))
+GRAPH_BATCH_SUBREQUESTS = REGISTRY.counter(
+    "graph_batch_subrequests_total", "Microsoft Graph $batch sub-requests by method and final status.", ("method", "status"))
+GRAPH_BATCH_RETRIES = REGISTRY.counter(
+    "graph_batch_retries_total", "Throttled Microsoft Graph $batch sub-requests sent again.")
+
+logger = get_logger(__name__)
+
+
+def _retry_after(response: dict, attempt: int) -> float:
+    try:
+        return min(float(response["headers"].get("retry-after")), MAX_RETRY_AFTER_SECONDS)
+    except (TypeError, ValueError):
+        return min(0.5 * (2 ** attempt), MAX_RETRY_AFTER_SECONDS)
+
+
+async def graph_batch(
+    auth_handler: MicrosoftGraphAuth,
+    requests: list[dict[str, Any]],
+    concurrency: Optional[int] = None,
+    max_attempts: int = 4
+) -> list[dict[str, Any]]:
+    """
+    Sends requests through Graph JSON batching.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        requests: Sub-requests: {"method", "url", "headers"?, "body"?}, URLs relative to the
+            Graph version root.
+        concurrency: Batches in flight at once (default AGENT_GRAPH_BATCH_CONCURRENCY or 4).
+        max_attempts: Attempts per throttled sub-request.
+
+    Returns:
+        One {"status", "headers", "body"} per request, in request order. Header names are
+        lower-cased; a status of 0 means the batch could not be sent at all.
+    """
+    responses: list[Optional[dict]] = [None] * len(requests)
+    slots = asyncio.Semaphore(concurrency or int(os.getenv("AGENT_GRAPH_BATCH_CONCURRENCY", "4")))
+    batch_url = f"{auth_handler.get_base_graph_url()}/$batch"
+
+    async def send(client: httpx.AsyncClient, indexes: list[int]) -> dict[int, dict]:
+        payload = []
+        for index in indexes:
+            request = requests[index]
+            entry = {"id": str(index), "method": request["method"], "url": request["url"]}
+            headers = dict(request.get("headers") or {})
+            if request.get("body") is not None:
+                entry["body"] = request["body"]
+                headers.setdefault("Content-Type", "application/json")
+            if headers:
+                entry["headers"] = headers
+            payload.append(entry)
+        GRAPH_BATCHES.observe(len(payload))
+        async with slots:
+            try:
+                token = await auth_handler.get_access_token_async()
+                response = await client.post(batch_url, headers={"Authorization": f"Bearer {token}"},
+                                             json={"requests": payload})
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                failure = {"status": e.response.status_code, "headers": {},
+                           "body": {"error": {"code": "batchFailed", "message": e.response.text[:500]}}}
+                return {index: failure for index in indexes}
+            except httpx.HTTPError as e:
+                failure = {"status": 0, "headers": {},
+                           "body": {"error": {"code": "batchFailed", "message": f"{type(e).__name__} - {e}"}}}
+                return {index: failure for index in indexes}
+        results = {}
+        for item in response.json().get("responses", []):
+            results[int(item["id"])] = {"status": int(item.get("status", 0)),
+                                        "headers": {name.lower(): value for name, value in (item.get("headers") or {}).items()},
+                                        "body": item.get("body")}
+        for index in indexes: # Graph answers every id; be safe if it ever doesn't
+            results.setdefault(index, {"status": 0, "headers": {},
+                                       "body": {"error": {"code": "missingResponse", "message": "No response in the batch."}}})
+        return results
+
+    async with graph_client() as client:
+        pending = list(range(len(requests)))
+        for attempt in range(max_attempts):
+            chunks = [pending[start:start + MAX_BATCH_REQUESTS] for start in range(0, len(pending), MAX_BATCH_REQUESTS)]
+            retry, delay = [], 0.0
+            for results in await asyncio.gather(*(send(client, chunk) for chunk in chunks)):
+                for index, response in results.items():
+                    responses[index] = response
+                    if response["status"] in RETRYABLE_STATUS and attempt + 1 < max_attempts:
+                        retry.append(index)
+                        delay = max(delay, _retry_after(response, attempt))
+            if not retry:
+                break
+            GRAPH_BATCH_RETRIES.inc(len(retry))
+            logger.info("graph_batch.retry", count=len(retry), delay_s=round(delay, 2))
+            await asyncio.sleep(delay)
+            pending = sorted(retry)
+
+    for request, response in zip(requests, responses):
+        GRAPH_BATCH_SUBREQUESTS.inc(method=request["method"], status=str(response["status"]))
+    return responses
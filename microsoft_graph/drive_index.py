@@ -0,0 +1,480 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+import httpx
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.text_extraction import ExtractionError, detect_format, get_extractor
+
+# Local full-text index of OneDrive file names, folder paths and document contents.
+#
+# search_onedrive_files answers "find the spreadsheet with last quarter's numbers" from an SQLite
+# FTS5 index in milliseconds, without a Graph round-trip. The index is kept current in the
+# background (or with `python main.py index`):
+#   - GET /drive/root/delta returns only what changed since the stored deltaLink, so a sync of an
+#     unchanged drive is a single small request. An expired link (410) falls back to a full
+#     enumeration, and items that were not seen again are dropped.
+#   - Paths are rebuilt from parent ids; delta responses carry no parentReference.path. When a
+#     folder is renamed or moved, the paths of everything below it are rewritten.
+#   - Document text is extracted (utils/text_extraction.py) only when the item's cTag differs from
+#     the cTag its indexed text came from. Renames and moves change the eTag but not the cTag, so
+#     they never cause a download. A file that cannot be parsed is not tried again until it
+#     changes; a failed download is retried by the next sync.
+#
+# Ranking is BM25 with name matches weighted above path matches, and path above content. Items
+# whose name contains every term come first, then items containing every term anywhere; if that
+# finds too little, any term may match.
+#
+# Configuration (environment):
+#     AGENT_DRIVE_INDEX            Path of the SQLite index file; unset disables the index
+#     AGENT_DRIVE_INDEX_USERS      Comma-separated OneDrive owners kept in sync by the server
+#     AGENT_DRIVE_INDEX_INTERVAL   Seconds between background syncs (default 300)
+#     AGENT_DRIVE_INDEX_MAX_CHARS  Characters of document text indexed per file (default 200000)
+
+DELTA_SELECT = "id,name,parentReference,file,folder,root,deleted,cTag,eTag,size,lastModifiedDateTime,webUrl"
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "my", "me", "find", "show", "get",
+    "file", "files", "document", "documents", "where", "is", "are", "that", "which", "from", "about",
+}
+NAME_WEIGHT, PATH_WEIGHT, CONTENT_WEIGHT = 10.0, 4.0, 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    user_id TEXT NOT NULL, id TEXT NOT NULL, parent_id TEXT, name TEXT, path TEXT, is_folder INTEGER,
+    size INTEGER, mime_type TEXT, ctag TEXT, etag TEXT, modified TEXT, web_url TEXT, quick_xor TEXT,
+    content_ctag TEXT, content_status TEXT, seen INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (user_id, parent_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(
+    name, path, content, tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3'
+);
+CREATE TABLE IF NOT EXISTS sync_state (user_id TEXT PRIMARY KEY, delta_link TEXT, synced_at REAL, generation INTEGER);
+"""
+
+INDEX_ITEMS = REGISTRY.gauge(
+    "drive_index_items", "Files and folders in the local OneDrive index.")
+INDEX_CHANGES = REGISTRY.counter(
+    "drive_index_changes_total", "Changes applied to the OneDrive index, by kind (upserted, deleted, extracted, failed).", ("kind",))
+INDEX_SYNC_SECONDS = REGISTRY.histogram(
+    "drive_index_sync_duration_seconds", "Duration of OneDrive index syncs, by mode (delta, full).", ("mode",))
+INDEX_SEARCH_SECONDS = REGISTRY.histogram(
+    "drive_index_search_duration_seconds", "Latency of local OneDrive index searches.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+logger = get_logger(__name__)
+
+
+class DeltaExpired(Exception):
+    """
+    Raised when Graph no longer accepts the stored deltaLink (HTTP 410); a full resync is needed.
+    """
+
+
+def _match_query(words: list[str], operator: str, column: Optional[str] = None) -> str:
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*" # The last word may be typed incompletely
+    query = f" {operator} ".join(terms)
+    return f"{column} : ({query})" if column else query
+
+
+class DriveIndex:
+    """
+    SQLite FTS5 index of OneDrive items for one or more drive owners.
+
+    Args:
+        path: SQLite file (":memory:" for a throwaway index).
+        max_chars: Characters of extracted text indexed per document.
+        concurrency: Documents downloaded and extracted at once during a sync.
+    """
+    def __init__(self, path: str = ":memory:", max_chars: int = 200_000, concurrency: int = 4):
+        self.path = path
+        self.max_chars = max_chars
+        self.concurrency = concurrency
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            if path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL") # No fsync per commit; the index can be rebuilt from Graph
+            self._db.executescript(SCHEMA)
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(items)")}
+            if "quick_xor" not in columns: # Index files created before hashes were recorded
+                self._db.execute("ALTER TABLE items ADD COLUMN quick_xor TEXT")
+        self._sync_locks: dict[str, asyncio.Lock] = {}
+        self._update_gauge()
+
+    @classmethod
+    def from_env(cls) -> Optional["DriveIndex"]:
+        path = os.getenv("AGENT_DRIVE_INDEX")
+        if not path:
+            return None
+        return cls(path, max_chars=int(os.getenv("AGENT_DRIVE_INDEX_MAX_CHARS", "200000")))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _update_gauge(self):
+        with self._lock:
+            INDEX_ITEMS.set(self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0])
+
+    # --- sync ---
+    async def sync(self, auth_handler: MicrosoftGraphAuth, user_id: str, extract: bool = True) -> dict[str, Any]:
+        """
+        Brings the index of `user_id`'s drive up to date through the delta API, extracting the text
+        of new or changed documents (unless `extract` is False; a later sync catches up).
+
+        Returns:
+            {"mode": "delta" or "full", "changes", "deleted", "extracted", "failed", "items", "seconds"}
+        """
+        lock = self._sync_locks.setdefault(user_id, asyncio.Lock())
+        async with lock: # One sync per drive at a time; a second caller waits and then finds nothing new
+            started = time.perf_counter()
+            delta_link, generation = await asyncio.to_thread(self._sync_state, user_id)
+            mode = "delta" if delta_link else "full"
+            try:
+                stats = await self._sync(auth_handler, user_id, delta_link, generation + 1, extract)
+            except DeltaExpired:
+                logger.info("drive_index.resync", user_id=user_id, reason="delta link expired")
+                mode = "full"
+                stats = await self._sync(auth_handler, user_id, None, generation + 1, extract)
+            seconds = time.perf_counter() - started
+            INDEX_SYNC_SECONDS.observe(seconds, mode=mode)
+            self._update_gauge()
+            stats.update(mode=mode, seconds=round(seconds, 3))
+            logger.info("drive_index.synced", user_id=user_id, **stats)
+            return stats
+
+    async def _sync(self, auth_handler: MicrosoftGraphAuth, user_id: str, delta_link: Optional[str], generation: int,
+                    extract: bool) -> dict[str, Any]:
+        full = delta_link is None
+        base_url = auth_handler.get_base_graph_url()
+        url = delta_link or f"{base_url}/users/{user_id}/drive/root/delta"
+        params = None if delta_link else {"$select": DELTA_SELECT}
+        changed: list[dict] = []
+
+        async with graph_client() as client:
+            while url:
+                access_token = await auth_handler.get_access_token_async()
+                response = await client.get(url, params=params, headers={"Authorization": f"Bearer {access_token}", "Accept": "application/json"})
+                if response.status_code == 410:
+                    raise DeltaExpired()
+                response.raise_for_status()
+                page = response.json()
+                changed.extend(page.get("value", []))
+                params = None # nextLink/deltaLink already carry the query
+                url = page.get("@odata.nextLink")
+                delta_link = page.get("@odata.deltaLink", delta_link)
+
+            upserted, deleted, to_extract = await asyncio.to_thread(self._apply, user_id, changed, generation, full)
+            extracted, failed = await self._extract_all(client, auth_handler, user_id, to_extract) if extract else (0, 0)
+
+        await asyncio.to_thread(self._save_state, user_id, delta_link, generation)
+        return {"changes": upserted, "deleted": deleted, "extracted": extracted, "failed": failed,
+                "items": await asyncio.to_thread(self.count, user_id)}
+
+    def _sync_state(self, user_id: str) -> tuple[Optional[str], int]:
+        with self._lock:
+            row = self._db.execute("SELECT delta_link, generation FROM sync_state WHERE user_id = ?", (user_id,)).fetchone()
+        return (row["delta_link"], row["generation"] or 0) if row else (None, 0)
+
+    def _save_state(self, user_id: str, delta_link: Optional[str], generation: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO sync_state (user_id, delta_link, synced_at, generation) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET delta_link = excluded.delta_link, synced_at = excluded.synced_at, "
+                "generation = excluded.generation",
+                (user_id, delta_link, time.time(), generation))
+
+    def _apply(self, user_id: str, changes: list[dict], generation: int, full: bool) -> tuple[int, int, list[dict]]:
+        """
+        Applies one sync's delta items. Returns (upserted, deleted, files whose text must be (re)extracted).
+        """
+        upserted = deleted = 0
+        moved_folders: list[str] = []
+        touched: list[str] = []
+        with self._lock, self._db:
+            db = self._db
+            for item in changes:
+                item_id = item.get("id")
+                if not item_id:
+                    continue
+                if "deleted" in item:
+                    deleted += self._delete(user_id, item_id)
+                    continue
+                parent_id = (item.get("parentReference") or {}).get("id")
+                is_folder = int("folder" in item or "root" in item)
+                previous = db.execute("SELECT rowid, name, parent_id FROM items WHERE user_id = ? AND id = ?",
+                                      (user_id, item_id)).fetchone()
+                db.execute(
+                    "INSERT INTO items (user_id, id, parent_id, name, is_folder, size, mime_type, ctag, etag, modified, web_url, "
+                    "quick_xor, seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, id) DO UPDATE SET parent_id = excluded.parent_id, name = excluded.name, "
+                    "is_folder = excluded.is_folder, size = excluded.size, mime_type = excluded.mime_type, ctag = excluded.ctag, "
+                    "etag = excluded.etag, modified = excluded.modified, web_url = excluded.web_url, "
+                    "quick_xor = excluded.quick_xor, seen = excluded.seen",
+                    (user_id, item_id, parent_id, "" if "root" in item else item.get("name"), is_folder, item.get("size"),
+                     (item.get("file") or {}).get("mimeType"), item.get("cTag"), item.get("eTag"),
+                     item.get("lastModifiedDateTime"), item.get("webUrl"),
+                     ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash"), generation))
+                upserted += 1
+                touched.append(item_id)
+                if is_folder and previous is not None and (previous["name"], previous["parent_id"]) != (item.get("name"), parent_id):
+                    moved_folders.append(item_id)
+
+            if full: # Items a full enumeration didn't return no longer exist
+                stale = [row["id"] for row in db.execute(
+                    "SELECT id FROM items WHERE user_id = ? AND seen != ?", (user_id, generation))]
+                for item_id in stale:
+                    deleted += self._delete(user_id, item_id)
+
+            self._refresh_paths(user_id, touched, moved_folders)
+
+            to_extract = [dict(row) for row in db.execute(
+                "SELECT id, name, mime_type, size, ctag FROM items WHERE user_id = ? AND is_folder = 0 "
+                "AND ctag IS NOT NULL AND content_ctag IS NOT ctag", (user_id,))]
+        INDEX_CHANGES.inc(upserted, kind="upserted")
+        INDEX_CHANGES.inc(deleted, kind="deleted")
+        return upserted, deleted, to_extract
+
+    def _delete(self, user_id: str, item_id: str) -> int:
+        """
+        Removes an item and, for a folder, everything below it (delta may report only the folder).
+        """
+        ids, removed = [item_id], 0
+        while ids:
+            current = ids.pop()
+            row = self._db.execute("SELECT rowid FROM items WHERE user_id = ? AND id = ?", (user_id, current)).fetchone()
+            ids.extend(child["id"] for child in self._db.execute(
+                "SELECT id FROM items WHERE user_id = ? AND parent_id = ?", (user_id, current)))
+            if row is not None:
+                self._db.execute("DELETE FROM documents WHERE rowid = ?", (row["rowid"],))
+                self._db.execute("DELETE FROM items WHERE rowid = ?", (row["rowid"],))
+                removed += 1
+        return removed
+
+    def _refresh_paths(self, user_id: str, touched: Iterable[str], moved_folders: Iterable[str]):
+        """
+        Recomputes the path of each touched item from its parent chain, then rewrites the subtrees of
+        renamed or moved folders, and mirrors names and paths into the full-text table.
+        """
+        db = self._db
+        cache: dict[str, str] = {}
+
+        def path_of(item_id: Optional[str], depth: int = 0) -> str:
+            if not item_id or depth > 64:
+                return ""
+            if item_id not in cache:
+                row = db.execute("SELECT parent_id, name FROM items WHERE user_id = ? AND id = ?", (user_id, item_id)).fetchone()
+                if row is None or not row["name"]: # Unknown or the drive root
+                    cache[item_id] = ""
+                else:
+                    parent = path_of(row["parent_id"], depth + 1)
+                    cache[item_id] = f"{parent}/{row['name']}" if parent else row["name"]
+            return cache[item_id]
+
+        pending = list(dict.fromkeys(touched))
+        for folder_id in moved_folders: # Descendants keep their own rows but inherit the new path
+            stack = [folder_id]
+            while stack:
+                children = [row["id"] for row in db.execute(
+                    "SELECT id FROM items WHERE user_id = ? AND parent_id = ?", (user_id, stack.pop()))]
+                pending.extend(children)
+                stack.extend(children)
+
+        for item_id in dict.fromkeys(pending):
+            row = db.execute("SELECT rowid, name, parent_id FROM items WHERE user_id = ? AND id = ?",
+                             (user_id, item_id)).fetchone()
+            if row is None:
+                continue
+            path = path_of(item_id)
+            db.execute("UPDATE items SET path = ? WHERE rowid = ?", (path, row["rowid"]))
+            if not row["name"]:
+                continue # The root is not searchable
+            folder = path.rsplit("/", 1)[0] if "/" in path else ""
+            existing = db.execute("SELECT content FROM documents WHERE rowid = ?", (row["rowid"],)).fetchone()
+            if existing is None:
+                db.execute("INSERT INTO documents (rowid, name, path, content) VALUES (?, ?, ?, '')",
+                           (row["rowid"], row["name"], folder))
+            else:
+                db.execute("UPDATE documents SET name = ?, path = ? WHERE rowid = ?", (row["name"], folder, row["rowid"]))
+
+    async def _extract_all(self, client: httpx.AsyncClient, auth_handler: MicrosoftGraphAuth, user_id: str,
+                           items: list[dict]) -> tuple[int, int]:
+        extractor = get_extractor()
+        slots = asyncio.Semaphore(self.concurrency)
+        outcome = {"extracted": 0, "failed": 0}
+
+        async def extract(item: dict):
+            document_format = detect_format(item["name"], item["mime_type"])
+            if document_format is None or (item["size"] or 0) > extractor.max_bytes:
+                await asyncio.to_thread(self._store_content, user_id, item, None, "skipped")
+                return
+            async with slots:
+                try:
+                    cache_key = f"{item['id']}:{item['ctag']}"
+                    result = extractor.cached(cache_key)
+                    if result is None:
+                        access_token = await auth_handler.get_access_token_async()
+                        response = await client.get(
+                            f"{auth_handler.get_base_graph_url()}/users/{user_id}/drive/items/{item['id']}/content",
+                            headers={"Authorization": f"Bearer {access_token}"})
+                        response.raise_for_status()
+                        result = await extractor.extract(response.content, item["name"], item["mime_type"], cache_key=cache_key)
+                except ExtractionError as e:
+                    outcome["failed"] += 1
+                    INDEX_CHANGES.inc(kind="failed")
+                    logger.warning("drive_index.extract_failed", item_id=item["id"], error=f"{type(e).__name__}: {e}")
+                    # A parse failure is recorded against this cTag, so the file is retried only once it changes
+                    await asyncio.to_thread(self._store_content, user_id, item, None, f"error: {e}"[:200])
+                    return
+                except httpx.HTTPError as e:
+                    outcome["failed"] += 1
+                    INDEX_CHANGES.inc(kind="failed")
+                    # Throttling, timeouts and the like: nothing is recorded, so the next sync retries
+                    logger.warning("drive_index.download_failed", item_id=item["id"], error=f"{type(e).__name__}: {e}")
+                    return
+            outcome["extracted"] += 1
+            INDEX_CHANGES.inc(kind="extracted")
+            await asyncio.to_thread(self._store_content, user_id, item, result["text"][:self.max_chars], "ok")
+
+        await asyncio.gather(*(extract(item) for item in items))
+        return outcome["extracted"], outcome["failed"]
+
+    def _store_content(self, user_id: str, item: dict, text: Optional[str], status: str):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT rowid, ctag FROM items WHERE user_id = ? AND id = ?", (user_id, item["id"])).fetchone()
+            if row is None or row["ctag"] != item["ctag"]:
+                return # Deleted or changed again meanwhile; the next sync handles it
+            if text is not None:
+                self._db.execute("UPDATE documents SET content = ? WHERE rowid = ?", (text, row["rowid"]))
+            self._db.execute("UPDATE items SET content_ctag = ?, content_status = ? WHERE rowid = ?",
+                             (item["ctag"], status, row["rowid"]))
+
+    async def keep_synced(self, auth_handler: MicrosoftGraphAuth, user_ids: Iterable[str], interval: float = 300.0):
+        """
+        Syncs the given drives every `interval` seconds until cancelled; failures are logged and retried.
+        """
+        user_ids = list(user_ids)
+        while True:
+            for user_id in user_ids:
+                try:
+                    await self.sync(auth_handler, user_id)
+                except Exception as e: # Keep the loop alive; the next round retries
+                    logger.error("drive_index.sync_failed", user_id=user_id, error=f"{type(e).__name__}: {e}")
+            await asyncio.sleep(interval)
+
+    # --- queries ---
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM items WHERE user_id = ? AND name != ''", (user_id,)).fetchone()[0]
+
+    def tree(self, user_id: str, folder_path: str) -> Optional[list[dict[str, Any]]]:
+        """
+        Everything below `folder_path` ("" for the drive root), with paths relative to it, or None
+        when no such folder is indexed.
+
+        Returns:
+            [{"id", "path", "is_folder", "size", "ctag", "etag", "modified", "quick_xor"}]
+        """
+        folder_path = folder_path.strip("/")
+        with self._lock:
+            if folder_path:
+                folder = self._db.execute("SELECT id FROM items WHERE user_id = ? AND path = ? COLLATE NOCASE AND is_folder = 1",
+                                          (user_id, folder_path)).fetchone()
+                if folder is None:
+                    return None
+                folder_path = self._db.execute("SELECT path FROM items WHERE user_id = ? AND id = ?",
+                                               (user_id, folder["id"])).fetchone()["path"]
+            prefix = f"{folder_path}/" if folder_path else ""
+            rows = self._db.execute(
+                "SELECT id, path, is_folder, size, ctag, etag, modified, quick_xor FROM items "
+                "WHERE user_id = ? AND name != '' AND substr(path, 1, ?) = ?", (user_id, len(prefix), prefix)).fetchall()
+        return [{**dict(row), "path": row["path"][len(prefix):]} for row in rows]
+
+    def synced_at(self, user_id: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("SELECT synced_at FROM sync_state WHERE user_id = ?", (user_id,)).fetchone()
+        return row["synced_at"] if row else None
+
+    def search(self, user_id: str, query: str, limit: int = 10, file_type: Optional[str] = None) -> list[dict[str, Any]]:
+        """
+        Ranked matches for `query` among `user_id`'s files and folders.
+
+        Args:
+            user_id: Drive owner.
+            query: Free text; stop words are ignored, the last word also matches as a prefix.
+            limit: Maximum results.
+            file_type: Only files with this extension (e.g. "xlsx"), or "folder".
+
+        Returns:
+            [{"id", "name", "path", "type", "size", "last_modified_date_time", "web_url", "score", "snippet"}]
+        """
+        started = time.perf_counter()
+        words = [word for word in re.findall(r"\w+", query.lower()) if word not in STOP_WORDS]
+        if not words:
+            words = re.findall(r"\w+", query.lower())
+        if not words:
+            return []
+        conditions, arguments = ["i.user_id = ?"], [user_id]
+        if file_type:
+            if file_type.lower().strip(".") == "folder":
+                conditions.append("i.is_folder = 1")
+            else:
+                conditions.append("i.is_folder = 0 AND lower(i.name) LIKE ?")
+                arguments.append(f"%.{file_type.lower().strip('.')}")
+        sql = (
+            "SELECT i.id, i.name, i.path, i.is_folder, i.size, i.modified, i.web_url, "
+            f"bm25(documents, {NAME_WEIGHT}, {PATH_WEIGHT}, {CONTENT_WEIGHT}) AS score, "
+            "snippet(documents, 2, '[', ']', '…', 16) AS snippet "
+            "FROM documents JOIN items i ON i.rowid = documents.rowid "
+            f"WHERE documents MATCH ? AND {' AND '.join(conditions)} ORDER BY score LIMIT ?"
+        )
+        results: dict[str, dict] = {}
+        with self._lock:
+            passes = [("AND", "name"), ("AND", None)] + ([("OR", None)] if len(words) > 1 else [])
+            for operator, column in passes:
+                for row in self._db.execute(sql, (_match_query(words, operator, column), *arguments, limit)):
+                    results.setdefault(row["id"], {
+                        "id": row["id"],
+                        "name": row["name"],
+                        "path": row["path"],
+                        "type": "folder" if row["is_folder"] else "file",
+                        "size": row["size"],
+                        "last_modified_date_time": row["modified"],
+                        "web_url": row["web_url"],
+                        "score": round(-row["score"], 3), # bm25() is lower-is-better
+                        "snippet": row["snippet"] or None,
+                    })
+                if len(results) >= limit:
+                    break
+        INDEX_SEARCH_SECONDS.observe(time.perf_counter() - started)
+        return list(results.values())[:limit]
+
+
+_index: Optional[DriveIndex] = None
+_index_loaded = False
+
+
+def get_drive_index() -> Optional[DriveIndex]:
+    """
+    The process-wide DriveIndex from AGENT_DRIVE_INDEX, or None when the index is disabled.
+    """
+    global _index, _index_loaded
+    if not _index_loaded:
+        _index, _index_loaded = DriveIndex.from_env(), True
+    return _index
+
+
+def indexed_users() -> list[str]:
+    return [user.strip() for user in os.getenv("AGENT_DRIVE_INDEX_USERS", "").split(",") if user.strip()]
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import httpx
+
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+# Conditional requests for Microsoft Graph.
+#
+# Reading a file or email again transfers the whole payload again, even when nothing changed.
+# ConditionalTransport sits between the pooled Graph client and GraphTransport:
+#   - A GET response with a validator (ETag header, or the eTag/@odata.etag of a JSON entity) is
+#     stored on disk with its raw body. The next GET of the same URL sends If-None-Match. A 304
+#     is answered from the stored body, so only headers cross the network.
+#   - File and message content downloads (/content, /$value) pass through unstored unless
+#     AGENT_GRAPH_CACHE_CONTENT is on: sync, export and text extraction read each file once, and
+#     their bodies would evict the small metadata entries the cache is for. With it on, downloads
+#     that Graph redirects (302 to a pre-authenticated URL) are stored under the original Graph
+#     URL, which is what the next request asks for.
+#   - Every eTag seen for an entity, including the items of list responses, is remembered under
+#     the entity's canonical URL. A later PATCH, PUT or DELETE of that entity sends If-Match, so
+#     Graph rejects the change with 412 when someone else modified the entity in between (no lost
+#     updates). Tags older than `if_match_ttl` are not used: knowledge that old is no longer the
+#     agent's view of the entity.
+# Collections (folder listings, message lists) carry no validator on Graph and pass through
+# unchanged, though their items' eTags are recorded for If-Match.
+#
+# The store is shared by all users of the process. Keys contain the full URL, including the
+# mailbox/drive owner, so every cached body is only served for the same Graph resource.
+#
+# Configuration (environment):
+#     AGENT_GRAPH_CACHE           "memory", or a path to an SQLite file; unset disables the layer
+#     AGENT_GRAPH_CACHE_MB        Total size of stored bodies (default 500)
+#     AGENT_GRAPH_CACHE_ENTRY_MB  Largest body stored (default 10)
+#     AGENT_GRAPH_CACHE_CONTENT   "on" also stores file and message content downloads (default off)
+#     AGENT_GRAPH_IF_MATCH        "off" stops sending If-Match on updates and deletes
+#     AGENT_GRAPH_IF_MATCH_TTL    Seconds an eTag is used for If-Match (default 3600)
+
+CONDITIONAL_REQUESTS = REGISTRY.counter(
+    "graph_conditional_requests_total",
+    "Conditional Graph GETs by result (hit: 304 served from cache, changed: 200 replaced the entry).", ("result",))
+CONDITIONAL_BYTES_SAVED = REGISTRY.counter(
+    "graph_conditional_bytes_saved_total", "Response body bytes served from the ETag cache instead of the network.")
+PRECONDITIONS = REGISTRY.counter(
+    "graph_preconditions_total", "If-Match headers sent on Graph writes, by outcome (ok, failed).", ("result",))
+ETAG_CACHE_BYTES = REGISTRY.gauge(
+    "graph_etag_cache_bytes", "Bytes of response bodies held by the ETag cache.")
+
+VERSION_PREFIX = re.compile(r"^.*?/(v1\.0|beta)(?=/)")
+WRITE_METHODS = {"PATCH", "PUT", "DELETE"}
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+VARY_HEADERS = ("accept", "prefer") # Request headers that change the representation
+CONTENT_PATH = re.compile(r"(/content|/\$value)$") # Downloads of file or message content
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bodies (
+    key TEXT PRIMARY KEY, resource TEXT, etag TEXT, headers TEXT, body BLOB, size INTEGER, last_used REAL
+);
+CREATE INDEX IF NOT EXISTS bodies_resource ON bodies (resource);
+CREATE INDEX IF NOT EXISTS bodies_last_used ON bodies (last_used);
+CREATE TABLE IF NOT EXISTS etags (resource TEXT PRIMARY KEY, etag TEXT, seen REAL);
+"""
+
+logger = get_logger(__name__)
+
+
+def resource_key(url: httpx.URL) -> str:
+    """
+    The entity a Graph URL addresses: the path after /v1.0 without query or /content, lower-cased,
+    e.g. .../users/A@B.com/drive/items/01X/content -> /users/a@b.com/drive/items/01x.
+    """
+    path = VERSION_PREFIX.sub("", url.path).lower().rstrip("/")
+    path = re.sub(r":?/content$", "", path)
+    return path.rstrip(":")
+
+
+def _entity_aliases(resource: str, entity: dict) -> list[str]:
+    """
+    Canonical URLs of an entity returned under `resource`, so that e.g. an item listed through
+    /drive/root:/Reports:/children is found again when it is deleted through /drive/items/{id}.
+    """
+    entity_id = str(entity.get("id") or "").lower()
+    owner = re.match(r"^/(users/[^/]+|me)", resource)
+    if not entity_id or owner is None:
+        return []
+    prefix = f"/{owner.group(1)}"
+    if "/drive" in resource:
+        return [f"{prefix}/drive/items/{entity_id}"]
+    if "/events" in resource:
+        return [f"{prefix}/calendar/events/{entity_id}", f"{prefix}/events/{entity_id}"]
+    if "/messages" in resource:
+        return [f"{prefix}/messages/{entity_id}"]
+    return []
+
+
+def _entity_etag(entity: Any) -> Optional[str]:
+    if isinstance(entity, dict):
+        return entity.get("eTag") or entity.get("@odata.etag")
+    return None
+
+
+class ETagStore:
+    """
+    SQLite store of response bodies by request key and of the last eTag seen per entity.
+
+    Args:
+        path: SQLite file, or ":memory:".
+        max_bytes: Total body bytes kept; least recently used bodies are evicted beyond it.
+    """
+    def __init__(self, path: str = ":memory:", max_bytes: int = 500 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            if path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL") # A lost entry only costs a full download
+            self._db.executescript(SCHEMA)
+            self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+        ETAG_CACHE_BYTES.set(self._bytes)
+
+    def validator(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT etag FROM bodies WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, key: str) -> Optional[tuple[list, bytes]]:
+        """
+        (headers, raw body) stored under `key`, or None.
+        """
+        with self._lock, self._db:
+            row = self._db.execute("SELECT headers, body FROM bodies WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE bodies SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def save(self, key: str, resource: str, etag: str, headers: list, body: bytes):
+        with self._lock, self._db:
+            previous = self._db.execute("SELECT size FROM bodies WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO bodies (key, resource, etag, headers, body, size, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, resource, etag, json.dumps(headers), body, len(body), time.time()))
+            self._bytes += len(body) - (previous[0] if previous else 0)
+            while self._bytes > self.max_bytes:
+                oldest = self._db.execute("SELECT key, size FROM bodies ORDER BY last_used LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._db.execute("DELETE FROM bodies WHERE key = ?", (oldest[0],))
+                self._bytes -= oldest[1]
+        ETAG_CACHE_BYTES.set(self._bytes)
+
+    def remember(self, resources: list[str], etag: str):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO etags (resource, etag, seen) VALUES (?, ?, ?)",
+                                 [(resource, etag, now) for resource in resources])
+
+    def entity_etag(self, resource: str, max_age: float) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT etag, seen FROM etags WHERE resource = ?", (resource,)).fetchone()
+        if row is None or time.time() - row[1] > max_age:
+            return None
+        return row[0]
+
+    def forget(self, resource: str):
+        """
+        Drops the eTag and stored bodies of a deleted entity.
+        """
+        with self._lock, self._db:
+            freed = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies WHERE resource = ?", (resource,)).fetchone()[0]
+            self._db.execute("DELETE FROM bodies WHERE resource = ?", (resource,))
+            self._db.execute("DELETE FROM etags WHERE resource = ?", (resource,))
+            self._bytes -= freed
+        ETAG_CACHE_BYTES.set(self._bytes)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _decoded_json(headers: httpx.Headers, raw: bytes) -> Any:
+    if "json" not in headers.get("Content-Type", ""):
+        return None
+    try:
+        return httpx.Response(200, headers=headers, content=raw).json()
+    except (ValueError, httpx.DecodingError):
+        return None
+
+
+class ConditionalTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport adding If-None-Match / If-Match to Graph requests (see the module comment).
+
+    Args:
+        transport: The wrapped transport (GraphTransport).
+        store: Where bodies and eTags are kept.
+        max_entry_bytes: Larger responses are streamed through without being stored.
+        cache_content: Whether content downloads (/content, /$value) are stored too.
+        if_match: Whether writes carry If-Match.
+        if_match_ttl: Maximum age in seconds of an eTag used for If-Match.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport, store: ETagStore, max_entry_bytes: int = 10 * 1024 * 1024,
+                 if_match: bool = True, if_match_ttl: float = 3600.0, cache_content: bool = False):
+        self._transport = transport
+        self.store = store
+        self.max_entry_bytes = max_entry_bytes
+        self.cache_content = cache_content
+        self.if_match = if_match
+        self.if_match_ttl = if_match_ttl
+        self._redirects: dict[str, tuple[Optional[str], str, float]] = {} # Location -> (cache key or None, resource, expiry)
+
+    @classmethod
+    def from_env(cls, transport: httpx.AsyncBaseTransport) -> Optional["ConditionalTransport"]:
+        setting = os.getenv("AGENT_GRAPH_CACHE")
+        if not setting:
+            return None
+        store = ETagStore(":memory:" if setting == "memory" else setting,
+                          max_bytes=int(float(os.getenv("AGENT_GRAPH_CACHE_MB", "500")) * 1024 * 1024))
+        return cls(
+            transport, store,
+            max_entry_bytes=int(float(os.getenv("AGENT_GRAPH_CACHE_ENTRY_MB", "10")) * 1024 * 1024),
+            if_match=os.getenv("AGENT_GRAPH_IF_MATCH", "on").lower() not in ("0", "off", "false", "no"),
+            if_match_ttl=float(os.getenv("AGENT_GRAPH_IF_MATCH_TTL", "3600")),
+            cache_content=os.getenv("AGENT_GRAPH_CACHE_CONTENT", "off").lower() in ("1", "on", "true", "yes"),
+        )
+
+    @staticmethod
+    def _key(request: httpx.Request) -> str:
+        vary = "|".join(request.headers.get(name, "") for name in VARY_HEADERS)
+        return f"{request.url}|{vary}"
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        method = request.method
+        if method == "GET" and not any(name in request.headers for name in ("If-None-Match", "If-Match", "Range")):
+            redirect = self._redirects.pop(str(request.url), None)
+            if redirect is not None and redirect[2] > time.monotonic():
+                return await self._store_response(request, await self._transport.handle_async_request(request), redirect[0], redirect[1])
+            return await self._conditional_get(request)
+
+        if method in WRITE_METHODS and self.if_match and "If-Match" not in request.headers:
+            resource = resource_key(request.url)
+            etag = await asyncio.to_thread(self.store.entity_etag, resource, self.if_match_ttl)
+            if etag:
+                request.headers["If-Match"] = etag
+        response = await self._transport.handle_async_request(request)
+        if method in WRITE_METHODS and "If-Match" in request.headers:
+            PRECONDITIONS.inc(result="failed" if response.status_code == 412 else "ok")
+            if response.status_code == 412:
+                logger.info("graph.precondition_failed", method=method, resource=resource_key(request.url))
+        if method in WRITE_METHODS and response.status_code < 300:
+            return await self._after_write(request, response)
+        return response
+
+    async def _conditional_get(self, request: httpx.Request) -> httpx.Response:
+        key: Optional[str] = self._key(request)
+        resource = resource_key(request.url)
+        if not self.cache_content and CONTENT_PATH.search(request.url.path):
+            key = None # Passed through; only the item's eTag is remembered
+        etag = await asyncio.to_thread(self.store.validator, key) if key else None
+        if etag:
+            request.headers["If-None-Match"] = etag
+        response = await self._transport.handle_async_request(request)
+
+        if response.status_code == 304 and etag:
+            cached = await asyncio.to_thread(self.store.load, key)
+            if cached is not None:
+                await response.aclose()
+                headers, body = cached
+                CONDITIONAL_REQUESTS.inc(result="hit")
+                CONDITIONAL_BYTES_SAVED.inc(len(body))
+                return httpx.Response(200, headers=headers + [("x-graph-cache", "hit")],
+                                      stream=httpx.ByteStream(body), request=request, extensions=response.extensions)
+            # Evicted meanwhile: ask again without the condition
+            del request.headers["If-None-Match"]
+            await response.aclose()
+            response = await self._transport.handle_async_request(request)
+
+        if response.status_code in REDIRECT_STATUS and "Location" in response.headers:
+            # The body comes from the redirect target; store it under this URL (see handle_async_request)
+            location = str(request.url.join(response.headers["Location"]))
+            self._redirects[location] = (key, resource, time.monotonic() + 60.0)
+            if len(self._redirects) > 1000:
+                now = time.monotonic()
+                self._redirects = {url: entry for url, entry in self._redirects.items() if entry[2] > now}
+            return response
+        if etag and response.status_code == 200:
+            CONDITIONAL_REQUESTS.inc(result="changed")
+        return await self._store_response(request, response, key, resource)
+
+    async def _store_response(self, request: httpx.Request, response: httpx.Response, key: Optional[str], resource: str) -> httpx.Response:
+        if key is None: # Not stored (a content download)
+            if response.status_code == 200 and "ETag" in response.headers:
+                await asyncio.to_thread(self.store.remember, [resource], response.headers["ETag"])
+            return response
+        length = response.headers.get("Content-Length")
+        if response.status_code != 200 or (length is not None and int(length) > self.max_entry_bytes):
+            return response
+        buffer = bytearray()
+        async for chunk in response.stream:
+            buffer += chunk
+            if len(buffer) > self.max_entry_bytes: # No Content-Length and too big: pass the rest through
+                return httpx.Response(response.status_code, headers=response.headers,
+                                      stream=_PrefixedStream(bytes(buffer), response), request=request,
+                                      extensions=response.extensions)
+        await response.aclose()
+        raw = bytes(buffer)
+
+        body = _decoded_json(response.headers, raw)
+        etag = response.headers.get("ETag") or _entity_etag(body)
+        if etag:
+            headers = [(name, value) for name, value in response.headers.multi_items()]
+            await asyncio.to_thread(self.store.save, key, resource, etag, headers, raw)
+        if "ETag" in response.headers and not isinstance(body, dict): # File content: the tag is the item's
+            await asyncio.to_thread(self.store.remember, [resource], response.headers["ETag"])
+        await self._remember_entities(resource, body)
+        return httpx.Response(response.status_code, headers=response.headers, stream=httpx.ByteStream(raw),
+                              request=request, extensions=response.extensions)
+
+    async def _remember_entities(self, resource: str, body: Any):
+        if not isinstance(body, dict):
+            return
+        pending: list[tuple[list[str], str]] = []
+        if isinstance(body.get("value"), list): # A collection: remember each item
+            for entity in body["value"]:
+                etag = _entity_etag(entity)
+                if etag:
+                    pending.append((_entity_aliases(resource, entity), etag))
+        else:
+            etag = _entity_etag(body)
+            if etag:
+                pending.append(([resource, *_entity_aliases(resource, body)], etag))
+        for resources, etag in pending:
+            if resources:
+                await asyncio.to_thread(self.store.remember, resources, etag)
+
+    async def _after_write(self, request: httpx.Request, response: httpx.Response) -> httpx.Response:
+        resource = resource_key(request.url)
+        if request.method == "DELETE":
+            await asyncio.to_thread(self.store.forget, resource)
+            return response
+        if "json" not in response.headers.get("Content-Type", "") or int(response.headers.get("Content-Length") or 0) > 1024 * 1024:
+            return response
+        raw = b"".join([chunk async for chunk in response.stream])
+        await response.aclose()
+        await self._remember_entities(resource, _decoded_json(response.headers, raw)) # The entity's new eTag
+        return httpx.Response(response.status_code, headers=response.headers, stream=httpx.ByteStream(raw),
+                              request=request, extensions=response.extensions)
+
+    async def aclose(self):
+        await self._transport.aclose()
+        self.store.close()
+
+
+class _PrefixedStream(httpx.AsyncByteStream):
+    """
+    Replays the bytes already read from a response, then streams the rest of it.
+    """
+    def __init__(self, prefix: bytes, response: httpx.Response):
+        self._prefix = prefix
+        self._response = response
+
+    async def __aiter__(self):
+        yield self._prefix
+        async for chunk in self._response.stream:
+            yield chunk
+
+    async def aclose(self):
+        await self._response.aclose()
@@ -0,0 +1,225 @@
+import asyncio
+import contextlib
+import re
+import time
+from typing import Optional
+
+import httpx
+
+from microsoft_graph.etag_cache import ConditionalTransport
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.tracing import Span, tracer
+
+# Shared HTTP plumbing for all direct Microsoft Graph calls.
+#
+# Every Graph helper gets its client through `graph_client()`. It hands out one pooled
+# client per event loop, so TLS connections to Graph are reused across calls (and can be
+# opened ahead of time by `warm_up_connection()`). Its transport records a span and metrics
+# for each request (latency, status, retries, payload bytes) and retries throttled (429)
+# and transiently unavailable responses. With AGENT_GRAPH_CACHE set, the pooled client also
+# makes conditional requests (If-None-Match / If-Match, see etag_cache.py).
+
+GRAPH_REQUEST_SECONDS = REGISTRY.histogram(
+    "graph_request_duration_seconds", "Latency of Microsoft Graph HTTP requests, including retries and body transfer.",
+    ("method", "route", "status"))
+GRAPH_REQUESTS = REGISTRY.counter(
+    "graph_requests_total", "Microsoft Graph HTTP requests by final status.", ("method", "route", "status"))
+GRAPH_RETRIES = REGISTRY.counter(
+    "graph_request_retries_total", "Microsoft Graph request attempts that were retried.", ("method", "route", "reason"))
+GRAPH_BYTES = REGISTRY.counter(
+    "graph_payload_bytes_total", "Microsoft Graph payload bytes by direction.", ("method", "route", "direction"))
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+MAX_RETRY_AFTER_SECONDS = 30.0
+
+logger = get_logger(__name__)
+
+# Path templating keeps metric label cardinality bounded (no ids, paths or mailboxes in labels).
+_ROUTE_PATTERNS = [
+    (re.compile(r"root:/[^:]*:"), "root:{path}:"),
+    (re.compile(r"root:/.*$"), "root:{path}"),
+    (re.compile(r"/(users|messages|events|items|mailFolders|drives|sites|groups)/[^/]+"), r"/\1/{id}"),
+    (re.compile(r"/children/[^/]+/content$"), "/children/{name}/content"),
+]
+
+
+def route_template(url: httpx.URL) -> str:
+    """
+    Reduces a Graph URL to a low-cardinality route, e.g.
+    /v1.0/users/a@b.com/messages/AAMk... -> /users/{id}/messages/{id}
+    """
+    path = re.sub(r"^.*?/(v1\.0|beta)(?=/|$)", "", url.path)
+    for pattern, replacement in _ROUTE_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path or "/"
+
+
+def _retry_delay(response: httpx.Response, attempt: int, backoff: float) -> float:
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+        except ValueError:
+            pass
+    return min(backoff * (2 ** attempt), MAX_RETRY_AFTER_SECONDS)
+
+
+class _MeasuredStream(httpx.AsyncByteStream):
+    """
+    Wraps a response body so the span and metrics are finished when the body has been
+    consumed, not when the headers arrive. Streaming downloads stay streaming.
+    """
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self.bytes_received = 0
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self.bytes_received += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close(self.bytes_received)
+
+
+class GraphTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that traces, measures and retries Microsoft Graph requests.
+
+    Args:
+        transport: The underlying transport; defaults to a plain AsyncHTTPTransport.
+        max_retries: How many times a retryable response is retried. Throttling (429) is retried for
+                     every method; 5xx only for idempotent methods, so writes are never duplicated.
+        backoff: Base delay in seconds for exponential backoff when no Retry-After header is sent.
+    """
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None, max_retries: int = 3, backoff: float = 0.5):
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        method = request.method
+        route = route_template(request.url)
+        bytes_sent = int(request.headers.get("Content-Length") or 0)
+        span = tracer.start_span("graph.request", kind="client", method=method, route=route, bytes_sent=bytes_sent)
+        started = time.perf_counter()
+        retries = 0
+
+        try:
+            while True:
+                response = await self._transport.handle_async_request(request)
+                retryable = response.status_code in RETRYABLE_STATUS and (
+                    response.status_code == 429 or method in IDEMPOTENT_METHODS)
+                if not retryable or retries >= self.max_retries:
+                    break
+                delay = _retry_delay(response, retries, self.backoff)
+                await response.aclose()
+                GRAPH_RETRIES.inc(method=method, route=route, reason=str(response.status_code))
+                logger.warning("graph.retry", method=method, route=route, status=response.status_code,
+                               attempt=retries + 1, delay_s=delay)
+                retries += 1
+                await asyncio.sleep(delay)
+        except Exception as e:
+            span.fail(e).set(retries=retries)
+            span.finish()
+            self._record(span, method, route, "exception", started, bytes_sent, 0)
+            raise
+
+        span.set(status_code=response.status_code, retries=retries)
+        if response.status_code >= 400:
+            span.status = "error"
+
+        def finish(bytes_received: int):
+            span.set(bytes_received=bytes_received)
+            span.finish()
+            self._record(span, method, route, str(response.status_code), started, bytes_sent, bytes_received)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_MeasuredStream(response.stream, finish),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    @staticmethod
+    def _record(span: Span, method: str, route: str, status: str, started: float, bytes_sent: int, bytes_received: int):
+        GRAPH_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route, status=status)
+        GRAPH_REQUESTS.inc(method=method, route=route, status=status)
+        if bytes_sent:
+            GRAPH_BYTES.inc(bytes_sent, method=method, route=route, direction="sent")
+        if bytes_received:
+            GRAPH_BYTES.inc(bytes_received, method=method, route=route, direction="received")
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+GRAPH_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+GRAPH_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+# One pooled client per event loop; httpx clients cannot be shared across loops.
+_shared_client: Optional[httpx.AsyncClient] = None
+_shared_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_shared_graph_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled, traced httpx.AsyncClient for the running event loop, creating it on first use.
+    """
+    global _shared_client, _shared_client_loop
+    loop = asyncio.get_running_loop()
+    if _shared_client is None or _shared_client.is_closed or _shared_client_loop is not loop:
+        transport = GraphTransport(httpx.AsyncHTTPTransport(limits=GRAPH_POOL_LIMITS))
+        transport = ConditionalTransport.from_env(transport) or transport
+        # Graph answers /content downloads with a 302 to a pre-authenticated URL
+        _shared_client = httpx.AsyncClient(transport=transport, timeout=GRAPH_TIMEOUT, follow_redirects=True)
+        _shared_client_loop = loop
+    return _shared_client
+
+
+async def close_shared_graph_client():
+    """
+    Closes the pooled client (e.g. on shutdown); the next call creates a fresh one.
+    """
+    global _shared_client, _shared_client_loop
+    if _shared_client is not None:
+        await _shared_client.aclose()
+    _shared_client = None
+    _shared_client_loop = None
+
+
+@contextlib.asynccontextmanager
+async def graph_client(**kwargs):
+    """
+    Yields an httpx.AsyncClient for Microsoft Graph whose requests are traced and measured.
+    Use it like httpx.AsyncClient: `async with graph_client() as client: ...`
+
+    Without arguments this is the shared pooled client, which stays open after the block.
+    With arguments (e.g. a custom transport) a dedicated client is created and closed afterwards.
+    """
+    if not kwargs:
+        yield get_shared_graph_client()
+        return
+    kwargs.setdefault("transport", GraphTransport())
+    async with httpx.AsyncClient(**kwargs) as client:
+        yield client
+
+
+async def warm_up_connection(base_graph_url: str):
+    """
+    Opens a pooled connection to the Graph host ahead of the first real request
+    (DNS, TCP and TLS handshakes). The response itself is irrelevant.
+    """
+    client = get_shared_graph_client()
+    response = await client.head(base_graph_url.rstrip("/") + "/")
+    await response.aclose()
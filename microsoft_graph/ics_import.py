@@ -0,0 +1,690 @@
+import asyncio
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterable, Optional, Union
+from urllib.parse import quote
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.batch import MAX_BATCH_REQUESTS, graph_batch
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+# Import of iCalendar (.ics) files into an Outlook calendar.
+#
+# The file is parsed incrementally (IcsParser is fed one line at a time), so only the event
+# being read is held in memory, whatever the size of the file. Each VEVENT is mapped to a Graph
+# event payload:
+#   - DTSTART/DTEND (or DURATION), with TZID, UTC ("Z"), floating (default_timezone) and all-day
+#     (VALUE=DATE) times. TZIDs are resolved to IANA or Windows names, including the vendor forms
+#     ("/mozilla.org/.../Europe/Berlin") and VTIMEZONE X-LIC-LOCATION.
+#   - RRULE to a patternedRecurrence (daily, weekly, absolute/relative monthly and yearly; COUNT,
+#     UNTIL or no end). EXDATEs cancel the matching occurrences after the series is created; an
+#     EXDATE in another zone than DTSTART (typically UTC) is converted to the series' zone first,
+#     and EXDATEs that match no occurrence are reported.
+#   - SUMMARY, DESCRIPTION, LOCATION, CATEGORIES, CLASS, TRANSP and the first VALARM reminder.
+#     Attendees only with include_attendees: creating an event with attendees sends them
+#     invitations, which a migration rarely wants.
+# Rules Graph cannot express (BYHOUR, hourly frequencies, several ordinals...) and modified
+# occurrences (RECURRENCE-ID) are reported as unsupported instead of being imported wrongly.
+#
+# Events are deduplicated by UID. The UID is stored on each created event as a single-value
+# extended property (UID_PROPERTY), and events whose UID is already in the calendar, or appeared
+# earlier in the file, are skipped, so an import can be run again safely.
+#
+# Events are handled in windows of WINDOW_ROUNDS full rounds of `concurrency` batches (80 events
+# by default). For each window, batched lookups find the UIDs already imported and batched POSTs
+# create the rest (batch.py), 20 per request. Exchange runs at most four concurrent requests per
+# mailbox, so only `concurrency` batches (default 2) are in flight at once. Parsing the next
+# window overlaps with sending the current one.
+
+UID_PROPERTY = "String {00020329-0000-0000-C000-000000000046} Name ImportedICalUid" # PS_PUBLIC_STRINGS
+WINDOW_ROUNDS = 2
+REPORT_ERRORS = 20
+READ_CHUNK_CHARS = 1024 * 1024
+
+DAYS = {"MO": "monday", "TU": "tuesday", "WE": "wednesday", "TH": "thursday", "FR": "friday", "SA": "saturday", "SU": "sunday"}
+WEEKDAYS = list(DAYS.values())
+INDEXES = {1: "first", 2: "second", 3: "third", 4: "fourth", -1: "last"}
+UNSUPPORTED_RULE_PARTS = {"BYHOUR", "BYMINUTE", "BYSECOND", "BYWEEKNO", "BYYEARDAY"}
+SENSITIVITY = {"PRIVATE": "private", "CONFIDENTIAL": "confidential"}
+ATTENDEE_TYPES = {"OPT-PARTICIPANT": "optional", "NON-PARTICIPANT": "optional"}
+_DURATION = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+_IANA_SUFFIX = re.compile(r"([A-Z][A-Za-z_]+(?:/[A-Za-z0-9_+\-]+){1,2})$")
+
+ICS_EVENTS = REGISTRY.counter(
+    "ics_import_events_total", "Events read by ICS imports, by result.", ("result",))
+ICS_SECONDS = REGISTRY.histogram(
+    "ics_import_duration_seconds", "Duration of ICS imports.")
+
+logger = get_logger(__name__)
+
+
+class UnsupportedEvent(ValueError):
+    """
+    Raised when a VEVENT uses something Graph events cannot represent.
+    """
+
+
+# --- parsing ---
+def _unescape(value: str) -> str:
+    return re.sub(r"\\([\\;,nN])", lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def _split_unquoted(text: str, separator: str, limit: int = -1) -> list[str]:
+    parts, current, quoted = [], [], False
+    for character in text:
+        if character == '"':
+            quoted = not quoted
+        if character == separator and not quoted and limit != 0:
+            parts.append("".join(current))
+            current = []
+            limit -= 1
+        else:
+            current.append(character)
+    parts.append("".join(current))
+    return parts
+
+
+def parse_content_line(line: str) -> tuple[str, dict[str, str], str]:
+    """
+    Splits `NAME;PARAM=VALUE;...:value` into (NAME, {PARAM: VALUE}, value).
+    """
+    head, value = (_split_unquoted(line, ":", 1) + [""])[:2]
+    name, *params = _split_unquoted(head, ";")
+    parsed = {}
+    for param in params:
+        key, _, param_value = param.partition("=")
+        parsed[key.upper()] = param_value.strip('"')
+    return name.upper(), parsed, value
+
+
+class IcsParser:
+    """
+    Incremental iCalendar parser: `feed()` takes raw lines and returns the VEVENT and VTIMEZONE
+    components completed by them, as {"name", "props": [(NAME, params, value)], "children"}.
+    """
+    def __init__(self):
+        self._pending: Optional[str] = None
+        self._stack: list[dict] = []
+
+    def feed(self, raw_line: str) -> list[dict]:
+        line = raw_line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and self._pending is not None: # Folded continuation
+            self._pending += line[1:]
+            return []
+        completed = self._line(self._pending) if self._pending else []
+        self._pending = line
+        return completed
+
+    def close(self) -> list[dict]:
+        completed = self._line(self._pending) if self._pending else []
+        self._pending = None
+        return completed
+
+    def _line(self, line: str) -> list[dict]:
+        name, params, value = parse_content_line(line)
+        if name == "BEGIN":
+            self._stack.append({"name": value.upper(), "props": [], "children": []})
+        elif name == "END":
+            if not self._stack:
+                return []
+            component = self._stack.pop()
+            if self._stack:
+                self._stack[-1]["children"].append(component)
+                if component["name"] in ("VEVENT", "VTIMEZONE") and self._stack[-1]["name"] == "VCALENDAR":
+                    self._stack[-1]["children"].pop() # Handed out, not kept
+                    return [component]
+        elif self._stack:
+            self._stack[-1]["props"].append((name, params, value))
+        return []
+
+
+def _first(component: dict, name: str) -> Optional[tuple[str, dict, str]]:
+    return next((prop for prop in component["props"] if prop[0] == name), None)
+
+
+def _all(component: dict, name: str) -> list[tuple[str, dict, str]]:
+    return [prop for prop in component["props"] if prop[0] == name]
+
+
+# --- mapping ---
+def _parse_duration(value: str) -> timedelta:
+    match = _DURATION.match(value.strip())
+    if match is None:
+        raise UnsupportedEvent(f"invalid DURATION {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+
+def _parse_value(value: str, params: dict) -> Union[date, datetime]:
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value, "%Y%m%d").date()
+    return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+
+
+@lru_cache(maxsize=1)
+def _have_tz_database() -> bool:
+    return bool(available_timezones())
+
+
+class TimeZones:
+    """
+    Resolves TZIDs to time zone names Graph accepts (IANA or Windows), using the VTIMEZONE
+    components seen so far.
+    """
+    def __init__(self, default: str):
+        self.default = default
+        self._locations: dict[str, str] = {}
+        self._cache: dict[str, Optional[str]] = {}
+
+    def add(self, component: dict):
+        tzid, location = _first(component, "TZID"), _first(component, "X-LIC-LOCATION")
+        if tzid and location:
+            self._locations[tzid[2]] = location[2]
+
+    @staticmethod
+    def _is_iana(name: str) -> bool:
+        try:
+            ZoneInfo(name)
+            return True
+        except (ZoneInfoNotFoundError, ValueError):
+            # Without a tz database (Windows without tzdata), trust the Area/City shape; Graph validates
+            return not _have_tz_database() and bool(_IANA_SUFFIX.fullmatch(name))
+
+    def resolve(self, tzid: str) -> str:
+        if tzid not in self._cache:
+            name = tzid.strip().strip('"')
+            candidates = [name, self._locations.get(name, "")]
+            suffix = _IANA_SUFFIX.search(name)
+            if suffix:
+                candidates.append(suffix.group(1))
+            if name.upper() in ("UTC", "GMT", "Z", "ETC/UTC"):
+                resolved = "UTC"
+            elif name.endswith(" Standard Time"): # A Windows time zone name, as Outlook exports them
+                resolved = name
+            else:
+                resolved = next((candidate for candidate in candidates if candidate and self._is_iana(candidate)), None)
+            self._cache[tzid] = resolved
+        if self._cache[tzid] is None:
+            raise UnsupportedEvent(f"unknown time zone {tzid!r}")
+        return self._cache[tzid]
+
+    def of(self, params: dict, value: str) -> str:
+        if value.strip().endswith("Z"):
+            return "UTC"
+        return self.resolve(params["TZID"]) if "TZID" in params else self.default
+
+
+def _zone_info(name: str) -> Optional[Union[ZoneInfo, timezone]]:
+    if name == "UTC":
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None # e.g. a Windows name; Graph converts those itself
+
+
+def _convert(moment: datetime, from_zone: str, to_zone: str) -> Optional[datetime]:
+    """
+    The wall time `moment` in `from_zone` as a wall time in `to_zone`, or None if either zone is unknown locally.
+    """
+    source, target = _zone_info(from_zone), _zone_info(to_zone)
+    if source is None or target is None:
+        return None
+    return moment.replace(tzinfo=source).astimezone(target).replace(tzinfo=None)
+
+
+def _exdate(moment: Union[date, datetime], moment_zone: str, series_zone: str) -> tuple[str, str]:
+    """
+    An EXDATE as (start prefix of the occurrence to cancel, time zone of that prefix). Times are
+    converted to the series' zone where zoneinfo knows both zones; otherwise they stay in their
+    own zone, and the occurrences are requested in that zone.
+    """
+    if not isinstance(moment, datetime):
+        return moment.strftime("%Y-%m-%d"), series_zone
+    if moment_zone != series_zone:
+        converted = _convert(moment, moment_zone, series_zone)
+        if converted is not None:
+            moment, moment_zone = converted, series_zone
+    return moment.strftime("%Y-%m-%dT%H:%M"), moment_zone
+
+
+def _graph_time(moment: Union[date, datetime], zone: str) -> dict:
+    if not isinstance(moment, datetime):
+        moment = datetime(moment.year, moment.month, moment.day)
+    return {"dateTime": moment.strftime("%Y-%m-%dT%H:%M:%S"), "timeZone": zone}
+
+
+def _by_day(token: str) -> tuple[Optional[int], str]:
+    match = re.fullmatch(r"([+-]?\d{1,2})?(MO|TU|WE|TH|FR|SA|SU)", token.strip().upper())
+    if match is None:
+        raise UnsupportedEvent(f"invalid BYDAY {token!r}")
+    return (int(match.group(1)) if match.group(1) else None), DAYS[match.group(2)]
+
+
+def rrule_to_recurrence(rule: str, start: Union[date, datetime], zone: str) -> dict:
+    """
+    Maps an RRULE to a Graph patternedRecurrence; raises UnsupportedEvent for rules Graph cannot express.
+    """
+    parts = {}
+    for part in rule.split(";"):
+        key, _, value = part.partition("=")
+        if key:
+            parts[key.upper()] = value.upper()
+    unsupported = UNSUPPORTED_RULE_PARTS & set(parts)
+    if unsupported:
+        raise UnsupportedEvent(f"RRULE uses {', '.join(sorted(unsupported))}")
+    frequency = parts.get("FREQ")
+    interval = int(parts.get("INTERVAL", "1"))
+    start_day = start if not isinstance(start, datetime) else start.date()
+    by_day = [_by_day(token) for token in parts["BYDAY"].split(",")] if parts.get("BYDAY") else []
+    if "BYSETPOS" in parts:
+        if any(ordinal is not None for ordinal, _ in by_day) or "," in parts["BYSETPOS"]:
+            raise UnsupportedEvent("RRULE combines BYSETPOS with ordinals or several positions")
+        by_day = [(int(parts["BYSETPOS"]), day) for _, day in by_day]
+    month_days = parts["BYMONTHDAY"].split(",") if parts.get("BYMONTHDAY") else []
+    months = parts["BYMONTH"].split(",") if parts.get("BYMONTH") else []
+    if len(month_days) > 1 or len(months) > 1:
+        raise UnsupportedEvent("RRULE has several BYMONTHDAY or BYMONTH values")
+
+    def relative() -> dict:
+        ordinals = {ordinal for ordinal, _ in by_day}
+        if len(ordinals) != 1 or next(iter(ordinals)) not in INDEXES:
+            raise UnsupportedEvent("RRULE mixes or uses unsupported BYDAY ordinals")
+        return {"daysOfWeek": [day for _, day in by_day], "index": INDEXES[next(iter(ordinals))]}
+
+    if frequency == "DAILY":
+        if by_day:
+            if interval != 1 or any(ordinal is not None for ordinal, _ in by_day):
+                raise UnsupportedEvent("daily RRULE with BYDAY and an interval")
+            pattern = {"type": "weekly", "interval": 1, "daysOfWeek": [day for _, day in by_day]}
+        else:
+            pattern = {"type": "daily", "interval": interval}
+    elif frequency == "WEEKLY":
+        days = [day for _, day in by_day] or [WEEKDAYS[start_day.weekday()]]
+        pattern = {"type": "weekly", "interval": interval, "daysOfWeek": days,
+                   "firstDayOfWeek": DAYS.get(parts.get("WKST", "MO"), "monday")}
+    elif frequency in ("MONTHLY", "YEARLY"):
+        kind = "Monthly" if frequency == "MONTHLY" else "Yearly"
+        if by_day:
+            pattern = {"type": f"relative{kind}", "interval": interval, **relative()}
+        else:
+            pattern = {"type": f"absolute{kind}", "interval": interval,
+                       "dayOfMonth": int(month_days[0]) if month_days else start_day.day}
+            if pattern["dayOfMonth"] < 1:
+                raise UnsupportedEvent("RRULE counts BYMONTHDAY from the end of the month")
+        if frequency == "YEARLY":
+            pattern["month"] = int(months[0]) if months else start_day.month
+    else:
+        raise UnsupportedEvent(f"RRULE frequency {frequency or 'missing'} is not supported")
+
+    recurrence_range = {"type": "noEnd", "startDate": start_day.isoformat(), "recurrenceTimeZone": zone}
+    if "COUNT" in parts:
+        recurrence_range.update(type="numbered", numberOfOccurrences=int(parts["COUNT"]))
+    elif "UNTIL" in parts:
+        until = _parse_value(parts["UNTIL"], {})
+        recurrence_range.update(type="endDate", endDate=(until.date() if isinstance(until, datetime) else until).isoformat())
+    return {"pattern": pattern, "range": recurrence_range}
+
+
+def _reminder_minutes(component: dict) -> Optional[int]:
+    for alarm in component["children"]:
+        trigger = _first(alarm, "TRIGGER") if alarm["name"] == "VALARM" else None
+        if trigger and trigger[1].get("VALUE", "DURATION") == "DURATION" and trigger[1].get("RELATED", "START") == "START":
+            try:
+                before = -_parse_duration(trigger[2])
+            except UnsupportedEvent:
+                continue
+            if before >= timedelta(0):
+                return int(before.total_seconds() // 60)
+    return None
+
+
+def vevent_to_event(component: dict, zones: TimeZones, include_attendees: bool = False) -> dict[str, Any]:
+    """
+    Maps a VEVENT to {"uid", "payload" (the Graph event), "exdates" [(start prefix, timeZone)]}.
+    """
+    uid = _first(component, "UID")
+    dtstart = _first(component, "DTSTART")
+    if uid is None or dtstart is None:
+        raise UnsupportedEvent("VEVENT without UID or DTSTART")
+    if _first(component, "RECURRENCE-ID"):
+        raise UnsupportedEvent("modified occurrence (RECURRENCE-ID) of a recurring event")
+    start = _parse_value(dtstart[2], dtstart[1])
+    all_day = not isinstance(start, datetime)
+    zone = zones.default if all_day else zones.of(dtstart[1], dtstart[2])
+
+    dtend, duration = _first(component, "DTEND"), _first(component, "DURATION")
+    if dtend:
+        end = _parse_value(dtend[2], dtend[1])
+        end_zone = zone if all_day else zones.of(dtend[1], dtend[2])
+    else:
+        end = start + (_parse_duration(duration[2]) if duration else (timedelta(days=1) if all_day else timedelta(0)))
+        end_zone = zone
+    if all_day and isinstance(end, datetime):
+        end = end.date()
+
+    summary = _first(component, "SUMMARY")
+    payload: dict[str, Any] = {
+        "subject": _unescape(summary[2]) if summary else "(no title)",
+        "start": _graph_time(start, zone),
+        "end": _graph_time(end, end_zone),
+        "isAllDay": all_day,
+        "singleValueExtendedProperties": [{"id": UID_PROPERTY, "value": uid[2]}],
+    }
+    description, location = _first(component, "DESCRIPTION"), _first(component, "LOCATION")
+    if description:
+        payload["body"] = {"contentType": "text", "content": _unescape(description[2])}
+    if location:
+        payload["location"] = {"displayName": _unescape(location[2])}
+    categories = [_unescape(value) for prop in _all(component, "CATEGORIES") for value in _split_unquoted(prop[2], ",") if value]
+    if categories:
+        payload["categories"] = categories
+    sensitivity = _first(component, "CLASS")
+    if sensitivity and sensitivity[2].upper() in SENSITIVITY:
+        payload["sensitivity"] = SENSITIVITY[sensitivity[2].upper()]
+    transparency = _first(component, "TRANSP")
+    if transparency and transparency[2].upper() == "TRANSPARENT":
+        payload["showAs"] = "free"
+    reminder = _reminder_minutes(component)
+    if reminder is not None:
+        payload.update(isReminderOn=True, reminderMinutesBeforeStart=reminder)
+    if include_attendees:
+        attendees = []
+        for _, params, value in _all(component, "ATTENDEE"):
+            address = re.sub(r"^mailto:", "", value, flags=re.IGNORECASE).strip()
+            if "@" in address:
+                kind = "resource" if params.get("CUTYPE") in ("RESOURCE", "ROOM") else ATTENDEE_TYPES.get(params.get("ROLE", ""), "required")
+                attendees.append({"emailAddress": {"address": address, **({"name": params["CN"]} if params.get("CN") else {})},
+                                  "type": kind})
+        if attendees:
+            payload["attendees"] = attendees
+
+    exdates = []
+    rrule = _first(component, "RRULE")
+    if rrule:
+        payload["recurrence"] = rrule_to_recurrence(rrule[2], start, zone)
+        for _, params, value in _all(component, "EXDATE"):
+            for single in value.split(","):
+                if single.strip():
+                    moment = _parse_value(single, params)
+                    exdates.append(_exdate(moment, zone if all_day else zones.of(params, single), zone))
+    return {"uid": uid[2], "payload": payload, "exdates": exdates}
+
+
+# --- import ---
+async def _file_chunks(path: str) -> AsyncIterator[str]:
+    with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as file:
+        while True:
+            chunk = await asyncio.to_thread(file.read, READ_CHUNK_CHARS)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def _lines(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Content lines of a chunked stream. Lines end at "\n" only (CRLF, or a bare LF); a "\r" at the
+    end of a chunk stays with its line, and U+2028 and friends are text, unlike with splitlines().
+    """
+    remainder = ""
+    async for chunk in chunks:
+        lines = (remainder + chunk).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if remainder:
+        yield remainder
+
+
+def _error_message(response: dict) -> str:
+    body = response["body"] if isinstance(response["body"], dict) else {}
+    return (body.get("error") or {}).get("message") or f"HTTP {response['status']}"
+
+
+def _odata_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class IcsImport:
+    """
+    One import of an ICS stream into a calendar.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName of the calendar owner.
+        calendar_id: The calendar to import into (default: the user's main calendar).
+        default_timezone: Time zone of floating times and all-day events.
+        include_attendees: Add the ATTENDEEs (Outlook then sends them invitations).
+        dry_run: Parse, map and deduplicate, but create nothing.
+        concurrency: $batch requests in flight at once.
+    """
+    def __init__(
+        self,
+        auth_handler: MicrosoftGraphAuth,
+        user_id: str,
+        calendar_id: Optional[str] = None,
+        default_timezone: str = "UTC",
+        include_attendees: bool = False,
+        dry_run: bool = False,
+        concurrency: int = 2
+    ):
+        self.auth_handler = auth_handler
+        self.user_id = user_id
+        self.include_attendees = include_attendees
+        self.dry_run = dry_run
+        self.concurrency = max(1, concurrency)
+        self.window = MAX_BATCH_REQUESTS * self.concurrency * WINDOW_ROUNDS
+        self.zones = TimeZones(default_timezone)
+        calendar = f"calendars/{quote(calendar_id)}" if calendar_id else "calendar"
+        self._events_url = f"/users/{quote(user_id)}/{calendar}/events"
+        self._parser = IcsParser()
+        self._seen: set[str] = set()
+        self.counts = {"parsed": 0, "created": 0, "existing": 0, "duplicate": 0, "unsupported": 0, "failed": 0,
+                       "occurrences_cancelled": 0, "exdates_unmatched": 0}
+        self.errors: list[dict] = []
+
+    async def run(self, chunks: AsyncIterator[str]) -> dict[str, Any]:
+        """
+        Imports the ICS text yielded by `chunks` and returns the report.
+        """
+        started = time.perf_counter()
+        lines = _lines(chunks).__aiter__()
+        pending = asyncio.create_task(self._next_window(lines))
+        try:
+            while True:
+                window = await pending
+                if not window:
+                    break
+                pending = asyncio.create_task(self._next_window(lines)) # Parse ahead while this window is sent
+                await self._import_window(window)
+        finally:
+            pending.cancel()
+        seconds = time.perf_counter() - started
+        ICS_SECONDS.observe(seconds)
+        return self._report(seconds)
+
+    async def _next_window(self, lines: AsyncIterator[str]) -> list[dict]:
+        parser = self._parser
+        window: list[dict] = []
+        while len(window) < self.window:
+            try:
+                line = await lines.__anext__()
+                components = parser.feed(line)
+            except StopAsyncIteration:
+                components = parser.close()
+                window.extend(self._map(components))
+                break
+            window.extend(self._map(components))
+        return window
+
+    def _map(self, components: list[dict]) -> list[dict]:
+        events = []
+        for component in components:
+            if component["name"] == "VTIMEZONE":
+                self.zones.add(component)
+                continue
+            self.counts["parsed"] += 1
+            summary = _first(component, "SUMMARY")
+            label = {"uid": (_first(component, "UID") or ("", {}, ""))[2], "subject": _unescape(summary[2]) if summary else ""}
+            try:
+                event = vevent_to_event(component, self.zones, self.include_attendees)
+            except (UnsupportedEvent, ValueError) as e:
+                self._count("unsupported", {**label, "reason": str(e)})
+                continue
+            if event["uid"] in self._seen:
+                self._count("duplicate")
+                continue
+            self._seen.add(event["uid"])
+            events.append(event)
+        return events
+
+    def _count(self, result: str, error: Optional[dict] = None, amount: int = 1):
+        self.counts[result] += amount
+        ICS_EVENTS.inc(amount, result=result)
+        if error and len(self.errors) < REPORT_ERRORS:
+            self.errors.append({**error, "result": result})
+
+    async def _import_window(self, events: list[dict]):
+        lookups = await graph_batch(self.auth_handler, [
+            {"method": "GET",
+             "url": f"{self._events_url}?$filter=" + quote(
+                 f"singleValueExtendedProperties/Any(ep: ep/id eq {_odata_string(UID_PROPERTY)} and ep/value eq {_odata_string(event['uid'])})")
+                 + "&$select=id&$top=1"}
+            for event in events], concurrency=self.concurrency)
+        new = []
+        for event, lookup in zip(events, lookups):
+            if lookup["status"] == 200 and (lookup["body"] or {}).get("value"):
+                self._count("existing")
+            elif lookup["status"] != 200:
+                self._count("failed", {"uid": event["uid"], "subject": event["payload"]["subject"],
+                                       "reason": f"looking up the UID failed: {_error_message(lookup)}"})
+            else:
+                new.append(event)
+        if self.dry_run or not new:
+            return
+
+        created = await graph_batch(self.auth_handler, [
+            {"method": "POST", "url": self._events_url, "body": event["payload"]} for event in new],
+            concurrency=self.concurrency)
+        series = []
+        for event, response in zip(new, created):
+            if response["status"] == 201:
+                self._count("created")
+                if event["exdates"]:
+                    series.append((response["body"]["id"], event))
+            else:
+                self._count("failed", {"uid": event["uid"], "subject": event["payload"]["subject"],
+                                       "reason": _error_message(response)})
+        if series:
+            await self._cancel_exdates(series)
+
+    async def _cancel_exdates(self, series: list[tuple[str, dict]]):
+        """
+        Deletes the occurrences listed in EXDATE; Graph cannot create a series with exceptions.
+        """
+        requests, wanted = [], []
+        for event_id, event in series:
+            for prefix, zone in event["exdates"]:
+                day = datetime.strptime(prefix[:10], "%Y-%m-%d")
+                window = f"startDateTime={(day - timedelta(days=1)):%Y-%m-%dT00:00:00}&endDateTime={(day + timedelta(days=2)):%Y-%m-%dT00:00:00}"
+                requests.append({"method": "GET", "url": f"{self._events_url}/{quote(event_id)}/instances?{window}&$select=id,start",
+                                 "headers": {"Prefer": f'outlook.timezone="{zone}"'}}) # Instance times in the EXDATE's zone
+                wanted.append((event, prefix, zone))
+        deletes, deleted = [], []
+        for (event, prefix, zone), response in zip(wanted, await graph_batch(self.auth_handler, requests, concurrency=self.concurrency)):
+            matched = [instance for instance in ((response["body"] or {}).get("value") or []) if response["status"] == 200
+                       and instance["start"]["dateTime"].startswith(prefix)]
+            if not matched:
+                reason = (f"EXDATE {prefix} ({zone}) matches no occurrence" if response["status"] == 200
+                          else f"listing the occurrences around EXDATE {prefix} failed: {_error_message(response)}")
+                self._exdate_problem(event, reason)
+            for instance in matched:
+                deletes.append({"method": "DELETE", "url": f"/users/{quote(self.user_id)}/events/{quote(instance['id'])}"})
+                deleted.append((event, prefix))
+        if deletes:
+            results = await graph_batch(self.auth_handler, deletes, concurrency=self.concurrency)
+            for (event, prefix), result in zip(deleted, results):
+                if result["status"] == 204:
+                    self.counts["occurrences_cancelled"] += 1
+                else:
+                    self._exdate_problem(event, f"cancelling the occurrence of EXDATE {prefix} failed: {_error_message(result)}")
+
+    def _exdate_problem(self, event: dict, reason: str):
+        self.counts["exdates_unmatched"] += 1
+        if len(self.errors) < REPORT_ERRORS:
+            self.errors.append({"uid": event["uid"], "subject": event["payload"]["subject"], "reason": reason,
+                                "result": "exdate_unmatched"})
+
+    def _report(self, seconds: float) -> dict[str, Any]:
+        counts = self.counts
+        verb = "Would create" if self.dry_run else "Created"
+        importable = len(self._seen) - counts["existing"] - counts["failed"]
+        message = (f"{verb} {importable if self.dry_run else counts['created']} of {counts['parsed']} event(s); "
+                   f"{counts['existing']} already imported, {counts['duplicate']} duplicate UID(s) in the file, "
+                   f"{counts['unsupported']} unsupported, {counts['failed']} failed.")
+        if counts["exdates_unmatched"]:
+            message += f" {counts['exdates_unmatched']} excluded date(s) (EXDATE) could not be cancelled; see problems."
+        report = {"status": "success" if not counts["failed"] else ("partial" if counts["created"] else "error"),
+                  "message": message, **counts, "duration_ms": round(seconds * 1000)}
+        if self.dry_run:
+            report.update(dry_run=True, created=0, would_create=importable)
+        if self.errors:
+            report["problems"] = self.errors
+        logger.info("ics_import.done", user_id=self.user_id, duration_s=round(seconds, 3),
+                    **{key: value for key, value in counts.items()})
+        return report
+
+
+async def import_ics(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str,
+    source: Union[str, Iterable[str], AsyncIterator[str]],
+    calendar_id: Optional[str] = None,
+    default_timezone: str = "UTC",
+    include_attendees: bool = False,
+    dry_run: bool = False,
+    concurrency: int = 2
+) -> dict[str, Any]:
+    """
+    Imports an ICS file into a calendar and returns the report (see IcsImport).
+
+    `source` is a local file path or an (async) iterable of text chunks, e.g. a streamed download.
+    """
+    if isinstance(source, str):
+        chunks = _file_chunks(source)
+    elif hasattr(source, "__aiter__"):
+        chunks = source
+    else:
+        async def from_iterable():
+            for chunk in source:
+                yield chunk
+        chunks = from_iterable()
+    job = IcsImport(auth_handler, user_id, calendar_id, default_timezone, include_attendees, dry_run, concurrency)
+    return await job.run(chunks)
+
+
+async def import_ics_from_onedrive(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str,
+    file_path: str,
+    **options
+) -> dict[str, Any]:
+    """
+    Streams an .ics file stored in the user's OneDrive into `import_ics`.
+    """
+    url = f"{auth_handler.get_base_graph_url()}/users/{quote(user_id)}/drive/root:/{quote(file_path.strip('/'))}:/content"
+    async with graph_client() as client:
+        token = await auth_handler.get_access_token_async()
+        async with client.stream("GET", url, headers={"Authorization": f"Bearer {token}"}) as response:
+            if response.is_error:
+                await response.aread() # So the error (and the callers' handlers) can include the body
+            response.raise_for_status()
+            return await import_ics(auth_handler, user_id, response.aiter_text(), **options)
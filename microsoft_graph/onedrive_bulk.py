@@ -0,0 +1,513 @@
+import asyncio
+import fnmatch
+import hashlib
+import time
+from typing import Any, Optional
+from urllib.parse import quote
+
+import httpx
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.batch import graph_batch
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+# Bulk OneDrive operations: move, copy or delete many items in one job.
+#
+# Items are given as ids, paths or glob patterns ("Reports/2023/*.pdf", "Archive/**/~$*"). A
+# pattern is expanded by listing the folders it can match in (paged, folders listed
+# concurrently). `**` matches any number of folders, and matching is case-insensitive like
+# OneDrive. When a folder is selected together with items below it, only the folder is kept:
+# moving, copying or deleting it covers them.
+#
+# The writes go through JSON batching (batch.py), 20 per request. Moves and deletes carry the
+# eTag each item had when it was resolved as If-Match, so an item changed in the meantime is
+# reported as "changed" instead of being overwritten or deleted.
+#
+# Copies are asynchronous in Graph: each returns 202 and a monitor URL. The monitors of a job are
+# polled concurrently, each with exponential backoff (honouring Retry-After), until the copy has
+# completed or failed, or COPY_TIMEOUT_SECONDS have passed. A copy still running then is reported
+# as "pending", with its monitor URL.
+#
+# Every job returns one report: the count of items per outcome and one line per item. Failures
+# come first, and the list is capped at REPORT_ITEMS lines.
+#
+# Guards against a pattern that selects far more than meant:
+#   - a job selects at most MAX_ITEMS items, counted before folders absorb their contents;
+#     expansion stops as soon as a pattern passes the limit, so "**" never lists a whole drive
+#   - a pattern at the drive root ("*", "**/x"), or a move or delete of a folder selected by a
+#     pattern, needs a preview: the dry run returns a confirm_token (a hash of the selected items
+#     and their eTags) that the real run must pass. A selection that changed in between needs a
+#     new preview.
+
+OPERATIONS = ("move", "copy", "delete")
+PAST_TENSE = {"move": "moved", "copy": "copied", "delete": "deleted"}
+CONFLICT_BEHAVIORS = ("fail", "replace", "rename")
+GLOB_CHARACTERS = set("*?[")
+MAX_ITEMS = 1000 # Per job; a pattern matching more is almost certainly too broad
+LIST_PAGE_SIZE = 200
+REPORT_ITEMS = 50
+COPY_POLL_INITIAL_SECONDS = 0.5
+COPY_POLL_MAX_SECONDS = 10.0
+COPY_TIMEOUT_SECONDS = 300.0
+ITEM_FIELDS = "id,name,eTag,folder,file,size,parentReference"
+SUCCESS_RESULTS = {"moved", "copied", "deleted", "skipped", "missing", "planned"}
+
+BULK_ITEMS = REGISTRY.counter(
+    "onedrive_bulk_items_total", "Items processed by bulk OneDrive jobs, by operation and result.", ("operation", "result"))
+BULK_SECONDS = REGISTRY.histogram(
+    "onedrive_bulk_duration_seconds", "Duration of bulk OneDrive jobs.", ("operation",))
+COPY_MONITOR_POLLS = REGISTRY.counter(
+    "onedrive_copy_monitor_polls_total", "Polls of OneDrive copy monitor URLs, by reported status.", ("status",))
+
+logger = get_logger(__name__)
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.strip().strip("/").split("/") if segment]
+
+
+def _is_pattern(path: str) -> bool:
+    return any(character in GLOB_CHARACTERS for character in path)
+
+
+def _match(pattern: list[str], names: list[str]) -> bool:
+    """
+    Whether the path segments `names` match the pattern segments; "**" matches zero or more segments.
+    """
+    if not pattern:
+        return not names
+    if pattern[0] == "**":
+        return any(_match(pattern[1:], names[skip:]) for skip in range(len(names) + 1))
+    return bool(names) and fnmatch.fnmatchcase(names[0].lower(), pattern[0].lower()) and _match(pattern[1:], names[1:])
+
+
+def _may_contain_matches(pattern: list[str], names: list[str]) -> bool:
+    """
+    Whether a folder at `names` can contain matches of the pattern (so it is worth listing).
+    """
+    for index, name in enumerate(names):
+        if index >= len(pattern):
+            return False
+        if pattern[index] == "**":
+            return True
+        if not fnmatch.fnmatchcase(name.lower(), pattern[index].lower()):
+            return False
+    return len(pattern) > len(names)
+
+
+def _error_message(response: dict) -> str:
+    body = response.get("body")
+    error = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error, dict):
+        return error.get("message") or error.get("code") or f"HTTP {response['status']}"
+    return f"HTTP {response['status']}"
+
+
+class BulkDriveJob:
+    """
+    One bulk move, copy or delete over the items of a user's OneDrive.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive is changed.
+        operation: "move", "copy" or "delete".
+        destination_folder: Target folder of a move or copy (created when missing).
+        conflict_behavior: What Graph does when the destination already has an item of that name:
+            "fail", "replace" or "rename".
+        dry_run: Resolve the items and report what would be done, without changing anything.
+        confirm_token: The confirm_token of a dry run of the same selection, needed for patterns
+            at the drive root and for moves and deletes of folders selected by a pattern.
+        concurrency: Folder listings and copy-monitor polls in flight at once.
+        copy_timeout: Seconds to wait for copies before reporting them as pending.
+    """
+    def __init__(
+        self,
+        auth_handler: MicrosoftGraphAuth,
+        user_id: str,
+        operation: str,
+        destination_folder: Optional[str] = None,
+        conflict_behavior: str = "fail",
+        dry_run: bool = False,
+        confirm_token: Optional[str] = None,
+        concurrency: int = 8,
+        copy_timeout: float = COPY_TIMEOUT_SECONDS
+    ):
+        if operation not in OPERATIONS:
+            raise ValueError(f"operation must be one of {OPERATIONS}")
+        if conflict_behavior not in CONFLICT_BEHAVIORS:
+            raise ValueError(f"conflict_behavior must be one of {CONFLICT_BEHAVIORS}")
+        if operation != "delete" and destination_folder is None:
+            raise ValueError(f"a {operation} needs a destination folder")
+        self.auth_handler = auth_handler
+        self.user_id = user_id
+        self.operation = operation
+        self.destination = "/".join(_segments(destination_folder or ""))
+        self.conflict_behavior = conflict_behavior
+        self.dry_run = dry_run
+        self.confirm_token = confirm_token
+        self.copy_timeout = copy_timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self._matched = 0 # Items selected so far, before folders absorb their contents
+        self._drive = f"/users/{quote(user_id)}/drive"
+
+    async def run(self, paths: Optional[list[str]] = None, item_ids: Optional[list[str]] = None) -> dict[str, Any]:
+        """
+        Resolves the items and applies the operation to them.
+
+        Args:
+            paths: Item paths or glob patterns, relative to the drive root.
+            item_ids: Item ids.
+
+        Returns:
+            The job report.
+        """
+        started = time.perf_counter()
+        async with graph_client() as client:
+            resolved, outcomes, unmatched = await self._resolve(client, paths or [], item_ids or [])
+            if self._matched > MAX_ITEMS:
+                return {"status": "error", "operation": self.operation,
+                        "message": f"The selection matches more than the {MAX_ITEMS} items allowed in one job; narrow the paths or patterns."}
+            token = self._confirm_token(resolved) if self._needs_preview(paths or [], resolved) else None
+            if token is not None and not self.dry_run and self.confirm_token != token:
+                return {"status": "error", "operation": self.operation, "confirmation_required": True,
+                        "message": f"This {self.operation} uses a pattern at the drive root or selects folders by pattern. "
+                                   "Run it with dry_run first, check the items, then pass its confirm_token."
+                                   + (" The selection changed since that dry run." if self.confirm_token else "")}
+            if self.dry_run:
+                outcomes += [{**self._line(item), "result": "planned"} for item in resolved]
+            elif resolved:
+                if self.operation == "delete":
+                    outcomes += await self._delete(resolved)
+                else:
+                    destination = await self._destination(client)
+                    if self.operation == "move":
+                        outcomes += await self._move(resolved, destination)
+                    else:
+                        outcomes += await self._copy(client, resolved, destination)
+        seconds = time.perf_counter() - started
+        BULK_SECONDS.observe(seconds, operation=self.operation)
+        for outcome in outcomes:
+            BULK_ITEMS.inc(operation=self.operation, result=outcome["result"])
+        report = self._report(outcomes, unmatched, seconds)
+        if self.dry_run and token is not None:
+            report["confirm_token"] = token
+        logger.info("onedrive_bulk.done", user_id=self.user_id, operation=self.operation, counts=report["counts"],
+                    duration_s=round(seconds, 3))
+        return report
+
+    # --- resolution ---
+    def _needs_preview(self, paths: list[str], items: list[dict]) -> bool:
+        """
+        Whether the selection is broad enough to need a dry run first (see the module comment).
+        """
+        if any(_is_pattern(path) and _is_pattern(_segments(path)[0]) for path in paths):
+            return True
+        return self.operation in ("move", "delete") and any(item["folder"] and item.get("by_pattern") for item in items)
+
+    def _confirm_token(self, items: list[dict]) -> str:
+        digest = hashlib.sha256(f"{self.operation}\n{self.destination}".encode("utf-8"))
+        for item in items:
+            digest.update(f"\n{item['id']}:{item['etag']}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    async def _resolve(self, client: httpx.AsyncClient, paths: list[str], item_ids: list[str]) -> tuple[list[dict], list[dict], list[str]]:
+        """
+        Turns ids, paths and patterns into distinct items. Returns (items, outcomes of entries
+        that don't exist, patterns that matched nothing).
+        """
+        outcomes, unmatched = [], []
+        requests, labels = [], []
+        for item_id in item_ids:
+            requests.append({"method": "GET", "url": f"{self._drive}/items/{quote(item_id)}?$select={ITEM_FIELDS}"})
+            labels.append(("id", item_id))
+        for path in paths:
+            if not _is_pattern(path):
+                requests.append({"method": "GET", "url": f"{self._drive}/{self._address(path)}?$select={ITEM_FIELDS}"})
+                labels.append(("path", "/".join(_segments(path))))
+
+        found: dict[str, dict] = {}
+        self._matched = 0
+        for (kind, label), response in zip(labels, await graph_batch(self.auth_handler, requests) if requests else []):
+            if response["status"] == 200:
+                item = self._entry(response["body"], label if kind == "path" else None)
+                found.setdefault(item["id"], item)
+                self._matched += 1
+            else:
+                outcomes.append({kind: label, "result": "missing" if response["status"] == 404 else "failed",
+                                 **({} if response["status"] == 404 else {"error": _error_message(response)})})
+
+        listings = await asyncio.gather(*(self._expand(client, path) for path in paths if _is_pattern(path)))
+        for path, matches in zip([path for path in paths if _is_pattern(path)], listings):
+            if not matches:
+                unmatched.append(path)
+            for item in matches:
+                found.setdefault(item["id"], {**item, "by_pattern": True})
+
+        # A selected folder covers everything below it
+        folders = {item["path"].lower() for item in found.values() if item["folder"]}
+        items = [item for item in found.values()
+                 if not any(prefix in folders for prefix in self._ancestors(item["path"].lower()))]
+        items.sort(key=lambda item: item["path"].lower())
+        return items, outcomes, unmatched
+
+    async def _expand(self, client: httpx.AsyncClient, pattern_path: str) -> list[dict]:
+        segments = _segments(pattern_path)
+        first = next(index for index, segment in enumerate(segments) if _is_pattern(segment))
+        base, pattern = segments[:first], segments[first:]
+        matches: list[dict] = []
+
+        async def visit(folder_url: str, relative: list[str]):
+            if self._matched > MAX_ITEMS:
+                return # Too broad already; the job is refused
+            children = await self._list(client, folder_url)
+            folders = []
+            for child in children:
+                names = relative + [child["name"]]
+                item = self._entry(child, "/".join(base + names))
+                if _match(pattern, names):
+                    matches.append(item)
+                    self._matched += 1
+                if item["folder"] and _may_contain_matches(pattern, names):
+                    folders.append((child["id"], names))
+            await asyncio.gather(*(visit(f"{self._drive}/items/{quote(folder_id)}", names) for folder_id, names in folders))
+
+        try:
+            await visit(f"{self._drive}/{self._address('/'.join(base))}", [])
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+        return matches
+
+    async def _list(self, client: httpx.AsyncClient, folder_url: str) -> list[dict]:
+        items = []
+        url = f"{self.auth_handler.get_base_graph_url()}{folder_url}/children?$select={ITEM_FIELDS}&$top={LIST_PAGE_SIZE}"
+        while url:
+            async with self._slots:
+                response = await client.get(url, headers=await self._headers())
+            response.raise_for_status()
+            page = response.json()
+            items.extend(page.get("value", []))
+            url = page.get("@odata.nextLink")
+        return items
+
+    @staticmethod
+    def _address(path: str) -> str:
+        segments = _segments(path)
+        return f"root:/{quote('/'.join(segments))}:" if segments else "root"
+
+    @staticmethod
+    def _ancestors(path: str) -> list[str]:
+        segments = path.split("/")
+        return ["/".join(segments[:count]) for count in range(1, len(segments))]
+
+    @staticmethod
+    def _entry(item: dict, path: Optional[str]) -> dict:
+        if path is None: # Resolved by id: Graph reports the parent as "/drive/root:/Folder"
+            parent = (item.get("parentReference") or {}).get("path", "").split("root:", 1)[-1]
+            path = "/".join(_segments(f"{parent}/{item['name']}"))
+        return {"id": item["id"], "path": path, "etag": item.get("eTag"), "folder": "folder" in item,
+                "parent_id": (item.get("parentReference") or {}).get("id"),
+                "drive_id": (item.get("parentReference") or {}).get("driveId")}
+
+    @staticmethod
+    def _line(item: dict) -> dict:
+        return {"path": item["path"], "id": item["id"], **({"folder": True} if item["folder"] else {})}
+
+    async def _headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {await self.auth_handler.get_access_token_async()}"}
+
+    async def _destination(self, client: httpx.AsyncClient) -> dict:
+        """
+        The destination folder, created (with its missing parents) if needed.
+        """
+        base = self.auth_handler.get_base_graph_url()
+        response = await client.get(f"{base}{self._drive}/{self._address(self.destination)}?$select={ITEM_FIELDS}",
+                                     headers=await self._headers())
+        if response.status_code == 404:
+            parent = ""
+            for name in _segments(self.destination):
+                response = await client.post(f"{base}{self._drive}/{self._address(parent)}/children", headers=await self._headers(),
+                                             json={"name": name, "folder": {}, "@microsoft.graph.conflictBehavior": "fail"})
+                if response.status_code != 409: # 409: it exists already
+                    response.raise_for_status()
+                parent = f"{parent}/{name}"
+            response = await client.get(f"{base}{self._drive}/{self._address(self.destination)}?$select={ITEM_FIELDS}",
+                                         headers=await self._headers())
+        response.raise_for_status()
+        return self._entry(response.json(), self.destination)
+
+    # --- operations ---
+    def _target(self, item: dict, destination: dict, name: Optional[str] = None) -> str:
+        return "/".join(filter(None, [destination["path"], name or item["path"].rsplit("/", 1)[-1]]))
+
+    async def _delete(self, items: list[dict]) -> list[dict]:
+        responses = await graph_batch(self.auth_handler, [
+            {"method": "DELETE", "url": f"{self._drive}/items/{quote(item['id'])}",
+             "headers": {"If-Match": item["etag"]} if item["etag"] else None}
+            for item in items])
+        return [self._outcome(item, response, {204: "deleted", 404: "missing"}) for item, response in zip(items, responses)]
+
+    async def _move(self, items: list[dict], destination: dict) -> list[dict]:
+        outcomes, moving = [], []
+        for item in items:
+            if item["parent_id"] == destination["id"]:
+                outcomes.append({**self._line(item), "result": "skipped", "reason": "already in the destination folder"})
+            elif item["folder"] and (destination["path"].lower() + "/").startswith(item["path"].lower() + "/"):
+                outcomes.append({**self._line(item), "result": "failed", "error": "cannot move a folder into itself"})
+            else:
+                moving.append(item)
+        responses = await graph_batch(self.auth_handler, [
+            {"method": "PATCH",
+             "url": f"{self._drive}/items/{quote(item['id'])}?@microsoft.graph.conflictBehavior={self.conflict_behavior}",
+             "headers": {"If-Match": item["etag"]} if item["etag"] else None,
+             "body": {"parentReference": {"id": destination["id"]}}}
+            for item in moving]) if moving else []
+        for item, response in zip(moving, responses):
+            outcome = self._outcome(item, response, {200: "moved"})
+            if outcome["result"] == "moved": # The body has the final name (it differs after a "rename")
+                outcome["new_path"] = self._target(item, destination, (response["body"] or {}).get("name"))
+            outcomes.append(outcome)
+        return outcomes
+
+    async def _copy(self, client: httpx.AsyncClient, items: list[dict], destination: dict) -> list[dict]:
+        parent = {"id": destination["id"], **({"driveId": destination["drive_id"]} if destination["drive_id"] else {})}
+        responses = await graph_batch(self.auth_handler, [
+            {"method": "POST",
+             "url": f"{self._drive}/items/{quote(item['id'])}/copy?@microsoft.graph.conflictBehavior={self.conflict_behavior}",
+             "body": {"parentReference": parent}}
+            for item in items])
+        outcomes, monitors = [], []
+        for item, response in zip(items, responses):
+            outcome = self._outcome(item, response, {202: "copied"})
+            if outcome["result"] == "copied":
+                outcome["new_path"] = self._target(item, destination)
+                monitor = response["headers"].get("location")
+                if monitor:
+                    monitors.append((outcome, monitor))
+            outcomes.append(outcome)
+
+        deadline = time.monotonic() + self.copy_timeout
+        await asyncio.gather(*(self._await_copy(client, outcome, monitor, deadline) for outcome, monitor in monitors))
+        if self.conflict_behavior == "rename": # Graph picked the names; look them up
+            renamed = [outcome for outcome in outcomes if outcome.get("new_id")]
+            responses = await graph_batch(self.auth_handler, [
+                {"method": "GET", "url": f"{self._drive}/items/{quote(outcome['new_id'])}?$select=id,name"}
+                for outcome in renamed]) if renamed else []
+            for outcome, response in zip(renamed, responses):
+                if response["status"] == 200:
+                    outcome["new_path"] = self._target(outcome, destination, response["body"]["name"])
+        return outcomes
+
+    async def _await_copy(self, client: httpx.AsyncClient, outcome: dict, monitor: str, deadline: float):
+        """
+        Polls one copy monitor until the copy completes or fails, and updates its outcome.
+        The monitor URL is pre-authorized, so no token is sent.
+        """
+        delay = COPY_POLL_INITIAL_SECONDS
+        while True:
+            async with self._slots:
+                try:
+                    response = await client.get(monitor, follow_redirects=False)
+                except httpx.HTTPError as e:
+                    response = None
+                    status, error = "unreachable", f"{type(e).__name__} - {e}"
+            if response is not None:
+                if response.status_code == 303: # Completed; Location is the new item
+                    COPY_MONITOR_POLLS.inc(status="completed")
+                    outcome["new_id"] = response.headers.get("Location", "").rstrip("/").rsplit("/", 1)[-1]
+                    return
+                body = response.json() if response.headers.get("Content-Type", "").startswith("application/json") else {}
+                status = body.get("status") or ("failed" if response.status_code >= 400 else "inProgress")
+                error = _error_message({"status": response.status_code, "body": body})
+                COPY_MONITOR_POLLS.inc(status=status)
+                if status == "completed":
+                    if body.get("resourceId"):
+                        outcome["new_id"] = body["resourceId"]
+                    return
+                if status == "failed" or response.status_code in (400, 404, 410):
+                    outcome.update(result="failed", error=error)
+                    outcome.pop("new_path", None)
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                outcome.update(result="pending", monitor_url=monitor)
+                if status == "unreachable":
+                    outcome["error"] = error
+                return
+            wait = delay
+            if response is not None and response.headers.get("Retry-After"):
+                try:
+                    wait = float(response.headers["Retry-After"])
+                except ValueError:
+                    pass
+            await asyncio.sleep(min(wait, remaining))
+            delay = min(delay * 2, COPY_POLL_MAX_SECONDS)
+
+    def _outcome(self, item: dict, response: dict, results: dict[int, str]) -> dict:
+        status = response["status"]
+        if status in results:
+            return {**self._line(item), "result": results[status]}
+        if status == 412:
+            return {**self._line(item), "result": "changed", "error": "changed since it was listed; list it again"}
+        if status == 409:
+            return {**self._line(item), "result": "conflict", "error": _error_message(response)}
+        if status == 404:
+            return {**self._line(item), "result": "missing"}
+        return {**self._line(item), "result": "failed", "error": _error_message(response)}
+
+    # --- report ---
+    def _report(self, outcomes: list[dict], unmatched: list[str], seconds: float) -> dict[str, Any]:
+        counts: dict[str, int] = {}
+        for outcome in outcomes:
+            counts[outcome["result"]] = counts.get(outcome["result"], 0) + 1
+        failed = sum(count for result, count in counts.items() if result not in SUCCESS_RESULTS)
+        done = counts.get(PAST_TENSE[self.operation], 0)
+        if self.dry_run:
+            summary = f"Would {self.operation} {counts.get('planned', 0)} item(s)"
+        else:
+            summary = f"{PAST_TENSE[self.operation].capitalize()} {done} of {len(outcomes)} item(s)"
+        if self.operation != "delete":
+            summary += f" to '{self.destination or 'root'}'"
+        if failed:
+            summary += f"; {failed} did not succeed"
+        if counts.get("pending"):
+            summary += f"; {counts['pending']} copies still running"
+        if unmatched:
+            summary += f"; no match for {', '.join(repr(path) for path in unmatched)}"
+
+        ordered = sorted(outcomes, key=lambda outcome: outcome["result"] in SUCCESS_RESULTS)
+        report = {
+            "status": "success" if not failed else ("partial" if failed < len(outcomes) else "error"),
+            "operation": self.operation,
+            "message": summary + ".",
+            "counts": counts,
+            "items": ordered[:REPORT_ITEMS],
+            "duration_ms": round(seconds * 1000),
+        }
+        if self.dry_run:
+            report["dry_run"] = True
+        if len(ordered) > REPORT_ITEMS:
+            report["items_omitted"] = len(ordered) - REPORT_ITEMS
+        if unmatched:
+            report["unmatched"] = unmatched
+        return report
+
+
+async def run_bulk_job(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str,
+    operation: str,
+    paths: Optional[list[str]] = None,
+    item_ids: Optional[list[str]] = None,
+    destination_folder: Optional[str] = None,
+    conflict_behavior: str = "fail",
+    dry_run: bool = False,
+    confirm_token: Optional[str] = None
+) -> dict[str, Any]:
+    """
+    Runs one bulk move, copy or delete and returns its report (see BulkDriveJob).
+    """
+    job = BulkDriveJob(auth_handler, user_id, operation, destination_folder, conflict_behavior, dry_run, confirm_token)
+    return await job.run(paths, item_ids)
@@ -0,0 +1,342 @@
+import asyncio
+import contextlib
+import os
+import posixpath
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from typing import Any, BinaryIO, Optional
+from urllib.parse import quote
+
+import httpx
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.quickxor import QuickXorHash, matches
+
+# Export of a OneDrive folder as one zip archive, written to a local file or uploaded back to
+# OneDrive.
+#
+# Files are streamed from Graph straight into the zip writer; no file is ever held in memory
+# whole. Up to `prefetch` downloads run ahead of the writer, each into its own bounded queue of
+# CHUNK_BYTES chunks. A download whose queue is full waits (back-pressure on its HTTP stream), so
+# memory stays under prefetch * FILE_BUFFER_CHUNKS * CHUNK_BYTES (4 MiB by default) whatever the
+# size of the folder or of its files. The writer takes the files in path order, and compression
+# and disk writes run in a worker thread, off the event loop.
+#
+# Every file is hashed while it streams by and checked against its quickXorHash. A mismatch fails
+# the export, and a partial archive never replaces an existing one.
+#
+# Uploads: a Graph upload session needs the total size in every Content-Range, and a zip's size
+# is only known once it is written. The archive is therefore spooled to a temporary file (disk,
+# not memory) and then sent in UPLOAD_FRAGMENT_BYTES fragments.
+#
+# Entries are "<folder name>/<relative path>", with the files' modification times. Empty folders
+# are kept as directory entries. Items without content (OneNote notebooks and other packages)
+# are skipped and listed in the report.
+
+CHUNK_BYTES = 256 * 1024
+FILE_BUFFER_CHUNKS = 4 # Chunks buffered per prefetched file
+WRITE_BATCH_BYTES = 1024 * 1024 # Chunks are handed to the writer thread in batches of this size
+LIST_PAGE_SIZE = 200
+UPLOAD_FRAGMENT_BYTES = 32 * 320 * 1024 # Fragments must be multiples of 320 KiB
+LIST_FIELDS = "id,name,size,file,folder,package,lastModifiedDateTime"
+COMPRESSION = {"deflated": zipfile.ZIP_DEFLATED, "stored": zipfile.ZIP_STORED}
+PARTIAL_SUFFIX = ".partial"
+
+EXPORT_BYTES = REGISTRY.counter(
+    "onedrive_export_bytes_total", "Bytes handled by OneDrive folder exports (downloaded, archived, uploaded).", ("stage",))
+EXPORT_SECONDS = REGISTRY.histogram(
+    "onedrive_export_duration_seconds", "Duration of OneDrive folder exports, by target.", ("target",))
+EXPORT_BUFFERED = REGISTRY.gauge(
+    "onedrive_export_buffered_bytes", "Downloaded bytes waiting for the zip writer.")
+
+logger = get_logger(__name__)
+
+
+class ExportError(Exception):
+    """
+    Raised when an export cannot be completed (a file changed or failed to download).
+    """
+
+
+def _zip_time(timestamp: Optional[str]) -> tuple:
+    try:
+        moment = datetime.fromisoformat((timestamp or "").replace("Z", "+00:00"))
+    except ValueError:
+        moment = datetime.now()
+    return max(moment.timetuple()[:6], (1980, 1, 1, 0, 0, 0)) # The earliest a zip can store
+
+
+class FolderExport:
+    """
+    Streams the contents of a OneDrive folder into a zip archive.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the folder is in.
+        folder_path: The folder to export, relative to the drive root ("" for the whole drive).
+        compression: "deflated" (smaller archives) or "stored" (faster; most Office files and
+            PDFs are compressed already).
+        prefetch: Files downloaded ahead of the zip writer.
+    """
+    def __init__(
+        self,
+        auth_handler: MicrosoftGraphAuth,
+        user_id: str,
+        folder_path: str,
+        compression: str = "deflated",
+        prefetch: int = 4
+    ):
+        if compression not in COMPRESSION:
+            raise ValueError(f"compression must be one of {tuple(COMPRESSION)}")
+        self.auth_handler = auth_handler
+        self.user_id = user_id
+        self.folder_path = folder_path.strip("/")
+        self.compression = COMPRESSION[compression]
+        self.prefetch = max(1, prefetch)
+        self.root_name = posixpath.basename(self.folder_path) or "OneDrive"
+        self._drive = f"{auth_handler.get_base_graph_url()}/users/{quote(user_id)}/drive"
+        self._buffered = 0
+        self._buffered_peak = 0
+
+    async def to_file(self, path: str) -> dict[str, Any]:
+        """
+        Writes the archive to a local file (through a ".partial" file, replaced when complete).
+        """
+        started = time.perf_counter()
+        partial = f"{path}{PARTIAL_SUFFIX}"
+        try:
+            with open(partial, "wb") as sink:
+                report = await self._export(sink)
+            os.replace(partial, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+            raise
+        report.update(path=os.path.abspath(path))
+        return self._finish(report, "file", started)
+
+    async def to_onedrive(self, destination_path: str) -> dict[str, Any]:
+        """
+        Uploads the archive to OneDrive at `destination_path` (replacing an existing file).
+        """
+        started = time.perf_counter()
+        with tempfile.TemporaryFile(prefix="onedrive-export-") as spool:
+            report = await self._export(spool)
+            item = await self._upload(spool, destination_path.strip("/"))
+        report.update(destination_path=destination_path.strip("/"), file_id=item.get("id"), web_url=item.get("webUrl"))
+        return self._finish(report, "onedrive", started)
+
+    def _finish(self, report: dict, target: str, started: float) -> dict[str, Any]:
+        seconds = time.perf_counter() - started
+        EXPORT_SECONDS.observe(seconds, target=target)
+        report.update(duration_ms=round(seconds * 1000), buffered_peak_bytes=self._buffered_peak)
+        logger.info("onedrive_export.done", user_id=self.user_id, folder=self.folder_path, target=target,
+                    files=report["files"], zip_bytes=report["zip_bytes"], duration_s=round(seconds, 3))
+        return report
+
+    # --- listing ---
+    async def _list_tree(self, client: httpx.AsyncClient) -> list[dict]:
+        """
+        Every item below the folder, with its path relative to it; subfolders are listed concurrently.
+        """
+        address = f"root:/{quote(self.folder_path)}:" if self.folder_path else "root"
+        response = await client.get(f"{self._drive}/{address}?$select=id,folder", headers=await self._headers())
+        if response.status_code == 404:
+            raise FileNotFoundError(f"OneDrive folder '{self.folder_path}' does not exist")
+        response.raise_for_status()
+        if "folder" not in response.json():
+            raise NotADirectoryError(f"'{self.folder_path}' is a file, not a folder")
+
+        items: list[dict] = []
+        slots = asyncio.Semaphore(8)
+
+        async def visit(folder_id: str, relative: str):
+            url = f"{self._drive}/items/{quote(folder_id)}/children?$select={LIST_FIELDS}&$top={LIST_PAGE_SIZE}"
+            children = []
+            while url:
+                async with slots:
+                    response = await client.get(url, headers=await self._headers())
+                response.raise_for_status()
+                page = response.json()
+                children.extend(page.get("value", []))
+                url = page.get("@odata.nextLink")
+            pending = []
+            for child in children:
+                child["path"] = f"{relative}/{child['name']}" if relative else child["name"]
+                items.append(child)
+                if "folder" in child:
+                    pending.append(visit(child["id"], child["path"]))
+            await asyncio.gather(*pending)
+
+        await visit(response.json()["id"], "")
+        items.sort(key=lambda item: item["path"].lower())
+        return items
+
+    # --- archive ---
+    async def _export(self, sink: BinaryIO) -> dict[str, Any]:
+        async with graph_client() as client:
+            items = await self._list_tree(client)
+            files = [item for item in items if "file" in item]
+            skipped = [item["path"] for item in items if "file" not in item and "folder" not in item]
+            folders = {item["path"] for item in items if "folder" in item}
+            parents = {posixpath.dirname(item["path"]) for item in items}
+            empty_folders = sorted(folders - parents)
+
+            archive = zipfile.ZipFile(sink, "w", compression=self.compression, allowZip64=True)
+            try:
+                for folder in empty_folders:
+                    await asyncio.to_thread(archive.writestr, zipfile.ZipInfo(f"{self.root_name}/{folder}/"), b"")
+                downloaded = await self._write_files(client, archive, files)
+            finally:
+                await asyncio.to_thread(archive.close)
+        zip_bytes = sink.tell()
+        EXPORT_BYTES.inc(zip_bytes, stage="archived")
+        return {"status": "success", "folder_path": self.folder_path, "files": len(files), "folders": len(folders),
+                "bytes_downloaded": downloaded, "zip_bytes": zip_bytes, "skipped": skipped}
+
+    async def _write_files(self, client: httpx.AsyncClient, archive: zipfile.ZipFile, files: list[dict]) -> int:
+        """
+        Downloads up to `prefetch` files ahead of the writer and streams each into the archive.
+        """
+        window = asyncio.Semaphore(self.prefetch)
+        ready: asyncio.Queue = asyncio.Queue() # (item, chunk queue) in path order
+        tasks: list[asyncio.Task] = []
+
+        async def schedule():
+            for item in files:
+                await window.acquire() # Released by the writer when it has finished a file
+                chunks: asyncio.Queue = asyncio.Queue(maxsize=FILE_BUFFER_CHUNKS)
+                tasks.append(asyncio.create_task(self._download(client, item, chunks)))
+                ready.put_nowait((item, chunks))
+
+        scheduler = asyncio.create_task(schedule())
+        total = 0
+        try:
+            for _ in files:
+                item, chunks = await ready.get()
+                total += await self._write_file(archive, item, chunks)
+                window.release()
+            await scheduler
+        finally:
+            for task in [scheduler, *tasks]:
+                task.cancel()
+            await asyncio.gather(scheduler, *tasks, return_exceptions=True)
+            self._track(-self._buffered)
+        return total
+
+    async def _download(self, client: httpx.AsyncClient, item: dict, chunks: asyncio.Queue):
+        """
+        Streams one file into its chunk queue; ends with None, or with the exception that stopped it.
+        """
+        try:
+            url = f"{self._drive}/items/{quote(item['id'])}/content"
+            async with client.stream("GET", url, headers=await self._headers()) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(CHUNK_BYTES):
+                    await chunks.put(chunk)
+                    self._track(len(chunk))
+            await chunks.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await chunks.put(e)
+
+    async def _write_file(self, archive: zipfile.ZipFile, item: dict, chunks: asyncio.Queue) -> int:
+        info = zipfile.ZipInfo(f"{self.root_name}/{item['path']}", date_time=_zip_time(item.get("lastModifiedDateTime")))
+        info.compress_type = self.compression
+        info.file_size = item.get("size") or 0
+        hasher = QuickXorHash()
+        entry = await asyncio.to_thread(archive.open, info, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT)
+
+        def write(data: bytes):
+            entry.write(data)
+            hasher.update(data)
+
+        received, batch = 0, []
+        try:
+            while True:
+                chunk = await chunks.get()
+                if isinstance(chunk, Exception):
+                    raise ExportError(f"Downloading '{item['path']}' failed: {type(chunk).__name__} - {chunk}") from chunk
+                if chunk is not None:
+                    batch.append(chunk)
+                    received += len(chunk)
+                if batch and (chunk is None or sum(map(len, batch)) >= WRITE_BATCH_BYTES):
+                    data = b"".join(batch)
+                    batch.clear()
+                    await asyncio.to_thread(write, data)
+                    self._track(-len(data))
+                if chunk is None:
+                    break
+        finally:
+            await asyncio.to_thread(entry.close)
+        EXPORT_BYTES.inc(received, stage="downloaded")
+        expected = ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash")
+        if received != info.file_size or not matches(expected, hasher.b64digest()):
+            raise ExportError(f"'{item['path']}' changed or was corrupted during the export "
+                              f"({received} of {info.file_size} bytes, quickXorHash {hasher.b64digest()}, expected {expected})")
+        return received
+
+    def _track(self, delta: int):
+        self._buffered += delta
+        self._buffered_peak = max(self._buffered_peak, self._buffered)
+        EXPORT_BUFFERED.set(self._buffered)
+
+    # --- upload ---
+    async def _upload(self, spool: BinaryIO, destination_path: str) -> dict:
+        size = spool.tell()
+        hasher = QuickXorHash()
+        url = f"{self._drive}/root:/{quote(destination_path)}:/createUploadSession"
+        async with graph_client() as client:
+            response = await client.post(url, headers=await self._headers(),
+                                         json={"item": {"@microsoft.graph.conflictBehavior": "replace"}})
+            response.raise_for_status()
+            upload_url = response.json()["uploadUrl"]
+            try:
+                spool.seek(0)
+                for start in range(0, size, UPLOAD_FRAGMENT_BYTES):
+                    data = await asyncio.to_thread(spool.read, UPLOAD_FRAGMENT_BYTES)
+                    await asyncio.to_thread(hasher.update, data)
+                    # The upload URL is pre-authenticated; it must not receive the bearer token
+                    response = await client.put(upload_url, content=data, headers={
+                        "Content-Range": f"bytes {start}-{start + len(data) - 1}/{size}", "Content-Length": str(len(data))})
+                    response.raise_for_status()
+                    EXPORT_BYTES.inc(len(data), stage="uploaded")
+            except BaseException:
+                with contextlib.suppress(httpx.HTTPError):
+                    await client.delete(upload_url) # Discard the fragments already sent
+                raise
+        item = response.json()
+        reported = ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash")
+        if not matches(reported, hasher.b64digest()):
+            raise ExportError(f"OneDrive reports quickXorHash {reported} for the uploaded archive, expected {hasher.b64digest()}")
+        return item
+
+    async def _headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {await self.auth_handler.get_access_token_async()}"}
+
+
+async def export_onedrive_folder(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str,
+    folder_path: str,
+    output_path: Optional[str] = None,
+    destination_path: Optional[str] = None,
+    compression: str = "deflated",
+    prefetch: int = 4
+) -> dict[str, Any]:
+    """
+    Exports a OneDrive folder as a zip archive, to a local file (`output_path`) or to OneDrive
+    (`destination_path`). See FolderExport.
+    """
+    if (output_path is None) == (destination_path is None):
+        raise ValueError("give exactly one of output_path and destination_path")
+    export = FolderExport(auth_handler, user_id, folder_path, compression, prefetch)
+    if output_path is not None:
+        return await export.to_file(output_path)
+    return await export.to_onedrive(destination_path)
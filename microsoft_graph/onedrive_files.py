@@ -348,15 +348,42 @@
 
 
 import asyncio
+import base64
 import httpx
 import os
 import json
 from datetime import datetime
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 from urllib.parse import quote_plus # Import for proper URL encoding of path segments
 
 from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.http_client import graph_client
+from tools.registry import tool
+from utils.quickxor import matches, quickxor_bytes
 
+# Transfers are verified against the quickXorHash OneDrive reports for each file, and an upload
+# whose content OneDrive already has is skipped (the check costs one metadata request, so only
+# for payloads where that is cheaper than sending them).
+HASH_INLINE_BYTES = 1024 * 1024 # Larger payloads are hashed in a thread, off the event loop
+UPLOAD_SKIP_CHECK_BYTES = 256 * 1024
+DOWNLOAD_INLINE_BYTES = 256 * 1024 # Binary files up to this size are returned base64-encoded; larger ones are not returned
+
+
+async def _quick_xor(data: bytes) -> str:
+    if len(data) < HASH_INLINE_BYTES:
+        return quickxor_bytes(data)
+    return await asyncio.to_thread(quickxor_bytes, data)
+
+
+def _reported_quick_xor(item: dict) -> Optional[str]:
+    return ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash")
+
+
+@tool(
+    description="Uploads a file with specified content to a designated folder in a user's OneDrive. If the folder does not exist, it will be created.",
+    params={"file_content": "The text content of the file to upload."},
+    mutating=True
+)
 async def upload_file_to_onedrive(
     auth_handler: MicrosoftGraphAuth,
     user_id: str, # The user ID or userPrincipalName of the OneDrive owner
@@ -379,7 +406,7 @@ async def upload_file_to_onedrive(
         A dictionary indicating success/failure and file details.
     """
     try:
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         encoded_file_name = quote_plus(file_name) # Encode filename
@@ -387,29 +414,49 @@ async def upload_file_to_onedrive(
         if folder_path and folder_path.lower() != 'root' and folder_path != '':
             encoded_folder_path_segments = '/'.join(quote_plus(s) for s in folder_path.split('/') if s)
             upload_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_folder_path_segments}/{encoded_file_name}:/content"
+            item_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_folder_path_segments}/{encoded_file_name}"
         else:
             upload_url = f"{base_url}/users/{user_id}/drive/root/children/{encoded_file_name}/content"
+            item_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_file_name}"
         
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "text/plain" if isinstance(file_content, str) else "application/octet-stream"
         }
-
-        async with httpx.AsyncClient() as client:
+        data = file_content.encode('utf-8') if isinstance(file_content, str) else file_content
+        local_hash = await _quick_xor(data)
+
+        async with graph_client() as client:
+            if len(data) >= UPLOAD_SKIP_CHECK_BYTES:
+                existing = await client.get(item_url, headers={"Authorization": f"Bearer {access_token}"},
+                                            params={"$select": "id,name,size,file"})
+                if existing.status_code == 200 and _reported_quick_xor(existing.json()) == local_hash:
+                    item = existing.json()
+                    return {"status": "success", "message": f"'{file_name}' in '{folder_path}' already has this content; nothing was uploaded.",
+                            "file_id": item.get("id"), "file_name": item.get("name"), "unchanged": True}
             response = await client.put(
                 upload_url,
                 headers=headers,
-                content=file_content.encode('utf-8') if isinstance(file_content, str) else file_content
+                content=data
             )
             response.raise_for_status()
         
         file_data = response.json()
+        if not matches(_reported_quick_xor(file_data), local_hash):
+            return {"status": "error", "message": f"'{file_name}' was uploaded but OneDrive's quickXorHash does not match the sent content; upload it again.",
+                    "file_id": file_data.get("id")}
         return {"status": "success", "message": f"File '{file_name}' uploaded to '{folder_path}' successfully.", "file_id": file_data.get("id"), "file_name": file_data.get("name")}
     except httpx.HTTPStatusError as e:
+        if e.response.status_code == 412:
+            return {"status": "error", "message": f"'{file_name}' was changed since it was last read; read it again before overwriting it."}
         return {"status": "error", "message": f"Failed to upload file '{file_name}': HTTP Error {e.response.status_code} - {e.response.text}"}
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during file upload: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Downloads the content of a specific file from a user's OneDrive. The file can be identified by its ID or its full path. Text files are returned as text and small binary files base64-encoded; for .docx, .xlsx and .pdf use extract_text_from_onedrive_file instead.",
+    require_any=[("file_id", "file_path")]
+)
 async def download_file_from_onedrive(
     auth_handler: MicrosoftGraphAuth,
     user_id: str, # The user ID or userPrincipalName of the OneDrive owner
@@ -427,20 +474,26 @@ async def download_file_from_onedrive(
         file_path: The path to the file in OneDrive (e.g., "Documents/MyFile.txt").
 
     Returns:
-        A dictionary indicating success/failure and the file content (as bytes).
+        A dictionary indicating success/failure with the file's name, MIME type and size, and its content:
+        "file_content" (text) for text files, "content_base64" for binary files up to DOWNLOAD_INLINE_BYTES.
+        Documents the extractor can read (.docx, .xlsx, .pdf) and larger binary files come without content.
     """
+    from utils.text_extraction import detect_format
+
     try:
         if not file_id and not file_path:
             return {"status": "error", "message": "Either file_id or file_path must be provided for download."}
 
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         if file_id:
-            download_url = f"{base_url}/users/{user_id}/drive/items/{file_id}/content"
+            item_url = f"{base_url}/users/{user_id}/drive/items/{file_id}"
+            download_url = f"{item_url}/content"
         elif file_path:
             encoded_file_path_segments = '/'.join(quote_plus(s) for s in file_path.split('/') if s)
-            download_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_file_path_segments}:/content"
+            item_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_file_path_segments}"
+            download_url = f"{item_url}:/content"
         else:
             return {"status": "error", "message": "Invalid file identifier for download."}
         
@@ -449,14 +502,39 @@ async def download_file_from_onedrive(
             "Accept": "application/octet-stream"
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                download_url,
-                headers=headers
-            )
+        async with graph_client() as client:
+            # The metadata (with the file's hash) is fetched alongside the content, not before it
+            metadata, response = await asyncio.gather(
+                client.get(item_url, headers={"Authorization": f"Bearer {access_token}"}, params={"$select": "id,name,size,file"}),
+                client.get(download_url, headers=headers))
             response.raise_for_status()
-        
-        return {"status": "success", "message": f"File downloaded successfully.", "file_content": response.content}
+
+        item = metadata.json() if metadata.status_code == 200 else {}
+        expected = _reported_quick_xor(item) if item else None
+        actual = await _quick_xor(response.content)
+        if not matches(expected, actual):
+            return {"status": "error", "message": "The downloaded content does not match OneDrive's quickXorHash (the file may have changed during the download); download it again."}
+
+        # Raw bytes mean nothing to the model (and are not JSON): return text, base64 or a pointer to the extractor
+        name = item.get("name") or (file_path or "").rstrip("/").split("/")[-1] or None
+        mime_type = (item.get("file") or {}).get("mimeType") or response.headers.get("content-type", "").split(";")[0] or None
+        result = {"status": "success", "message": "File downloaded successfully.", "name": name, "mime_type": mime_type,
+                  "size": len(response.content), "quick_xor_hash": actual, "verified": expected is not None}
+        document_format = detect_format(name, mime_type)
+        if document_format == "text":
+            try:
+                result["file_content"] = response.content.decode("utf-8-sig")
+                return result
+            except UnicodeDecodeError:
+                pass # Not UTF-8 after all; treated as binary below
+        elif document_format is not None:
+            result["message"] = "File downloaded, but its content is not returned: use extract_text_from_onedrive_file to read the text of this document."
+            return result
+        if len(response.content) <= DOWNLOAD_INLINE_BYTES:
+            result["content_base64"] = base64.b64encode(response.content).decode("ascii")
+        else:
+            result["message"] = f"File downloaded, but its content is not returned: binary files over {DOWNLOAD_INLINE_BYTES // 1024} KiB are too large to pass back."
+        return result
     except httpx.HTTPStatusError as e:
         # Provide more specific HTTP error details for debugging download failures
         return {"status": "error", "message": f"Failed to download file: HTTP Error {e.response.status_code} - {e.response.text} URL: {e.request.url}"}
@@ -464,6 +542,124 @@ async def download_file_from_onedrive(
         # Provide more specific generic error details for debugging download failures
         return {"status": "error", "message": f"An unexpected error occurred during file download: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Reads the text of a .docx, .xlsx, .pdf or plain-text file in a user's OneDrive, returned in chunks. The file can be identified by its ID or its full path. Long documents span several chunks; request the next one with chunk=N.",
+    require_any=[("file_id", "file_path")]
+)
+async def extract_text_from_onedrive_file(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    file_id: Optional[str] = None, # File ID
+    file_path: Optional[str] = None, # Path to the file, e.g., "Documents/report.docx"
+    chunk: int = 1 # 1-based chunk number
+) -> dict:
+    """
+    Extracts the text of a OneDrive file in a worker process (see utils/text_extraction.py).
+    The text is cached by item id and cTag, so only the first read of an unchanged file
+    downloads and parses it; later chunks and re-reads come from the cache.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the file is in.
+        file_id: The ID of the file.
+        file_path: The path to the file in OneDrive (e.g., "Documents/report.docx").
+        chunk: Which chunk of the text to return, starting at 1.
+
+    Returns:
+        A dictionary with the file name, the chunk number, the total number of chunks and the chunk's text.
+    """
+    from utils.text_extraction import ExtractionError, get_extractor
+
+    try:
+        access_token = await auth_handler.get_access_token_async()
+        base_url = auth_handler.get_base_graph_url()
+
+        if file_id:
+            item_url = f"{base_url}/users/{user_id}/drive/items/{file_id}"
+        elif file_path:
+            encoded_file_path_segments = '/'.join(quote_plus(s) for s in file_path.split('/') if s)
+            item_url = f"{base_url}/users/{user_id}/drive/root:/{encoded_file_path_segments}:"
+        else:
+            return {"status": "error", "message": "Either file_id or file_path must be provided."}
+
+        headers = {"Authorization": f"Bearer {access_token}"}
+        extractor = get_extractor()
+
+        async with graph_client() as client:
+            response = await client.get(item_url, headers={**headers, "Accept": "application/json"},
+                                        params={"$select": "id,name,size,cTag,file"})
+            response.raise_for_status()
+            item = response.json()
+            if "file" not in item:
+                return {"status": "error", "message": f"'{item.get('name')}' is a folder, not a file."}
+            if (item.get("size") or 0) > extractor.max_bytes:
+                return {"status": "error", "message": f"'{item.get('name')}' is {item.get('size')} bytes; files over {extractor.max_bytes} bytes are not read."}
+
+            name = item.get("name")
+            mime_type = (item.get("file") or {}).get("mimeType")
+            cache_key = f"{item['id']}:{item['cTag']}" if item.get("cTag") else None
+            result = extractor.cached(cache_key) if cache_key else None
+            if result is None:
+                response = await client.get(f"{base_url}/users/{user_id}/drive/items/{item['id']}/content", headers=headers)
+                response.raise_for_status()
+                data = response.content
+                if not matches(_reported_quick_xor(item), await _quick_xor(data)):
+                    return {"status": "error", "message": f"The downloaded content of '{name}' does not match OneDrive's quickXorHash; try again."}
+
+        if result is None:
+            result = await extractor.extract(data, name, mime_type, cache_key=cache_key)
+        part = extractor.chunk(result["text"], chunk)
+        return {
+            "status": "success",
+            "file_id": item["id"],
+            "file_name": name,
+            "format": result["format"],
+            "chunk": part["chunk"],
+            "chunks": part["chunks"],
+            "truncated": result["truncated"],
+            "text": part["text"],
+        }
+    except ExtractionError as e:
+        return {"status": "error", "message": f"Could not read the text of the file: {e}"}
+    except httpx.HTTPStatusError as e:
+        return {"status": "error", "message": f"Failed to read file: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while reading the file: {type(e).__name__} - {e}"}
+
+@tool(description="Searches a user's OneDrive by file name, folder path and document contents, using a local index. Returns ranked matches with a snippet of the matching text. Prefer this over listing folders when looking for a file.")
+async def search_onedrive_files(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    query: str, # Words to look for, e.g. "Q3 budget numbers"
+    limit: int = 10, # Maximum number of results
+    file_type: Optional[str] = None # Extension such as "xlsx", or "folder"
+) -> Union[list[dict], dict]:
+    """
+    Searches the local OneDrive index (microsoft_graph/drive_index.py); no Graph request is made.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance (unused; the index is local).
+        user_id: The user ID or userPrincipalName whose OneDrive to search.
+        query: Words to look for in file names, folder paths and document text.
+        limit: Maximum number of results.
+        file_type: Only return files with this extension (e.g. "xlsx", "docx", "pdf"), or "folder".
+
+    Returns:
+        A list of matches (id, name, path, type, size, last modified, web URL, score, snippet), best first.
+    """
+    from microsoft_graph.drive_index import get_drive_index
+
+    try:
+        index = get_drive_index()
+        if index is None:
+            return {"status": "error", "message": "The OneDrive search index is not enabled; use list_files_in_folder instead."}
+        if await asyncio.to_thread(index.synced_at, user_id) is None:
+            return {"status": "error", "message": f"The OneDrive of '{user_id}' has not been indexed yet; use list_files_in_folder instead."}
+        return await asyncio.to_thread(index.search, user_id, query, max(1, min(limit, 50)), file_type)
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred during the OneDrive search: {type(e).__name__} - {e}"}
+
+@tool(description="Lists files and subfolders within a specified folder in a user's OneDrive. Returns summary details like name, type (file/folder), and ID.")
 async def list_files_in_folder(
     auth_handler: MicrosoftGraphAuth,
     user_id: str, # The user ID or userPrincipalName of the OneDrive owner
@@ -481,7 +677,7 @@ async def list_files_in_folder(
         A list of dictionaries, each representing a file or folder.
     """
     try:
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         if folder_path and folder_path.lower() != 'root' and folder_path != '':
@@ -495,7 +691,7 @@ async def list_files_in_folder(
             "Accept": "application/json"
         }
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.get(
                 list_url,
                 headers=headers
@@ -520,6 +716,11 @@ async def list_files_in_folder(
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during file listing: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Deletes a specific file or folder from a user's OneDrive. The item can be identified by its ID or its full path. This action is permanent.",
+    mutating=True,
+    require_any=[("file_id", "file_path")]
+)
 async def delete_file_from_onedrive(
     auth_handler: MicrosoftGraphAuth,
     user_id: str, # The user ID or userPrincipalName of the OneDrive owner
@@ -543,7 +744,7 @@ async def delete_file_from_onedrive(
         if not file_id and not file_path:
             return {"status": "error", "message": "Either file_id or file_path must be provided for deletion."}
 
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         if file_id:
@@ -558,7 +759,7 @@ async def delete_file_from_onedrive(
             "Authorization": f"Bearer {access_token}"
         }
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.delete( # Use DELETE method
                 delete_url,
                 headers=headers
@@ -567,10 +768,175 @@ async def delete_file_from_onedrive(
 
         return {"status": "success", "message": f"File deleted successfully."}
     except httpx.HTTPStatusError as e:
+        if e.response.status_code == 412: # If-Match from the ETag cache: someone else changed it
+            return {"status": "error", "message": "The file was changed since it was last read; read it again before deleting."}
         return {"status": "error", "message": f"Failed to delete file: HTTP Error {e.response.status_code} - {e.response.text}"}
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during file deletion: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Moves many files or folders of a user's OneDrive into one folder in a single job. Items are given by path, glob pattern (e.g. 'Reports/2023/*.pdf', 'Old/**/*.tmp') or ID. Returns one report with the outcome of every item. Use dry_run to preview what a pattern matches; patterns at the drive root or matching folders need the confirm_token of that dry run.",
+    mutating=True,
+    require_any=[("paths", "item_ids")]
+)
+async def move_onedrive_items(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    destination_folder: str, # Folder to move the items into, e.g. "Archive/2023"
+    paths: Optional[list[str]] = None, # Paths or glob patterns, e.g. ["Reports/*.xlsx"]
+    item_ids: Optional[list[str]] = None, # Item IDs
+    conflict_behavior: Literal["fail", "replace", "rename"] = "fail",
+    dry_run: bool = False,
+    confirm_token: Optional[str] = None # From the dry run, when the report asked for one
+) -> dict:
+    """
+    Moves items in bulk (microsoft_graph/onedrive_bulk.py).
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the items are in.
+        destination_folder: The folder to move the items into; created if it does not exist. Use "root" or "" for the top level.
+        paths: Item paths or glob patterns relative to the drive root. "*" matches within a folder name, "**" matches any number of folders.
+        item_ids: IDs of items to move.
+        conflict_behavior: What to do when the destination already has an item of the same name: "fail", "replace" or "rename".
+        dry_run: If true, only report which items would be moved.
+        confirm_token: The confirm_token of a dry run of the same items; required for patterns at the drive root and for folders selected by a pattern.
+
+    Returns:
+        The job report: status, message, counts per outcome and one line per item.
+    """
+    from microsoft_graph.onedrive_bulk import run_bulk_job
+
+    try:
+        destination = "" if destination_folder.strip().lower() == "root" else destination_folder
+        return await run_bulk_job(auth_handler, user_id, "move", paths, item_ids, destination, conflict_behavior, dry_run,
+                                  confirm_token)
+    except httpx.HTTPStatusError as e:
+        return {"status": "error", "message": f"Failed to move items: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while moving items: {type(e).__name__} - {e}"}
+
+@tool(
+    description="Copies many files or folders of a user's OneDrive into one folder in a single job and waits for the copies to finish. Items are given by path, glob pattern (e.g. 'Templates/*.docx') or ID. Returns one report with the outcome of every item. Patterns at the drive root need the confirm_token of a dry run.",
+    mutating=True,
+    require_any=[("paths", "item_ids")]
+)
+async def copy_onedrive_items(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    destination_folder: str, # Folder to copy the items into, e.g. "Backup/Reports"
+    paths: Optional[list[str]] = None, # Paths or glob patterns, e.g. ["Templates/*.docx"]
+    item_ids: Optional[list[str]] = None, # Item IDs
+    conflict_behavior: Literal["fail", "replace", "rename"] = "fail",
+    dry_run: bool = False,
+    confirm_token: Optional[str] = None # From the dry run, when the report asked for one
+) -> dict:
+    """
+    Copies items in bulk (microsoft_graph/onedrive_bulk.py). Copies that are still running after
+    a few minutes are reported as pending.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the items are in.
+        destination_folder: The folder to copy the items into; created if it does not exist. Use "root" or "" for the top level.
+        paths: Item paths or glob patterns relative to the drive root. "*" matches within a folder name, "**" matches any number of folders.
+        item_ids: IDs of items to copy.
+        conflict_behavior: What to do when the destination already has an item of the same name: "fail", "replace" or "rename".
+        dry_run: If true, only report which items would be copied.
+        confirm_token: The confirm_token of a dry run of the same items; required for patterns at the drive root.
+
+    Returns:
+        The job report: status, message, counts per outcome and one line per item.
+    """
+    from microsoft_graph.onedrive_bulk import run_bulk_job
+
+    try:
+        destination = "" if destination_folder.strip().lower() == "root" else destination_folder
+        return await run_bulk_job(auth_handler, user_id, "copy", paths, item_ids, destination, conflict_behavior, dry_run,
+                                  confirm_token)
+    except httpx.HTTPStatusError as e:
+        return {"status": "error", "message": f"Failed to copy items: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while copying items: {type(e).__name__} - {e}"}
+
+@tool(
+    description="Deletes many files or folders from a user's OneDrive in a single job. Items are given by path, glob pattern (e.g. 'Downloads/*.tmp', 'Projects/**/~$*') or ID. Returns one report with the outcome of every item. Use dry_run first to check what a pattern matches; deletion is permanent. Patterns at the drive root or matching folders need the confirm_token of that dry run.",
+    mutating=True,
+    require_any=[("paths", "item_ids")]
+)
+async def delete_onedrive_items(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    paths: Optional[list[str]] = None, # Paths or glob patterns, e.g. ["Downloads/*.tmp"]
+    item_ids: Optional[list[str]] = None, # Item IDs
+    dry_run: bool = False,
+    confirm_token: Optional[str] = None # From the dry run, when the report asked for one
+) -> dict:
+    """
+    Deletes items in bulk (microsoft_graph/onedrive_bulk.py).
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the items are in.
+        paths: Item paths or glob patterns relative to the drive root. "*" matches within a folder name, "**" matches any number of folders.
+        item_ids: IDs of items to delete.
+        dry_run: If true, only report which items would be deleted.
+        confirm_token: The confirm_token of a dry run of the same items; required for patterns at the drive root and for folders selected by a pattern.
+
+    Returns:
+        The job report: status, message, counts per outcome and one line per item.
+    """
+    from microsoft_graph.onedrive_bulk import run_bulk_job
+
+    try:
+        return await run_bulk_job(auth_handler, user_id, "delete", paths, item_ids, dry_run=dry_run, confirm_token=confirm_token)
+    except httpx.HTTPStatusError as e:
+        return {"status": "error", "message": f"Failed to delete items: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while deleting items: {type(e).__name__} - {e}"}
+
+@tool(
+    description="Packs a whole folder of a user's OneDrive (with its subfolders) into one zip file saved in OneDrive, e.g. to send someone everything in 'Reports/Q3'. Returns the zip's path, ID and web URL.",
+    mutating=True
+)
+async def export_onedrive_folder_as_zip(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the OneDrive owner
+    folder_path: str, # Folder to export, e.g. "Reports/Q3"
+    destination_path: Optional[str] = None, # Where to save the zip, e.g. "Exports/Q3.zip"
+    compression: Literal["deflated", "stored"] = "deflated"
+) -> dict:
+    """
+    Exports a folder as a zip archive uploaded to OneDrive (microsoft_graph/onedrive_export.py).
+    Files are streamed into the archive, so folders of any size can be exported.
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose OneDrive the folder is in.
+        folder_path: The folder to export, relative to the drive root (e.g. "Reports/Q3").
+        destination_path: Path of the zip file in OneDrive. Defaults to "<folder_path>.zip", next to the folder. An existing file is replaced.
+        compression: "deflated" for a smaller archive, "stored" for a faster export of already compressed files (Office documents, PDFs, images).
+
+    Returns:
+        The export report: status, zip path, file ID and web URL, number of files and folders, sizes, and skipped items.
+    """
+    from microsoft_graph.onedrive_export import ExportError, export_onedrive_folder
+
+    try:
+        folder = folder_path.strip().strip("/")
+        if not folder or folder.lower() == "root":
+            return {"status": "error", "message": "Give a folder to export; the whole drive cannot be exported as one zip."}
+        destination = destination_path or f"{folder}.zip"
+        report = await export_onedrive_folder(auth_handler, user_id, folder, destination_path=destination, compression=compression)
+        report["message"] = f"Exported {report['files']} file(s) from '{folder}' to '{report['destination_path']}'."
+        return report
+    except (FileNotFoundError, NotADirectoryError, ExportError) as e:
+        return {"status": "error", "message": str(e)}
+    except httpx.HTTPStatusError as e:
+        return {"status": "error", "message": f"Failed to export folder: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred during the folder export: {type(e).__name__} - {e}"}
+
 # Example Usage (for testing purposes)
 async def main():
     auth_handler = MicrosoftGraphAuth()
@@ -627,7 +993,7 @@ async def main():
         )
         print(f"Download file result: {download_result['status']}")
         if download_result.get("status") == "success":
-            downloaded_content = download_result.get("file_content", b"").decode('utf-8')
+            downloaded_content = download_result.get("file_content", "")
             print(f"  Downloaded content snippet: {downloaded_content[:150]}...")
             if test_file_content == downloaded_content:
                 print("  Content matches original!")
@@ -650,7 +1016,7 @@ async def main():
         # Get folder ID by path first (list children of root and filter by name)
         base_list_url = f"{auth_handler.get_base_graph_url()}/users/{onedrive_owner_id}/drive/root/children"
         headers = {"Authorization": f"Bearer {auth_handler.get_access_token()}", "Accept": "application/json"}
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             # Use params for cleaner query string construction
             list_response = await client.get(base_list_url, headers=headers, params={"$filter": f"name eq '{test_folder_path}' and folder ne null"})
             list_response.raise_for_status()
@@ -0,0 +1,645 @@
+import asyncio
+import collections
+import contextlib
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+from urllib.parse import quote
+
+import httpx
+
+from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.drive_index import DriveIndex, get_drive_index
+from microsoft_graph.http_client import graph_client
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+from utils.quickxor import QuickXorHash, matches, quickxor_file
+
+# Two-way sync between a local directory and a OneDrive folder.
+#
+# Uploading every file of a report directory again costs a full transfer even when nothing
+# changed. A sync compares three views of every file and transfers only the differences:
+#   - remote: the OneDrive folder as recorded by the drive index (drive_index.py), brought up to
+#     date through the delta API first, so an unchanged drive costs one request
+#   - local: a scan of the directory (size, mtime, inode; no reads)
+#   - base: what both sides looked like after the last sync, kept in `.onedrive-sync.db` inside the
+#     local directory
+# A local file is unchanged when its size and mtime equal the base. When only the mtime moved, its
+# quickXorHash decides (a touched file is not uploaded). A remote file is unchanged when its cTag
+# or quickXorHash equals the base. Files that are new on both sides are compared by hash, so
+# syncing into an existing copy transfers nothing. Re-syncing an unchanged tree therefore reads no
+# file contents at all.
+#
+# Decisions per file (local state, remote state):
+#   changed/new, unchanged/absent -> upload        unchanged/absent, changed/new -> download
+#   deleted, unchanged            -> delete remote  unchanged, deleted             -> delete local
+#   changed/new, changed/new      -> the local file is kept as a "(conflict ...)" copy, which is
+#   (different)                      uploaded, and the remote version is downloaded
+# Renames are detected by identity instead of content: a remote item whose id moved to another
+# path, or a local file whose inode reappears under a new name, is moved on the other side rather
+# than transferred again. Folders are created and removed as needed; a deleted folder is deleted
+# remotely with one request.
+#
+# Uploads and downloads run concurrently. Files above 4 MB are uploaded through upload sessions in
+# 10 MB fragments. Every transfer is hashed on the way and checked against the quickXorHash OneDrive
+# reports; a mismatch fails the file (a partial download never replaces the local copy). Writes carry If-Match with the eTag the decision was based on, so a file changed
+# remotely during the sync is not overwritten; it is picked up by the next sync.
+#
+# direction="upload" or "download" applies changes one way only; the source side wins conflicts and
+# nothing is deleted on the source side.
+
+SYNC_ACTIONS = REGISTRY.counter(
+    "onedrive_sync_actions_total", "OneDrive folder sync actions by kind and result.", ("action", "result"))
+SYNC_BYTES = REGISTRY.counter(
+    "onedrive_sync_bytes_total", "Bytes transferred by OneDrive folder syncs, by direction.", ("direction",))
+SYNC_SECONDS = REGISTRY.histogram(
+    "onedrive_sync_duration_seconds", "Duration of OneDrive folder syncs.", buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+
+STATE_FILE = ".onedrive-sync.db"
+INDEX_FILE = ".onedrive-sync-index.db" # Used when AGENT_DRIVE_INDEX is not set
+PARTIAL_SUFFIX = ".onedrive-partial"
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+UPLOAD_FRAGMENT_BYTES = 32 * 320 * 1024 # Fragments must be multiples of 320 KiB
+WRITE_BUFFER_BYTES = 1024 * 1024
+DIRECTIONS = ("both", "upload", "download")
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    user_id TEXT NOT NULL, remote TEXT NOT NULL, key TEXT NOT NULL, path TEXT, is_folder INTEGER,
+    size INTEGER, mtime_ns INTEGER, inode INTEGER, quick_xor TEXT, item_id TEXT, ctag TEXT, etag TEXT,
+    PRIMARY KEY (user_id, remote, key)
+);
+"""
+
+logger = get_logger(__name__)
+
+
+class VerificationError(Exception):
+    """
+    Raised when a transferred file's quickXorHash differs from the one OneDrive reports.
+    """
+
+
+def _key(path: str) -> str:
+    return path.casefold() # OneDrive names are case-insensitive
+
+
+def _is_internal(name: str) -> bool:
+    return name.startswith(".onedrive-sync") or name.endswith(PARTIAL_SUFFIX)
+
+
+def scan_local(root: str) -> dict[str, dict[str, Any]]:
+    """
+    Files and folders below `root` by key, with their relative path, size, mtime and inode.
+    Symbolic links and the sync's own files are skipped.
+    """
+    entries: dict[str, dict[str, Any]] = {}
+    pending = [("", root)]
+    while pending:
+        relative, directory = pending.pop()
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                if entry.is_symlink() or _is_internal(entry.name):
+                    continue
+                path = f"{relative}/{entry.name}" if relative else entry.name
+                stat = entry.stat(follow_symlinks=False)
+                is_folder = entry.is_dir(follow_symlinks=False)
+                entries[_key(path)] = {"path": path, "is_folder": is_folder, "size": 0 if is_folder else stat.st_size,
+                                       "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+                if is_folder:
+                    pending.append((path, entry.path))
+    return entries
+
+
+class SyncState:
+    """
+    The base of a three-way sync: every file and folder as of the last sync of one
+    (OneDrive folder, local directory) pair.
+    """
+    def __init__(self, local_root: str, user_id: str, remote_folder: str):
+        self.user_id = user_id
+        self.remote = remote_folder.strip("/").casefold()
+        self._db = sqlite3.connect(os.path.join(local_root, STATE_FILE), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(STATE_SCHEMA)
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM files WHERE user_id = ? AND remote = ?", (self.user_id, self.remote)).fetchall()
+        return {row["key"]: dict(row) for row in rows}
+
+    def update(self, records: list[dict[str, Any]], removed: list[str]):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM files WHERE user_id = ? AND remote = ? AND key = ?",
+                                 [(self.user_id, self.remote, key) for key in removed])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (user_id, remote, key, path, is_folder, size, mtime_ns, inode, quick_xor, item_id, ctag, etag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.user_id, self.remote, _key(record["path"]), record["path"], int(record["is_folder"]), record.get("size"),
+                  record.get("mtime_ns"), record.get("inode"), record.get("quick_xor"), record.get("item_id"),
+                  record.get("ctag"), record.get("etag")) for record in records])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class OneDriveSync:
+    """
+    One sync run of a local directory with a OneDrive folder (see the module comment).
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: OneDrive owner.
+        local_dir: Local directory; created if missing.
+        remote_folder: Folder path relative to the drive root, e.g. "Reports/Q3" ("" for the root).
+        index: Drive index providing the remote view; defaults to AGENT_DRIVE_INDEX, or a private
+               index file in `local_dir`.
+        direction: "both", "upload" or "download".
+        delete: Whether deletions are propagated.
+        concurrency: Transfers (and hash computations) running at once.
+        dry_run: Plan only; nothing is transferred or changed.
+    """
+    def __init__(self, auth_handler: MicrosoftGraphAuth, user_id: str, local_dir: str, remote_folder: str,
+                 index: Optional[DriveIndex] = None, direction: str = "both", delete: bool = True,
+                 concurrency: int = 8, dry_run: bool = False):
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {', '.join(DIRECTIONS)}")
+        self.auth_handler = auth_handler
+        self.user_id = user_id
+        self.local_root = os.path.abspath(local_dir)
+        self.remote_root = remote_folder.strip("/")
+        self.direction = direction
+        self.delete = delete
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+        self._index = index
+        self._slots = asyncio.Semaphore(concurrency)
+        self._records: list[dict[str, Any]] = []
+        self._removed: list[str] = []
+        self.report: dict[str, Any] = {
+            "uploaded": 0, "downloaded": 0, "moved_remote": 0, "moved_local": 0, "deleted_remote": 0,
+            "deleted_local": 0, "folders_created": 0, "unchanged": 0, "hashed": 0, "bytes_uploaded": 0,
+            "bytes_downloaded": 0, "conflicts": [], "skipped": [], "failed": [],
+        }
+
+    async def run(self) -> dict[str, Any]:
+        """
+        Performs the sync and returns its report.
+        """
+        started = time.perf_counter()
+        os.makedirs(self.local_root, exist_ok=True)
+        index, private_index = self._index or get_drive_index(), None
+        if index is None:
+            index = private_index = DriveIndex(os.path.join(self.local_root, INDEX_FILE))
+        state = SyncState(self.local_root, self.user_id, self.remote_root)
+        try:
+            await index.sync(self.auth_handler, self.user_id, extract=False)
+            remote_tree = await asyncio.to_thread(index.tree, self.user_id, self.remote_root)
+            remote = {_key(item["path"]): item for item in remote_tree or []}
+            local = await asyncio.to_thread(scan_local, self.local_root)
+            base = await asyncio.to_thread(state.load)
+            if remote_tree is None and base:
+                # Renamed or deleted as a whole; syncing would delete every local file
+                raise FileNotFoundError(f"OneDrive folder '{self.remote_root}' no longer exists; nothing was changed.")
+
+            hashes = await self._hash_candidates(local, remote, base)
+            actions = self._plan(local, remote, base, hashes)
+            self.report["planned"] = dict(collections.Counter(action["op"] for action in actions))
+            if not self.dry_run:
+                async with graph_client() as client:
+                    if remote_tree is None and self.remote_root and any(action["op"] in ("upload", "mkdir_remote") for action in actions):
+                        await self._mkdir_remote(client, "")
+                    await self._execute(client, actions)
+                    await asyncio.to_thread(state.update, self._records, self._removed)
+        finally:
+            state.close()
+            if private_index is not None:
+                private_index.close()
+        seconds = time.perf_counter() - started
+        SYNC_SECONDS.observe(seconds)
+        self.report.update(seconds=round(seconds, 3), dry_run=self.dry_run)
+        logger.info("onedrive_sync.done", user_id=self.user_id, remote=self.remote_root, local=self.local_root,
+                    **{name: value for name, value in self.report.items() if isinstance(value, (int, float))})
+        return self.report
+
+    # --- planning ---
+    async def _hash_candidates(self, local: dict, remote: dict, base: dict) -> dict[str, str]:
+        """
+        quickXorHashes of the local files whose state cannot be decided from size and mtime alone.
+        """
+        wanted = []
+        for key, entry in local.items():
+            if entry["is_folder"]:
+                continue
+            previous, current = base.get(key), remote.get(key)
+            if previous and (previous["size"], previous["mtime_ns"]) == (entry["size"], entry["mtime_ns"]):
+                continue # Unchanged since the last sync
+            if previous and previous["size"] == entry["size"] and previous["quick_xor"]:
+                wanted.append(key) # Touched or rewritten with the same length
+            elif current and not current["is_folder"] and current["quick_xor"] and current["size"] == entry["size"]:
+                wanted.append(key) # Maybe already identical on OneDrive
+
+        async def digest(key: str) -> tuple[str, Optional[str]]:
+            async with self._slots:
+                try:
+                    return key, await asyncio.to_thread(quickxor_file, self._local_path(local[key]["path"]))
+                except OSError:
+                    return key, None
+
+        results = await asyncio.gather(*(digest(key) for key in wanted))
+        self.report["hashed"] = len(wanted)
+        return {key: value for key, value in results if value}
+
+    def _plan(self, local: dict, remote: dict, base: dict, hashes: dict[str, str]) -> list[dict[str, Any]]:
+        actions: list[dict[str, Any]] = []
+        settled: set[str] = set() # Keys already handled by a move
+        remote_by_id = {item["id"]: key for key, item in remote.items()}
+
+        # Renames on OneDrive: the item id of a base entry now lives under another path
+        for key, previous in base.items():
+            moved_to = remote_by_id.get(previous["item_id"])
+            if previous["is_folder"] or moved_to is None or moved_to == key or moved_to in base or moved_to in local:
+                continue
+            if key in local and not self._local_changed(local[key], previous, hashes.get(key)) and self.direction != "upload":
+                actions.append({"op": "move_local", "key": moved_to, "source": local[key]["path"],
+                                "path": remote[moved_to]["path"], "base": previous})
+                settled.update((key, moved_to))
+
+        # Renames on this side: a vanished base entry's inode, size and mtime reappear under a new name
+        vanished = {(previous["inode"], previous["size"], previous["mtime_ns"]): key for key, previous in base.items()
+                    if not previous["is_folder"] and key not in local and key not in settled
+                    and key in remote and not self._remote_changed(remote[key], previous)}
+        for key, entry in local.items():
+            identity = (entry["inode"], entry["size"], entry["mtime_ns"])
+            if entry["is_folder"] or key in base or key in remote or identity not in vanished or self.direction == "download":
+                continue
+            source = vanished.pop(identity)
+            actions.append({"op": "move_remote", "key": key, "path": entry["path"], "item": remote[source],
+                            "source": base[source]["path"], "local": entry})
+            settled.update((key, source))
+
+        for key in set(local) | set(remote) | set(base):
+            if key not in settled:
+                action = self._decide(key, local.get(key), remote.get(key), base.get(key), hashes.get(key))
+                if action is not None:
+                    actions.append(action)
+        return self._fold_folder_deletes(actions)
+
+    @staticmethod
+    def _local_changed(entry: dict, previous: dict, digest: Optional[str]) -> bool:
+        if (entry["size"], entry["mtime_ns"]) == (previous["size"], previous["mtime_ns"]):
+            return False
+        return digest is None or digest != previous["quick_xor"]
+
+    @staticmethod
+    def _remote_changed(item: dict, previous: dict) -> bool:
+        return item["ctag"] != previous["ctag"] and not (item["quick_xor"] and item["quick_xor"] == previous["quick_xor"])
+
+    def _decide(self, key: str, entry: Optional[dict], item: Optional[dict], previous: Optional[dict],
+                digest: Optional[str]) -> Optional[dict[str, Any]]:
+        if (entry and entry["is_folder"]) or (item and item["is_folder"]):
+            return self._decide_folder(key, entry, item, previous)
+        path = (entry or item or previous)["path"]
+        action = {"key": key, "path": path, "local": entry, "item": item, "base": previous, "digest": digest}
+
+        if entry is None and item is None:
+            return {**action, "op": "forget"}
+        local_state = "new" if previous is None else ("absent" if entry is None else
+                      ("changed" if self._local_changed(entry, previous, digest) else "unchanged"))
+        remote_state = "new" if previous is None else ("absent" if item is None else
+                       ("changed" if self._remote_changed(item, previous) else "unchanged"))
+        if entry is None and previous is None:
+            local_state = "missing"
+        if item is None and previous is None:
+            remote_state = "missing"
+
+        if local_state == "unchanged" and remote_state == "unchanged":
+            self.report["unchanged"] += 1
+            if (entry["size"], entry["mtime_ns"]) != (previous["size"], previous["mtime_ns"]):
+                return {**action, "op": "record"} # Touched only; remember the new mtime
+            return None
+        if local_state in ("new", "changed") and remote_state in ("new", "changed"):
+            if digest is not None and digest == item["quick_xor"]:
+                self.report["unchanged"] += 1
+                return {**action, "op": "record"} # Same content on both sides
+            op = "conflict" # Including files new on both sides: neither version is thrown away
+        elif local_state in ("new", "changed") or (local_state == "unchanged" and remote_state == "absent" and self.direction == "upload"):
+            op = "upload"
+        elif remote_state in ("new", "changed") or (remote_state == "unchanged" and local_state == "absent" and self.direction == "download"):
+            op = "download"
+        elif local_state == "absent" and remote_state == "absent":
+            op = "forget"
+        elif local_state == "absent":
+            op = "delete_remote"
+        else:
+            op = "delete_local"
+        return self._directed({**action, "op": op})
+
+    def _decide_folder(self, key: str, entry: Optional[dict], item: Optional[dict], previous: Optional[dict]) -> Optional[dict[str, Any]]:
+        path = (entry or item or previous)["path"]
+        action = {"key": key, "path": path, "local": entry, "item": item, "base": previous}
+        if (entry and not entry["is_folder"]) or (item and not item["is_folder"]):
+            self.report["skipped"].append({"path": path, "reason": "a file on one side and a folder on the other"})
+            return None
+        if entry and item:
+            return None if previous else {**action, "op": "record"}
+        if entry is None and item is None:
+            return {**action, "op": "forget"}
+        if previous is None: # New on one side
+            return self._directed({**action, "op": "mkdir_remote" if entry else "mkdir_local"})
+        return self._directed({**action, "op": "delete_remote" if item else "delete_local"})
+
+    def _directed(self, action: dict[str, Any]) -> Optional[dict[str, Any]]:
+        """
+        Adapts a two-way decision to the configured direction and deletion policy.
+        """
+        op = action["op"]
+        if self.direction == "upload":
+            op = {"download": None, "mkdir_local": None, "delete_local": "upload", "conflict": "upload"}.get(op, op)
+            if op == "upload" and action["local"] is None:
+                op = None # Deleted locally and changed remotely: leave OneDrive alone
+        elif self.direction == "download":
+            op = {"upload": None, "mkdir_remote": None, "delete_remote": "download", "conflict": "download"}.get(op, op)
+            if op == "download" and action["item"] is None:
+                op = None
+        if op in ("delete_remote", "delete_local") and not self.delete:
+            self.report["skipped"].append({"path": action["path"], "reason": "deletions are disabled"})
+            return None
+        if op == "upload" and action["local"] and action["local"]["is_folder"]:
+            op = "mkdir_remote"
+        if op == "download" and action["item"] and action["item"]["is_folder"]:
+            op = "mkdir_local"
+        return {**action, "op": op} if op else None
+
+    @staticmethod
+    def _fold_folder_deletes(actions: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        A folder delete is dropped when anything below it is kept or transferred. A remote folder
+        delete removes its subtree in one request, so the remote deletes below it become "forget".
+        """
+        by_key = {action["key"]: action for action in actions}
+        kept, folded = [], set()
+        for action in actions:
+            if action["op"] in ("delete_remote", "delete_local") and action["base"]["is_folder"]:
+                prefix = f"{action['key']}/"
+                if any(other["op"] not in (action["op"], "forget") for key, other in by_key.items() if key.startswith(prefix)):
+                    continue
+                if action["op"] == "delete_remote":
+                    folded.add(action["key"])
+            kept.append(action)
+        return [{**action, "op": "forget"} if action["op"] == "delete_remote"
+                and any(action["key"].startswith(f"{folder}/") for folder in folded) else action for action in kept]
+
+    # --- execution ---
+    async def _execute(self, client: httpx.AsyncClient, actions: list[dict[str, Any]]):
+        by_op: dict[str, list[dict]] = {}
+        for action in actions:
+            by_op.setdefault(action["op"], []).append(action)
+        depth = lambda action: action["key"].count("/")
+
+        for action in sorted(by_op.get("mkdir_local", []), key=depth):
+            await self._run(action, self._mkdir_local(action))
+        for action in sorted(by_op.get("mkdir_remote", []), key=depth): # Parents before children
+            await self._run(action, self._mkdir_remote(client, action["path"], action))
+        for action in by_op.get("move_local", []):
+            await self._run(action, self._move_local(action))
+        for action in by_op.get("move_remote", []):
+            await self._run(action, self._move_remote(client, action))
+        for action in by_op.get("conflict", []): # Keep the local edit under a new name, then fetch OneDrive's
+            copy = await self._run(action, self._set_conflict_aside(action))
+            if copy is not None:
+                by_op.setdefault("upload", []).append(copy)
+                by_op.setdefault("download", []).append({**action, "op": "download"})
+        transfers = [self._run(action, self._upload(client, action)) for action in by_op.get("upload", [])]
+        transfers += [self._run(action, self._download(client, action)) for action in by_op.get("download", [])]
+        transfers += [self._run(action, self._delete_remote(client, action)) for action in by_op.get("delete_remote", [])]
+        await asyncio.gather(*transfers)
+        for action in sorted(by_op.get("delete_local", []), key=depth, reverse=True): # Files before their folders
+            await self._run(action, self._delete_local(action))
+        for action in by_op.get("record", []):
+            self._record_synced(action["path"], action["local"], action["item"], action.get("digest"))
+        self._removed.extend(action["key"] for action in by_op.get("forget", []))
+
+    async def _run(self, action: dict[str, Any], operation) -> Any:
+        try:
+            result = await operation
+            SYNC_ACTIONS.inc(action=action["op"], result="ok")
+            return result
+        except (httpx.HTTPError, OSError, VerificationError) as e:
+            SYNC_ACTIONS.inc(action=action["op"], result="failed")
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            reason = "changed on OneDrive during the sync" if status == 412 else f"{type(e).__name__}: {e}"
+            self.report["failed"].append({"path": action["path"], "action": action["op"], "error": reason[:300]})
+            logger.warning("onedrive_sync.action_failed", action=action["op"], path=action["path"], error=reason[:300])
+            return None
+
+    def _local_path(self, path: str) -> str:
+        return os.path.join(self.local_root, *path.split("/"))
+
+    def _remote_path(self, path: str) -> str:
+        return "/".join(part for part in (self.remote_root, path) if part)
+
+    def _item_url(self, path: str) -> str:
+        drive = f"{self.auth_handler.get_base_graph_url()}/users/{self.user_id}/drive"
+        remote_path = self._remote_path(path)
+        return f"{drive}/root:/{quote(remote_path)}:" if remote_path else f"{drive}/root"
+
+    async def _headers(self, etag: Optional[str] = None) -> dict[str, str]:
+        headers = {"Authorization": f"Bearer {await self.auth_handler.get_access_token_async()}"}
+        if etag:
+            headers["If-Match"] = etag
+        return headers
+
+    def _record_synced(self, path: str, entry: Optional[dict], item: Optional[dict], digest: Optional[str] = None):
+        item = item or {}
+        self._records.append({
+            "path": path, "is_folder": bool((entry or {}).get("is_folder") or item.get("is_folder") or "folder" in item),
+            "size": (entry or {}).get("size"), "mtime_ns": (entry or {}).get("mtime_ns"), "inode": (entry or {}).get("inode"),
+            "quick_xor": item.get("quick_xor") or ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash") or digest,
+            "item_id": item.get("id"), "ctag": item.get("ctag", item.get("cTag")), "etag": item.get("etag", item.get("eTag")),
+        })
+
+    def _stat(self, path: str) -> dict[str, Any]:
+        stat = os.stat(self._local_path(path))
+        return {"path": path, "is_folder": False, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    async def _mkdir_local(self, action: dict[str, Any]):
+        os.makedirs(self._local_path(action["path"]), exist_ok=True)
+        self.report["folders_created"] += 1
+        self._record_synced(action["path"], {"is_folder": True}, action["item"])
+
+    async def _mkdir_remote(self, client: httpx.AsyncClient, path: str, action: Optional[dict] = None):
+        """
+        Creates a folder on OneDrive. `path` "" is the synced folder itself, which is created with
+        its parents; other folders are created after their parents (see _execute).
+        """
+        segments = self._remote_path(path).split("/")
+        drive = f"{self.auth_handler.get_base_graph_url()}/users/{self.user_id}/drive"
+        item: dict[str, Any] = {}
+        for depth in range(1 if not path else len(segments), len(segments) + 1):
+            parent, name = "/".join(segments[:depth - 1]), segments[depth - 1]
+            url = f"{drive}/root:/{quote(parent)}:/children" if parent else f"{drive}/root/children"
+            response = await client.post(url, headers=await self._headers(), json={
+                "name": name, "folder": {}, "@microsoft.graph.conflictBehavior": "fail"})
+            if response.status_code != 409: # 409: it exists already
+                response.raise_for_status()
+                item = response.json()
+        if action is not None:
+            self.report["folders_created"] += 1
+            self._record_synced(path, {"is_folder": True}, {**item, "is_folder": True})
+
+    async def _move_local(self, action: dict[str, Any]):
+        target = self._local_path(action["path"])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self._local_path(action["source"]), target)
+        self.report["moved_local"] += 1
+        self._removed.append(action["base"]["key"])
+        previous = action["base"]
+        self._record_synced(action["path"], self._stat(action["path"]), {
+            "id": previous["item_id"], "ctag": previous["ctag"], "etag": previous["etag"], "quick_xor": previous["quick_xor"]})
+
+    async def _move_remote(self, client: httpx.AsyncClient, action: dict[str, Any]):
+        parent, _, name = self._remote_path(action["path"]).rpartition("/")
+        response = await client.patch(
+            f"{self.auth_handler.get_base_graph_url()}/users/{self.user_id}/drive/items/{action['item']['id']}",
+            headers=await self._headers(action["item"]["etag"]),
+            json={"name": name, "parentReference": {"path": f"/drive/root:/{parent}" if parent else "/drive/root:"}})
+        response.raise_for_status()
+        self.report["moved_remote"] += 1
+        self._removed.append(_key(action["source"]))
+        self._record_synced(action["path"], action["local"], {**response.json(), "quick_xor": action["item"]["quick_xor"]})
+
+    async def _set_conflict_aside(self, action: dict[str, Any]) -> dict[str, Any]:
+        stem, extension = posixpath.splitext(action["path"])
+        copy_path = f"{stem} (conflict {time.strftime('%Y-%m-%d %H%M%S')}){extension}"
+        os.replace(self._local_path(action["path"]), self._local_path(copy_path))
+        self.report["conflicts"].append({"path": action["path"], "local_copy": copy_path})
+        logger.info("onedrive_sync.conflict", path=action["path"], local_copy=copy_path)
+        return {**action, "op": "upload", "key": _key(copy_path), "path": copy_path, "local": self._stat(copy_path), "item": None}
+
+    async def _upload(self, client: httpx.AsyncClient, action: dict[str, Any]):
+        entry = self._stat(action["path"]) # Before reading: a change during the upload shows up next time
+        etag = (action["item"] or {}).get("etag")
+        async with self._slots:
+            hasher = QuickXorHash()
+            if entry["size"] <= SIMPLE_UPLOAD_LIMIT:
+                data = await asyncio.to_thread(self._read, action["path"], 0, entry["size"])
+                hasher.update(data)
+                response = await client.put(f"{self._item_url(action['path'])}/content",
+                                            headers={**await self._headers(etag), "Content-Type": "application/octet-stream"},
+                                            content=data)
+                response.raise_for_status()
+                item = response.json()
+            else:
+                item = await self._upload_session(client, action["path"], entry["size"], etag, hasher)
+        reported = ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash")
+        if not matches(reported, hasher.b64digest()):
+            raise VerificationError(f"OneDrive reports quickXorHash {reported} for the upload, the sent content hashes to {hasher.b64digest()}")
+        self.report["uploaded"] += 1
+        self.report["bytes_uploaded"] += entry["size"]
+        SYNC_BYTES.inc(entry["size"], direction="upload")
+        self._record_synced(action["path"], entry, item, hasher.b64digest())
+
+    async def _upload_session(self, client: httpx.AsyncClient, path: str, size: int, etag: Optional[str],
+                              hasher: QuickXorHash) -> dict:
+        response = await client.post(f"{self._item_url(path)}/createUploadSession", headers=await self._headers(etag),
+                                     json={"item": {"@microsoft.graph.conflictBehavior": "replace"}})
+        response.raise_for_status()
+        upload_url = response.json()["uploadUrl"]
+        try:
+            for start in range(0, size, UPLOAD_FRAGMENT_BYTES):
+                data = await asyncio.to_thread(self._read, path, start, UPLOAD_FRAGMENT_BYTES)
+                await asyncio.to_thread(hasher.update, data)
+                end = start + len(data) - 1
+                # The upload URL is pre-authenticated; it must not receive the bearer token
+                response = await client.put(upload_url, content=data, headers={
+                    "Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(len(data))})
+                response.raise_for_status()
+            return response.json()
+        except BaseException:
+            with contextlib.suppress(httpx.HTTPError):
+                await client.delete(upload_url) # Discard the fragments already sent
+            raise
+
+    def _read(self, path: str, offset: int, length: int) -> bytes:
+        with open(self._local_path(path), "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
+    async def _download(self, client: httpx.AsyncClient, action: dict[str, Any]):
+        item = action["item"]
+        target = self._local_path(action["path"])
+        partial = f"{target}{PARTIAL_SUFFIX}"
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        received, hasher = 0, QuickXorHash()
+
+        def write(file, data: bytes):
+            file.write(data)
+            hasher.update(data)
+
+        async with self._slots:
+            url = f"{self.auth_handler.get_base_graph_url()}/users/{self.user_id}/drive/items/{item['id']}/content"
+            try:
+                async with client.stream("GET", url, headers=await self._headers()) as response:
+                    response.raise_for_status()
+                    with open(partial, "wb") as file:
+                        buffer = bytearray()
+                        async for chunk in response.aiter_bytes():
+                            buffer += chunk
+                            if len(buffer) >= WRITE_BUFFER_BYTES:
+                                await asyncio.to_thread(write, file, bytes(buffer))
+                                received += len(buffer)
+                                buffer.clear()
+                        await asyncio.to_thread(write, file, bytes(buffer))
+                        received += len(buffer)
+                if not matches(item["quick_xor"], hasher.b64digest()):
+                    raise VerificationError(f"downloaded content hashes to {hasher.b64digest()}, OneDrive reports {item['quick_xor']}")
+                os.replace(partial, target)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(partial)
+                raise
+        self.report["downloaded"] += 1
+        self.report["bytes_downloaded"] += received
+        SYNC_BYTES.inc(received, direction="download")
+        self._record_synced(action["path"], self._stat(action["path"]), item)
+
+    async def _delete_remote(self, client: httpx.AsyncClient, action: dict[str, Any]):
+        item = action["item"]
+        async with self._slots:
+            response = await client.delete(f"{self.auth_handler.get_base_graph_url()}/users/{self.user_id}/drive/items/{item['id']}",
+                                           headers=await self._headers(item["etag"] if not item["is_folder"] else None))
+        if response.status_code != 404: # Already gone
+            response.raise_for_status()
+        self.report["deleted_remote"] += 1
+        self._removed.append(action["key"])
+
+    async def _delete_local(self, action: dict[str, Any]):
+        path = self._local_path(action["path"])
+        if action["local"]["is_folder"]:
+            if os.listdir(path): # Something new appeared meanwhile; keep it
+                return
+            os.rmdir(path)
+        else:
+            os.remove(path)
+        self.report["deleted_local"] += 1
+        self._removed.append(action["key"])
+
+
+async def sync_onedrive_folder(auth_handler: MicrosoftGraphAuth, user_id: str, local_dir: str, remote_folder: str,
+                               **options) -> dict[str, Any]:
+    """
+    Syncs `local_dir` with the OneDrive folder `remote_folder` of `user_id`; see OneDriveSync for the options.
+
+    Returns:
+        The sync report: counts per action, bytes transferred, conflicts, skipped and failed paths.
+    """
+    return await OneDriveSync(auth_handler, user_id, local_dir, remote_folder, **options).run()
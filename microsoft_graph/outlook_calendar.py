@@ -5,7 +5,14 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional, Union
 
 from microsoft_graph.auth import MicrosoftGraphAuth
+from microsoft_graph.http_client import graph_client
+from tools.registry import tool
 
+@tool(
+    description="Creates a new event in an Outlook calendar for a specified user. Requires start and end times, subject, and optional attendees and body content.",
+    params={"timezone_str": "The IANA timezone ID for the start and end times, e.g., 'UTC', 'America/New_York', 'Asia/Colombo'."},
+    mutating=True
+)
 async def create_calendar_event(
     auth_handler: MicrosoftGraphAuth,
     user_id: str, # The user ID or userPrincipalName of the calendar owner
@@ -33,7 +40,7 @@ async def create_calendar_event(
         A dictionary indicating success/failure and event details.
     """
     try:
-        access_token = auth_handler.get_access_token() # get_access_token is sync, but called from async context
+        access_token = await auth_handler.get_access_token_async() # Cached; refreshed off the event loop
         base_url = auth_handler.get_base_graph_url()
 
         event_body = {
@@ -63,7 +70,7 @@ async def create_calendar_event(
 
         create_event_url = f"{base_url}/users/{user_id}/calendar/events"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.post(
                 create_event_url,
                 headers={
@@ -81,6 +88,10 @@ async def create_calendar_event(
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during event creation: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Updates an existing calendar event identified by its ID for a specified user. Provide the event ID and a dictionary of fields to update.",
+    mutating=True
+)
 async def update_calendar_event(
     auth_handler: MicrosoftGraphAuth,
     user_id: str,
@@ -100,12 +111,12 @@ async def update_calendar_event(
         A dictionary indicating success/failure.
     """
     try:
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         update_event_url = f"{base_url}/users/{user_id}/calendar/events/{event_id}"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.patch( # Use PATCH for partial updates
                 update_event_url,
                 headers={
@@ -118,10 +129,16 @@ async def update_calendar_event(
         
         return {"status": "success", "message": f"Calendar event {event_id} updated successfully."}
     except httpx.HTTPStatusError as e:
+        if e.response.status_code == 412:
+            return {"status": "error", "message": f"Event {event_id} was changed since it was last read; read it again before updating."}
         return {"status": "error", "message": f"Failed to update event {event_id}: HTTP Error {e.response.status_code} - {e.response.text}"}
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during event update: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Deletes a calendar event identified by its ID for a specified user. This action is permanent.",
+    mutating=True
+)
 async def delete_calendar_event(
     auth_handler: MicrosoftGraphAuth,
     user_id: str,
@@ -139,12 +156,12 @@ async def delete_calendar_event(
         A dictionary indicating success/failure.
     """
     try:
-        access_token = auth_handler.get_access_token()
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         delete_event_url = f"{base_url}/users/{user_id}/calendar/events/{event_id}"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.delete( # Use DELETE method
                 delete_event_url,
                 headers={
@@ -156,10 +173,53 @@ async def delete_calendar_event(
         return {"status": "success", "message": f"Calendar event {event_id} deleted successfully."}
     except httpx.HTTPStatusError as e:
         # 404 Not Found is common if event already deleted or ID is wrong
+        if e.response.status_code == 412:
+            return {"status": "error", "message": f"Event {event_id} was changed since it was last read; read it again before deleting."}
         return {"status": "error", "message": f"Failed to delete event {event_id}: HTTP Error {e.response.status_code} - {e.response.text}"}
     except Exception as e:
         return {"status": "error", "message": f"An error occurred during event deletion: {type(e).__name__} - {e}"}
 
+@tool(
+    description="Imports all events of an iCalendar (.ics) file stored in the user's OneDrive into their Outlook calendar in one job, including recurring events and time zones. Events already imported (same UID) are skipped. Returns a summary report. Use this instead of creating events one by one when migrating a calendar.",
+    mutating=True
+)
+async def import_ics_to_calendar(
+    auth_handler: MicrosoftGraphAuth,
+    user_id: str, # The user ID or userPrincipalName of the calendar owner
+    file_path: str, # Path of the .ics file in OneDrive, e.g. "Documents/team.ics"
+    calendar_id: Optional[str] = None,
+    default_timezone: str = "UTC",
+    include_attendees: bool = False,
+    dry_run: bool = False
+) -> dict:
+    """
+    Streams an .ics file from OneDrive into the calendar through batched requests (microsoft_graph/ics_import.py).
+
+    Args:
+        auth_handler: An authenticated MicrosoftGraphAuth instance.
+        user_id: The user ID or userPrincipalName whose calendar the events are imported into (and whose OneDrive holds the file).
+        file_path: The path of the .ics file in OneDrive (e.g., "Documents/team-calendar.ics").
+        calendar_id: The ID of the calendar to import into. Defaults to the user's main calendar.
+        default_timezone: The IANA timezone ID for events without one (floating times and all-day events), e.g. 'Europe/London'.
+        include_attendees: If true, the events' attendees are added, and Outlook sends each of them an invitation.
+        dry_run: If true, only report what would be imported.
+
+    Returns:
+        The import report: counts of events created, already imported, duplicated in the file, unsupported and failed, with the reasons for the first problems.
+    """
+    from microsoft_graph.ics_import import import_ics_from_onedrive
+
+    try:
+        return await import_ics_from_onedrive(auth_handler, user_id, file_path, calendar_id=calendar_id,
+                                              default_timezone=default_timezone, include_attendees=include_attendees,
+                                              dry_run=dry_run)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return {"status": "error", "message": f"The file '{file_path}' was not found in OneDrive."}
+        return {"status": "error", "message": f"Failed to import the calendar: HTTP Error {e.response.status_code} - {e.response.text}"}
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred during the calendar import: {type(e).__name__} - {e}"}
+
 # Example Usage (for testing purposes)
 async def main():
     auth_handler = MicrosoftGraphAuth()
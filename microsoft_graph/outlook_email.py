@@ -1,13 +1,19 @@
 import asyncio
 import httpx
 import json # To manually serialize JSON bodies
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 
 from microsoft_graph.auth import MicrosoftGraphAuth # Import the auth handler
+from microsoft_graph.http_client import graph_client
+from tools.registry import tool
 
 # We are no longer using msgraph-sdk's GraphServiceClient or any msgraph.generated.models.*
 # All Graph API calls are made directly using httpx.
 
+@tool(
+    description="Sends an email to a specified recipient with a given subject and body content. Requires the email address of the sender's mailbox (userPrincipalName) for application permissions.",
+    mutating=True
+)
 async def send_outlook_email(
     auth_handler: MicrosoftGraphAuth, # Pass the auth_handler directly
     recipient_email: str,
@@ -27,8 +33,8 @@ async def send_outlook_email(
         A dictionary indicating success or failure.
     """
     try:
-        # Get access token and base URL from the auth_handler (NO AWAIT HERE, as get_access_token is now SYNC)
-        access_token = auth_handler.get_access_token()
+        # Get access token and base URL from the auth_handler (cached token; refreshes run off the event loop)
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         message_payload = {
@@ -54,7 +60,7 @@ async def send_outlook_email(
         sender_mailbox_id = "ai_agent_dev2@intellistrata.com.au"
         send_mail_url = f"{base_url}/users/{sender_mailbox_id}/sendMail"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.post(
                 send_mail_url,
                 headers={
@@ -72,12 +78,13 @@ async def send_outlook_email(
         return {"status": "error", "message": f"Failed to send email: {type(e).__name__} - {e}"}
 
 
+@tool(description="Lists emails from a specified Outlook mailbox folder (e.g., 'Inbox', 'JunkEmail', 'SentItems', 'Drafts'). Can filter by unread status or importance. Returns a list of email summaries (id, subject, from, read status, importance).")
 async def list_outlook_emails(
     auth_handler: MicrosoftGraphAuth, # Pass the auth_handler directly
     user_id: str, # The user ID or userPrincipalName of the mailbox
     folder_name: str = "Inbox",
     filter_unread: bool = False,
-    filter_importance: Optional[str] = None # e.g., 'high', 'normal', 'low'
+    filter_importance: Optional[Literal["high", "normal", "low"]] = None
 ) -> Union[list[dict], dict]:
     """
     Lists emails from a specified Outlook folder with optional filters, using direct HTTP request with httpx.
@@ -93,8 +100,8 @@ async def list_outlook_emails(
         A list of dictionaries, each representing an email.
     """
     try:
-        # Get access token and base URL from the auth_handler (NO AWAIT HERE)
-        access_token = auth_handler.get_access_token()
+        # Get access token and base URL from the auth_handler
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         odata_filter_parts = []
@@ -118,7 +125,7 @@ async def list_outlook_emails(
         
         full_request_url = f"{request_url}?{'&'.join(query_params_list)}"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.get(
                 full_request_url,
                 headers={
@@ -150,6 +157,7 @@ async def list_outlook_emails(
         return {"status": "error", "message": f"An error occurred during email listing: {type(e).__name__} - {e}"}
 
 
+@tool(description="Retrieves the full body content and details of a specific email using its unique ID from a user's mailbox. Useful after listing emails.")
 async def get_outlook_email_content(
     auth_handler: MicrosoftGraphAuth, # Pass the auth_handler directly
     user_id: str,
@@ -167,15 +175,15 @@ async def get_outlook_email_content(
         A dictionary containing the email details and body content.
     """
     try:
-        # Get access token and base URL from the auth_handler (NO AWAIT HERE)
-        access_token = auth_handler.get_access_token()
+        # Get access token and base URL from the auth_handler
+        access_token = await auth_handler.get_access_token_async()
         base_url = auth_handler.get_base_graph_url()
 
         select_fields_str = "id,subject,from,receivedDateTime,isRead,importance,body,hasAttachments"
         
         request_url = f"{base_url}/users/{user_id}/messages/{email_id}?$select={select_fields_str}"
 
-        async with httpx.AsyncClient() as client:
+        async with graph_client() as client:
             response = await client.get(
                 request_url,
                 headers={
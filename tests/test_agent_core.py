@@ -0,0 +1,115 @@
+import asyncio
+import base64
+import json
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+from agent.core import AgentCore
+from benchmarks.standins import StubAuth
+
+
+def _completion(content=None, tool_calls=None) -> ChatCompletion:
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [
+            {"id": call_id, "type": "function", "function": {"name": name, "arguments": "{}"}}
+            for call_id, name in tool_calls
+        ]
+    return ChatCompletion.model_validate({
+        "id": "c", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+    })
+
+
+class _ScriptedClient:
+    """An AsyncOpenAI stand-in answering with the given completions in turn."""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        return self.responses.pop(0)
+
+
+def _agent(client) -> AgentCore:
+    return AgentCore("supervisor@example.com", openai_client=client, auth_handler=StubAuth("http://127.0.0.1:9"),
+                     tool_routing=False, completion_cache=None, outbox=None)
+
+
+def _call(call_id: str, name: str):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments="{}"))
+
+
+def _assert_every_call_answered(history):
+    for index, entry in enumerate(history):
+        for tool_call in entry.get("tool_calls") or []:
+            answers = [later for later in history[index + 1:] if later.get("tool_call_id") == tool_call["id"]]
+            assert len(answers) == 1, tool_call["id"]
+
+
+def test_bytes_in_a_tool_result_are_serialized():
+    agent = _agent(_ScriptedClient())
+
+    async def dispatch(tool_call):
+        return {"status": "success", "file_content": b"\x00\x01binary"}
+    agent._dispatch_tool_call = dispatch
+
+    asyncio.run(agent._run_tool_round([_call("a", "download_file_from_onedrive")], {}))
+    content = json.loads(agent.messages_history[-1]["content"])
+    assert base64.b64decode(content["file_content"]) == b"\x00\x01binary"
+
+
+def test_a_failing_tool_still_gets_a_result():
+    agent = _agent(_ScriptedClient())
+
+    async def dispatch(tool_call):
+        if tool_call.id == "b":
+            raise RuntimeError("boom")
+        return {"status": "success"}
+    agent._dispatch_tool_call = dispatch
+
+    results = asyncio.run(agent._run_tool_round([_call("a", "x"), _call("b", "y")], {}))
+    assert results[0] == {"status": "success"}
+    assert "boom" in results[1]["error"]
+    assert [entry["tool_call_id"] for entry in agent.messages_history[-2:]] == ["a", "b"]
+
+
+def test_a_failed_tool_round_leaves_a_valid_history():
+    client = _ScriptedClient(_completion(tool_calls=[("a", "x"), ("b", "y")]), _completion(content="Hello again"))
+    agent = _agent(client)
+
+    async def broken_round(tool_calls, seen_calls):
+        raise RuntimeError("boom")
+    run_tool_round, agent._run_tool_round = agent._run_tool_round, broken_round
+
+    result = asyncio.run(agent.process_message("download my file"))
+    assert result["text_output"].startswith("An internal error occurred")
+    _assert_every_call_answered(agent.messages_history)
+
+    # The next turn sends a history the API accepts
+    agent._run_tool_round = run_tool_round
+    assert asyncio.run(agent.process_message("hello"))["text_output"] == "Hello again"
+    _assert_every_call_answered(client.requests[-1]["messages"])
+
+
+def test_mutating_calls_of_a_round_run_one_at_a_time_in_order():
+    agent = _agent(_ScriptedClient())
+    agent.tools = SimpleNamespace(get=lambda name: SimpleNamespace(mutating=name.startswith("send")))
+    events = []
+
+    async def dispatch(tool_call):
+        events.append(("start", tool_call.id))
+        await asyncio.sleep(0.01)
+        events.append(("end", tool_call.id))
+        return {"status": "success"}
+    agent._dispatch_tool_call = dispatch
+
+    calls = [_call("r1", "read_a"), _call("r2", "read_b"), _call("s1", "send_a"), _call("s2", "send_b"), _call("r3", "read_c")]
+    asyncio.run(agent._run_tool_round(calls, {}))
+    assert events == [("start", "r1"), ("start", "r2"), ("end", "r1"), ("end", "r2"), # Reads overlap
+                      ("start", "s1"), ("end", "s1"), ("start", "s2"), ("end", "s2"),
+                      ("start", "r3"), ("end", "r3")]
+    assert [entry["tool_call_id"] for entry in agent.messages_history[-5:]] == ["r1", "r2", "s1", "s2", "r3"]
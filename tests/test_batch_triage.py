@@ -0,0 +1,72 @@
+import asyncio
+import json
+import re
+
+from openai.types.chat import ChatCompletion
+
+from agent import batch_triage
+from agent.batch_triage import BatchTriage
+from agent.model_router import ModelRouter
+
+
+class _FakeAgent:
+    """
+    Answers triage completions, labelling every email routine. A completion for a batch holding
+    one of `failing_refs` raises its first `failures` times (every time when None).
+    """
+    def __init__(self, failing_refs=(), failures=None):
+        self.model_router = ModelRouter.from_env()
+        self.failing_refs = set(failing_refs)
+        self.failures = failures
+        self.calls = 0
+
+    async def _create_completion(self, route=None, cacheable=False, **kwargs):
+        self.calls += 1
+        refs = re.findall(r'"ref":"(e\d+)"', kwargs["messages"][-1]["content"])
+        if self.failing_refs & set(refs) and (self.failures is None or self.failures > 0):
+            if self.failures is not None:
+                self.failures -= 1
+            raise RuntimeError("429 Too Many Requests")
+        results = [{"ref": ref, "label": "routine", "action": "none", "escalate": False, "reason": "newsletter"} for ref in refs]
+        return ChatCompletion.model_validate({
+            "id": "c", "object": "chat.completion", "created": 0, "model": "m",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps({"results": results})}}],
+        })
+
+
+def _emails(count: int) -> list[dict]:
+    return [{"id": f"m{index}", "from": "news@example.com", "subject": f"Update {index}", "body_preview": "..."}
+            for index in range(count)]
+
+
+def _triage(agent, emails, **options):
+    return asyncio.run(BatchTriage(agent, max_batch_size=5, max_concurrent_batches=1, **options).triage(emails))
+
+
+def test_batches_every_email():
+    agent = _FakeAgent()
+    report = _triage(agent, _emails(12))
+    assert agent.calls == 3
+    assert report["stats"]["llm"] == 12
+    assert report["escalations"] == []
+
+
+def test_a_failed_completion_is_retried(monkeypatch):
+    monkeypatch.setattr(batch_triage, "ERROR_BACKOFF_SECONDS", 0.0)
+    agent = _FakeAgent(failing_refs={"e6"}, failures=1)
+    report = _triage(agent, _emails(12))
+    assert report["stats"]["llm"] == 12
+    assert report["stats"]["failed"] == 0
+
+
+def test_a_batch_that_keeps_failing_only_fails_its_own_emails(monkeypatch):
+    monkeypatch.setattr(batch_triage, "ERROR_BACKOFF_SECONDS", 0.0)
+    agent = _FakeAgent(failing_refs={"e6"})
+    report = _triage(agent, _emails(12), max_error_retries=2)
+    assert agent.calls == 5 # Two batches, plus the failing one tried three times
+    assert report["stats"]["llm"] == 7
+    assert report["stats"]["failed"] == 5
+    failed = [result for result in report["results"].values() if result["source"] == "failed"]
+    assert all(result["escalate"] for result in failed)
+    assert len(report["escalations"]) == 5
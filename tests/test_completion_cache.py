@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from openai.types.chat import ChatCompletion
+
+from agent.completion_cache import CompletionCache
+
+
+def _completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "c", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    })
+
+
+REQUEST = {"model": "m", "messages": [{"role": "user", "content": "What is on my calendar?"}]}
+
+
+def test_sqlite_lookups_and_stores_run_off_the_event_loop(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "cache.db"))
+    threads = []
+    for method in ("get", "set"):
+        original = getattr(cache.backend, method)
+
+        def record(*args, original=original):
+            threads.append(threading.get_ident())
+            return original(*args)
+        setattr(cache.backend, method, record)
+
+    async def run():
+        key, cached = await cache.get_async(REQUEST)
+        assert cached is None
+        await cache.put_async(key, _completion("Two meetings."))
+        return (await cache.get_async(REQUEST))[1], threading.get_ident()
+
+    cached, loop_thread = asyncio.run(run())
+    assert cached.choices[0].message.content == "Two meetings."
+    assert len(threads) == 3 and loop_thread not in threads
+    cache.close()
+
+
+def test_the_memory_backend_is_used_inline():
+    cache = CompletionCache()
+    calls = []
+    original = cache.backend.get
+    cache.backend.get = lambda key: calls.append(threading.get_ident()) or original(key)
+
+    async def run():
+        await cache.get_async(REQUEST)
+        return threading.get_ident()
+
+    assert calls == [asyncio.run(run())]
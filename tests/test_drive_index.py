@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+
+from benchmarks.standins import StubAuth
+from microsoft_graph import drive_index
+from microsoft_graph.drive_index import DriveIndex
+from utils.text_extraction import ExtractionError
+
+USER = "user@example.com"
+
+
+def _root() -> dict:
+    return {"id": "root", "root": {}, "folder": {}}
+
+
+def _folder(item_id: str, name: str, parent: str = "root") -> dict:
+    return {"id": item_id, "name": name, "folder": {}, "parentReference": {"id": parent}, "cTag": f"c-{item_id}"}
+
+
+def _file(item_id: str, name: str, parent: str = "root", ctag: str = "c1") -> dict:
+    return {"id": item_id, "name": name, "file": {"mimeType": "text/plain"}, "parentReference": {"id": parent},
+            "cTag": ctag, "size": 10}
+
+
+def _paths(index: DriveIndex) -> dict[str, str]:
+    return {item["id"]: item["path"] for item in index.tree(USER, "")}
+
+
+def test_renamed_and_moved_folders_rewrite_the_paths_below_them():
+    index = DriveIndex()
+    index._apply(USER, [_root(), _folder("f", "Reports"), _folder("q", "Q3", parent="f"),
+                        _file("a", "budget.xlsx", parent="q")], 1, full=True)
+    assert _paths(index) == {"f": "Reports", "q": "Reports/Q3", "a": "Reports/Q3/budget.xlsx"}
+
+    index._apply(USER, [_folder("f", "Finance")], 2, full=False) # Delta only reports the renamed folder
+    assert _paths(index)["a"] == "Finance/Q3/budget.xlsx"
+    index._apply(USER, [_folder("archive", "Archive"), _folder("q", "Q3", parent="archive")], 3, full=False)
+    assert _paths(index)["a"] == "Archive/Q3/budget.xlsx"
+    assert index.search(USER, "archive")[0]["id"] == "archive"
+
+
+def test_a_deleted_folder_takes_its_subtree_with_it():
+    index = DriveIndex()
+    index._apply(USER, [_root(), _folder("f", "Old"), _file("a", "alpha.txt", parent="f"), _file("b", "b.txt")], 1, full=True)
+    _, deleted, _ = index._apply(USER, [{"id": "f", "deleted": {}}], 2, full=False)
+    assert deleted == 2
+    assert _paths(index) == {"b": "b.txt"}
+    assert index.search(USER, "alpha") == []
+
+
+def test_a_full_resync_drops_items_it_did_not_see():
+    index = DriveIndex()
+    index._apply(USER, [_root(), _file("a", "a.txt"), _file("b", "b.txt")], 1, full=True)
+    _, deleted, _ = index._apply(USER, [_root(), _file("b", "b.txt")], 2, full=True)
+    assert deleted == 1
+    assert _paths(index) == {"b": "b.txt"}
+
+
+def test_only_new_or_changed_files_are_extracted():
+    index = DriveIndex()
+    _, _, to_extract = index._apply(USER, [_root(), _file("a", "a.txt")], 1, full=True)
+    assert [item["id"] for item in to_extract] == ["a"]
+    index._store_content(USER, to_extract[0], "text", "ok")
+    assert index._apply(USER, [_file("a", "renamed.txt")], 2, full=False)[2] == [] # Same cTag
+    assert [item["id"] for item in index._apply(USER, [_file("a", "renamed.txt", ctag="c2")], 3, full=False)[2]] == ["a"]
+
+
+def test_search_ranks_name_matches_above_content_matches():
+    index = DriveIndex()
+    _, _, files = index._apply(USER, [_root(), _folder("f", "Finance"), _file("n", "budget 2025.xlsx"),
+                                      _file("c", "notes.txt", parent="f"), _file("p", "summary.txt", parent="f"),
+                                      _file("x", "holiday.txt")], 1, full=True)
+    contents = {"n": "", "c": "the budget for next year", "p": "nothing here", "x": "beach"}
+    for item in files:
+        index._store_content(USER, item, contents[item["id"]], "ok")
+
+    results = index.search(USER, "find the budget")
+    assert [result["id"] for result in results] == ["n", "c"]
+    assert results[0]["score"] > results[1]["score"]
+    assert "[budget]" in results[1]["snippet"]
+    assert [result["id"] for result in index.search(USER, "finance")][0] == "f" # Folder name before its contents
+    assert [result["id"] for result in index.search(USER, "budg")] == ["n", "c"] # Prefix of the last word
+    assert [result["id"] for result in index.search(USER, "budget", file_type="txt")] == ["c"]
+    assert {result["id"] for result in index.search(USER, "budget beach")} == {"n", "c", "x"} # Any term, as a last resort
+
+
+class _Extractor:
+    max_bytes = 1024 * 1024
+
+    def cached(self, cache_key):
+        return None
+
+    async def extract(self, data, name, mime_type, cache_key=None):
+        raise ExtractionError("corrupt file")
+
+
+def _extract(index: DriveIndex, monkeypatch, status: int) -> list[dict]:
+    monkeypatch.setattr(drive_index, "get_extractor", _Extractor)
+    _, _, to_extract = index._apply(USER, [_root(), _file("a", "a.txt")], 1, full=True)
+
+    async def run():
+        transport = httpx.MockTransport(lambda request: httpx.Response(status, content=b"data"))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await index._extract_all(client, StubAuth("https://graph.test/v1.0"), USER, to_extract)
+
+    assert asyncio.run(run()) == (0, 1)
+    return index._apply(USER, [], 2, full=False)[2]
+
+
+def test_a_failed_download_is_retried_by_the_next_sync(monkeypatch):
+    assert [item["id"] for item in _extract(DriveIndex(), monkeypatch, 503)] == ["a"]
+
+
+def test_a_file_that_cannot_be_parsed_waits_for_a_change(monkeypatch):
+    assert _extract(DriveIndex(), monkeypatch, 200) == []
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+
+from microsoft_graph.etag_cache import ConditionalTransport, ETagStore, resource_key
+
+GRAPH = "https://graph.microsoft.com/v1.0"
+ITEM = f"{GRAPH}/users/a@b.com/drive/items/01X"
+
+
+class _Graph:
+    """A MockTransport handler serving one drive item whose content and eTag can change."""
+    def __init__(self, content: bytes = b"hello"):
+        self.content = content
+        self.etag = '"v1"'
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304)
+        if request.url.path.endswith("/content"):
+            # No Content-Length, in several chunks, like a chunked download
+            chunks = [self.content[start:start + 4] for start in range(0, len(self.content), 4)]
+            return httpx.Response(200, headers={"ETag": self.etag}, stream=_Chunks(chunks))
+        if request.method == "PATCH":
+            return httpx.Response(200, json={"id": "01X", "eTag": self.etag})
+        return httpx.Response(200, json={"id": "01X", "name": "a.txt", "eTag": self.etag})
+
+
+class _Chunks(httpx.AsyncByteStream):
+    """A single-pass body stream, like a network response's."""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def _client(graph: _Graph, **options) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=ConditionalTransport(httpx.MockTransport(graph), ETagStore(), **options))
+
+
+def test_resource_key():
+    assert resource_key(httpx.URL(f"{GRAPH}/users/A@B.com/drive/items/01X/content")) == "/users/a@b.com/drive/items/01x"
+    assert resource_key(httpx.URL(f"{GRAPH}/users/a@b.com/drive/root:/Docs/a.txt:/content")) == "/users/a@b.com/drive/root:/docs/a.txt"
+
+
+def test_unchanged_metadata_is_served_from_the_cache():
+    async def run():
+        graph = _Graph()
+        async with _client(graph) as client:
+            first = await client.get(ITEM)
+            second = await client.get(ITEM)
+        assert graph.requests[1].headers["If-None-Match"] == '"v1"'
+        assert second.headers["x-graph-cache"] == "hit"
+        assert second.json() == first.json()
+    asyncio.run(run())
+
+
+def test_content_downloads_are_not_stored_by_default():
+    async def run():
+        graph = _Graph()
+        async with _client(graph) as client:
+            await client.get(f"{ITEM}/content")
+            second = await client.get(f"{ITEM}/content")
+            # The item's eTag is still known for If-Match
+            await client.patch(ITEM, json={"name": "b.txt"})
+        assert "If-None-Match" not in graph.requests[1].headers
+        assert "x-graph-cache" not in second.headers
+        assert graph.requests[2].headers["If-Match"] == '"v1"'
+    asyncio.run(run())
+
+
+def test_content_downloads_are_stored_when_enabled():
+    async def run():
+        graph = _Graph()
+        async with _client(graph, cache_content=True) as client:
+            await client.get(f"{ITEM}/content")
+            second = await client.get(f"{ITEM}/content")
+        assert second.content == b"hello"
+        assert second.headers["x-graph-cache"] == "hit"
+    asyncio.run(run())
+
+
+def test_oversized_body_without_length_streams_through_intact():
+    async def run():
+        graph = _Graph(bytes(range(256)) * 8)
+        async with _client(graph, cache_content=True, max_entry_bytes=1000) as client:
+            first = await client.get(f"{ITEM}/content")
+            second = await client.get(f"{ITEM}/content")
+        assert first.content == second.content == bytes(range(256)) * 8
+        assert "If-None-Match" not in graph.requests[1].headers
+    asyncio.run(run())
+
+
+def test_changed_entity_replaces_the_entry():
+    async def run():
+        graph = _Graph()
+        async with _client(graph) as client:
+            await client.get(ITEM)
+            graph.etag = '"v2"'
+            changed = await client.get(ITEM)
+            again = await client.get(ITEM)
+        assert changed.json()["eTag"] == '"v2"'
+        assert again.headers["x-graph-cache"] == "hit"
+    asyncio.run(run())
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.standins import StandInServer, StubAuth
+from microsoft_graph.ics_import import (IcsParser, TimeZones, UnsupportedEvent, _lines, import_ics, parse_content_line,
+                                        rrule_to_recurrence, vevent_to_event)
+from microsoft_graph.outlook_calendar import import_ics_to_calendar
+
+
+def _calendar(*events: str) -> str:
+    return "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n" + "".join(events) + "END:VCALENDAR\r\n"
+
+
+def _vevent(uid: str, *lines: str) -> str:
+    return f"BEGIN:VEVENT\r\nUID:{uid}\r\n" + "".join(line + "\r\n" for line in lines) + "END:VEVENT\r\n"
+
+
+def _components(text: str) -> list[dict]:
+    parser = IcsParser()
+    components = [component for line in text.splitlines(keepends=True) for component in parser.feed(line)]
+    return components + parser.close()
+
+
+def _event(*lines: str, zones: TimeZones = None) -> dict:
+    component, = _components(_calendar(_vevent("e@test", *lines)))
+    return vevent_to_event(component, zones or TimeZones("Europe/London"))
+
+
+def test_parse_content_line_with_quoted_parameters():
+    name, params, value = parse_content_line('ATTENDEE;CN="Doe, Jane";ROLE=OPT-PARTICIPANT:mailto:jane@example.com')
+    assert name == "ATTENDEE"
+    assert params == {"CN": "Doe, Jane", "ROLE": "OPT-PARTICIPANT"}
+    assert value == "mailto:jane@example.com"
+
+
+def test_parser_unfolds_lines_and_hands_out_events():
+    text = _calendar(_vevent("a@test", "SUMMARY:A long", "  title", "DTSTART:20250101T090000Z"), _vevent("b@test", "DTSTART:20250102"))
+    first, second = _components(text)
+    assert ("SUMMARY", {}, "A long title") in first["props"]
+    assert second["name"] == "VEVENT"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 13])
+def test_streamed_lines_survive_any_chunking(size):
+    text = _calendar(_vevent("a@test", "SUMMARY:Hello\u2028World\x0bagain", "DESCRIPTION:First part,",
+                             "  second part", "DTSTART:20250101T090000Z"))
+
+    async def chunks():
+        for start in range(0, len(text), size):
+            yield text[start:start + size]
+
+    async def components():
+        parser = IcsParser()
+        found = [component async for line in _lines(chunks()) for component in parser.feed(line)]
+        return found + parser.close()
+
+    event, = asyncio.run(components())
+    assert [prop[0] for prop in event["props"]] == ["UID", "SUMMARY", "DESCRIPTION", "DTSTART"]
+    assert ("SUMMARY", {}, "Hello\u2028World\x0bagain") in event["props"]
+    assert ("DESCRIPTION", {}, "First part, second part") in event["props"]
+
+
+def test_floating_utc_and_all_day_times():
+    assert _event("DTSTART:20250301T100000", "DURATION:PT1H")["payload"]["start"] == \
+        {"dateTime": "2025-03-01T10:00:00", "timeZone": "Europe/London"}
+    assert _event("DTSTART:20250301T100000Z")["payload"]["start"]["timeZone"] == "UTC"
+    payload = _event("DTSTART;VALUE=DATE:20250301")["payload"]
+    assert payload["isAllDay"] is True
+    assert payload["end"]["dateTime"] == "2025-03-02T00:00:00"
+
+
+def test_time_zone_resolution():
+    zones = TimeZones("UTC")
+    assert zones.resolve("/mozilla.org/20050126_1/Europe/Berlin") == "Europe/Berlin"
+    assert zones.resolve("W. Europe Standard Time") == "W. Europe Standard Time"
+    component, = _components(_calendar("BEGIN:VTIMEZONE\r\nTZID:Custom\r\nX-LIC-LOCATION:Australia/Sydney\r\nEND:VTIMEZONE\r\n"))
+    zones.add(component)
+    assert zones.resolve("Custom") == "Australia/Sydney"
+    with pytest.raises(UnsupportedEvent):
+        zones.resolve("Mars/Olympus_Mons")
+
+
+@pytest.mark.parametrize("rule, start, pattern", [
+    ("FREQ=DAILY;INTERVAL=2", date(2025, 1, 1), {"type": "daily", "interval": 2}),
+    ("FREQ=WEEKLY;BYDAY=MO,WE", date(2025, 1, 6),
+     {"type": "weekly", "interval": 1, "daysOfWeek": ["monday", "wednesday"], "firstDayOfWeek": "monday"}),
+    ("FREQ=MONTHLY;BYDAY=-1FR", date(2025, 1, 31),
+     {"type": "relativeMonthly", "interval": 1, "daysOfWeek": ["friday"], "index": "last"}),
+    ("FREQ=MONTHLY;BYDAY=TU;BYSETPOS=2", date(2025, 1, 14),
+     {"type": "relativeMonthly", "interval": 1, "daysOfWeek": ["tuesday"], "index": "second"}),
+    ("FREQ=MONTHLY", date(2025, 1, 15), {"type": "absoluteMonthly", "interval": 1, "dayOfMonth": 15}),
+    ("FREQ=YEARLY", date(2025, 3, 3), {"type": "absoluteYearly", "interval": 1, "dayOfMonth": 3, "month": 3}),
+])
+def test_rrule_patterns(rule, start, pattern):
+    assert rrule_to_recurrence(rule, start, "UTC")["pattern"] == pattern
+
+
+def test_rrule_ranges():
+    start = datetime(2025, 1, 6, 9)
+    assert rrule_to_recurrence("FREQ=DAILY;COUNT=5", start, "UTC")["range"] == \
+        {"type": "numbered", "startDate": "2025-01-06", "recurrenceTimeZone": "UTC", "numberOfOccurrences": 5}
+    assert rrule_to_recurrence("FREQ=DAILY;UNTIL=20250131T235959Z", start, "UTC")["range"]["endDate"] == "2025-01-31"
+    assert rrule_to_recurrence("FREQ=DAILY", start, "UTC")["range"]["type"] == "noEnd"
+
+
+@pytest.mark.parametrize("rule", ["FREQ=HOURLY", "FREQ=DAILY;BYHOUR=9,17", "FREQ=MONTHLY;BYMONTHDAY=1,15",
+                                  "FREQ=MONTHLY;BYMONTHDAY=-1", "FREQ=MONTHLY;BYDAY=1MO,-1FR"])
+def test_rrules_graph_cannot_express(rule):
+    with pytest.raises(UnsupportedEvent):
+        rrule_to_recurrence(rule, date(2025, 1, 1), "UTC")
+
+
+def test_modified_occurrences_are_unsupported():
+    with pytest.raises(UnsupportedEvent):
+        _event("DTSTART:20250301T100000Z", "RECURRENCE-ID:20250301T100000Z")
+
+
+def test_utc_exdate_is_converted_to_the_series_zone():
+    event = _event("DTSTART;TZID=Europe/Berlin:20240101T100000", "RRULE:FREQ=WEEKLY",
+                   "EXDATE:20240108T090000Z", "EXDATE;TZID=Europe/Berlin:20240115T100000")
+    assert event["exdates"] == [("2024-01-08T10:00", "Europe/Berlin"), ("2024-01-15T10:00", "Europe/Berlin")]
+
+
+def test_exdate_in_a_zone_zoneinfo_does_not_know_keeps_its_own_zone():
+    event = _event("DTSTART;TZID=W. Europe Standard Time:20240101T100000", "RRULE:FREQ=WEEKLY", "EXDATE:20240108T090000Z")
+    assert event["exdates"] == [("2024-01-08T09:00", "UTC")]
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_import_cancels_exdates_and_skips_what_is_already_imported():
+    text = _calendar(
+        _vevent("weekly@test", "SUMMARY:Team sync", "DTSTART;TZID=Europe/Berlin:20240101T100000", "DURATION:PT30M",
+                "RRULE:FREQ=WEEKLY;COUNT=6", "EXDATE:20240108T090000Z", "EXDATE:20240122T100000Z"),
+        _vevent("once@test", "SUMMARY:Once", "DTSTART:20240105T120000Z"),
+        _vevent("once@test", "SUMMARY:Once again", "DTSTART:20240105T120000Z"),
+        _vevent("hourly@test", "SUMMARY:Hourly", "DTSTART:20240105T120000Z", "RRULE:FREQ=HOURLY"),
+    )
+    with StandInServer(graph_latency_ms=0) as server:
+        auth = StubAuth(server.graph_url)
+        report = _run(import_ics(auth, "user@example.com", [text]))
+        assert (report["created"], report["duplicate"], report["unsupported"]) == (2, 1, 1)
+        assert report["occurrences_cancelled"] == 1
+        series_id, = [event_id for event_id, event in server.events.items() if event.get("recurrence")]
+        assert server.cancelled == {f"{series_id}-occ-20240108"}
+        # 2024-01-22T10:00Z is 11:00 in Berlin: no occurrence starts then, which is reported
+        assert report["exdates_unmatched"] == 1
+        assert any("2024-01-22T11:00" in problem["reason"] for problem in report["problems"])
+
+        again = _run(import_ics(auth, "user@example.com", [text]))
+        assert (again["created"], again["existing"]) == (0, 2)
+
+
+def test_dry_run_creates_nothing():
+    with StandInServer(graph_latency_ms=0) as server:
+        report = _run(import_ics(StubAuth(server.graph_url), "user@example.com",
+                                 [_calendar(_vevent("a@test", "DTSTART:20240105T120000Z"))], dry_run=True))
+        assert report["would_create"] == 1
+        assert server.events == {}
+
+
+class _Forbidden(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'{"error": {"code": "accessDenied", "message": "Access denied"}}'
+        self.send_response(403)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_tool_reports_a_streamed_http_error():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Forbidden)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        auth = StubAuth(f"http://127.0.0.1:{server.server_address[1]}/v1.0")
+        result = _run(import_ics_to_calendar(auth, "user@example.com", "Documents/team.ics"))
+    finally:
+        server.shutdown()
+    assert result["status"] == "error"
+    assert "403" in result["message"] and "Access denied" in result["message"]
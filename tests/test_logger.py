@@ -0,0 +1,24 @@
+from utils.logger import sanitize
+
+
+def test_secret_keys_are_redacted():
+    logged = sanitize({"Authorization": "Bearer abc", "access_token": "t", "refresh_token": "r", "client_secret": "s",
+                       "password": "p", "api_key": "k", "token": "t"}, 100)
+    assert set(logged.values()) == {"[REDACTED]"}
+
+
+def test_measurements_named_like_secrets_are_kept():
+    logged = sanitize({"graph_token": 12.5, "prompt_tokens": 812, "completion_tokens": 64, "tokens_saved": 300}, 100)
+    assert logged == {"graph_token": 12.5, "prompt_tokens": 812, "completion_tokens": 64, "tokens_saved": 300}
+
+
+def test_secrets_inside_text_are_redacted():
+    logged = sanitize({"error": "401 for header Authorization: Bearer eyJhbGciOi.abc"}, 200)
+    assert "eyJhbGciOi" not in logged["error"]
+
+
+def test_content_is_replaced_by_its_size_and_long_values_are_capped():
+    logged = sanitize({"body": "x" * 5000, "note": "y" * 50, "file_content": b"\x00" * 10}, 20)
+    assert logged["body"] == "[5000 chars]"
+    assert logged["file_content"] == "[10 bytes]"
+    assert logged["note"].startswith("y" * 20) and "truncated 30 chars" in logged["note"]
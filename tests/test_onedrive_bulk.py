@@ -0,0 +1,160 @@
+import asyncio
+from urllib.parse import unquote
+
+import pytest
+
+from benchmarks.standins import StubAuth
+from microsoft_graph import onedrive_bulk
+from microsoft_graph.onedrive_bulk import BulkDriveJob, _match, _may_contain_matches, _segments
+
+
+@pytest.mark.parametrize("pattern, path, expected", [
+    ("Reports/*.pdf", "Reports/a.PDF", True),
+    ("Reports/*.pdf", "Reports/2023/a.pdf", False),
+    ("Reports/**/*.pdf", "Reports/a.pdf", True),
+    ("Reports/**/*.pdf", "Reports/2023/q1/a.pdf", True),
+    ("**/~$*", "Deep/er/~$lock.docx", True),
+    ("*", "Reports", True),
+    ("*", "Reports/a.pdf", False),
+    ("Report?/[ab].txt", "Reports/b.txt", True),
+])
+def test_match(pattern, path, expected):
+    assert _match(_segments(pattern), _segments(path)) is expected
+
+
+@pytest.mark.parametrize("pattern, folder, expected", [
+    ("Reports/*.pdf", "Reports", True),
+    ("Reports/*.pdf", "Reports/2023", False),
+    ("Reports/*.pdf", "Other", False),
+    ("*/2023/*", "Anything", True),
+    ("Reports/**/*.pdf", "Reports/2023/q1", True),
+])
+def test_may_contain_matches(pattern, folder, expected):
+    assert _may_contain_matches(_segments(pattern), _segments(folder)) is expected
+
+
+class _Drive:
+    """A drive tree served to BulkDriveJob._list and graph_batch, recording listings and writes."""
+    def __init__(self, tree: dict):
+        self.items: dict[str, dict] = {} # Ids are the items' paths
+        self.children: dict[str, list[dict]] = {}
+        self.listed: list[str] = []
+        self.written: list[dict] = []
+        self._add("", tree)
+
+    def _add(self, folder_id: str, tree: dict):
+        self.children[folder_id] = []
+        for name, subtree in tree.items():
+            item_id = f"{folder_id}/{name}" if folder_id else name
+            item = {"id": item_id, "name": name, "eTag": f"e-{item_id}", "parentReference": {"id": folder_id or "root"}}
+            if isinstance(subtree, dict):
+                item["folder"] = {}
+                self._add(item_id, subtree)
+            self.items[item_id] = item
+            self.children[folder_id].append(item)
+
+    @staticmethod
+    def _id(url: str) -> str:
+        address = unquote(url.split("/drive/", 1)[1].split("?", 1)[0])
+        if address == "root":
+            return ""
+        return address[len("root:/"):-1] if address.startswith("root:/") else address[len("items/"):]
+
+    async def list_children(self, client, folder_url: str) -> list[dict]:
+        folder_id = self._id(folder_url)
+        self.listed.append(folder_id)
+        return self.children[folder_id]
+
+    async def batch(self, auth_handler, requests: list[dict]) -> list[dict]:
+        responses = []
+        for request in requests:
+            if request["method"] == "GET":
+                item = self.items.get(self._id(request["url"]))
+                responses.append({"status": 200 if item else 404, "headers": {}, "body": item})
+            else:
+                self.written.append(request)
+                responses.append({"status": 204, "headers": {}, "body": None})
+        return responses
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    drive = _Drive({
+        "Reports": {"2023": {"a.pdf": None, "b.pdf": None}, "c.pdf": None, "notes.txt": None},
+        "Archive": {"old.pdf": None},
+        "Temp": {},
+    })
+    monkeypatch.setattr(BulkDriveJob, "_list", lambda job, client, folder_url: drive.list_children(client, folder_url))
+    monkeypatch.setattr(onedrive_bulk, "graph_batch", drive.batch)
+    return drive
+
+
+def _run(paths: list[str], **options) -> dict:
+    job = BulkDriveJob(StubAuth("https://graph.test/v1.0"), "user@example.com", "delete", **options)
+    return asyncio.run(job.run(paths))
+
+
+def _paths(report: dict) -> list[str]:
+    return [line["path"] for line in report["items"]]
+
+
+def test_a_selected_folder_covers_the_items_below_it(drive):
+    report = _run(["Reports/**/*.pdf", "Reports/*"], dry_run=True)
+    assert _paths(report) == ["Reports/2023", "Reports/c.pdf", "Reports/notes.txt"]
+    assert report["counts"] == {"planned": 3}
+    assert report["message"] == "Would delete 3 item(s)."
+
+
+def test_patterns_only_list_folders_that_can_match(drive):
+    report = _run(["Reports/*.pdf"])
+    assert drive.listed == ["Reports"]
+    assert report["counts"] == {"deleted": 1}
+    assert drive.written == [{"method": "DELETE", "url": "/users/user%40example.com/drive/items/Reports/c.pdf",
+                              "headers": {"If-Match": "e-Reports/c.pdf"}}]
+
+
+def test_the_item_limit_counts_before_folders_absorb_their_contents(drive, monkeypatch):
+    monkeypatch.setattr(onedrive_bulk, "MAX_ITEMS", 3)
+    report = _run(["Reports/**"], dry_run=True) # 5 matches, 1 item after collapsing
+    assert report["status"] == "error" and "more than the 3 items" in report["message"]
+
+
+def test_expansion_stops_once_past_the_limit(drive, monkeypatch):
+    monkeypatch.setattr(onedrive_bulk, "MAX_ITEMS", 2)
+    assert _run(["**"], dry_run=True)["status"] == "error"
+    assert drive.listed == [""] # The root's three items were enough; no folder below it was listed
+
+
+def test_root_patterns_need_a_dry_run_first(drive):
+    refused = _run(["*"])
+    assert refused["status"] == "error" and refused["confirmation_required"]
+    assert drive.written == []
+
+    preview = _run(["*"], dry_run=True)
+    assert _paths(preview) == ["Archive", "Reports", "Temp"]
+    assert _run(["*"], confirm_token="0" * 16)["confirmation_required"]
+    done = _run(["*"], confirm_token=preview["confirm_token"])
+    assert done["counts"] == {"deleted": 3}
+
+
+def test_folders_selected_by_a_pattern_need_a_dry_run_first(drive):
+    assert _run(["Reports/2*"])["confirmation_required"]
+    assert "confirmation_required" not in _run(["Reports/*.txt"]) # Files only
+    assert "confirmation_required" not in _run(["Temp"]) # Named, not matched
+    copy = BulkDriveJob(StubAuth("https://graph.test/v1.0"), "user@example.com", "copy", "Backup", dry_run=True)
+    assert "confirm_token" not in asyncio.run(copy.run(["Reports/2*"])) # Copies destroy nothing
+
+
+def test_report_puts_failures_first_and_caps_the_lines(monkeypatch):
+    monkeypatch.setattr(onedrive_bulk, "REPORT_ITEMS", 2)
+    job = BulkDriveJob(StubAuth("https://graph.test/v1.0"), "user@example.com", "move", "Archive")
+    outcomes = [{"path": "a", "result": "moved"}, {"path": "b", "result": "moved"},
+                {"path": "c", "result": "changed", "error": "changed since it was listed"}]
+    report = job._report(outcomes, ["Nope/*.pdf"], 0.25)
+    assert report["status"] == "partial"
+    assert report["counts"] == {"moved": 2, "changed": 1}
+    assert [line["path"] for line in report["items"]] == ["c", "a"]
+    assert report["items_omitted"] == 1
+    assert report["message"] == "Moved 2 of 3 item(s) to 'Archive'; 1 did not succeed; no match for 'Nope/*.pdf'."
+    assert report["unmatched"] == ["Nope/*.pdf"]
+    assert job._report([{"path": "c", "result": "failed"}], [], 0)["status"] == "error"
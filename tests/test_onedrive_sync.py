@@ -0,0 +1,113 @@
+import pytest
+
+from microsoft_graph.onedrive_sync import OneDriveSync
+
+
+def _local(path: str, size: int = 5, mtime: int = 100, inode: int = 1, is_folder: bool = False) -> dict:
+    return {"path": path, "is_folder": is_folder, "size": size, "mtime_ns": mtime, "inode": inode}
+
+
+def _remote(path: str, item_id: str = "i1", ctag: str = "c1", quick_xor: str = "h1", size: int = 5,
+            modified: str = "2025-01-01T00:00:00Z", is_folder: bool = False) -> dict:
+    return {"id": item_id, "path": path, "is_folder": is_folder, "size": size, "ctag": ctag, "etag": f"e-{ctag}",
+            "modified": modified, "quick_xor": quick_xor}
+
+
+def _base(path: str, item_id: str = "i1", ctag: str = "c1", quick_xor: str = "h1", size: int = 5, mtime: int = 100,
+          inode: int = 1, is_folder: bool = False) -> dict:
+    return {"path": path, "is_folder": is_folder, "size": size, "mtime_ns": mtime, "inode": inode,
+            "quick_xor": quick_xor, "item_id": item_id, "ctag": ctag, "etag": f"e-{ctag}"}
+
+
+def _by_key(*entries: dict) -> dict:
+    return {entry["path"].casefold(): entry for entry in entries}
+
+
+def _plan(local=(), remote=(), base=(), hashes=None, **options) -> tuple[dict[str, str], OneDriveSync]:
+    sync = OneDriveSync(None, "user@example.com", "/tmp/sync", "Docs", **options)
+    actions = sync._plan(_by_key(*local), _by_key(*remote), _by_key(*base), hashes or {})
+    return {action["key"]: action["op"] for action in actions}, sync
+
+
+def test_an_unchanged_tree_plans_nothing():
+    ops, sync = _plan([_local("a.txt")], [_remote("a.txt")], [_base("a.txt")])
+    assert ops == {}
+    assert sync.report["unchanged"] == 1
+
+
+@pytest.mark.parametrize("local, remote, op", [
+    (_local("a.txt", size=9), _remote("a.txt"), "upload"),
+    (_local("a.txt"), _remote("a.txt", ctag="c2", quick_xor="h2"), "download"),
+    (_local("a.txt", size=9), _remote("a.txt", ctag="c2", quick_xor="h2"), "conflict"),
+])
+def test_changes_on_one_or_both_sides(local, remote, op):
+    assert _plan([local], [remote], [_base("a.txt")])[0] == {"a.txt": op}
+
+
+def test_a_touched_file_is_recorded_not_uploaded():
+    ops, _ = _plan([_local("a.txt", mtime=200)], [_remote("a.txt")], [_base("a.txt")], hashes={"a.txt": "h1"})
+    assert ops == {"a.txt": "record"}
+
+
+def test_a_new_ctag_with_the_same_hash_is_not_a_remote_change():
+    assert _plan([_local("a.txt")], [_remote("a.txt", ctag="c2")], [_base("a.txt")])[0] == {}
+
+
+def test_files_new_on_both_sides():
+    same, _ = _plan([_local("a.txt")], [_remote("a.txt")], hashes={"a.txt": "h1"})
+    assert same == {"a.txt": "record"}
+    # Different content: neither side is overwritten without a copy
+    different, _ = _plan([_local("a.txt", mtime=2_000_000_000 * 10**9)], [_remote("a.txt")], hashes={"a.txt": "h9"})
+    assert different == {"a.txt": "conflict"}
+    other_size, _ = _plan([_local("a.txt", size=9)], [_remote("a.txt")])
+    assert other_size == {"a.txt": "conflict"}
+    one_way, _ = _plan([_local("a.txt", size=9)], [_remote("a.txt")], direction="download")
+    assert one_way == {"a.txt": "download"} # The source side wins a one-way sync
+
+
+def test_deletions():
+    assert _plan([], [_remote("a.txt")], [_base("a.txt")])[0] == {"a.txt": "delete_remote"}
+    assert _plan([_local("a.txt")], [], [_base("a.txt")])[0] == {"a.txt": "delete_local"}
+    assert _plan([], [], [_base("a.txt")])[0] == {"a.txt": "forget"}
+    ops, sync = _plan([], [_remote("a.txt")], [_base("a.txt")], delete=False)
+    assert ops == {}
+    assert sync.report["skipped"] == [{"path": "a.txt", "reason": "deletions are disabled"}]
+
+
+def test_one_way_syncs_never_change_the_source():
+    # A local deletion is restored from OneDrive instead of propagated
+    assert _plan([], [_remote("a.txt")], [_base("a.txt")], direction="download")[0] == {"a.txt": "download"}
+    # A local edit is not uploaded
+    assert _plan([_local("a.txt", size=9)], [_remote("a.txt")], [_base("a.txt")], direction="download")[0] == {}
+    # In a conflict the local side wins
+    conflict = _plan([_local("a.txt", size=9)], [_remote("a.txt", ctag="c2", quick_xor="h2")], [_base("a.txt")], direction="upload")
+    assert conflict[0] == {"a.txt": "upload"}
+
+
+def test_renames_are_moves():
+    remote_rename, _ = _plan([_local("old.txt")], [_remote("new.txt")], [_base("old.txt")])
+    assert remote_rename == {"new.txt": "move_local"}
+    local_rename, _ = _plan([_local("new.txt")], [_remote("old.txt")], [_base("old.txt")])
+    assert local_rename == {"new.txt": "move_remote"}
+    # A different inode is a new file, not a rename
+    unrelated, _ = _plan([_local("new.txt", inode=2)], [_remote("old.txt")], [_base("old.txt")])
+    assert unrelated == {"new.txt": "upload", "old.txt": "delete_remote"}
+
+
+def test_a_deleted_folder_is_deleted_with_one_request():
+    base = [_base("Old", item_id="f", is_folder=True), _base("Old/a.txt", item_id="a"), _base("Old/b.txt", item_id="b")]
+    remote = [_remote("Old", item_id="f", is_folder=True), _remote("Old/a.txt", item_id="a"), _remote("Old/b.txt", item_id="b")]
+    ops, _ = _plan([], remote, base)
+    assert ops == {"old": "delete_remote", "old/a.txt": "forget", "old/b.txt": "forget"}
+
+
+def test_a_folder_delete_is_dropped_when_something_below_it_changed():
+    base = [_base("Old", item_id="f", is_folder=True), _base("Old/a.txt", item_id="a")]
+    remote = [_remote("Old", item_id="f", is_folder=True), _remote("Old/a.txt", item_id="a", ctag="c2", quick_xor="h2")]
+    ops, _ = _plan([], remote, base)
+    assert ops == {"old/a.txt": "download"}
+
+
+def test_new_folders_are_created_on_the_other_side():
+    ops, _ = _plan([_local("New", is_folder=True)], [_remote("Remote", item_id="r", is_folder=True)])
+    assert ops == {"new": "mkdir_remote", "remote": "mkdir_local"}
@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import pytest
+
+from agent.outbox import Outbox, idempotency_key
+from tools.registry import ToolRegistry
+from utils.tracing import tracer
+
+calls: list[tuple[str, dict]] = []
+failures: dict[str, list[dict]] = {} # tool -> results returned before it succeeds
+
+registry = ToolRegistry(modules=())
+
+
+@registry.tool(mutating=True)
+async def send_outlook_email(auth_handler, to: str, subject: str) -> dict:
+    """Sends an email."""
+    calls.append(("send_outlook_email", {"to": to, "subject": subject}))
+    pending = failures.get("send_outlook_email")
+    return pending.pop(0) if pending else {"status": "success"}
+
+
+@registry.tool(mutating=True)
+async def delete_file_from_onedrive(auth_handler, file_id: str) -> dict:
+    """Deletes a file."""
+    calls.append(("delete_file_from_onedrive", {"file_id": file_id}))
+    pending = failures.get("delete_file_from_onedrive")
+    return pending.pop(0) if pending else {"status": "success"}
+
+
+def _outbox(path) -> Outbox:
+    calls.clear()
+    return Outbox(str(path), auth_handler=None, registry=registry, backoff=0.0, confirm_wait=1.0)
+
+
+def _last_record(path, job_id: str) -> dict:
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    return [record for record in records if record["job_id"] == job_id][-1]
+
+
+def test_idempotency_key_ignores_argument_order():
+    assert idempotency_key("t", {"a": 1, "b": 2}) == idempotency_key("t", {"b": 2, "a": 1})
+    assert idempotency_key("t", {"a": 1}) != idempotency_key("t", {"a": 2})
+
+
+def test_repeated_submission_runs_once(tmp_path):
+    async def run():
+        outbox = _outbox(tmp_path / "outbox.jsonl")
+        outbox.start()
+        job, created = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        await outbox.wait(job.id, timeout=5)
+        again, created_again = await outbox.submit("send_outlook_email", {"subject": "Hi", "to": "a@b.com"})
+        await outbox.stop()
+        assert (created, created_again) == (True, False)
+        assert again.id == job.id and job.state == "succeeded"
+        assert len(calls) == 1
+    asyncio.run(run())
+
+
+def test_throttled_job_is_retried(tmp_path):
+    async def run():
+        failures["send_outlook_email"] = [{"status": "error", "message": "HTTP Error 429 - throttled"}]
+        outbox = _outbox(tmp_path / "outbox.jsonl")
+        outbox.start()
+        job, _ = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        await outbox.wait(job.id, timeout=5)
+        await outbox.stop()
+        assert (job.state, job.attempts) == ("succeeded", 2)
+    asyncio.run(run())
+
+
+def test_server_error_is_retried_only_when_safe_to_repeat(tmp_path):
+    async def run():
+        error = {"status": "error", "message": "HTTP Error 500 - oops"}
+        failures["send_outlook_email"] = [dict(error)]
+        failures["delete_file_from_onedrive"] = [dict(error)]
+        outbox = _outbox(tmp_path / "outbox.jsonl")
+        outbox.start()
+        send, _ = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        delete, _ = await outbox.submit("delete_file_from_onedrive", {"file_id": "01X"})
+        await outbox.wait(send.id, timeout=5)
+        await outbox.wait(delete.id, timeout=5)
+        await outbox.stop()
+        assert (send.state, send.attempts) == ("failed", 1)
+        assert (delete.state, delete.attempts) == ("succeeded", 2)
+
+        # A failed job does not absorb a new attempt at the same operation
+        outbox = _outbox(tmp_path / "outbox.jsonl")
+        outbox.start()
+        retry, created = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        await outbox.wait(retry.id, timeout=5)
+        await outbox.stop()
+        assert created and retry.state == "succeeded"
+    asyncio.run(run())
+
+
+def test_replay_after_a_crash(tmp_path):
+    path = tmp_path / "outbox.jsonl"
+    records = [
+        {"event": "enqueued", "job_id": "send", "ts": 1.0, "tool": "send_outlook_email",
+         "arguments": {"to": "a@b.com", "subject": "Hi"}, "key": "k-send"},
+        {"event": "started", "job_id": "send", "ts": 2.0, "attempt": 1},
+        {"event": "enqueued", "job_id": "delete", "ts": 1.0, "tool": "delete_file_from_onedrive",
+         "arguments": {"file_id": "01X"}, "key": "k-delete"},
+        {"event": "started", "job_id": "delete", "ts": 2.0, "attempt": 1},
+        {"event": "enqueued", "job_id": "queued", "ts": 1.0, "tool": "delete_file_from_onedrive",
+         "arguments": {"file_id": "01Y"}, "key": "k-queued"},
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records) + '{"event": "star') # Torn last line
+
+    async def run():
+        outbox = _outbox(path)
+        # A send interrupted mid-flight may have happened: it is not repeated
+        assert outbox.jobs["send"].state == "unknown"
+        outbox.start()
+        await outbox.wait("delete", timeout=5)
+        await outbox.wait("queued", timeout=5)
+        await outbox.stop()
+        assert outbox.jobs["delete"].state == outbox.jobs["queued"].state == "succeeded"
+        assert sorted(arguments["file_id"] for _, arguments in calls) == ["01X", "01Y"]
+    asyncio.run(run())
+    # The torn line was cut off, so the records appended after it are readable
+    assert _last_record(path, "send")["event"] == "unknown"
+    assert _last_record(path, "delete")["event"] == "succeeded"
+
+
+def test_finished_jobs_dedupe_across_restarts(tmp_path):
+    async def run():
+        path = tmp_path / "outbox.jsonl"
+        outbox = _outbox(path)
+        outbox.start()
+        job, _ = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        await outbox.wait(job.id, timeout=5)
+        await outbox.stop()
+
+        restarted = _outbox(path)
+        restarted.start()
+        again, created = await restarted.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+        await restarted.stop()
+        assert not created and again.id == job.id and again.state == "succeeded"
+        assert calls == []
+    asyncio.run(run())
+
+
+def test_jobs_do_not_join_the_trace_of_the_submitting_turn(tmp_path):
+    async def run():
+        outbox = _outbox(tmp_path / "outbox.jsonl")
+        with tracer.turn() as first:
+            outbox.start() # Even when started inside a turn
+            job, _ = await outbox.submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+            await outbox.wait(job.id, timeout=5)
+        with tracer.turn():
+            job, _ = await outbox.submit("send_outlook_email", {"to": "c@d.com", "subject": "Hi"})
+            await outbox.wait(job.id, timeout=5)
+        await outbox.stop()
+        assert first.spans == []
+    asyncio.run(run())
+
+
+def test_submit_needs_started_workers(tmp_path):
+    async def run():
+        with pytest.raises(RuntimeError):
+            await _outbox(tmp_path / "outbox.jsonl").submit("send_outlook_email", {"to": "a@b.com", "subject": "Hi"})
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import base64
+import os
+import random
+
+import pytest
+
+from utils import quickxor
+from utils.quickxor import QuickXorHash, fold_lanes, quickxor_bytes, quickxor_file
+
+
+def _reference(data: bytes) -> str:
+    """Byte-at-a-time quickXorHash, straight from the definition."""
+    state = 0
+    for index, byte in enumerate(data):
+        shift = (index * 11) % 160
+        value = byte << shift
+        state ^= (value | (value >> 160)) & ((1 << 160) - 1)
+    result = bytearray(state.to_bytes(20, "little"))
+    for index, byte in enumerate(len(data).to_bytes(8, "little")):
+        result[12 + index] ^= byte
+    return base64.b64encode(bytes(result)).decode("ascii")
+
+
+PAYLOADS = [b"", b"a", b"hello world", bytes(range(256)) * 3, random.Random(7).randbytes(160 * 64 * 3 + 17)]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(quickxor, "numpy", None)
+    elif quickxor.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+def test_known_values():
+    assert quickxor_bytes(b"") == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+    assert quickxor_bytes(b"a") == _reference(b"a")
+
+
+@pytest.mark.parametrize("data", PAYLOADS, ids=lambda data: f"{len(data)}B")
+def test_matches_the_definition(backend, data):
+    assert quickxor_bytes(data) == _reference(data)
+
+
+def test_incremental_updates_equal_one_shot(backend):
+    data = PAYLOADS[-1]
+    hasher = QuickXorHash()
+    for start, end in [(0, 1), (1, 161), (161, 500), (500, 10_000), (10_000, len(data))]:
+        hasher.update(data[start:end])
+    assert hasher.b64digest() == quickxor_bytes(data)
+
+
+def test_backends_fold_alike(monkeypatch):
+    if quickxor.numpy is None:
+        pytest.skip("numpy is not installed")
+    data = PAYLOADS[-1][:160 * 64 * 3]
+    folded = fold_lanes(data)
+    monkeypatch.setattr(quickxor, "numpy", None)
+    assert fold_lanes(data) == folded
+    with pytest.raises(ValueError):
+        fold_lanes(data[:100])
+
+
+def test_files_are_hashed_in_windows(tmp_path, monkeypatch):
+    monkeypatch.setattr(quickxor, "FILE_WINDOW_BYTES", 160 * 10)
+    data = PAYLOADS[-1]
+    path = tmp_path / "data.bin"
+    path.write_bytes(data)
+    empty = tmp_path / "empty.bin"
+    empty.write_bytes(b"")
+    assert quickxor_file(str(path)) == _reference(data)
+    assert quickxor_file(str(empty)) == _reference(b"")
+    assert os.path.getsize(path) > quickxor.FILE_WINDOW_BYTES
@@ -0,0 +1,136 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from agent.conversation import SessionManager, SessionStore
+from benchmarks.standins import StubAuth
+from main import build_app
+
+
+class _FakeAgent:
+    """Answers every turn with "ok", after `gate` opens (if set)."""
+    gate = None
+
+    def __init__(self):
+        self.messages_history = [{"role": "system", "content": "instructions"}]
+        self.token_usage = {}
+
+    async def warm_up(self):
+        return {}
+
+    async def process_message(self, user_message, on_delta=None, **kwargs):
+        self.messages_history.append({"role": "user", "content": user_message})
+        if self.gate is not None:
+            await self.gate.wait()
+        self.messages_history.append({"role": "assistant", "content": "ok"})
+        return {"text_output": "ok"}
+
+    def close(self):
+        pass
+
+
+class _FakeOpenAI:
+    async def close(self):
+        pass
+
+
+def _manager(store=None, max_sessions=1) -> SessionManager:
+    return SessionManager("supervisor@example.com", openai_client=_FakeOpenAI(), auth_handler=StubAuth("http://127.0.0.1:9"),
+                          max_sessions=max_sessions, store=store, agent_factory=lambda session_id: _FakeAgent())
+
+
+async def _with_busy_server(tmp_path, check):
+    """
+    Runs `check(client, spilled_session_id)` against a one-slot server whose slot is running a turn,
+    while another session sits in the store.
+    """
+    manager = _manager(SessionStore(str(tmp_path)))
+    async with TestClient(TestServer(build_app(manager, token=""))) as client:
+        spilled = (await manager.create()).id
+        busy = await manager.create() # Evicts (spills) the first session
+        busy.agent.gate = asyncio.Event()
+        turn = asyncio.create_task(manager.process_message(busy.id, "long task"))
+        await asyncio.sleep(0)
+        try:
+            await check(client, spilled)
+        finally:
+            busy.agent.gate.set()
+            await turn
+
+
+def test_session_creation_persists_the_system_message(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path))
+        session = await _manager(store).create()
+        assert store.load(session.id) == [{"role": "system", "content": "instructions"}]
+    asyncio.run(run())
+
+
+def test_busy_server_answers_503_with_retry_after(tmp_path):
+    async def check(client, spilled):
+        for method, path, payload in [("POST", "/sessions", None),
+                                      ("POST", f"/sessions/{spilled}/messages", {"message": "hi"}),
+                                      ("POST", f"/sessions/{spilled}/messages?stream=1", {"message": "hi"}),
+                                      ("GET", f"/sessions/{spilled}", None)]:
+            response = await client.request(method, path, json=payload)
+            assert response.status == 503, path
+            assert response.headers["Retry-After"] == "5"
+    asyncio.run(_with_busy_server(tmp_path, check))
+
+
+def test_busy_server_sends_an_error_frame(tmp_path):
+    async def check(client, spilled):
+        async with client.ws_connect(f"/sessions/{spilled}/ws") as socket:
+            await socket.send_json({"message": "hi"})
+            frame = await socket.receive_json()
+            assert frame["type"] == "error"
+            assert frame["retry_after"] == 5
+    asyncio.run(_with_busy_server(tmp_path, check))
+
+
+def test_spilled_session_resumes_when_a_slot_is_free(tmp_path):
+    async def run():
+        manager = _manager(SessionStore(str(tmp_path)))
+        async with TestClient(TestServer(build_app(manager, token=""))) as client:
+            first = (await (await client.post("/sessions")).json())["session_id"]
+            await client.post("/sessions")
+            response = await client.post(f"/sessions/{first}/messages", json={"message": "hi"})
+            assert (await response.json()) == {"text_output": "ok"}
+            assert manager.get(first).agent.messages_history[0]["content"] == "instructions"
+    asyncio.run(run())
+
+
+def test_a_session_deleted_during_its_turn_stays_deleted(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path))
+        manager = _manager(store)
+        session = await manager.create()
+        session.agent.gate = asyncio.Event()
+        turn = asyncio.create_task(manager.process_message(session.id, "long task"))
+        await asyncio.sleep(0)
+        async with TestClient(TestServer(build_app(manager, token=""))) as client:
+            assert (await client.delete(f"/sessions/{session.id}")).status == 204
+        session.agent.gate.set()
+        await turn
+        assert session.id not in store
+        assert not manager.exists(session.id)
+    asyncio.run(run())
+
+
+def test_the_reaper_survives_a_failed_compaction(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path))
+        manager = _manager(store)
+        manager.idle_timeout = 1.0 # Reaps every second
+        attempts = []
+
+        def compact():
+            attempts.append(1)
+            raise RuntimeError("dictionary changed size during iteration")
+
+        store.compact = compact
+        manager._reaper = asyncio.create_task(manager._reap())
+        await asyncio.sleep(2.2)
+        assert len(attempts) == 2 and not manager._reaper.done()
+        await manager.close()
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import json
+
+from agent.conversation import SessionStore
+
+
+def _turn(text: str) -> list[dict]:
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"re: {text}"}]
+
+
+def test_sessions_survive_a_reopen(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append("a", _turn("one"))
+    store.append("b", _turn("two"))
+    store.append("a", _turn("three"))
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.load("a") == _turn("one") + _turn("three")
+    assert reopened.load("b") == _turn("two")
+    assert reopened.load("missing") == []
+
+
+def test_records_missing_from_the_index_are_recovered(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append("a", _turn("one"))
+    store.append("a", _turn("two"))
+    store.append("b", _turn("three"))
+    # A crash between the segment write and the index write loses the last index entries
+    index = tmp_path / "index.jsonl"
+    index.write_text(index.read_text().splitlines(keepends=True)[0])
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.load("a") == _turn("one") + _turn("two")
+    assert reopened.load("b") == _turn("three")
+    assert SessionStore(str(tmp_path)).load("a") == _turn("one") + _turn("two") # Recovered once, not twice
+
+
+def test_a_torn_segment_line_is_cut_off(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append("a", _turn("one"))
+    segment = tmp_path / "segment-000001.jsonl"
+    with open(segment, "ab") as f:
+        f.write(b'{"s":"a","m":{"role":"us') # Crashed mid-append
+
+    reopened = SessionStore(str(tmp_path))
+    reopened.append("a", _turn("two"))
+    assert SessionStore(str(tmp_path)).load("a") == _turn("one") + _turn("two")
+
+
+def test_a_torn_index_line_is_cut_off(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append("a", _turn("one"))
+    with open(tmp_path / "index.jsonl", "a") as f:
+        f.write('{"s":"a","g":1,') # Crashed mid-write of an index entry
+
+    reopened = SessionStore(str(tmp_path))
+    reopened.append("b", _turn("two"))
+    reopened.append("a", _turn("three"))
+    again = SessionStore(str(tmp_path))
+    assert again.load("a") == _turn("one") + _turn("three")
+    assert again.load("b") == _turn("two")
+
+
+def test_deleted_sessions_stay_deleted(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append("a", _turn("one"))
+    store.append("b", _turn("two"))
+    store.delete("a")
+    assert "a" not in store
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.session_ids() == ["b"]
+    assert reopened.load("a") == []
+
+
+def test_compaction_keeps_live_sessions_and_drops_garbage(tmp_path):
+    store = SessionStore(str(tmp_path), max_segment_bytes=300)
+    for index in range(6):
+        store.append("a" if index % 2 else "b", _turn(f"message {index}"))
+    store.append("c", _turn("temporary"))
+    assert store.compact() is False # Nothing deleted yet
+    store.delete("b")
+    store.delete("c")
+
+    assert store.compact(min_garbage=0.1) is True
+    expected = [message for index in (1, 3, 5) for message in _turn(f"message {index}")]
+    assert store.load("a") == expected
+    assert store.garbage_ratio() == 0.0
+    assert [json.loads(line)["s"] for line in (tmp_path / "index.jsonl").read_text().splitlines()] == ["a"]
+
+    reopened = SessionStore(str(tmp_path))
+    reopened.append("a", _turn("after"))
+    assert SessionStore(str(tmp_path)).load("a") == expected + _turn("after")
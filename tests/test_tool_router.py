@@ -0,0 +1,60 @@
+from agent.tool_router import ToolRouter
+
+EMAIL = "microsoft_graph.outlook_email"
+CALENDAR = "microsoft_graph.outlook_calendar"
+
+
+def _tool_names(decision: dict) -> list[str]:
+    return [schema["function"]["name"] for schema in decision["tools"]]
+
+
+def test_routes_a_clear_message_to_its_group():
+    decision = ToolRouter().select("show my unread emails in the inbox")
+    assert decision["mode"] == "routed"
+    assert decision["groups"] == [EMAIL]
+    assert decision["tokens_saved"] > 0
+
+
+def test_vague_opening_message_falls_back_without_sticking():
+    router = ToolRouter()
+    assert router.select("hello there")["mode"] == "fallback"
+    assert router.sticky_groups == set()
+    assert router.select("show my unread emails in the inbox")["groups"] == [EMAIL]
+
+
+def test_tool_list_is_stable_across_chit_chat():
+    router = ToolRouter()
+    messages = [
+        "show my unread emails in the inbox",
+        "thanks!",
+        "reply to the sender of the first message",
+        "ok, great",
+        "forward that email to my manager",
+        "hmm",
+    ]
+    tool_lists = [_tool_names(router.select(message)) for message in messages]
+    assert all(tools == tool_lists[0] for tools in tool_lists)
+    assert router.select("thanks")["mode"] == "sticky"
+
+
+def test_tool_list_changes_at_most_twice():
+    router = ToolRouter()
+    messages = [
+        "show my unread emails in the inbox",
+        "thanks",
+        "schedule a meeting with the sender tomorrow",
+        "great",
+        "upload the report to my onedrive folder",
+        "read the last message again",
+        "ok",
+    ]
+    tool_lists = [_tool_names(router.select(message)) for message in messages]
+    changes = sum(1 for before, after in zip(tool_lists, tool_lists[1:]) if before != after)
+    assert changes <= 1 # Routed to email, then straight to the full set
+    assert CALENDAR in router.sticky_groups
+
+
+def test_non_sticky_router_follows_each_message():
+    router = ToolRouter(sticky=False)
+    assert router.select("show my unread emails in the inbox")["groups"] == [EMAIL]
+    assert router.select("thanks")["mode"] == "fallback"
@@ -0,0 +1,43 @@
+import json
+import threading
+
+from utils import tracing
+from utils.tracing import Tracer
+
+
+def test_finished_turns_are_written_by_a_background_thread(tmp_path, monkeypatch):
+    disk = threading.Event()
+
+    def slow_open(*args, **kwargs):
+        disk.wait(5)
+        return open(*args, **kwargs)
+    monkeypatch.setattr(tracing, "open", slow_open, raising=False)
+
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(trace_file=str(path))
+    with tracer.turn("agent.turn", supervisor="a@example.com"):
+        with tracer.span("graph.request", kind="http"):
+            pass
+    assert not path.exists() # The turn ended without waiting for the disk
+
+    disk.set()
+    tracer.flush()
+    trace = json.loads(path.read_text())
+    assert trace["attributes"] == {"supervisor": "a@example.com"}
+    assert [span["name"] for span in trace["spans"]] == ["graph.request"]
+
+
+def test_traces_past_the_queue_are_dropped(tmp_path, monkeypatch):
+    disk = threading.Event()
+    monkeypatch.setattr(tracing, "open", lambda *args, **kwargs: disk.wait(5) and open(*args, **kwargs), raising=False)
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(trace_file=str(path), queue_size=1)
+    dropped = tracing.TRACES_DROPPED.value()
+    for _ in range(3): # At most one is being written and one waits in the queue
+        with tracer.turn():
+            pass
+    assert tracing.TRACES_DROPPED.value() > dropped
+
+    disk.set()
+    tracer.flush()
+    assert 1 <= len(path.read_text().splitlines()) <= 2
@@ -0,0 +1,399 @@
+import importlib
+import inspect
+import json
+import re
+import threading
+import typing
+from typing import Any, Callable, Iterable, Literal, Optional, Union
+
+from utils.metrics import REGISTRY
+
+# Single source of truth for the agent's tools.
+#
+# The Graph helpers in microsoft_graph/* are registered with the @tool decorator. The OpenAI
+# function schema of each tool is generated from the function's signature (type annotations,
+# defaults) and the "Args:" section of its docstring, and an argument validator is compiled
+# once at registration. The validator coerces what the model commonly gets slightly wrong
+# ("true" for a boolean, one address instead of a list, "High" instead of "high") and rejects
+# the rest locally, so a bad call never costs a Graph round-trip.
+#
+# Usage:
+#     from tools.registry import tool
+#
+#     @tool(description="Deletes a calendar event ...", mutating=True)
+#     async def delete_calendar_event(auth_handler, user_id: str, event_id: str) -> dict: ...
+
+# Modules whose import registers tools; loaded on first use because they pull in httpx.
+TOOL_MODULES = (
+    "microsoft_graph.outlook_email",
+    "microsoft_graph.outlook_calendar",
+    "microsoft_graph.onedrive_files",
+)
+
+# Parameters supplied by the agent itself, never by the model.
+INJECTED_PARAMS = {"auth_handler"}
+
+TOOL_ARGS_REJECTED = REGISTRY.counter(
+    "tool_arguments_rejected_total", "Tool calls rejected locally because of invalid arguments.", ("tool",))
+TOOL_ARGS_COERCED = REGISTRY.counter(
+    "tool_arguments_coerced_total", "Tool arguments coerced to their declared type.", ("tool",))
+
+_MISSING = object()
+_TRUE_STRINGS = {"true", "yes", "1", "on"}
+_FALSE_STRINGS = {"false", "no", "0", "off"}
+
+
+class ToolArgumentError(ValueError):
+    """
+    Raised when the arguments of a tool call cannot be validated or coerced.
+    """
+
+
+def parse_docstring_args(docstring: Optional[str]) -> dict[str, str]:
+    """
+    Extracts parameter descriptions from the Google-style "Args:" section of a docstring.
+    Continuation lines (indented deeper than the parameter) are joined to its description.
+    """
+    descriptions: dict[str, str] = {}
+    if not docstring:
+        return descriptions
+    lines = inspect.cleandoc(docstring).splitlines()
+    in_args = False
+    current = None
+    param_indent = None
+    for line in lines:
+        stripped = line.strip()
+        if not in_args:
+            in_args = stripped == "Args:"
+            continue
+        if not stripped:
+            continue
+        indent = len(line) - len(line.lstrip())
+        if indent == 0:
+            break # Next section (Returns:, Raises:, ...)
+        match = re.match(r"^(\w+)\s*(?:\([^)]*\))?:\s*(.*)$", stripped)
+        if match and (param_indent is None or indent <= param_indent):
+            param_indent = indent
+            current = match.group(1)
+            descriptions[current] = match.group(2)
+        elif current:
+            descriptions[current] = f"{descriptions[current]} {stripped}".strip()
+    return descriptions
+
+
+def _unwrap_optional(annotation) -> tuple[Any, bool]:
+    """
+    Returns (inner annotation, whether None is allowed).
+    """
+    if typing.get_origin(annotation) is Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        nullable = len(args) < len(typing.get_args(annotation))
+        if len(args) == 1:
+            return args[0], nullable
+        # Union[str, bytes] and similar: the model can only send JSON, so use the first JSON-able type.
+        json_types = [arg for arg in args if arg is not bytes]
+        return (json_types[0] if json_types else str), nullable
+    return annotation, False
+
+
+# --- per-type coercers; each returns (value, coerced) or raises ToolArgumentError ---
+def _to_string(value):
+    if isinstance(value, str):
+        return value, False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value), True
+    raise ToolArgumentError(f"expected a string, got {type(value).__name__}")
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value, False
+    if isinstance(value, str) and value.strip().lower() in _TRUE_STRINGS | _FALSE_STRINGS:
+        return value.strip().lower() in _TRUE_STRINGS, True
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value), True
+    raise ToolArgumentError(f"expected a boolean, got {value!r}")
+
+
+def _to_integer(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value, False
+    if isinstance(value, float) and value.is_integer():
+        return int(value), True
+    if isinstance(value, str) and re.fullmatch(r"\s*-?\d+\s*", value):
+        return int(value), True
+    raise ToolArgumentError(f"expected an integer, got {value!r}")
+
+
+def _to_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value, False
+    if isinstance(value, str):
+        try:
+            return float(value), True
+        except ValueError:
+            pass
+    raise ToolArgumentError(f"expected a number, got {value!r}")
+
+
+def _to_object(value):
+    if isinstance(value, dict):
+        return value, False
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed, True
+    raise ToolArgumentError(f"expected an object, got {type(value).__name__}")
+
+
+_SCALARS = {
+    str: ("string", _to_string),
+    bytes: ("string", _to_string),
+    bool: ("boolean", _to_boolean),
+    int: ("integer", _to_integer),
+    float: ("number", _to_number),
+    dict: ("object", _to_object),
+}
+
+
+def _compile_type(annotation) -> tuple[dict, Callable]:
+    """
+    Returns the JSON schema fragment and the coercer for a (non-Optional) annotation.
+    """
+    origin = typing.get_origin(annotation) or annotation
+
+    if origin is Literal:
+        choices = list(typing.get_args(annotation))
+        lookup = {str(choice).lower(): choice for choice in choices}
+
+        def to_choice(value):
+            if value in choices:
+                return value, False
+            key = str(value).strip().lower()
+            if key in lookup:
+                return lookup[key], True
+            raise ToolArgumentError(f"expected one of {choices}, got {value!r}")
+
+        json_type = "string" if all(isinstance(choice, str) for choice in choices) else "integer"
+        return {"type": json_type, "enum": choices}, to_choice
+
+    if origin in (list, tuple, set):
+        item_args = typing.get_args(annotation)
+        item_schema, to_item = _compile_type(item_args[0] if item_args else str)
+
+        def to_array(value):
+            coerced = False
+            if not isinstance(value, list):
+                if isinstance(value, (tuple, set)):
+                    value = list(value)
+                else:
+                    value = [value] # A single item where a list was expected
+                coerced = True
+            items = []
+            for index, item in enumerate(value):
+                try:
+                    item, item_coerced = to_item(item)
+                except ToolArgumentError as e:
+                    raise ToolArgumentError(f"item {index}: {e}") from None
+                items.append(item)
+                coerced = coerced or item_coerced
+            return items, coerced
+
+        return {"type": "array", "items": item_schema}, to_array
+
+    if origin in _SCALARS:
+        json_type, coercer = _SCALARS[origin]
+        return {"type": json_type}, coercer
+
+    # Unannotated or unknown: accept anything JSON.
+    return {}, lambda value: (value, False)
+
+
+class ToolSpec:
+    """
+    A registered tool: the implementation, its generated schema and its compiled validator.
+
+    Args:
+        func: The async implementation; receives auth_handler plus the validated arguments.
+        description: Description shown to the model.
+        param_descriptions: Description of each model-facing parameter.
+        mutating: Whether the tool changes state (sends, creates, updates or deletes something).
+        require_any: Groups of parameters of which at least one must be given.
+    """
+    def __init__(
+        self,
+        func: Callable,
+        description: str,
+        param_descriptions: dict[str, str],
+        mutating: bool = False,
+        require_any: Iterable[Iterable[str]] = ()
+    ):
+        self.func = func
+        self.name = func.__name__
+        self.module = func.__module__
+        self.description = description
+        self.mutating = mutating
+        self.require_any = [tuple(group) for group in require_any]
+
+        properties = {}
+        required = []
+        # name -> (coercer, default or _MISSING, nullable); evaluated in signature order
+        self._validators: dict[str, tuple[Callable, Any, bool]] = {}
+        hints = typing.get_type_hints(func)
+        for param in inspect.signature(func).parameters.values():
+            if param.name in INJECTED_PARAMS or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                continue
+            annotation, nullable = _unwrap_optional(hints.get(param.name, Any))
+            schema, coercer = _compile_type(annotation)
+            text = param_descriptions.get(param.name, "")
+            if param.default is not inspect.Parameter.empty and param.default is not None:
+                text = f"{text} Defaults to {json.dumps(param.default)}.".strip()
+            if text:
+                schema["description"] = text
+            properties[param.name] = schema
+            default = _MISSING if param.default is inspect.Parameter.empty else param.default
+            if default is _MISSING:
+                required.append(param.name)
+            self._validators[param.name] = (coercer, default, nullable or default is None)
+
+        for group in self.require_any:
+            unknown = set(group) - set(properties)
+            if unknown:
+                raise ValueError(f"require_any of '{self.name}' names unknown parameters {sorted(unknown)}")
+
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": description,
+                "parameters": {"type": "object", "properties": properties, "required": required},
+            },
+        }
+
+    def validate(self, arguments: dict) -> dict:
+        """
+        Returns the arguments coerced to the declared types.
+
+        Raises:
+            ToolArgumentError: Unknown or missing parameters, or values that cannot be coerced.
+        """
+        try:
+            return self._coerce(arguments)
+        except ToolArgumentError:
+            TOOL_ARGS_REJECTED.inc(tool=self.name)
+            raise
+
+    def _coerce(self, arguments: dict) -> dict:
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError(f"arguments must be a JSON object, got {type(arguments).__name__}")
+        unknown = [name for name in arguments if name not in self._validators]
+        if unknown:
+            raise ToolArgumentError(f"unknown parameter(s) {unknown}; expected {list(self._validators)}")
+
+        validated = {}
+        coerced_any = False
+        for name, (coercer, default, nullable) in self._validators.items():
+            value = arguments.get(name, _MISSING)
+            if value is _MISSING or (value is None and nullable):
+                if default is _MISSING:
+                    raise ToolArgumentError(f"missing required parameter '{name}'")
+                continue # Let the function apply its own default
+            if value is None:
+                raise ToolArgumentError(f"parameter '{name}' must not be null")
+            try:
+                value, coerced = coercer(value)
+            except ToolArgumentError as e:
+                raise ToolArgumentError(f"parameter '{name}': {e}") from None
+            coerced_any = coerced_any or coerced
+            validated[name] = value
+
+        for group in self.require_any:
+            if not any(validated.get(name) for name in group):
+                raise ToolArgumentError(f"provide at least one of {list(group)}")
+
+        if coerced_any:
+            TOOL_ARGS_COERCED.inc(tool=self.name)
+        return validated
+
+
+class ToolRegistry:
+    """
+    Name -> ToolSpec map filled by the @tool decorator.
+    """
+    def __init__(self, modules: Iterable[str] = TOOL_MODULES):
+        self.modules = tuple(modules)
+        self._tools: dict[str, ToolSpec] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def tool(
+        self,
+        description: Optional[str] = None,
+        params: Optional[dict[str, str]] = None,
+        mutating: bool = False,
+        require_any: Iterable[Iterable[str]] = ()
+    ) -> Callable:
+        """
+        Decorator registering an async Graph helper as an agent tool. The function is returned unchanged.
+
+        Args:
+            description: Description for the model; defaults to the first paragraph of the docstring.
+            params: Per-parameter description overrides; the rest come from the docstring's Args section.
+            mutating: Whether the tool changes state (its results must never be cached or replayed).
+            require_any: Groups of parameters of which at least one must be given, e.g. [("file_id", "file_path")].
+        """
+        def register(func: Callable) -> Callable:
+            docstring = inspect.getdoc(func) or ""
+            param_descriptions = parse_docstring_args(docstring)
+            param_descriptions.update(params or {})
+            text = description or " ".join(docstring.split("\n\n", 1)[0].split())
+            for group in require_any:
+                text = f"{text} Provide at least one of: {', '.join(group)}."
+            spec = ToolSpec(func, text, param_descriptions, mutating, require_any)
+            with self._lock:
+                self._tools[spec.name] = spec
+            return func
+        return register
+
+    def load(self) -> "ToolRegistry":
+        """
+        Imports the tool modules (registering their tools) once.
+        """
+        if not self._loaded:
+            for module in self.modules:
+                importlib.import_module(module)
+            self._loaded = True
+        return self
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        spec = self._tools.get(name)
+        if spec is None and not self._loaded:
+            spec = self.load()._tools.get(name)
+        return spec
+
+    def names(self) -> list[str]:
+        return list(self.load()._tools)
+
+    def schemas(self, module: Optional[str] = None) -> list[dict]:
+        """
+        Returns the OpenAI tool schemas, optionally only those defined in `module`.
+        """
+        if module:
+            importlib.import_module(module)
+        else:
+            self.load()
+        return [spec.schema for spec in self._tools.values() if module is None or spec.module == module]
+
+    def validate(self, name: str, arguments: dict) -> dict:
+        spec = self.get(name)
+        if spec is None:
+            raise ToolArgumentError(f"unknown tool '{name}'")
+        return spec.validate(arguments)
+
+
+# Process-wide registry used by the agent.
+registry = ToolRegistry()
+tool = registry.tool
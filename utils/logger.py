@@ -0,0 +1,311 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+from utils.metrics import REGISTRY
+
+# Non-blocking structured logging for the agent.
+#
+# Callers on the event loop only sanitize the record (redact secrets, cap payload sizes) and
+# put it on a bounded in-memory queue; a background listener thread formats it as one JSON
+# line and writes it out. A slow terminal or pipe therefore never stalls the loop: when the
+# queue is full, records are dropped and counted instead.
+#
+# Usage:
+#     from utils.logger import get_logger
+#     logger = get_logger(__name__)
+#     logger.info("tool.call", tool="list_outlook_emails", args=parsed_args)
+#
+# Configuration (environment):
+#     AGENT_LOG_LEVEL       DEBUG, INFO (default), WARNING, ...
+#     AGENT_LOG_FORMAT      json (default) or text
+#     AGENT_LOG_MAX_FIELD   Maximum characters kept per logged value (default 2000)
+#     AGENT_LOG_RATE        Per-event records/second allowed for INFO and below (default 20)
+
+ROOT_LOGGER_NAME = "m365agent"
+
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full.")
+LOG_RECORDS_SAMPLED_OUT = REGISTRY.counter(
+    "log_records_sampled_out_total", "Log records suppressed by per-event rate limiting.", ("event",))
+
+# Keys whose values are secrets and are never logged. Matched as whole key names (case-insensitive),
+# so measurements such as "graph_token" (a timing) or "prompt_tokens" (a count) keep their values.
+SECRET_KEYS = re.compile(
+    r"(authorization|proxy-authorization|cookie|set-cookie|token|access_token|refresh_token|id_token|"
+    r"client_secret|secret|password|api_key|apikey|x-api-key)", re.IGNORECASE)
+# Keys whose values are user content (email bodies, file contents); only their size is logged.
+CONTENT_KEYS = {"body", "body_content", "content", "file_content", "text"}
+# Secrets that can appear inside free text, e.g. in an error message echoing a header.
+_SECRET_PATTERNS = [
+    (re.compile(r"Bearer\s+[A-Za-z0-9\-._~+/]+=*", re.IGNORECASE), "Bearer [REDACTED]"),
+    (re.compile(r"eyJ[A-Za-z0-9_\-]{10,}\.[A-Za-z0-9_\-]{10,}\.[A-Za-z0-9_\-]+"), "[REDACTED_JWT]"),
+    (re.compile(r"sk-[A-Za-z0-9_\-]{16,}"), "[REDACTED_KEY]"),
+]
+
+MAX_ITEMS = 20 # Items kept per list/dict; the rest are summarized
+MAX_DEPTH = 4
+
+
+def _redact_text(text: str) -> str:
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def sanitize(value: Any, max_chars: int, depth: int = 0) -> Any:
+    """
+    Returns a JSON-friendly copy of `value` with secrets redacted, user content replaced by its
+    size, strings truncated to `max_chars` and containers truncated to MAX_ITEMS entries.
+    The work done is bounded by the caps, not by the size of the input.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"[{len(value)} bytes]"
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            value = value[:max_chars] + f"...[truncated {len(value) - max_chars} chars]"
+        return _redact_text(value)
+    if depth >= MAX_DEPTH:
+        return f"[{type(value).__name__}]"
+    if isinstance(value, dict):
+        result = {}
+        for i, (key, item) in enumerate(value.items()):
+            if i >= MAX_ITEMS:
+                result["..."] = f"[{len(value) - MAX_ITEMS} more keys]"
+                break
+            key = str(key)
+            if SECRET_KEYS.fullmatch(key):
+                result[key] = "[REDACTED]"
+            elif key in CONTENT_KEYS and isinstance(item, (str, bytes, bytearray)):
+                result[key] = f"[{len(item)} {'chars' if isinstance(item, str) else 'bytes'}]"
+            else:
+                result[key] = sanitize(item, max_chars, depth + 1)
+        return result
+    if isinstance(value, (list, tuple, set)):
+        items = list(value) if not isinstance(value, list) else value
+        result = [sanitize(item, max_chars, depth + 1) for item in items[:MAX_ITEMS]]
+        if len(items) > MAX_ITEMS:
+            result.append(f"[{len(items) - MAX_ITEMS} more items]")
+        return result
+    return sanitize(str(value), max_chars, depth)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: timestamp, level, logger, event and the record's structured fields.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Human-readable variant for local development: `time LEVEL logger event key=value ...`.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        rendered = " ".join(f"{key}={json.dumps(value, default=str, ensure_ascii=False)}" for key, value in fields.items())
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name} {record.getMessage()} {rendered}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per-event token bucket for chatty records. Records at WARNING and above always pass;
+    DEBUG/INFO records beyond `rate` per second (with `burst` headroom) for the same event are
+    dropped, and the next record that passes carries a `suppressed` count.
+    """
+    def __init__(self, rate: float = 20.0, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate * 2)
+        self._buckets: dict[str, list] = {} # event -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        event = f"{record.name}:{record.msg}"
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                LOG_RECORDS_SAMPLED_OUT.inc(event=str(record.msg))
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            fields = getattr(record, "fields", None)
+            if fields is not None:
+                fields["suppressed"] = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that sanitizes records in the caller's thread and drops (and counts) records
+    instead of blocking when the queue is full.
+    """
+    def __init__(self, log_queue: queue.Queue, max_chars: int):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = sanitize(fields, self.max_chars)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class StructuredLogger:
+    """
+    Thin wrapper over a stdlib logger: `logger.info("event.name", key=value, ...)`.
+    Keyword arguments become structured fields of the JSON record.
+    """
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    @property
+    def name(self) -> str:
+        return self._logger.name
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: dict, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info, stacklevel=3)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+_setup_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    stream=None,
+    max_chars: Optional[int] = None,
+    rate: Optional[float] = None,
+    queue_size: int = 10000
+):
+    """
+    Configures the agent's log pipeline. Safe to call more than once; later calls replace the
+    previous configuration. Arguments default to the AGENT_LOG_* environment variables.
+
+    Args:
+        level: Minimum level name (e.g. "INFO").
+        log_format: "json" or "text".
+        stream: Where the listener thread writes; defaults to stderr.
+        max_chars: Maximum characters kept per logged value.
+        rate: Per-event records per second allowed for DEBUG/INFO records (0 disables sampling).
+        queue_size: Records buffered before new ones are dropped.
+    """
+    global _listener
+    level = (level or os.getenv("AGENT_LOG_LEVEL") or "INFO").upper()
+    log_format = (log_format or os.getenv("AGENT_LOG_FORMAT") or "json").lower()
+    max_chars = max_chars if max_chars is not None else int(os.getenv("AGENT_LOG_MAX_FIELD", "2000"))
+    rate = rate if rate is not None else float(os.getenv("AGENT_LOG_RATE", "20"))
+
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(level)
+        root.propagate = False
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(TextFormatter() if log_format == "text" else JsonFormatter())
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        queue_handler = NonBlockingQueueHandler(log_queue, max_chars)
+        queue_handler.addFilter(RateLimitFilter(rate))
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+        _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flushes queued records and stops the listener thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """
+    Returns a structured logger under the agent's logger namespace, configuring the
+    pipeline from the environment on first use.
+    """
+    if _listener is None:
+        with _setup_lock:
+            needs_setup = _listener is None
+        if needs_setup:
+            setup_logging()
+    if not name.startswith(ROOT_LOGGER_NAME):
+        name = f"{ROOT_LOGGER_NAME}.{name}"
+    return StructuredLogger(logging.getLogger(name))
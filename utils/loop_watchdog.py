@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+from utils.logger import get_logger
+from utils.metrics import REGISTRY, MetricsRegistry
+
+# Opt-in event-loop blocking detector.
+#
+# A heartbeat task on the event loop wakes up every `interval` seconds and records how late
+# it fired (the loop lag). A separate watchdog thread checks that the heartbeat keeps beating;
+# when it has been silent for longer than `stall_threshold` the loop is blocked by synchronous
+# code, and the thread captures the loop thread's current stack, which points at the culprit
+# (e.g. a synchronous OpenAI call or Azure AD token fetch).
+#
+# Enable it for the REPL with AGENT_LOOP_WATCHDOG=1 (threshold: AGENT_LOOP_STALL_MS, default 250).
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99)
+# Innermost frames are what matter; keep the tail of long stacks within the log field cap.
+STACK_LOG_CHARS = 1800
+
+logger = get_logger(__name__)
+
+
+def _quantile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+def log_stall(stall: dict):
+    """
+    Default stall handler: logs the blocking stack as a warning.
+    """
+    logger.warning("loop.stall", blocked_ms=round(stall["blocked_s"] * 1000, 1), stack=stall["stack"][-STACK_LOG_CHARS:])
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop lag continuously and captures the stack of code that blocks the loop.
+
+    Args:
+        interval: Heartbeat period in seconds.
+        stall_threshold: Heartbeat silence (seconds) after which the loop counts as stalled.
+        window: Number of recent lag samples kept for percentile calculations.
+        on_stall: Called from the watchdog thread with a stall record
+                  ({"timestamp", "blocked_s", "stack"}); defaults to logging a warning.
+        registry: Metrics registry receiving the lag histogram, quantile gauges and stall counter.
+    """
+    def __init__(
+        self,
+        interval: float = 0.05,
+        stall_threshold: float = 0.25,
+        window: int = 2048,
+        on_stall: Optional[Callable[[dict], None]] = log_stall,
+        registry: MetricsRegistry = REGISTRY
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.on_stall = on_stall
+        self.samples: collections.deque[float] = collections.deque(maxlen=window)
+        self.stalls: collections.deque[dict] = collections.deque(maxlen=50)
+
+        self._lag_histogram = registry.histogram(
+            "event_loop_lag_seconds", "How late the event-loop heartbeat fired.", buckets=LAG_BUCKETS)
+        self._lag_quantiles = registry.gauge(
+            "event_loop_lag_quantile_seconds", "Event-loop lag percentiles over the recent sample window.", ("quantile",))
+        self._stall_counter = registry.counter(
+            "event_loop_stalls_total", "Times the event loop was blocked longer than the stall threshold.")
+
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._beats = 0
+        self._reported_beat = -1 # Heartbeat count at the last reported stall, to report each stall once
+        self._pending_stall: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, **kwargs) -> Optional["LoopWatchdog"]:
+        """
+        Returns a watchdog configured from AGENT_LOOP_WATCHDOG / AGENT_LOOP_STALL_MS, or None when disabled.
+        """
+        if os.getenv("AGENT_LOOP_WATCHDOG", "").lower() not in ("1", "true", "yes", "on"):
+            return None
+        stall_ms = float(os.getenv("AGENT_LOOP_STALL_MS", "250"))
+        kwargs.setdefault("stall_threshold", stall_ms / 1000.0)
+        return cls(**kwargs)
+
+    # --- lifecycle ---
+    def start(self) -> "LoopWatchdog":
+        """
+        Starts the heartbeat on the running loop and the watchdog thread. Must be called from the loop.
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._thread:
+            self._thread.join(timeout=self.interval * 4 + 1)
+            self._thread = None
+
+    async def __aenter__(self) -> "LoopWatchdog":
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def reset(self):
+        """
+        Clears the recent sample window and stall records (metrics keep accumulating).
+        """
+        with self._lock:
+            self.samples.clear()
+            self.stalls.clear()
+
+    # --- measurements ---
+    def percentiles(self) -> dict[str, float]:
+        with self._lock:
+            ordered = sorted(self.samples)
+        result = {f"p{int(q * 100)}": _quantile(ordered, q) for q in QUANTILES}
+        result["max"] = ordered[-1] if ordered else 0.0
+        return result
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._lag_histogram.observe(lag)
+            with self._lock:
+                self._last_beat = time.monotonic()
+                self._beats += 1
+                self.samples.append(lag)
+                if self._pending_stall is not None:
+                    # The stall is over; record how long it actually lasted.
+                    self._pending_stall["blocked_s"] = max(self._pending_stall["blocked_s"], lag)
+                    self._pending_stall = None
+                if self._beats % 20 == 0:
+                    ordered = sorted(self.samples)
+                else:
+                    ordered = None
+            if ordered is not None:
+                for q in QUANTILES:
+                    self._lag_quantiles.set(_quantile(ordered, q), quantile=str(q))
+
+    def _watch(self):
+        check_every = min(self.interval, self.stall_threshold / 2)
+        while not self._stop.wait(check_every):
+            with self._lock:
+                silent_for = time.monotonic() - self._last_beat
+                beats = self._beats
+                already_reported = beats == self._reported_beat
+            if silent_for < self.stall_threshold + self.interval or already_reported:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<loop thread not found>"
+            stall = {"timestamp": time.time(), "blocked_s": silent_for - self.interval, "stack": stack}
+            with self._lock:
+                self._reported_beat = beats
+                self._pending_stall = stall
+                self.stalls.append(stall)
+            self._stall_counter.inc()
+            if self.on_stall:
+                try:
+                    self.on_stall(stall)
+                except Exception:
+                    pass # A broken handler must not kill the watchdog
@@ -0,0 +1,158 @@
+import base64
+import mmap
+import os
+from typing import Optional
+
+try:
+    import numpy
+except ImportError: # Optional; without it the lanes are folded with Python integers (~20x slower)
+    numpy = None
+
+# quickXorHash, the content hash OneDrive for Business and SharePoint report for every file
+# (driveItem.file.hashes.quickXorHash).
+#
+# The hash is a 160-bit XOR accumulator: byte number i of the input is XORed in at bit
+# (i * 11) mod 160, rotating around the 160 bits. The input length (64-bit little-endian) is XORed
+# into the last 8 bytes of the result, which is base64-encoded.
+#
+# Bytes whose positions are congruent mod 160 land on the same bits, so the input is first folded
+# into 160 byte lanes (the XOR of all 160-byte blocks) and only the 160 lanes are shifted into
+# place. Folding is the whole cost and is done in bulk passes over large blocks:
+#   - with numpy, the input is viewed (without copying) as rows of 64 blocks of 20 uint64 words
+#     and XOR-reduced along the rows, which runs at memory speed (several GB/s)
+#   - without it, halves of a window are XORed as Python integers until one block is left
+# Files are hashed through a read-only memory map, so no read buffers are allocated.
+#
+# `python -m benchmarks.quickxor_bench` measures the throughput in GB/s.
+
+WIDTH_BITS = 160
+SHIFT = 11
+LANES = WIDTH_BITS # One lane per input position mod 160
+ROW_BLOCKS = 64 # 160-byte blocks per numpy row; long rows keep the XOR loop vectorized
+WINDOW_BYTES = LANES * 64 * 1024 # 10 MiB per integer fold, bounding its temporary memory
+FILE_WINDOW_BYTES = LANES * 256 * 1024 # 40 MiB of a memory-mapped file per update
+BACKEND = "numpy" if numpy is not None else "python"
+_MASK = (1 << WIDTH_BITS) - 1
+_LANE_SHIFTS = [(lane * SHIFT) % WIDTH_BITS for lane in range(LANES)]
+
+
+def _rotate_in(value: int, shift: int) -> int:
+    value <<= shift
+    return (value | (value >> WIDTH_BITS)) & _MASK
+
+
+def _fold_numpy(view: memoryview) -> int:
+    words = numpy.frombuffer(view, dtype=numpy.uint64)
+    row_words = ROW_BLOCKS * LANES // 8
+    rows = len(words) // row_words
+    lanes = numpy.zeros(LANES // 8, dtype=numpy.uint64)
+    if rows:
+        wide = numpy.bitwise_xor.reduce(words[:rows * row_words].reshape(rows, row_words), axis=0)
+        lanes ^= numpy.bitwise_xor.reduce(wide.reshape(ROW_BLOCKS, LANES // 8), axis=0)
+    if len(words) > rows * row_words:
+        lanes ^= numpy.bitwise_xor.reduce(words[rows * row_words:].reshape(-1, LANES // 8), axis=0)
+    return int.from_bytes(lanes.tobytes(), "little")
+
+
+def _fold_integers(view: memoryview) -> int:
+    folded = 0
+    for start in range(0, len(view), WINDOW_BYTES):
+        window = view[start:start + WINDOW_BYTES]
+        blocks = len(window) // LANES
+        while blocks > 1:
+            half = blocks // 2
+            if blocks % 2:
+                folded ^= int.from_bytes(window[(blocks - 1) * LANES:blocks * LANES], "little")
+            value = int.from_bytes(window[:half * LANES], "little") ^ int.from_bytes(window[half * LANES:2 * half * LANES], "little")
+            window = memoryview(value.to_bytes(half * LANES, "little"))
+            blocks = half
+        if blocks:
+            folded ^= int.from_bytes(window[:LANES], "little")
+    return folded
+
+
+def fold_lanes(data) -> bytes:
+    """
+    XOR of all 160-byte blocks of `data`, whose length must be a multiple of 160.
+    """
+    view = memoryview(data).cast("B")
+    if len(view) % LANES:
+        raise ValueError("fold_lanes needs whole 160-byte blocks")
+    folded = _fold_numpy(view) if numpy is not None and view.c_contiguous else _fold_integers(view)
+    return folded.to_bytes(LANES, "little")
+
+
+class QuickXorHash:
+    """
+    Incremental quickXorHash, used like hashlib objects: `update()` then `digest()`/`b64digest()`.
+    """
+    def __init__(self, data: Optional[bytes] = None):
+        self._state = 0
+        self._length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        view = memoryview(data).cast("B")
+        whole = len(view) - len(view) % LANES
+        lanes = bytearray(fold_lanes(view[:whole])) if whole else bytearray(LANES)
+        for index, byte in enumerate(view[whole:]): # The tail lines up with lane 0 like every block
+            lanes[index] ^= byte
+        self._absorb(lanes, self._length % LANES)
+        self._length += len(view)
+
+    def _absorb(self, lanes: bytes, offset: int):
+        """
+        XORs folded lanes into the state; lane i holds bytes at stream positions = offset + i (mod 160).
+        """
+        state = self._state
+        for index, byte in enumerate(lanes):
+            if byte:
+                state ^= _rotate_in(byte, _LANE_SHIFTS[(offset + index) % LANES])
+        self._state = state
+
+    def digest(self) -> bytes:
+        result = bytearray(self._state.to_bytes(WIDTH_BITS // 8, "little"))
+        for index, byte in enumerate(self._length.to_bytes(8, "little")):
+            result[WIDTH_BITS // 8 - 8 + index] ^= byte
+        return bytes(result)
+
+    def b64digest(self) -> str:
+        """
+        The hash as Graph reports it (base64).
+        """
+        return base64.b64encode(self.digest()).decode("ascii")
+
+
+def quickxor_bytes(data) -> str:
+    """
+    Base64 quickXorHash of an in-memory payload.
+    """
+    return QuickXorHash(data).b64digest()
+
+
+def quickxor_file(path: str) -> str:
+    """
+    Base64 quickXorHash of a file, hashed through a read-only memory map.
+    """
+    hasher = QuickXorHash()
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return hasher.b64digest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start in range(0, size, FILE_WINDOW_BYTES):
+                    with view[start:start + FILE_WINDOW_BYTES] as window:
+                        hasher.update(window)
+    return hasher.b64digest()
+
+
+def matches(expected: Optional[str], actual: str) -> bool:
+    """
+    Whether a computed hash agrees with the one Graph reported; True when Graph reported none
+    (OneDrive personal drives only report SHA-1/SHA-256).
+    """
+    return not expected or expected == actual
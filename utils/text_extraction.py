@@ -0,0 +1,543 @@
+import asyncio
+import collections
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Optional
+from xml.etree import ElementTree
+
+from utils.logger import get_logger
+from utils.metrics import REGISTRY
+
+# Text extraction from Office/PDF documents, off the event loop.
+#
+# Parsing a 10 MB workbook takes hundreds of milliseconds of pure CPU, which would stall every
+# conversation sharing the loop. Parsers therefore run in a process pool ("spawn" workers, so no
+# locks or sockets of the server are inherited), with limits on:
+#   - input size, checked before anything is sent to a worker
+#   - uncompressed size of .docx/.xlsx archives (zip bombs)
+#   - output characters; parsing stops early and the text is marked truncated
+#   - wall time; a worker that exceeds it is killed and the pool is replaced
+# The text is handed out in chunks of about `chunk_chars`, cut at paragraph or line boundaries,
+# so a tool result never carries a whole document.
+#
+# Extracted text is cached under a caller-supplied key. For OneDrive this is item id + cTag: the
+# cTag changes only when the content changes, so an unchanged file is parsed once.
+#
+# Formats: .docx and .xlsx (zipfile + streaming XML, standard library only), .pdf (needs the
+# optional pypdf package) and plain text (.txt, .csv, .md, .json, ...).
+#
+# Configuration (environment):
+#     AGENT_EXTRACT_WORKERS       Worker processes (default 2)
+#     AGENT_EXTRACT_MAX_MB        Largest file accepted (default 25)
+#     AGENT_EXTRACT_TIMEOUT       Seconds per document (default 30)
+#     AGENT_EXTRACT_MAX_CHARS     Characters kept per document (default 2000000)
+#     AGENT_EXTRACT_CHUNK_CHARS   Characters per chunk handed to the model (default 8000)
+#     AGENT_EXTRACT_CACHE_DIR     Directory for the text cache (in memory only if unset)
+
+TEXT_EXTENSIONS = {".txt", ".csv", ".tsv", ".md", ".json", ".xml", ".html", ".htm", ".log", ".ics", ".yaml", ".yml"}
+FORMATS = {".docx": "docx", ".xlsx": "xlsx", ".pdf": "pdf", **{extension: "text" for extension in TEXT_EXTENSIONS}}
+MIME_FORMATS = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/pdf": "pdf",
+}
+MAX_UNCOMPRESSED_RATIO = 100 # Uncompressed archive bytes allowed per input byte
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+S = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PR = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+EXTRACTIONS = REGISTRY.counter(
+    "text_extractions_total", "Document text extractions by format and result (ok, cached, too_large, timeout, error).",
+    ("format", "result"))
+EXTRACTION_SECONDS = REGISTRY.histogram(
+    "text_extraction_duration_seconds", "Time to extract the text of a document, queueing included.", ("format",))
+EXTRACTED_CHARS = REGISTRY.counter(
+    "text_extracted_chars_total", "Characters of text extracted from documents.", ("format",))
+
+logger = get_logger(__name__)
+
+
+class ExtractionError(Exception):
+    """
+    Raised when a document cannot be turned into text (unsupported, too large, corrupt or too slow).
+    """
+
+
+def detect_format(name: Optional[str] = None, mime_type: Optional[str] = None) -> Optional[str]:
+    """
+    "docx", "xlsx", "pdf", "text", or None if the format is not supported.
+    """
+    extension = os.path.splitext(name or "")[1].lower()
+    if extension in FORMATS:
+        return FORMATS[extension]
+    if mime_type:
+        if mime_type in MIME_FORMATS:
+            return MIME_FORMATS[mime_type]
+        if mime_type.startswith("text/"):
+            return "text"
+    return None
+
+
+# --- parsers; run in the worker processes ---
+class _Output:
+    """
+    Collects text up to a character limit; raises _Output.Full once it is reached.
+    """
+    class Full(Exception):
+        pass
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts: list[str] = []
+        self.size = 0
+
+    def write(self, text: str):
+        if not text:
+            return
+        remaining = self.max_chars - self.size
+        if len(text) >= remaining:
+            self.parts.append(text[:remaining])
+            self.size = self.max_chars
+            raise _Output.Full()
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _open_archive(data: bytes) -> zipfile.ZipFile:
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise ExtractionError(f"not a valid Office document: {e}") from None
+    uncompressed = sum(info.file_size for info in archive.infolist())
+    if uncompressed > max(len(data), 1024 * 1024) * MAX_UNCOMPRESSED_RATIO:
+        raise ExtractionError(f"archive expands to {uncompressed} bytes; refusing to unpack it")
+    return archive
+
+
+def _docx(data: bytes, out: _Output):
+    archive = _open_archive(data)
+    try:
+        document = archive.open("word/document.xml")
+    except KeyError:
+        raise ExtractionError("word/document.xml is missing") from None
+    cell_depth = 0
+    with document:
+        for event, element in ElementTree.iterparse(document, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == f"{W}tc":
+                    cell_depth += 1
+                continue
+            if tag == f"{W}t":
+                out.write(element.text or "")
+            elif tag == f"{W}tab":
+                out.write("\t")
+            elif tag in (f"{W}br", f"{W}cr"):
+                out.write("\n")
+            elif tag == f"{W}p":
+                out.write(" " if cell_depth else "\n")
+                element.clear()
+            elif tag == f"{W}tc":
+                cell_depth -= 1
+                out.write("\t")
+            elif tag == f"{W}tr":
+                out.write("\n")
+                element.clear()
+
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _xlsx(data: bytes, out: _Output):
+    archive = _open_archive(data)
+    names = set(archive.namelist())
+
+    shared: list[str] = []
+    if "xl/sharedStrings.xml" in names:
+        with archive.open("xl/sharedStrings.xml") as f:
+            for _, element in ElementTree.iterparse(f):
+                if element.tag == f"{S}si":
+                    shared.append("".join(text.text or "" for text in element.iter(f"{S}t")))
+                    element.clear()
+
+    targets = {}
+    if "xl/_rels/workbook.xml.rels" in names:
+        relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        for relationship in relationships.iter(f"{PR}Relationship"):
+            target = relationship.get("Target", "")
+            targets[relationship.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.normpath(f"xl/{target}")
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    sheets = [(sheet.get("name"), targets.get(sheet.get(f"{R}id"))) for sheet in workbook.iter(f"{S}sheet")]
+
+    for sheet_name, path in sheets:
+        if path not in names:
+            continue
+        out.write(f"## {sheet_name}\n")
+        with archive.open(path) as f:
+            row: list[str] = []
+            cell_type = reference = None
+            value = None
+            for event, element in ElementTree.iterparse(f, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == f"{S}c":
+                        cell_type, reference, value = element.get("t"), element.get("r"), None
+                    continue
+                if tag == f"{S}v":
+                    value = element.text
+                elif tag == f"{S}is": # Inline string
+                    value = "".join(text.text or "" for text in element.iter(f"{S}t"))
+                elif tag == f"{S}c":
+                    if value is not None:
+                        if cell_type == "s":
+                            value = shared[int(value)] if value.isdigit() and int(value) < len(shared) else ""
+                        elif cell_type == "b":
+                            value = "TRUE" if value == "1" else "FALSE"
+                        column = _column_index(reference) if reference else len(row)
+                        if column > len(row):
+                            row.extend([""] * min(column - len(row), 256)) # Keep columns aligned, within reason
+                        row.append(value.replace("\t", " ").replace("\n", " "))
+                    element.clear()
+                elif tag == f"{S}row":
+                    if row:
+                        out.write("\t".join(row).rstrip("\t") + "\n")
+                    row = []
+                    element.clear()
+        out.write("\n")
+
+
+def _pdf(data: bytes, out: _Output):
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        raise ExtractionError("PDF support needs the optional 'pypdf' package (pip install pypdf)") from None
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        if reader.is_encrypted and not reader.decrypt(""):
+            raise ExtractionError("the PDF is password-protected")
+        for number, page in enumerate(reader.pages, start=1):
+            out.write(f"## Page {number}\n")
+            out.write((page.extract_text() or "").strip() + "\n\n")
+    except PdfReadError as e:
+        raise ExtractionError(f"not a valid PDF: {e}") from None
+
+
+def _text(data: bytes, out: _Output):
+    for encoding in ("utf-8-sig", "utf-16"):
+        try:
+            out.write(data.decode(encoding))
+            return
+        except UnicodeDecodeError:
+            continue
+    out.write(data.decode("latin-1"))
+
+
+PARSERS = {"docx": _docx, "xlsx": _xlsx, "pdf": _pdf, "text": _text}
+
+
+def extract_document(data: bytes, document_format: str, max_chars: int) -> dict[str, Any]:
+    """
+    Parses a document synchronously (the worker-process entry point).
+
+    Returns:
+        {"text": ..., "truncated": bool}
+
+    Raises:
+        ExtractionError: Unsupported or unreadable document.
+    """
+    parser = PARSERS.get(document_format)
+    if parser is None:
+        raise ExtractionError(f"unsupported format '{document_format}'")
+    out = _Output(max_chars)
+    truncated = False
+    try:
+        parser(data, out)
+    except _Output.Full:
+        truncated = True
+    except ExtractionError:
+        raise
+    except (ElementTree.ParseError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        raise ExtractionError(f"could not parse the {document_format} document: {type(e).__name__}: {e}") from None
+    text = re.sub(r" +(?=[\t\n])", "", out.text()) # Cell paragraph separators before a tab or line end
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    return {"text": text, "truncated": truncated}
+
+
+def split_chunks(text: str, chunk_chars: int) -> list[str]:
+    """
+    Splits text into chunks of at most `chunk_chars`, preferring paragraph, then line, then word breaks.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > chunk_chars:
+        end = start + chunk_chars
+        window = text[start:end]
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > chunk_chars // 2:
+                break
+        if cut <= chunk_chars // 2:
+            cut = chunk_chars # No good break in the second half: cut hard
+        chunks.append(text[start:start + cut].strip())
+        start += cut
+    if text[start:].strip() or not chunks:
+        chunks.append(text[start:].strip())
+    return chunks
+
+
+class TextCache:
+    """
+    LRU cache of extracted text bounded by total characters, optionally mirrored to a directory
+    (one JSON file per entry) so extractions survive restarts and are shared by processes.
+    """
+    def __init__(self, max_chars: int = 50_000_000, directory: Optional[str] = None):
+        self.max_chars = max_chars
+        self.directory = directory
+        self._entries: collections.OrderedDict[str, dict] = collections.OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        self._remember(key, entry)
+        if self.directory:
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temporary, self._path(key))
+
+    def _remember(self, key: str, entry: dict):
+        size = len(entry.get("text", ""))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._chars -= len(previous.get("text", ""))
+            if size > self.max_chars:
+                return
+            self._entries[key] = entry
+            self._chars += size
+            while self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted.get("text", ""))
+
+
+class TextExtractor:
+    """
+    Runs document parsers in a process pool with size, output and time limits, and caches the text.
+
+    Args:
+        workers: Worker processes; also the number of documents parsed at once.
+        max_bytes: Largest document accepted.
+        max_chars: Characters of text kept per document.
+        timeout: Seconds a worker may spend on one document before it is killed.
+        chunk_chars: Characters per chunk returned by chunks() / chunk().
+        cache: TextCache for extracted text (a memory-only cache if omitted).
+    """
+    def __init__(
+        self,
+        workers: int = 2,
+        max_bytes: int = 25 * 1024 * 1024,
+        max_chars: int = 2_000_000,
+        timeout: float = 30.0,
+        chunk_chars: int = 8000,
+        cache: Optional[TextCache] = None
+    ):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self.chunk_chars = chunk_chars
+        self.cache = cache or TextCache()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
+
+    @classmethod
+    def from_env(cls) -> "TextExtractor":
+        return cls(
+            workers=int(os.getenv("AGENT_EXTRACT_WORKERS", "2")),
+            max_bytes=int(float(os.getenv("AGENT_EXTRACT_MAX_MB", "25")) * 1024 * 1024),
+            max_chars=int(os.getenv("AGENT_EXTRACT_MAX_CHARS", "2000000")),
+            timeout=float(os.getenv("AGENT_EXTRACT_TIMEOUT", "30")),
+            chunk_chars=int(os.getenv("AGENT_EXTRACT_CHUNK_CHARS", "8000")),
+            cache=TextCache(directory=os.getenv("AGENT_EXTRACT_CACHE_DIR") or None),
+        )
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """
+        Kills the workers of `pool` (one of them is stuck) so the next extraction starts a fresh pool.
+        """
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        # ProcessPoolExecutor cannot cancel a running task; terminating its processes is the only way out
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots, self._slots_loop = asyncio.Semaphore(self.workers), loop
+        return self._slots
+
+    async def extract(self, data: bytes, name: Optional[str] = None, mime_type: Optional[str] = None,
+                      cache_key: Optional[str] = None) -> dict[str, Any]:
+        """
+        Extracts the text of a document.
+
+        Args:
+            data: The document's bytes.
+            name: File name; its extension selects the parser.
+            mime_type: Used when the extension is unknown.
+            cache_key: Key under which the text is cached, e.g. "<item id>:<cTag>"; None skips the cache.
+
+        Returns:
+            {"text", "format", "truncated", "chars", "cached"}
+
+        Raises:
+            ExtractionError: Unsupported format, too large, unparseable or timed out.
+        """
+        document_format = detect_format(name, mime_type)
+        if document_format is None:
+            raise ExtractionError(f"unsupported file type '{os.path.splitext(name or '')[1] or mime_type}'")
+        if cache_key is not None:
+            entry = self.cached(cache_key)
+            if entry is not None:
+                return entry
+        if len(data) > self.max_bytes:
+            EXTRACTIONS.inc(format=document_format, result="too_large")
+            raise ExtractionError(f"file is {len(data)} bytes; the limit is {self.max_bytes}")
+
+        started = time.perf_counter()
+        async with self._semaphore(): # Queue here, so the timeout only covers parsing
+            pool = self._executor()
+            future = asyncio.get_running_loop().run_in_executor(pool, extract_document, data, document_format, self.max_chars)
+            try:
+                result = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                EXTRACTIONS.inc(format=document_format, result="timeout")
+                logger.warning("extract.timeout", format=document_format, bytes=len(data), timeout_s=self.timeout)
+                self._discard_pool(pool)
+                raise ExtractionError(f"text extraction took longer than {self.timeout:g}s") from None
+            except BrokenProcessPool:
+                EXTRACTIONS.inc(format=document_format, result="error")
+                self._discard_pool(pool)
+                raise ExtractionError("the extraction worker crashed") from None
+            except ExtractionError:
+                EXTRACTIONS.inc(format=document_format, result="error")
+                raise
+        EXTRACTION_SECONDS.observe(time.perf_counter() - started, format=document_format)
+        EXTRACTIONS.inc(format=document_format, result="ok")
+        EXTRACTED_CHARS.inc(len(result["text"]), format=document_format)
+
+        entry = {"text": result["text"], "format": document_format, "truncated": result["truncated"],
+                 "chars": len(result["text"])}
+        if cache_key is not None:
+            await asyncio.to_thread(self.cache.put, cache_key, entry)
+        return {**entry, "cached": False}
+
+    def cached(self, cache_key: str) -> Optional[dict[str, Any]]:
+        """
+        The cached extraction result for `cache_key` (as returned by extract()), or None. Lets a
+        caller skip downloading a document whose text is already known.
+        """
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            return None
+        EXTRACTIONS.inc(format=entry.get("format", "unknown"), result="cached")
+        return {**entry, "cached": True}
+
+    def chunk(self, text: str, number: int) -> dict[str, Any]:
+        """
+        Chunk `number` (1-based) of `text`: {"chunk", "chunks", "text"}.
+        """
+        chunks = split_chunks(text, self.chunk_chars)
+        number = min(max(1, number), len(chunks))
+        return {"chunk": number, "chunks": len(chunks), "text": chunks[number - 1]}
+
+    async def chunks(self, data: bytes, name: Optional[str] = None, mime_type: Optional[str] = None,
+                     cache_key: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Extracts a document and yields its text chunk by chunk.
+        """
+        result = await self.extract(data, name, mime_type, cache_key)
+        for chunk in split_chunks(result["text"], self.chunk_chars):
+            yield chunk
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_extractor: Optional[TextExtractor] = None
+
+
+def get_extractor() -> TextExtractor:
+    """
+    The process-wide TextExtractor (configured from the environment on first use).
+    """
+    global _extractor
+    if _extractor is None:
+        _extractor = TextExtractor.from_env()
+    return _extractor
+
+
+def close_extractor():
+    global _extractor
+    if _extractor is not None:
+        _extractor.close()
+        _extractor = None
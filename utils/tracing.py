@@ -0,0 +1,211 @@
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from utils.metrics import REGISTRY
+
+# Lightweight per-turn tracing.
+#
+# A "turn" is one call to AgentCore.process_message. Every span started while a turn is
+# active (Graph requests, token acquisition, chat completions, tool calls) is attached to
+# that turn, including spans started from tasks spawned inside it, since asyncio copies the
+# current context into new tasks. When the turn ends its spans form a waterfall that can be
+# appended to a JSON-lines trace file (AGENT_TRACE_FILE). The file is written by a background
+# thread, so a finished turn never waits on the disk; traces that cannot be queued or written
+# are dropped and counted.
+
+TRACES_DROPPED = REGISTRY.counter(
+    "trace_exports_dropped_total", "Finished turn traces that could not be written to the trace file.")
+
+_current_trace: contextvars.ContextVar[Optional["TurnTrace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """
+    One timed operation. Attributes hold whatever the caller knows about it
+    (status, retries, payload bytes, token usage, ...).
+    """
+    def __init__(self, name: str, kind: str, trace: Optional["TurnTrace"], parent: Optional["Span"], attributes: Optional[dict] = None):
+        self.span_id = next(_span_ids)
+        self.name = name
+        self.kind = kind
+        self.trace = trace
+        self.parent_id = parent.span_id if parent else None
+        self.attributes: dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, error: BaseException) -> "Span":
+        self.status = "error"
+        self.attributes["error"] = f"{type(error).__name__}: {error}"
+        return self
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "status": self.status,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+class TurnTrace:
+    """
+    All spans recorded during one agent turn.
+    """
+    def __init__(self, name: str, attributes: Optional[dict] = None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes: dict[str, Any] = dict(attributes or {})
+        self.spans: list[Span] = []
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.wall_start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [span.to_dict(self.start) for span in spans],
+        }
+
+
+class Tracer:
+    """
+    Creates turn traces and spans, and writes finished turns to an optional trace file.
+
+    Args:
+        trace_file: Path of a JSON-lines file receiving one waterfall per finished turn.
+                    Defaults to the AGENT_TRACE_FILE environment variable; None disables the file.
+    """
+    def __init__(self, trace_file: Optional[str] = None, queue_size: int = 1000):
+        self.trace_file = trace_file if trace_file is not None else os.getenv("AGENT_TRACE_FILE") or None
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    def configure(self, trace_file: Optional[str]):
+        self.trace_file = trace_file or None
+
+    def current_trace(self) -> Optional[TurnTrace]:
+        return _current_trace.get()
+
+    @contextlib.contextmanager
+    def turn(self, name: str = "agent.turn", **attributes):
+        """
+        Marks the enclosed block as one turn; yields its TurnTrace.
+        """
+        trace = TurnTrace(name, attributes)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        finally:
+            trace.end = time.perf_counter()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._export(trace)
+
+    def start_span(self, name: str, kind: str = "internal", **attributes) -> Span:
+        """
+        Starts a span that the caller finishes explicitly with `span.finish()`.
+        Use this when the operation ends outside the current block (e.g. a streamed response).
+        """
+        trace = _current_trace.get()
+        span = Span(name, kind, trace, _current_span.get(), attributes)
+        if trace is not None:
+            trace.add(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        """
+        Times the enclosed block as a child of the current span; yields the Span.
+        Exceptions mark the span as failed and are re-raised.
+        """
+        span = self.start_span(name, kind, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            span.finish()
+            _current_span.reset(token)
+
+    def flush(self):
+        """
+        Blocks until every trace handed to the writer thread is in the trace file.
+        """
+        self._queue.join()
+
+    def _export(self, trace: TurnTrace):
+        if not self.trace_file:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_traces, name="trace-writer", daemon=True)
+                self._writer.start()
+        try:
+            self._queue.put_nowait((self.trace_file, trace))
+        except queue.Full:
+            TRACES_DROPPED.inc()
+
+    def _write_traces(self):
+        while True:
+            trace_file, trace = self._queue.get()
+            try:
+                line = json.dumps(trace.to_dict(), default=str)
+                with open(trace_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except Exception:
+                TRACES_DROPPED.inc()
+            finally:
+                self._queue.task_done()
+
+
+# Process-wide tracer used by the agent and the Graph helpers.
+tracer = Tracer()
+atexit.register(tracer.flush)